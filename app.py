@@ -1,38 +1,53 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, make_response
-from flask_mail import Mail, Message
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, make_response, send_file, stream_with_context, g, has_request_context, get_template_attribute
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import pymysql
 from datetime import datetime, timedelta
 import os
 import re
+import sys
+import json
+import logging
+import base64
+import uuid
+import threading
+import time
+from contextlib import contextmanager
 from functools import wraps
 from dotenv import load_dotenv
-try:
-    from dateutil.relativedelta import relativedelta
-except ImportError:
+from db_backup import (BACKUP_FREQUENCIES, EXCEL_AVAILABLE, BackupInProgressError, BackupJob, BackupScheduler, acquire_backup_lock,
+                       PRE_RESTORE_BACKUP_RE, chain_filenames, create_backup, export_database, list_backup_files,
+                       pre_restore_backup_filename, prune_backups, record_backup, record_failed_backup,
+                       release_backup_lock, scheduled_backup_filename)
+from db_health import (HealthCache, HealthSampler, build_health_status, exact_row_counts, growth_forecast,
+                       table_columns, table_stats)
+from db_pool import ConnectionPool, PoolTimeoutError
+from app_logging import LogLevelStore, configure_logging, parse_levels, parse_rates, request_id_var
+from query_tracker import QueryStats, TrackingCursor, format_report
+from document_cache import DocumentCache
+from audit_log import (ARCHIVE_FILENAME_RE, AUDIT_SOURCES, AuditArchiver, list_archives, monthly_partitions,
+                       record_audit)
+from invoice_batch import InvoiceBatches, load_class_invoices
+from email_outbox import EmailOutboxWorker, enqueue_email, message_statuses, outbox_summary, retry_failed_email
+from fee_ledger import (FeeLedger, format_iso_date, refresh_fee_balance, reprice_fee_balances,
+                        remove_fee_structure_balances)
+import csv
+import io
+
+class Relativedelta:
     # Fallback if dateutil is not available
-    class Relativedelta:
-        def __init__(self, years=0, months=0, days=0):
-            self.years = years
-            self.months = months
-            self.days = days
-    def relativedelta(*args, **kwargs):
+    def __init__(self, years=0, months=0, days=0):
+        self.years = years
+        self.months = months
+        self.days = days
+
+def relativedelta(*args, **kwargs):
+    """dateutil's relativedelta, imported on first use (only salary period calculations need it)"""
+    try:
+        from dateutil.relativedelta import relativedelta as dateutil_relativedelta
+    except ImportError:
         return Relativedelta(**kwargs)
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
-from io import BytesIO
-import csv
-try:
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment
-    EXCEL_AVAILABLE = True
-except ImportError:
-    EXCEL_AVAILABLE = False
+    return dateutil_relativedelta(*args, **kwargs)
 
 # Load environment variables from .env file
 load_dotenv()
@@ -47,9 +62,74 @@ app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'True').lower() in [
 app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME', '')
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD', '')
 app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'noreply@modernschool.com')
+# Reconnect to the SMTP server after this many messages in one session (Flask-Mail)
+app.config['MAIL_MAX_EMAILS'] = int(os.environ['MAIL_MAX_EMAILS']) if os.environ.get('MAIL_MAX_EMAILS') else None
+
+# Flask-Mail is created on first use (get_mail()), so workers that never send mail do not import it
+_mail = None
+_mail_lock = threading.Lock()
+
+def get_mail():
+    """The app's Flask-Mail extension"""
+    global _mail
+    if _mail is None:
+        with _mail_lock:
+            if _mail is None:
+                from flask_mail import Mail
+                _mail = Mail(app)
+    return _mail
+
+# Logging: "school.*" loggers write through a non-blocking queue. LOG_LEVELS sets per-module levels
+# (e.g. school.fees=DEBUG), LOG_SAMPLE_RATES keeps a fraction of their DEBUG/INFO output per request,
+# and technicians can override levels at runtime (stored in LOG_LEVELS_FILE, shared by all workers).
+configure_logging(level=os.environ.get('LOG_LEVEL', 'WARNING'),
+                  module_levels=parse_levels(os.environ.get('LOG_LEVELS', '')),
+                  sample_rates=parse_rates(os.environ.get('LOG_SAMPLE_RATES', '')),
+                  fmt=os.environ.get('LOG_FORMAT', 'text').lower())
+log_level_store = LogLevelStore(os.environ.get('LOG_LEVELS_FILE', os.path.join(app.root_path, 'log_levels.json')))
+auth_log = logging.getLogger('school.auth')
+permissions_log = logging.getLogger('school.permissions')
+fees_log = logging.getLogger('school.fees')
+payments_log = logging.getLogger('school.payments')
+settings_log = logging.getLogger('school.settings')
+sql_log = logging.getLogger('school.sql')
+students_log = logging.getLogger('school.students')
+staff_log = logging.getLogger('school.staff')
+email_log = logging.getLogger('school.email')
+backup_log = logging.getLogger('school.backup')
+db_log = logging.getLogger('school.db')
+APP_LOGGERS = {
+    'school.auth': 'Login',
+    'school.permissions': 'Permission checks',
+    'school.fees': 'Student fees',
+    'school.payments': 'Payments',
+    'school.settings': 'Settings & permissions admin',
+    'school.students': 'Students & admissions',
+    'school.staff': 'Staff & salaries',
+    'school.email': 'Email notifications',
+    'school.backup': 'Backups & restores',
+    'school.db': 'Database connections & maintenance',
+    'school.sql': 'Slow requests & N+1 queries'
+}
+
+@app.before_request
+def assign_request_id():
+    """Tag the request's log records with an id (the proxy's X-Request-ID when present)"""
+    g.request_id = (request.headers.get('X-Request-ID') or uuid.uuid4().hex[:12])[:64]
+    g.request_id_token = request_id_var.set(g.request_id)
+    log_level_store.refresh()
+
+@app.after_request
+def add_request_id_header(response):
+    if g.get('request_id'):
+        response.headers['X-Request-ID'] = g.request_id
+    return response
 
-# Initialize Flask-Mail
-mail = Mail(app)
+@app.teardown_request
+def clear_request_id(exception=None):
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        request_id_var.reset(token)
 
 # File upload configuration
 UPLOAD_FOLDER = 'static/uploads/profiles'
@@ -76,9 +156,40 @@ def allowed_payment_file(filename):
     """Check if payment proof file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_PAYMENT_EXTENSIONS
 
-def get_school_settings():
-    """Get school settings from database"""
-    school_data = {
+# Process-level cache for data rendered into every template (school settings, academic levels).
+# Writers call invalidate_school_settings_cache(); other worker processes pick changes up after the TTL.
+SETTINGS_CACHE_TTL = int(os.environ.get('SETTINGS_CACHE_TTL', 300))
+_settings_cache = {}
+_settings_cache_lock = threading.Lock()
+
+def get_cached_setting(key, loader, default):
+    """Return a cached value, reloading it with loader() once the TTL has expired.
+    
+    Failed loads are not cached, so a database outage does not pin the defaults.
+    """
+    now = time.monotonic()
+    with _settings_cache_lock:
+        entry = _settings_cache.get(key)
+        if entry and now - entry[0] < SETTINGS_CACHE_TTL:
+            return entry[1]
+    try:
+        value = loader()
+    except Exception:
+        # Silently return default values if there's an error
+        # Don't print errors for context processor to avoid cluttering logs
+        return default
+    with _settings_cache_lock:
+        _settings_cache[key] = (time.monotonic(), value)
+    return value
+
+def invalidate_school_settings_cache():
+    """Drop cached school settings and academic levels after they are changed"""
+    with _settings_cache_lock:
+        _settings_cache.clear()
+
+def default_school_settings():
+    """School settings used when none have been saved yet"""
+    return {
         'school_name': 'Modern School',
         'school_email': '',
         'school_phone': '',
@@ -90,97 +201,106 @@ def get_school_settings():
         'whatsapp_number': '',
         'school_location': ''
     }
-    
-    connection = None
+
+def _load_school_settings():
+    """Read school settings from the database (raises on connection errors)"""
+    school_data = default_school_settings()
+    connection = get_db_connection()
+    if not connection:
+        raise RuntimeError('Database connection unavailable')
     try:
-        connection = get_db_connection()
-        if connection:
-            with connection.cursor() as cursor:
-                # Check if table exists first
-                cursor.execute("""
-                    SELECT COUNT(*) as count 
-                    FROM information_schema.tables 
-                    WHERE table_schema = %s AND table_name = 'school_settings'
-                """, (DB_CONFIG['database'],))
-                table_exists = cursor.fetchone()
-                
-                if table_exists and table_exists['count'] > 0:
-                    # Table exists, fetch settings
-                    cursor.execute("SELECT * FROM school_settings ORDER BY id DESC LIMIT 1")
-                    result = cursor.fetchone()
-                    if result:
-                        # Handle both tuple and dict results
-                        if isinstance(result, dict):
-                            school_data = {
-                                'school_name': result.get('school_name') or 'Modern School',
-                                'school_email': result.get('school_email') or '',
-                                'school_phone': result.get('school_phone') or '',
-                                'school_logo': result.get('school_logo') or None,
-                                'twitter_url': result.get('twitter_url') or '',
-                                'facebook_url': result.get('facebook_url') or '',
-                                'instagram_url': result.get('instagram_url') or '',
-                                'tiktok_url': result.get('tiktok_url') or '',
-                                'whatsapp_number': result.get('whatsapp_number') or '',
-                                'school_location': result.get('school_location') or ''
-                            }
-                        else:
-                            # Tuple result (fallback)
-                            school_data = {
-                                'school_name': (result[1] if len(result) > 1 else None) or 'Modern School',
-                                'school_email': (result[2] if len(result) > 2 else None) or '',
-                                'school_phone': (result[3] if len(result) > 3 else None) or '',
-                                'school_logo': (result[4] if len(result) > 4 else None) or None,
-                                'twitter_url': (result[5] if len(result) > 5 else None) or '',
-                                'facebook_url': (result[6] if len(result) > 6 else None) or '',
-                                'instagram_url': (result[7] if len(result) > 7 else None) or '',
-                                'tiktok_url': (result[8] if len(result) > 8 else None) or '',
-                                'whatsapp_number': (result[9] if len(result) > 9 else None) or '',
-                                'school_location': (result[10] if len(result) > 10 else None) or ''
-                            }
-    except Exception as e:
-        # Silently return default values if there's an error
-        # Don't print errors for context processor to avoid cluttering logs
-        pass
-    finally:
-        if connection:
+        with connection.cursor() as cursor:
             try:
-                connection.close()
-            except:
-                pass
+                cursor.execute("SELECT * FROM school_settings ORDER BY id DESC LIMIT 1")
+            except pymysql.err.ProgrammingError:
+                # Table doesn't exist yet - use defaults
+                return school_data
+            result = cursor.fetchone()
+            if result:
+                # Handle both tuple and dict results
+                if isinstance(result, dict):
+                    school_data = {
+                        'school_name': result.get('school_name') or 'Modern School',
+                        'school_email': result.get('school_email') or '',
+                        'school_phone': result.get('school_phone') or '',
+                        'school_logo': result.get('school_logo') or None,
+                        'twitter_url': result.get('twitter_url') or '',
+                        'facebook_url': result.get('facebook_url') or '',
+                        'instagram_url': result.get('instagram_url') or '',
+                        'tiktok_url': result.get('tiktok_url') or '',
+                        'whatsapp_number': result.get('whatsapp_number') or '',
+                        'school_location': result.get('school_location') or ''
+                    }
+                else:
+                    # Tuple result (fallback)
+                    school_data = {
+                        'school_name': (result[1] if len(result) > 1 else None) or 'Modern School',
+                        'school_email': (result[2] if len(result) > 2 else None) or '',
+                        'school_phone': (result[3] if len(result) > 3 else None) or '',
+                        'school_logo': (result[4] if len(result) > 4 else None) or None,
+                        'twitter_url': (result[5] if len(result) > 5 else None) or '',
+                        'facebook_url': (result[6] if len(result) > 6 else None) or '',
+                        'instagram_url': (result[7] if len(result) > 7 else None) or '',
+                        'tiktok_url': (result[8] if len(result) > 8 else None) or '',
+                        'whatsapp_number': (result[9] if len(result) > 9 else None) or '',
+                        'school_location': (result[10] if len(result) > 10 else None) or ''
+                    }
+    finally:
+        connection.close()
     
     return school_data
 
-@app.context_processor
-def inject_school_settings():
-    """Make school settings and active academic levels available to all templates"""
+def get_school_settings():
+    """Get school settings (cached per process)"""
+    return dict(get_cached_setting('school_settings', _load_school_settings, default_school_settings()))
+
+def _load_active_academic_levels():
+    """Read active academic levels from the database (raises on connection errors)"""
     academic_levels = []
     connection = get_db_connection()
-    if connection:
-        try:
-            with connection.cursor() as cursor:
+    if not connection:
+        raise RuntimeError('Database connection unavailable')
+    try:
+        with connection.cursor() as cursor:
+            try:
                 cursor.execute("""
                     SELECT id, level_category, level_name, level_description 
                     FROM academic_levels 
                     WHERE level_status = 'active'
                     ORDER BY level_name ASC
                 """)
-                results = cursor.fetchall()
-                
-                if results:
-                    for row in results:
-                        academic_levels.append({
-                            'id': row.get('id'),
-                            'level_category': row.get('level_category', ''),
-                            'level_name': row.get('level_name', ''),
-                            'level_description': row.get('level_description', '')
-                        })
-                
-                # Update employee profile picture in session if user is logged in as employee
-                if session.get('user_id') and session.get('role'):
-                    user_role = session.get('role', '').lower()
-                    employee_roles = ['employee', 'super admin', 'principal', 'deputy principal', 'academic coordinator', 
-                                     'teachers', 'accountant', 'librarian', 'warden', 'transport manager', 'technician']
-                    if user_role in employee_roles:
+            except pymysql.err.ProgrammingError:
+                # Table might not exist yet, that's okay
+                return academic_levels
+            for row in cursor.fetchall():
+                academic_levels.append({
+                    'id': row.get('id'),
+                    'level_category': row.get('level_category', ''),
+                    'level_name': row.get('level_name', ''),
+                    'level_description': row.get('level_description', '')
+                })
+    finally:
+        connection.close()
+    
+    return academic_levels
+
+def get_active_academic_levels():
+    """Get active academic levels (cached per process)"""
+    return list(get_cached_setting('academic_levels', _load_active_academic_levels, []))
+
+@app.context_processor
+def inject_school_settings():
+    """Make school settings and active academic levels available to all templates"""
+    # Update employee profile picture in session if user is logged in as employee
+    if session.get('user_id') and session.get('role'):
+        user_role = session.get('role', '').lower()
+        employee_roles = ['employee', 'super admin', 'principal', 'deputy principal', 'academic coordinator', 
+                         'teachers', 'accountant', 'librarian', 'warden', 'transport manager', 'technician']
+        if user_role in employee_roles:
+            connection = get_db_connection()
+            if connection:
+                try:
+                    with connection.cursor() as cursor:
                         employee_id = session.get('employee_id') or session.get('user_id')
                         cursor.execute("SELECT profile_picture FROM employees WHERE id = %s OR employee_id = %s", 
                                      (employee_id, employee_id))
@@ -188,16 +308,15 @@ def inject_school_settings():
                         if employee and employee.get('profile_picture'):
                             # Update session with latest profile picture
                             session['profile_picture'] = employee.get('profile_picture')
-        except Exception as e:
-            # Table might not exist yet, that's okay
-            pass
-        finally:
-            if connection:
-                connection.close()
+                except Exception as e:
+                    # Table might not exist yet, that's okay
+                    pass
+                finally:
+                    connection.close()
     
     return {
         'school_settings': get_school_settings(),
-        'academic_levels': academic_levels
+        'academic_levels': get_active_academic_levels()
     }
 
 # Function to detect if running on hosted server
@@ -279,7 +398,7 @@ def check_table_exists(connection, table_name):
             result = cursor.fetchone()
             return result['count'] > 0
     except Exception as e:
-        print(f"Error checking table existence: {e}")
+        db_log.error("Error checking table existence: %s", e)
         return False
 
 def generate_student_id(connection):
@@ -307,10 +426,13 @@ def generate_student_id(connection):
             student_id = f"STU{new_number:03d}"
             return student_id
     except Exception as e:
-        print(f"Error generating student ID: {e}")
+        students_log.error("Error generating student ID: %s", e)
         # Fallback: use timestamp-based ID if there's an error
         return f"STU{int(datetime.now().timestamp()) % 100000:05d}"
 
+# Bump when init_db() changes, so the next worker start runs it again (see migrations.migration_manager.ensure_schema)
+SCHEMA_VERSION = 1
+
 def init_db():
     """Initialize database and tables - creates database if missing, then creates tables"""
     # First, ensure the database exists
@@ -981,38 +1103,256 @@ def init_db():
             except:
                 pass
 
+# Shared connection pool - get_db_connection() borrows from it and close() returns the connection
+db_pool = ConnectionPool(
+    DB_CONFIG,
+    max_size=int(os.environ.get('DB_POOL_SIZE', 10)),
+    max_idle=int(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+    max_lifetime=int(os.environ.get('DB_POOL_MAX_LIFETIME', 3600)),
+    checkout_timeout=int(os.environ.get('DB_POOL_TIMEOUT', 10))
+)
+
+class RequestConnection:
+    """Connection shared by everything that runs during one request.
+
+    Decorators, context processors and the view all receive the same object from
+    get_db_connection(); their close() calls are no-ops and the teardown handler
+    commits or rolls back and returns the connection to the pool.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def close(self):
+        """Keep the connection open until the request is torn down"""
+        pass
+
+    def cursor(self, *args, **kwargs):
+        """Cursor whose statements are counted and timed in the request's query stats"""
+        cursor = self._connection.cursor(*args, **kwargs)
+        stats = g.get('query_stats')
+        return TrackingCursor(cursor, stats) if stats is not None else cursor
+
+    def release(self, discard=False):
+        """Return the underlying connection to the pool"""
+        if discard:
+            self._connection.discard()
+        else:
+            self._connection.close()
+
+@contextmanager
+def helper_transaction(connection, name):
+    """Unit of work of a helper that may run on the request's shared connection.
+
+    On the request connection the helper's statements run inside SAVEPOINT name: a
+    failure rolls back only to the savepoint and the request teardown commits the rest,
+    so the helper never commits or discards the caller's unfinished writes. On its own
+    connection (outside a request) the helper commits or rolls back as before.
+    """
+    shared = isinstance(connection, RequestConnection)
+    if shared:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SAVEPOINT {name}")
+    try:
+        yield
+    except Exception:
+        if shared:
+            with connection.cursor() as cursor:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT {name}")
+        else:
+            connection.rollback()
+        raise
+    if shared:
+        with connection.cursor() as cursor:
+            cursor.execute(f"RELEASE SAVEPOINT {name}")
+    else:
+        connection.commit()
+
 def get_db_connection():
-    """Create and return a database connection - automatically creates database and tables if missing"""
+    """Return the request's shared connection, or borrow a pooled one outside a request"""
+    if has_request_context():
+        connection = g.get('db_connection')
+        if connection is None:
+            pooled = _open_pooled_connection()
+            if not pooled:
+                return None
+            connection = g.db_connection = RequestConnection(pooled)
+            if g.get('query_stats') is not None:
+                g.query_stats.connections += 1
+        return connection
+    return _open_pooled_connection()
+
+@app.teardown_request
+def release_request_connection(exception=None):
+    """Commit (or roll back on error) the request's connection and return it to the pool"""
+    connection = g.pop('db_connection', None)
+    if connection is None:
+        return
     try:
-        connection = pymysql.connect(**DB_CONFIG)
+        if exception is None:
+            connection.commit()
+        else:
+            connection.rollback()
+    except Exception as e:
+        db_log.error("Error finishing request database transaction: %s", e)
+        connection.release(discard=True)
+        return
+    connection.release()
+    if exception is None and g.pop('wake_email_worker', False):
+        # Emails queued during the request are only visible to the worker once committed
+        email_worker.wake()
+
+# Per-request SQL instrumentation: statements run through the request connection are counted and
+# timed. Technicians get the numbers in X-SQL-* / Server-Timing headers and, after visiting any
+# page with ?sql_debug=1, in a toolbar; slow requests and likely N+1 loops are logged.
+SQL_TRACKING_ENABLED = os.environ.get('SQL_TRACKING_ENABLED', 'True').lower() in ['true', '1', 'yes']
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 1000))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))
+
+@app.before_request
+def start_query_tracking():
+    """Collect the request's SQL statistics in g.query_stats"""
+    if SQL_TRACKING_ENABLED and request.endpoint != 'static':
+        g.query_stats = QueryStats()
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def report_query_stats(response):
+    """Expose the request's SQL statistics to technicians and log slow or N+1 requests"""
+    stats = g.get('query_stats')
+    if stats is None:
+        return response
+    seconds = time.perf_counter() - g.request_started
+    summary = stats.summary(N_PLUS_ONE_THRESHOLD)
+    if seconds * 1000 >= SLOW_REQUEST_MS or summary['n_plus_one']:
+        sql_log.warning("%s", format_report(request.method, request.path, seconds, summary))
+    
+    if session.get('role', '').lower() != 'technician':
+        return response
+    response.headers['X-SQL-Queries'] = str(summary['queries'])
+    response.headers['X-SQL-Time-Ms'] = str(summary['time_ms'])
+    response.headers['X-SQL-Connections'] = str(summary['connections'])
+    if summary['n_plus_one']:
+        response.headers['X-SQL-N-Plus-One'] = str(len(summary['n_plus_one']))
+    response.headers.add('Server-Timing', f'db;dur={summary["time_ms"]};desc="{summary["queries"]} queries"')
+    
+    if request.args.get('sql_debug') in ('0', '1'):
+        session['sql_debug'] = request.args.get('sql_debug') == '1'
+    if session.get('sql_debug') and response.mimetype == 'text/html' and not response.direct_passthrough \
+            and not response.is_streamed:
+        summary.update(endpoint=request.endpoint, request_ms=round(seconds * 1000, 1),
+                       slow=seconds * 1000 >= SLOW_REQUEST_MS)
+        toolbar = get_template_attribute('dashboards/sql_debug_toolbar.html', 'sql_debug_toolbar')(summary)
+        body = response.get_data(as_text=True)
+        position = body.rfind('</body>')
+        if position != -1:
+            response.set_data(body[:position] + str(toolbar) + body[position:])
+    return response
+
+def _open_pooled_connection():
+    """Borrow a pooled database connection - automatically creates database and tables if missing"""
+    try:
+        connection = db_pool.acquire()
         return connection
+    except PoolTimeoutError as e:
+        db_log.error("Database connection error: %s", e)
+        return None
     except pymysql.err.OperationalError as e:
         # If database doesn't exist, try to create it and reconnect
         if e.args[0] == 1049:  # Unknown database error
-            print(f"Database '{DB_CONFIG['database']}' not found. Creating database and tables...")
+            db_log.info("Database '%s' not found. Creating database and tables...", DB_CONFIG['database'])
             if ensure_database_exists():
                 try:
                     # Initialize tables in the newly created database
                     if init_db():
                         # Now connect to the database
-                        connection = pymysql.connect(**DB_CONFIG)
+                        connection = db_pool.acquire()
                         return connection
                     else:
-                        print("Failed to initialize database tables.")
+                        db_log.error("Failed to initialize database tables.")
                         return None
                 except Exception as e2:
-                    print(f"Database connection error after creation: {e2}")
+                    db_log.error("Database connection error after creation: %s", e2)
                     return None
             else:
-                print(f"Failed to create database '{DB_CONFIG['database']}'.")
+                db_log.error("Failed to create database '%s'.", DB_CONFIG['database'])
                 return None
         else:
-            print(f"Database connection error: {e}")
+            db_log.error("Database connection error: %s", e)
             return None
     except Exception as e:
-        print(f"Database connection error: {e}")
+        db_log.error("Database connection error: %s", e)
         return None
 
+# Transactional email: requests only write to the email_outbox table, a worker delivers
+EMAIL_WORKER_ENABLED = os.environ.get('EMAIL_WORKER_ENABLED', 'True').lower() in ['true', '1', 'yes']
+
+def send_outbox_batch(messages, send_interval=0):
+    """Send outbox messages over a single SMTP connection; returns {message_id: error or None}"""
+    from flask_mail import Message
+    results = {}
+    with app.app_context():
+        with get_mail().connect() as smtp:
+            for index, message in enumerate(messages):
+                if index and send_interval:
+                    time.sleep(send_interval)
+                try:
+                    smtp.send(Message(
+                        subject=message['subject'],
+                        recipients=[message['recipient']],
+                        html=message.get('html_body'),
+                        body=message.get('text_body')
+                    ))
+                    results[message['id']] = None
+                except Exception as e:
+                    results[message['id']] = str(e)
+    return results
+
+# Pause between messages when a bulk approval delivers its notifications in one SMTP session
+EMAIL_BULK_SEND_INTERVAL = float(os.environ.get('EMAIL_BULK_SEND_INTERVAL', 0.5))
+
+email_worker = EmailOutboxWorker(
+    _open_pooled_connection,
+    send_outbox_batch,
+    batch_size=int(os.environ.get('EMAIL_BATCH_SIZE', 20)),
+    poll_interval=int(os.environ.get('EMAIL_POLL_INTERVAL', 30)),
+    send_interval=float(os.environ.get('EMAIL_SEND_INTERVAL', 0)),
+    retry_base=int(os.environ.get('EMAIL_RETRY_BASE', 60))
+)
+
+@app.before_request
+def start_email_worker():
+    """Run the outbox worker thread in every web process (unless a separate worker is used)"""
+    if EMAIL_WORKER_ENABLED:
+        email_worker.start()
+
+def queue_email(recipient, subject, html_body, text_body=None, category=None):
+    """Add an email to the outbox and wake the delivery worker"""
+    connection = get_db_connection()
+    if not connection:
+        return False
+    try:
+        # Within a request the email commits with the request's own writes (and is
+        # dropped with them if the request fails)
+        with helper_transaction(connection, 'queue_email'):
+            with connection.cursor() as cursor:
+                enqueue_email(cursor, recipient, subject, html_body, text_body, category=category)
+    except Exception as e:
+        email_log.error("Error queueing email to %s: %s", recipient, e)
+        return False
+    finally:
+        connection.close()
+    if EMAIL_WORKER_ENABLED:
+        email_worker.start()
+        if isinstance(connection, RequestConnection):
+            g.wake_email_worker = True
+        else:
+            email_worker.wake()
+    return True
+
 def login_required(f):
     """Decorator to require login"""
     @wraps(f)
@@ -1038,11 +1378,79 @@ def role_required(role):
         return decorated_function
     return decorator
 
+class EmployeePermissions:
+    """Resolved employee id and permission set for the logged-in user"""
+
+    def __init__(self, employee_id=None, permissions=None):
+        self.employee_id = employee_id
+        self.permissions = set(permissions or [])
+
+    def __contains__(self, permission_key):
+        return permission_key in self.permissions
+
+    def __len__(self):
+        return len(self.permissions)
+
+def get_request_permissions():
+    """Load the logged-in employee's numeric id and full permission set once per request.
+    
+    Every permission check during the request is then an in-memory set lookup.
+    """
+    cached = g.get('employee_permissions')
+    if cached is not None:
+        return cached
+    
+    resolved = EmployeePermissions()
+    employee_id = session.get('employee_id') or session.get('user_id')
+    if employee_id:
+        connection = get_db_connection()
+        if connection:
+            try:
+                with connection.cursor() as cursor:
+                    # Find employee by id or employee_id field and all of their permissions in one query
+                    cursor.execute("""
+                        SELECT e.id, ep.permission_key
+                        FROM (
+                            SELECT id 
+                            FROM employees 
+                            WHERE id = %s OR employee_id = %s
+                            LIMIT 1
+                        ) e
+                        LEFT JOIN employee_permissions ep ON ep.employee_id = e.id
+                    """, (employee_id, employee_id))
+                    rows = cursor.fetchall()
+                    if rows:
+                        resolved = EmployeePermissions(
+                            rows[0].get('id'),
+                            [row.get('permission_key') for row in rows if row.get('permission_key')]
+                        )
+            except Exception as e:
+                permissions_log.error("Error finding employee ID or checking permissions: %s", e)
+            finally:
+                if connection:
+                    try:
+                        connection.close()
+                    except:
+                        pass
+    
+    g.employee_permissions = resolved
+    return resolved
+
+def invalidate_request_permissions():
+    """Forget the permission set loaded for this request (after permissions are changed)"""
+    g.pop('employee_permissions', None)
+
 def has_permission(employee_id, permission_key):
     """Check if an employee has a specific permission"""
     if not employee_id:
         return False
     
+    # The logged-in employee's permissions are already loaded for this request
+    if has_request_context() and 'user_id' in session:
+        current = get_request_permissions()
+        if current.employee_id is not None and str(current.employee_id) == str(employee_id):
+            return permission_key in current
+    
     connection = get_db_connection()
     if not connection:
         return False
@@ -1060,7 +1468,7 @@ def has_permission(employee_id, permission_key):
                 return count > 0
             return False
     except Exception as e:
-        print(f"Error checking permission: {e}")
+        permissions_log.error("Error checking permission: %s", e)
         return False
     finally:
         if connection:
@@ -1079,69 +1487,32 @@ def check_permission_or_role(permission_key, allowed_roles=None):
     4. If employee has NO permissions assigned, fall back to role-based access
     """
     user_role = session.get('role', '').lower()
-    employee_id = session.get('employee_id') or session.get('user_id')
     
     # Technicians have all permissions
     if user_role == 'technician':
         return True
     
-    # First, get the actual employee ID from database (handle both id and employee_id fields)
-    actual_employee_id = None
-    total_permissions = 0
-    
-    if employee_id:
-        connection = get_db_connection()
-        if connection:
-            try:
-                with connection.cursor() as cursor:
-                    # Try to find employee by id or employee_id field
-                    cursor.execute("""
-                        SELECT id 
-                        FROM employees 
-                        WHERE id = %s OR employee_id = %s
-                        LIMIT 1
-                    """, (employee_id, employee_id))
-                    result = cursor.fetchone()
-                    if result:
-                        actual_employee_id = result.get('id') if isinstance(result, dict) else result[0]
-                        
-                        # Check if employee has ANY permissions assigned (do this in same query for efficiency)
-                        cursor.execute("""
-                            SELECT COUNT(*) as count 
-                            FROM employee_permissions 
-                            WHERE employee_id = %s
-                        """, (actual_employee_id,))
-                        perm_result = cursor.fetchone()
-                        if perm_result:
-                            total_permissions = perm_result.get('count', 0) if isinstance(perm_result, dict) else perm_result[0] if isinstance(perm_result, tuple) else 0
-            except Exception as e:
-                print(f"Error finding employee ID or checking permissions: {e}")
-            finally:
-                if connection:
-                    try:
-                        connection.close()
-                    except:
-                        pass
+    # Actual employee ID and permission set, loaded once per request
+    current_permissions = get_request_permissions()
+    actual_employee_id = current_permissions.employee_id
+    total_permissions = len(current_permissions)
     
     # Check if employee has specific permission assigned
     if actual_employee_id:
-        has_specific_permission = has_permission(actual_employee_id, permission_key)
+        has_specific_permission = permission_key in current_permissions
         
-        # Debug logging
-        print(f"DEBUG check_permission_or_role('{permission_key}'):")
-        print(f"  - actual_employee_id: {actual_employee_id}")
-        print(f"  - user_role: {user_role}")
-        print(f"  - has_specific_permission: {has_specific_permission}")
-        print(f"  - total_permissions: {total_permissions}")
+        permissions_log.debug("check_permission_or_role(%r): employee=%s role=%s has_permission=%s total_permissions=%s",
+                              permission_key, actual_employee_id, user_role, has_specific_permission,
+                              total_permissions)
         
         if has_specific_permission:
-            print(f"  - RESULT: GRANTED (has specific permission)")
+            permissions_log.debug("%s: GRANTED (has specific permission)", permission_key)
             return True
         
         # If employee has ANY permissions assigned, we're in permission-based mode
         # So if they don't have this specific permission, deny access
         if total_permissions > 0:
-            print(f"  - RESULT: DENIED (permission-based mode, no specific permission)")
+            permissions_log.debug("%s: DENIED (permission-based mode, no specific permission)", permission_key)
             return False  # Permission-based mode: no permission = no access
         
         # IMPORTANT: For accountants, principals, and other roles that use permissions,
@@ -1156,7 +1527,8 @@ def check_permission_or_role(permission_key, allowed_roles=None):
         # So for now: if accountant/principal with 0 permissions, deny access (require explicit permissions)
         if user_role in ['accountant', 'principal'] and total_permissions == 0:
             # For accountants/principals, require explicit permissions - no role fallback
-            print(f"  - RESULT: DENIED (accountant/principal with no permissions - requires explicit permission)")
+            permissions_log.debug("%s: DENIED (accountant/principal with no permissions - requires explicit permission)",
+                                  permission_key)
             return False
     
     # Fall back to role-based access only if:
@@ -1165,17 +1537,24 @@ def check_permission_or_role(permission_key, allowed_roles=None):
     if allowed_roles and user_role in allowed_roles:
         # Only allow role fallback for non-accountant/principal roles
         if user_role not in ['accountant', 'principal']:
-            print(f"  - RESULT: GRANTED (role-based fallback: {user_role} in {allowed_roles})")
+            permissions_log.debug("%s: GRANTED (role-based fallback: %s in %s)", permission_key, user_role, allowed_roles)
             return True
         else:
-            print(f"  - RESULT: DENIED (accountant/principal requires explicit permission, no role fallback)")
+            permissions_log.debug("%s: DENIED (accountant/principal requires explicit permission, no role fallback)",
+                                  permission_key)
             return False
     
-    print(f"  - RESULT: DENIED (no permission, no role match)")
+    permissions_log.debug("%s: DENIED (no permission, no role match)", permission_key)
     return False
 
 def get_employee_permissions_list(employee_id):
     """Get list of all permissions for an employee"""
+    # Reuse the set already loaded for the logged-in employee
+    if has_request_context() and 'user_id' in session:
+        current = get_request_permissions()
+        if current.employee_id is not None and str(current.employee_id) == str(employee_id):
+            return sorted(current.permissions)
+    
     connection = get_db_connection()
     permissions = []
     
@@ -1196,7 +1575,7 @@ def get_employee_permissions_list(employee_id):
                 else:
                     permissions.append(result[0] if result else '')
     except Exception as e:
-        print(f"Error fetching employee permissions: {e}")
+        permissions_log.error("Error fetching employee permissions: %s", e)
     finally:
         if connection:
             try:
@@ -1234,7 +1613,7 @@ def permission_required(permission_key):
     return decorator
 
 def send_admission_confirmation_email(parent_email, parent_name, student_name, student_id):
-    """Send confirmation email to parent/guardian after admission submission"""
+    """Queue confirmation email to parent/guardian after admission submission"""
     try:
         # Get support contact information from environment or use defaults
         support_email = os.environ.get('SUPPORT_EMAIL', 'support@modernschool.com')
@@ -1374,29 +1753,64 @@ This is an automated message. Please do not reply to this email.
 © {datetime.now().year} {school_name}. All rights reserved.
         """
         
-        msg = Message(
-            subject=subject,
-            recipients=[parent_email],
-            html=html_body,
-            body=text_body
-        )
-        
-        mail.send(msg)
-        print(f"Admission confirmation email sent to {parent_email}")
-        return True
+        queued = queue_email(parent_email, subject, html_body, text_body, category='admission_confirmation')
+        if queued:
+            email_log.info("Admission confirmation email queued for %s", parent_email)
+        return queued
     except Exception as e:
-        print(f"Error sending admission confirmation email: {e}")
+        email_log.error("Error queueing admission confirmation email: %s", e)
         return False
 
+def _notification_email_context():
+    """School-wide values of the notification emails (support contact from the environment or defaults)"""
+    return {
+        'school_name': os.environ.get('SCHOOL_NAME', 'Modern School'),
+        'support_email': os.environ.get('SUPPORT_EMAIL', 'support@modernschool.com'),
+        'support_phone': os.environ.get('SUPPORT_PHONE', '+254 700 000 000'),
+        'year': datetime.now().year
+    }
+
+def student_approval_email_renderer():
+    """Renderer of student approval emails for one batch.
+
+    The compiled template macros and the school-wide values are resolved once; each
+    call only fills in one recipient and returns (subject, html_body, text_body).
+    """
+    email = _notification_email_context()
+    html = get_template_attribute('emails/approval_emails.html', 'student_approval')
+    text = get_template_attribute('emails/approval_emails.txt', 'student_approval')
+    
+    def render(parent_name, student_name, student_id):
+        subject = f"Congratulations! {student_name} Has Been Accepted to {email['school_name']}"
+        return (subject, str(html(email, parent_name, student_name, student_id)),
+                str(text(email, parent_name, student_name, student_id)))
+    return render
+
+def render_student_approval_email(parent_name, student_name, student_id):
+    """Subject, HTML and plain-text body of the student approval email"""
+    return student_approval_email_renderer()(parent_name, student_name, student_id)
+
 def send_student_approval_email(parent_email, parent_name, student_name, student_id):
-    """Send approval congratulations email to parent/guardian after student admission is approved"""
+    """Queue approval congratulations email to parent/guardian after student admission is approved"""
+    try:
+        subject, html_body, text_body = render_student_approval_email(parent_name, student_name, student_id)
+        queued = queue_email(parent_email, subject, html_body, text_body, category='student_approval')
+        if queued:
+            email_log.info("Student approval email queued for %s", parent_email)
+        return queued
+    except Exception as e:
+        email_log.error("Error queueing student approval email: %s", e)
+        return False
+
+def send_employee_welcome_email(employee_email, employee_name, employee_id):
+    """Queue welcome email to employee after registration"""
     try:
         # Get support contact information from environment or use defaults
         support_email = os.environ.get('SUPPORT_EMAIL', 'support@modernschool.com')
         support_phone = os.environ.get('SUPPORT_PHONE', '+254 700 000 000')
         school_name = os.environ.get('SCHOOL_NAME', 'Modern School')
         
-        subject = f"Congratulations! {student_name} Has Been Accepted to {school_name}"
+        subject = f"Welcome to {school_name} - Employee Registration"
         
         # Create email body
         html_body = f"""
@@ -1414,7 +1828,7 @@ def send_student_approval_email(parent_email, parent_name, student_name, student
                     padding: 20px;
                 }}
                 .header {{
-                    background: linear-gradient(135deg, #1e40af 0%, #f97316 100%);
+                    background: linear-gradient(135deg, #10b981 0%, #059669 100%);
                     color: white;
                     padding: 30px;
                     text-align: center;
@@ -1455,8 +1869,8 @@ def send_student_approval_email(parent_email, parent_name, student_name, student
                 }}
                 .status-badge {{
                     display: inline-block;
-                    background: #10b981;
-                    color: white;
+                    background: #fef3c7;
+                    color: #92400e;
                     padding: 5px 15px;
                     border-radius: 20px;
                     font-weight: bold;
@@ -1466,45 +1880,36 @@ def send_student_approval_email(parent_email, parent_name, student_name, student
         </head>
         <body>
             <div class="header">
-                <h1>🎉 Congratulations! 🎉</h1>
+                <h1>{school_name}</h1>
             </div>
             <div class="content">
-                <p>Dear {parent_name},</p>
+                <p>Dear {employee_name},</p>
                 
-                <p>We are delighted to inform you that <strong>{student_name}</strong> has been accepted to <strong>{school_name}</strong>! We are thrilled to welcome your child to our school community.</p>
+                <p>Welcome to the <strong>{school_name}</strong> community! We are thrilled to have you join our team.</p>
                 
                 <div class="info-box">
-                    <p><strong>Admission Details:</strong></p>
-                    <p><strong>Student Name:</strong> {student_name}</p>
-                    <p><strong>Student ID:</strong> {student_id}</p>
-                    <p><strong>Status:</strong> <span class="status-badge">Approved - In Session</span></p>
+                    <p><strong>Registration Details:</strong></p>
+                    <p><strong>Name:</strong> {employee_name}</p>
+                    <p><strong>Employee ID:</strong> {employee_id}</p>
+                    <p><strong>Status:</strong> <span class="status-badge">Pending Approval</span></p>
                 </div>
                 
-                <p>Your child's admission has been approved and they are now officially enrolled in our school. We are excited to have {student_name} join us and look forward to supporting their educational journey.</p>
-                
-                <p><strong>Next Steps:</strong></p>
-                <p>Our admissions office will be in touch with you shortly regarding the next steps in the admission procedure. This will include information about:</p>
-                <ul>
-                    <li>Orientation dates and schedules</li>
-                    <li>Required documentation and forms</li>
-                    <li>School policies and procedures</li>
-                    <li>Important dates and events</li>
-                </ul>
+                <p>Your employee registration has been successfully submitted and is currently under review. Our administration team will review your application and notify you once your account has been activated.</p>
                 
-                <p>Please keep your Student ID (<strong>{student_id}</strong>) for future reference, as you will need it for various school-related activities.</p>
+                <p>Please keep your Employee ID (<strong>{employee_id}</strong>) for future reference, as you will need it to access your account once approved.</p>
                 
                 <div class="contact-info">
                     <h3>Need Assistance?</h3>
-                    <p>If you have any questions or need support, please don't hesitate to contact our admissions office:</p>
+                    <p>If you have any questions or need support, please don't hesitate to contact us:</p>
                     <p><strong>Email:</strong> <a href="mailto:{support_email}" style="color: #059669;">{support_email}</a></p>
                     <p><strong>Phone:</strong> {support_phone}</p>
                     <p>Our support team is available Monday through Friday, 8:00 AM to 5:00 PM.</p>
                 </div>
                 
-                <p>Once again, congratulations on this wonderful achievement! We are honored to have {student_name} as part of our school family and look forward to working together to ensure their success.</p>
+                <p>We look forward to working with you and contributing to the success of {school_name}.</p>
                 
                 <p>Best regards,<br>
-                <strong>Admissions Office</strong><br>
+                <strong>Human Resources Department</strong><br>
                 {school_name}</p>
             </div>
             <div class="footer">
@@ -1517,36 +1922,29 @@ def send_student_approval_email(parent_email, parent_name, student_name, student
         
         # Plain text version
         text_body = f"""
-Dear {parent_name},
-
-We are delighted to inform you that {student_name} has been accepted to {school_name}! We are thrilled to welcome your child to our school community.
+Dear {employee_name},
 
-Admission Details:
-- Student Name: {student_name}
-- Student ID: {student_id}
-- Status: Approved - In Session
+Welcome to the {school_name} community! We are thrilled to have you join our team.
 
-Your child's admission has been approved and they are now officially enrolled in our school. We are excited to have {student_name} join us and look forward to supporting their educational journey.
+Registration Details:
+- Name: {employee_name}
+- Employee ID: {employee_id}
+- Status: Pending Approval
 
-Next Steps:
-Our admissions office will be in touch with you shortly regarding the next steps in the admission procedure. This will include information about:
-- Orientation dates and schedules
-- Required documentation and forms
-- School policies and procedures
-- Important dates and events
+Your employee registration has been successfully submitted and is currently under review. Our administration team will review your application and notify you once your account has been activated.
 
-Please keep your Student ID ({student_id}) for future reference, as you will need it for various school-related activities.
+Please keep your Employee ID ({employee_id}) for future reference, as you will need it to access your account once approved.
 
 Need Assistance?
-If you have any questions or need support, please don't hesitate to contact our admissions office:
+If you have any questions or need support, please don't hesitate to contact us:
 - Email: {support_email}
 - Phone: {support_phone}
 Our support team is available Monday through Friday, 8:00 AM to 5:00 PM.
 
-Once again, congratulations on this wonderful achievement! We are honored to have {student_name} as part of our school family and look forward to working together to ensure their success.
+We look forward to working with you and contributing to the success of {school_name}.
 
 Best regards,
-Admissions Office
+Human Resources Department
 {school_name}
 
 ---
@@ -1554,557 +1952,216 @@ This is an automated message. Please do not reply to this email.
 © {datetime.now().year} {school_name}. All rights reserved.
         """
         
-        msg = Message(
-            subject=subject,
-            recipients=[parent_email],
-            html=html_body,
-            body=text_body
-        )
-        
-        mail.send(msg)
-        print(f"Student approval email sent to {parent_email}")
-        return True
+        queued = queue_email(employee_email, subject, html_body, text_body, category='employee_welcome')
+        if queued:
+            email_log.info("Employee welcome email queued for %s", employee_email)
+        return queued
     except Exception as e:
-        print(f"Error sending student approval email: {e}")
+        email_log.error("Error queueing employee welcome email: %s", e)
         return False
 
-def send_employee_welcome_email(employee_email, employee_name, employee_id):
-    """Send welcome email to employee after registration"""
-    try:
-        # Get support contact information from environment or use defaults
-        support_email = os.environ.get('SUPPORT_EMAIL', 'support@modernschool.com')
-        support_phone = os.environ.get('SUPPORT_PHONE', '+254 700 000 000')
-        school_name = os.environ.get('SCHOOL_NAME', 'Modern School')
-        
-        subject = f"Welcome to {school_name} - Employee Registration"
-        
-        # Create email body
-        html_body = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                body {{
-                    font-family: Arial, sans-serif;
-                    line-height: 1.6;
-                    color: #333;
-                    max-width: 600px;
-                    margin: 0 auto;
-                    padding: 20px;
-                }}
-                .header {{
-                    background: linear-gradient(135deg, #10b981 0%, #059669 100%);
-                    color: white;
-                    padding: 30px;
-                    text-align: center;
-                    border-radius: 10px 10px 0 0;
-                }}
-                .content {{
-                    background: #f9fafb;
-                    padding: 30px;
-                    border: 1px solid #e5e7eb;
-                }}
-                .info-box {{
-                    background: white;
-                    border-left: 4px solid #10b981;
-                    padding: 15px;
-                    margin: 20px 0;
-                }}
-                .footer {{
-                    background: #1f2937;
-                    color: white;
-                    padding: 20px;
-                    text-align: center;
-                    border-radius: 0 0 10px 10px;
-                    font-size: 14px;
-                }}
-                .contact-info {{
-                    background: #d1fae5;
-                    border: 1px solid #10b981;
-                    border-radius: 8px;
-                    padding: 20px;
-                    margin: 20px 0;
-                }}
-                .contact-info h3 {{
-                    margin-top: 0;
-                    color: #059669;
-                }}
-                .contact-info p {{
-                    margin: 8px 0;
-                }}
-                .status-badge {{
-                    display: inline-block;
-                    background: #fef3c7;
-                    color: #92400e;
-                    padding: 5px 15px;
-                    border-radius: 20px;
-                    font-weight: bold;
-                    font-size: 14px;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h1>{school_name}</h1>
-            </div>
-            <div class="content">
-                <p>Dear {employee_name},</p>
-                
-                <p>Welcome to the <strong>{school_name}</strong> community! We are thrilled to have you join our team.</p>
-                
-                <div class="info-box">
-                    <p><strong>Registration Details:</strong></p>
-                    <p><strong>Name:</strong> {employee_name}</p>
-                    <p><strong>Employee ID:</strong> {employee_id}</p>
-                    <p><strong>Status:</strong> <span class="status-badge">Pending Approval</span></p>
-                </div>
-                
-                <p>Your employee registration has been successfully submitted and is currently under review. Our administration team will review your application and notify you once your account has been activated.</p>
-                
-                <p>Please keep your Employee ID (<strong>{employee_id}</strong>) for future reference, as you will need it to access your account once approved.</p>
-                
-                <div class="contact-info">
-                    <h3>Need Assistance?</h3>
-                    <p>If you have any questions or need support, please don't hesitate to contact us:</p>
-                    <p><strong>Email:</strong> <a href="mailto:{support_email}" style="color: #059669;">{support_email}</a></p>
-                    <p><strong>Phone:</strong> {support_phone}</p>
-                    <p>Our support team is available Monday through Friday, 8:00 AM to 5:00 PM.</p>
-                </div>
-                
-                <p>We look forward to working with you and contributing to the success of {school_name}.</p>
-                
-                <p>Best regards,<br>
-                <strong>Human Resources Department</strong><br>
-                {school_name}</p>
-            </div>
-            <div class="footer">
-                <p>This is an automated message. Please do not reply to this email.</p>
-                <p>&copy; {datetime.now().year} {school_name}. All rights reserved.</p>
-            </div>
-        </body>
-        </html>
-        """
-        
-        # Plain text version
-        text_body = f"""
-Dear {employee_name},
+def employee_approval_email_renderer():
+    """Renderer of employee approval emails for one batch (see student_approval_email_renderer)"""
+    email = _notification_email_context()
+    html = get_template_attribute('emails/approval_emails.html', 'employee_approval')
+    text = get_template_attribute('emails/approval_emails.txt', 'employee_approval')
+    
+    def render(employee_name, employee_id, role):
+        subject = f"Congratulations! Your Account Has Been Approved - {email['school_name']}"
+        return (subject, str(html(email, employee_name, employee_id, role)),
+                str(text(email, employee_name, employee_id, role)))
+    return render
 
-Welcome to the {school_name} community! We are thrilled to have you join our team.
+def render_employee_approval_email(employee_name, employee_id, role):
+    """Subject, HTML and plain-text body of the employee approval email"""
+    return employee_approval_email_renderer()(employee_name, employee_id, role)
 
-Registration Details:
-- Name: {employee_name}
-- Employee ID: {employee_id}
-- Status: Pending Approval
+def send_employee_approval_email(employee_email, employee_name, employee_id, role):
+    """Queue approval email to employee after approval and role assignment"""
+    try:
+        subject, html_body, text_body = render_employee_approval_email(employee_name, employee_id, role)
+        queued = queue_email(employee_email, subject, html_body, text_body, category='employee_approval')
+        if queued:
+            email_log.info("Employee approval email queued for %s", employee_email)
+        return queued
+    except Exception as e:
+        email_log.error("Error queueing employee approval email: %s", e)
+        return False
 
-Your employee registration has been successfully submitted and is currently under review. Our administration team will review your application and notify you once your account has been activated.
+# Routes
+@app.route('/')
+def home():
+    # Active academic levels for admission form (cached, shared with the template context)
+    academic_levels = get_active_academic_levels()
+    
+    return render_template('home.html', academic_levels=academic_levels)
 
-Please keep your Employee ID ({employee_id}) for future reference, as you will need it to access your account once approved.
+@app.route('/about')
+def about():
+    return render_template('about.html')
 
-Need Assistance?
-If you have any questions or need support, please don't hesitate to contact us:
-- Email: {support_email}
-- Phone: {support_phone}
-Our support team is available Monday through Friday, 8:00 AM to 5:00 PM.
+@app.route('/programs')
+def programs():
+    return render_template('programs.html')
 
-We look forward to working with you and contributing to the success of {school_name}.
+@app.route('/news')
+def news():
+    connection = get_db_connection()
+    news_items = []
+    if connection:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT * FROM news ORDER BY date DESC, created_at DESC LIMIT 6")
+                news_items = cursor.fetchall()
+        except Exception as e:
+            settings_log.error("Error fetching news: %s", e)
+        finally:
+            connection.close()
+    return render_template('news.html', news_items=news_items)
 
-Best regards,
-Human Resources Department
-{school_name}
+@app.route('/gallery')
+def gallery():
+    connection = get_db_connection()
+    gallery_items = []
+    if connection:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT * FROM gallery ORDER BY created_at DESC LIMIT 12")
+                gallery_items = cursor.fetchall()
+        except Exception as e:
+            settings_log.error("Error fetching gallery: %s", e)
+        finally:
+            connection.close()
+    return render_template('gallery.html', gallery_items=gallery_items)
 
----
-This is an automated message. Please do not reply to this email.
-© {datetime.now().year} {school_name}. All rights reserved.
-        """
-        
-        msg = Message(
-            subject=subject,
-            recipients=[employee_email],
-            html=html_body,
-            body=text_body
-        )
-        
-        mail.send(msg)
-        print(f"Employee welcome email sent to {employee_email}")
-        return True
-    except Exception as e:
-        print(f"Error sending employee welcome email: {e}")
-        return False
+@app.route('/team')
+def team():
+    # Team data - 5 key members
+    team_members = [
+        {
+            'name': 'Dr. Sarah Wanjala',
+            'position': 'Executive Director',
+            'email': 'sarah.wanjala@modernschool.com',
+            'phone': '+254 700 111 111',
+            'bio': 'With over 25 years of experience in education and non-profit management, Dr. Wanjala leads our organization with strategic vision and unwavering commitment to educational excellence.',
+            'details': 'Dr. Wanjala holds a Ph.D. in Educational Leadership and has been instrumental in establishing Modern School as a leading NGO-sponsored educational institution. She has spearheaded numerous initiatives that have transformed the lives of thousands of students.',
+            'image': 'https://images.unsplash.com/photo-1494790108377-be9c29b29330?w=800&h=1000&fit=crop',
+            'qualifications': 'Ph.D. Educational Leadership, M.Ed. Curriculum Development'
+        },
+        {
+            'name': 'Mr. James Ochieng',
+            'position': 'Program Manager',
+            'email': 'james.ochieng@modernschool.com',
+            'phone': '+254 700 111 112',
+            'bio': 'An experienced program manager specializing in educational program development, implementation, and evaluation with a focus on community impact.',
+            'details': 'Mr. Ochieng has managed over 50 educational programs across Kenya, ensuring effective delivery and measurable outcomes. He is passionate about creating sustainable educational solutions for underserved communities.',
+            'image': 'https://images.unsplash.com/photo-1507003211169-0a1dd7228f2d?w=800&h=1000&fit=crop',
+            'qualifications': 'M.A. Program Management, B.Ed. Educational Administration'
+        },
+        {
+            'name': 'Ms. Mary Kamau',
+            'position': 'Finance Manager',
+            'email': 'mary.kamau@modernschool.com',
+            'phone': '+254 700 111 113',
+            'bio': 'A certified public accountant with extensive experience in non-profit financial management, ensuring transparency and accountability in all financial operations.',
+            'details': 'Ms. Kamau brings over 15 years of financial management experience to Modern School. She ensures strict compliance with financial regulations and maintains the highest standards of fiscal responsibility.',
+            'image': 'https://images.unsplash.com/photo-1438761681033-6461ffad8d80?w=800&h=1000&fit=crop',
+            'qualifications': 'CPA (K), M.Sc. Finance, B.Com Accounting'
+        },
+        {
+            'name': 'Mr. Peter Mwangi',
+            'position': 'Project Officer',
+            'email': 'peter.mwangi@modernschool.com',
+            'phone': '+254 700 111 114',
+            'bio': 'Dedicated project officer with expertise in coordinating educational projects, managing resources, and ensuring timely delivery of program objectives.',
+            'details': 'Mr. Mwangi has successfully coordinated numerous educational projects, from infrastructure development to scholarship programs. His attention to detail and organizational skills ensure project success.',
+            'image': 'https://images.unsplash.com/photo-1500648767791-00dcc994a43e?w=800&h=1000&fit=crop',
+            'qualifications': 'M.A. Project Management, B.A. Social Work'
+        },
+        {
+            'name': 'Ms. Grace Wanjiku',
+            'position': 'Administrative Officer',
+            'email': 'grace.wanjiku@modernschool.com',
+            'phone': '+254 700 111 115',
+            'bio': 'Experienced administrative professional ensuring smooth day-to-day operations, efficient resource management, and excellent stakeholder relations.',
+            'details': 'Ms. Wanjiku is the backbone of our administrative operations, managing everything from human resources to facility coordination. Her organizational skills and dedication keep our institution running smoothly.',
+            'image': 'https://images.unsplash.com/photo-1544005313-94ddf0286df2?w=800&h=1000&fit=crop',
+            'qualifications': 'M.A. Public Administration, B.A. Business Administration'
+        }
+    ]
+    return render_template('team.html', team_members=team_members)
 
-def send_employee_approval_email(employee_email, employee_name, employee_id, role):
-    """Send approval email to employee after approval and role assignment"""
-    try:
-        # Get support contact information from environment or use defaults
-        support_email = os.environ.get('SUPPORT_EMAIL', 'support@modernschool.com')
-        support_phone = os.environ.get('SUPPORT_PHONE', '+254 700 000 000')
-        school_name = os.environ.get('SCHOOL_NAME', 'Modern School')
+@app.route('/contact', methods=['GET', 'POST'])
+def contact():
+    if request.method == 'POST':
+        name = request.form.get('name')
+        email = request.form.get('email')
+        phone = request.form.get('phone')
+        subject = request.form.get('subject')
+        message = request.form.get('message')
         
-        subject = f"Congratulations! Your Account Has Been Approved - {school_name}"
-        
-        # Create email body
-        html_body = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                body {{
-                    font-family: Arial, sans-serif;
-                    line-height: 1.6;
-                    color: #333;
-                    max-width: 600px;
-                    margin: 0 auto;
-                    padding: 20px;
-                }}
-                .header {{
-                    background: linear-gradient(135deg, #10b981 0%, #059669 100%);
-                    color: white;
-                    padding: 30px;
-                    text-align: center;
-                    border-radius: 10px 10px 0 0;
-                }}
-                .content {{
-                    background: #f9fafb;
-                    padding: 30px;
-                    border: 1px solid #e5e7eb;
-                }}
-                .info-box {{
-                    background: white;
-                    border-left: 4px solid #10b981;
-                    padding: 15px;
-                    margin: 20px 0;
-                }}
-                .footer {{
-                    background: #1f2937;
-                    color: white;
-                    padding: 20px;
-                    text-align: center;
-                    border-radius: 0 0 10px 10px;
-                    font-size: 14px;
-                }}
-                .contact-info {{
-                    background: #d1fae5;
-                    border: 1px solid #10b981;
-                    border-radius: 8px;
-                    padding: 20px;
-                    margin: 20px 0;
-                }}
-                .contact-info h3 {{
-                    margin-top: 0;
-                    color: #059669;
-                }}
-                .contact-info p {{
-                    margin: 8px 0;
-                }}
-                .status-badge {{
-                    display: inline-block;
-                    background: #d1fae5;
-                    color: #059669;
-                    padding: 5px 15px;
-                    border-radius: 20px;
-                    font-weight: bold;
-                    font-size: 14px;
-                }}
-                .role-badge {{
-                    display: inline-block;
-                    background: #dbeafe;
-                    color: #1e40af;
-                    padding: 5px 15px;
-                    border-radius: 20px;
-                    font-weight: bold;
-                    font-size: 14px;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h1>{school_name}</h1>
-            </div>
-            <div class="content">
-                <p>Dear {employee_name},</p>
-                
-                <p>We are delighted to inform you that your employee account has been <strong>approved</strong>! Welcome to the <strong>{school_name}</strong> team.</p>
-                
-                <div class="info-box">
-                    <p><strong>Account Details:</strong></p>
-                    <p><strong>Name:</strong> {employee_name}</p>
-                    <p><strong>Employee ID:</strong> {employee_id}</p>
-                    <p><strong>Assigned Role:</strong> <span class="role-badge">{role.title()}</span></p>
-                    <p><strong>Status:</strong> <span class="status-badge">Active</span></p>
-                </div>
-                
-                <p>Your account has been successfully activated and you have been assigned the role of <strong>{role.title()}</strong>. You can now log in to your employee dashboard using your registered email and password.</p>
-                
-                <p>Please keep your Employee ID (<strong>{employee_id}</strong>) for future reference, as you will need it for various school-related activities.</p>
-                
-                <div class="contact-info">
-                    <h3>Need Assistance?</h3>
-                    <p>If you have any questions or need support, please don't hesitate to contact us:</p>
-                    <p><strong>Email:</strong> <a href="mailto:{support_email}" style="color: #059669;">{support_email}</a></p>
-                    <p><strong>Phone:</strong> {support_phone}</p>
-                    <p>Our support team is available Monday through Friday, 8:00 AM to 5:00 PM.</p>
-                </div>
-                
-                <p>We are excited to have you as part of our team and look forward to working with you!</p>
-                
-                <p>Best regards,<br>
-                <strong>Human Resources Department</strong><br>
-                {school_name}</p>
-            </div>
-            <div class="footer">
-                <p>This is an automated message. Please do not reply to this email.</p>
-                <p>&copy; {datetime.now().year} {school_name}. All rights reserved.</p>
-            </div>
-        </body>
-        </html>
-        """
-        
-        # Plain text version
-        text_body = f"""
-Dear {employee_name},
-
-We are delighted to inform you that your employee account has been approved! Welcome to the {school_name} team.
-
-Account Details:
-- Name: {employee_name}
-- Employee ID: {employee_id}
-- Assigned Role: {role.title()}
-- Status: Active
-
-Your account has been successfully activated and you have been assigned the role of {role.title()}. You can now log in to your employee dashboard using your registered email and password.
-
-Please keep your Employee ID ({employee_id}) for future reference, as you will need it for various school-related activities.
-
-Need Assistance?
-If you have any questions or need support, please don't hesitate to contact us:
-- Email: {support_email}
-- Phone: {support_phone}
-Our support team is available Monday through Friday, 8:00 AM to 5:00 PM.
-
-We are excited to have you as part of our team and look forward to working with you!
+        # Here you would typically save to database or send email
+        flash('Thank you for your message! We will get back to you soon.', 'success')
+        return redirect(url_for('contact'))
+    
+    return render_template('contact.html')
 
-Best regards,
-Human Resources Department
-{school_name}
+def normalize_text(value, uppercase=True, allow_empty=False):
+    """
+    Normalize text: trim whitespace, replace multiple spaces with single space,
+    and optionally convert to uppercase.
+    
+    Args:
+        value: The text value to normalize
+        uppercase: If True, convert to uppercase (default: True)
+        allow_empty: If True, return None for empty values; if False, return empty string (default: False)
+    
+    Returns:
+        Normalized string, empty string, or None based on allow_empty parameter
+    """
+    if not value:
+        return None if allow_empty else ''
+    # Replace multiple spaces/tabs/newlines with single space, then trim
+    normalized = re.sub(r'\s+', ' ', str(value).strip())
+    if not normalized:
+        return None if allow_empty else ''
+    return normalized.upper() if uppercase else normalized
 
----
-This is an automated message. Please do not reply to this email.
-© {datetime.now().year} {school_name}. All rights reserved.
-        """
+@app.route('/admission', methods=['GET', 'POST'])
+def admission():
+    if request.method == 'POST':
+        # Get form data directly from students table column names
+        # All text fields to UPPERCASE except email (lowercase)
+        # Normalize spacing: multiple spaces become single space
+        full_name = normalize_text(request.form.get('full_name', ''))  # students.full_name
+        date_of_birth = request.form.get('date_of_birth')  # students.date_of_birth
+        gender = normalize_text(request.form.get('gender'), allow_empty=True) if request.form.get('gender') else None  # students.gender
+        current_grade = normalize_text(request.form.get('current_grade'), allow_empty=True) if request.form.get('current_grade') else None  # students.current_grade
+        previous_school = normalize_text(request.form.get('previous_school'), allow_empty=True) if request.form.get('previous_school') else None  # students.previous_school
+        address = normalize_text(request.form.get('address'), allow_empty=True) if request.form.get('address') else None  # students.address
+        medical_info = normalize_text(request.form.get('medical_info'), allow_empty=True) if request.form.get('medical_info') else None  # students.medical_info
+        special_needs = normalize_text(request.form.get('special_needs'), allow_empty=True) if request.form.get('special_needs') else None  # students.special_needs
+        student_category = normalize_text(request.form.get('student_category'), uppercase=False, allow_empty=True)  # students.student_category
+        if student_category:
+            student_category = student_category.lower()
+        sponsor_name = normalize_text(request.form.get('sponsor_name'), allow_empty=True) if request.form.get('sponsor_name') else None  # students.sponsor_name
+        sponsor_phone = normalize_text(request.form.get('sponsor_phone'), uppercase=False, allow_empty=True) if request.form.get('sponsor_phone') else None  # students.sponsor_phone
+        sponsor_email = normalize_text(request.form.get('sponsor_email', ''), uppercase=False, allow_empty=True)  # students.sponsor_email
+        if sponsor_email:
+            sponsor_email = sponsor_email.lower()  # Email in lowercase
+        else:
+            sponsor_email = None  # Convert empty string to None for database
         
-        msg = Message(
-            subject=subject,
-            recipients=[employee_email],
-            html=html_body,
-            body=text_body
-        )
-        
-        mail.send(msg)
-        print(f"Employee approval email sent to {employee_email}")
-        return True
-    except Exception as e:
-        print(f"Error sending employee approval email: {e}")
-        return False
-
-# Routes
-@app.route('/')
-def home():
-    # Fetch active academic levels for admission form
-    academic_levels = []
-    connection = get_db_connection()
-    if connection:
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                    SELECT id, level_category, level_name, level_description 
-                    FROM academic_levels 
-                    WHERE level_status = 'active'
-                    ORDER BY level_name ASC
-                """)
-                results = cursor.fetchall()
-                
-                if results:
-                    for row in results:
-                        academic_levels.append({
-                            'id': row.get('id'),
-                            'level_category': row.get('level_category', ''),
-                            'level_name': row.get('level_name', ''),
-                            'level_description': row.get('level_description', '')
-                        })
-        except Exception as e:
-            print(f"Error fetching academic levels for home: {e}")
-        finally:
-            connection.close()
-    
-    return render_template('home.html', academic_levels=academic_levels)
-
-@app.route('/about')
-def about():
-    return render_template('about.html')
-
-@app.route('/programs')
-def programs():
-    return render_template('programs.html')
-
-@app.route('/news')
-def news():
-    connection = get_db_connection()
-    news_items = []
-    if connection:
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT * FROM news ORDER BY date DESC, created_at DESC LIMIT 6")
-                news_items = cursor.fetchall()
-        except Exception as e:
-            print(f"Error fetching news: {e}")
-        finally:
-            connection.close()
-    return render_template('news.html', news_items=news_items)
-
-@app.route('/gallery')
-def gallery():
-    connection = get_db_connection()
-    gallery_items = []
-    if connection:
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT * FROM gallery ORDER BY created_at DESC LIMIT 12")
-                gallery_items = cursor.fetchall()
-        except Exception as e:
-            print(f"Error fetching gallery: {e}")
-        finally:
-            connection.close()
-    return render_template('gallery.html', gallery_items=gallery_items)
-
-@app.route('/team')
-def team():
-    # Team data - 5 key members
-    team_members = [
-        {
-            'name': 'Dr. Sarah Wanjala',
-            'position': 'Executive Director',
-            'email': 'sarah.wanjala@modernschool.com',
-            'phone': '+254 700 111 111',
-            'bio': 'With over 25 years of experience in education and non-profit management, Dr. Wanjala leads our organization with strategic vision and unwavering commitment to educational excellence.',
-            'details': 'Dr. Wanjala holds a Ph.D. in Educational Leadership and has been instrumental in establishing Modern School as a leading NGO-sponsored educational institution. She has spearheaded numerous initiatives that have transformed the lives of thousands of students.',
-            'image': 'https://images.unsplash.com/photo-1494790108377-be9c29b29330?w=800&h=1000&fit=crop',
-            'qualifications': 'Ph.D. Educational Leadership, M.Ed. Curriculum Development'
-        },
-        {
-            'name': 'Mr. James Ochieng',
-            'position': 'Program Manager',
-            'email': 'james.ochieng@modernschool.com',
-            'phone': '+254 700 111 112',
-            'bio': 'An experienced program manager specializing in educational program development, implementation, and evaluation with a focus on community impact.',
-            'details': 'Mr. Ochieng has managed over 50 educational programs across Kenya, ensuring effective delivery and measurable outcomes. He is passionate about creating sustainable educational solutions for underserved communities.',
-            'image': 'https://images.unsplash.com/photo-1507003211169-0a1dd7228f2d?w=800&h=1000&fit=crop',
-            'qualifications': 'M.A. Program Management, B.Ed. Educational Administration'
-        },
-        {
-            'name': 'Ms. Mary Kamau',
-            'position': 'Finance Manager',
-            'email': 'mary.kamau@modernschool.com',
-            'phone': '+254 700 111 113',
-            'bio': 'A certified public accountant with extensive experience in non-profit financial management, ensuring transparency and accountability in all financial operations.',
-            'details': 'Ms. Kamau brings over 15 years of financial management experience to Modern School. She ensures strict compliance with financial regulations and maintains the highest standards of fiscal responsibility.',
-            'image': 'https://images.unsplash.com/photo-1438761681033-6461ffad8d80?w=800&h=1000&fit=crop',
-            'qualifications': 'CPA (K), M.Sc. Finance, B.Com Accounting'
-        },
-        {
-            'name': 'Mr. Peter Mwangi',
-            'position': 'Project Officer',
-            'email': 'peter.mwangi@modernschool.com',
-            'phone': '+254 700 111 114',
-            'bio': 'Dedicated project officer with expertise in coordinating educational projects, managing resources, and ensuring timely delivery of program objectives.',
-            'details': 'Mr. Mwangi has successfully coordinated numerous educational projects, from infrastructure development to scholarship programs. His attention to detail and organizational skills ensure project success.',
-            'image': 'https://images.unsplash.com/photo-1500648767791-00dcc994a43e?w=800&h=1000&fit=crop',
-            'qualifications': 'M.A. Project Management, B.A. Social Work'
-        },
-        {
-            'name': 'Ms. Grace Wanjiku',
-            'position': 'Administrative Officer',
-            'email': 'grace.wanjiku@modernschool.com',
-            'phone': '+254 700 111 115',
-            'bio': 'Experienced administrative professional ensuring smooth day-to-day operations, efficient resource management, and excellent stakeholder relations.',
-            'details': 'Ms. Wanjiku is the backbone of our administrative operations, managing everything from human resources to facility coordination. Her organizational skills and dedication keep our institution running smoothly.',
-            'image': 'https://images.unsplash.com/photo-1544005313-94ddf0286df2?w=800&h=1000&fit=crop',
-            'qualifications': 'M.A. Public Administration, B.A. Business Administration'
-        }
-    ]
-    return render_template('team.html', team_members=team_members)
-
-@app.route('/contact', methods=['GET', 'POST'])
-def contact():
-    if request.method == 'POST':
-        name = request.form.get('name')
-        email = request.form.get('email')
-        phone = request.form.get('phone')
-        subject = request.form.get('subject')
-        message = request.form.get('message')
-        
-        # Here you would typically save to database or send email
-        flash('Thank you for your message! We will get back to you soon.', 'success')
-        return redirect(url_for('contact'))
-    
-    return render_template('contact.html')
-
-def normalize_text(value, uppercase=True, allow_empty=False):
-    """
-    Normalize text: trim whitespace, replace multiple spaces with single space,
-    and optionally convert to uppercase.
-    
-    Args:
-        value: The text value to normalize
-        uppercase: If True, convert to uppercase (default: True)
-        allow_empty: If True, return None for empty values; if False, return empty string (default: False)
-    
-    Returns:
-        Normalized string, empty string, or None based on allow_empty parameter
-    """
-    if not value:
-        return None if allow_empty else ''
-    # Replace multiple spaces/tabs/newlines with single space, then trim
-    normalized = re.sub(r'\s+', ' ', str(value).strip())
-    if not normalized:
-        return None if allow_empty else ''
-    return normalized.upper() if uppercase else normalized
-
-@app.route('/admission', methods=['GET', 'POST'])
-def admission():
-    if request.method == 'POST':
-        # Get form data directly from students table column names
-        # All text fields to UPPERCASE except email (lowercase)
-        # Normalize spacing: multiple spaces become single space
-        full_name = normalize_text(request.form.get('full_name', ''))  # students.full_name
-        date_of_birth = request.form.get('date_of_birth')  # students.date_of_birth
-        gender = normalize_text(request.form.get('gender'), allow_empty=True) if request.form.get('gender') else None  # students.gender
-        current_grade = normalize_text(request.form.get('current_grade'), allow_empty=True) if request.form.get('current_grade') else None  # students.current_grade
-        previous_school = normalize_text(request.form.get('previous_school'), allow_empty=True) if request.form.get('previous_school') else None  # students.previous_school
-        address = normalize_text(request.form.get('address'), allow_empty=True) if request.form.get('address') else None  # students.address
-        medical_info = normalize_text(request.form.get('medical_info'), allow_empty=True) if request.form.get('medical_info') else None  # students.medical_info
-        special_needs = normalize_text(request.form.get('special_needs'), allow_empty=True) if request.form.get('special_needs') else None  # students.special_needs
-        student_category = normalize_text(request.form.get('student_category'), uppercase=False, allow_empty=True)  # students.student_category
-        if student_category:
-            student_category = student_category.lower()
-        sponsor_name = normalize_text(request.form.get('sponsor_name'), allow_empty=True) if request.form.get('sponsor_name') else None  # students.sponsor_name
-        sponsor_phone = normalize_text(request.form.get('sponsor_phone'), uppercase=False, allow_empty=True) if request.form.get('sponsor_phone') else None  # students.sponsor_phone
-        sponsor_email = normalize_text(request.form.get('sponsor_email', ''), uppercase=False, allow_empty=True)  # students.sponsor_email
-        if sponsor_email:
-            sponsor_email = sponsor_email.lower()  # Email in lowercase
-        else:
-            sponsor_email = None  # Convert empty string to None for database
-        
-        # Parent/Guardian information (from parents table)
-        parent_name = normalize_text(request.form.get('parent_name', ''))  # parents.full_name
-        relationship = normalize_text(request.form.get('relationship'), allow_empty=True) if request.form.get('relationship') else None  # parents.relationship
-        parent_phone = normalize_text(request.form.get('parent_phone', ''))  # parents.phone
-        parent_email = normalize_text(request.form.get('parent_email', ''), uppercase=False, allow_empty=True)  # parents.email
-        if parent_email:
-            parent_email = parent_email.lower()  # Email in lowercase
-        else:
-            parent_email = None  # Convert empty string to None for database
-        emergency_contact = normalize_text(request.form.get('emergency_contact'), allow_empty=True) if request.form.get('emergency_contact') else None  # parents.emergency_contact
+        # Parent/Guardian information (from parents table)
+        parent_name = normalize_text(request.form.get('parent_name', ''))  # parents.full_name
+        relationship = normalize_text(request.form.get('relationship'), allow_empty=True) if request.form.get('relationship') else None  # parents.relationship
+        parent_phone = normalize_text(request.form.get('parent_phone', ''))  # parents.phone
+        parent_email = normalize_text(request.form.get('parent_email', ''), uppercase=False, allow_empty=True)  # parents.email
+        if parent_email:
+            parent_email = parent_email.lower()  # Email in lowercase
+        else:
+            parent_email = None  # Convert empty string to None for database
+        emergency_contact = normalize_text(request.form.get('emergency_contact'), allow_empty=True) if request.form.get('emergency_contact') else None  # parents.emergency_contact
         
         consent = request.form.get('consent')
         
@@ -2156,12 +2213,12 @@ def admission():
                         try:
                             send_admission_confirmation_email(parent_email, parent_name, full_name, student_id)
                         except Exception as email_error:
-                            print(f"Error sending email: {email_error}")
+                            students_log.error("Error sending email: %s", email_error)
                             # Don't fail the submission if email fails
                     
                     flash(f'Application submitted successfully! Your Student ID is: {student_id}. We will review it and get back to you soon.', 'success')
             except Exception as e:
-                print(f"Error saving admission: {e}")
+                students_log.error("Error saving admission: %s", e)
                 try:
                     connection.rollback()
                 except:
@@ -2202,7 +2259,7 @@ def admission():
                             'level_description': row.get('level_description', '')
                         })
         except Exception as e:
-            print(f"Error fetching academic levels for admission: {e}")
+            students_log.error("Error fetching academic levels for admission: %s", e)
         finally:
             connection.close()
     
@@ -2293,12 +2350,12 @@ def register_employee():
                     try:
                         send_employee_welcome_email(email, full_name, employee_id)
                     except Exception as email_error:
-                        print(f"Error sending welcome email: {email_error}")
+                        staff_log.error("Error sending welcome email: %s", email_error)
                         # Don't fail the registration if email fails
                     
                     flash('Employee registration submitted successfully! Your application is pending approval. You will receive a welcome email shortly.', 'success')
             except Exception as e:
-                print(f"Error saving employee registration: {e}")
+                staff_log.error("Error saving employee registration: %s", e)
                 try:
                     connection.rollback()
                 except:
@@ -2340,7 +2397,7 @@ def check_employee_id():
                     else:
                         return jsonify({'available': True, 'message': 'Employee ID is available!'}), 200
             except Exception as e:
-                print(f"Error checking employee ID: {e}")
+                staff_log.error("Error checking employee ID: %s", e)
                 return jsonify({'available': False, 'message': 'Error checking employee ID. Please try again.'}), 500
             finally:
                 if connection:
@@ -2351,7 +2408,7 @@ def check_employee_id():
         else:
             return jsonify({'available': False, 'message': 'Database connection error. Please try again.'}), 500
     except Exception as e:
-        print(f"Error in check_employee_id: {e}")
+        staff_log.error("Error in check_employee_id: %s", e)
         return jsonify({'available': False, 'message': 'An error occurred. Please try again.'}), 500
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -2362,8 +2419,8 @@ def login():
         admission_number = request.form.get('admission_number', '').strip()
         employee_id = request.form.get('employee_id', '').strip() or request.form.get('employee_id_fallback', '').strip()
         
-        print(f"DEBUG: Login attempt - Role: {role}, Employee ID: {employee_id}, Has Password: {bool(password)}")  # Debug
-        print(f"DEBUG: Form data - {dict(request.form)}")  # Debug
+        # Never log the form itself: it holds the password
+        auth_log.debug("Login attempt: role=%s employee_id=%s has_password=%s", role, employee_id, bool(password))
         
         if not role or not password:
             flash('Please fill in all required fields.', 'error')
@@ -2394,23 +2451,20 @@ def login():
                 with connection.cursor() as cursor:
                     if role == 'employee':
                         # Look up employee by employee_id
-                        print(f"DEBUG: Looking for employee with ID: {identifier}")  # Debug
                         cursor.execute(
                             "SELECT * FROM employees WHERE employee_id = %s",
                             (identifier,)
                         )
                         employee = cursor.fetchone()
                         
-                        print(f"DEBUG: Employee found: {employee is not None}")  # Debug
+                        auth_log.debug("Employee %s found: %s", identifier, employee is not None)
                         
                         if employee:
-                            print(f"DEBUG: Checking password...")  # Debug
                             # Check password
                             if check_password_hash(employee['password_hash'], password):
-                                print(f"DEBUG: Password correct!")  # Debug
                                 # Check employee status
                                 status = employee['status']
-                                print(f"DEBUG: Employee status: {status}")  # Debug
+                                auth_log.debug("Employee %s password correct, status %s", identifier, status)
                                 
                                 if status == 'pending approval':
                                     # Redirect to terms and conditions page
@@ -2436,16 +2490,17 @@ def login():
                                     flash('Your account status is invalid. Please contact support.', 'error')
                                     return redirect(url_for('home'))
                             else:
-                                print(f"DEBUG: Password incorrect!")  # Debug
+                                auth_log.info("Failed login for employee %s: wrong password", identifier)
                                 flash('Invalid employee code or password.', 'error')
                         else:
-                            print(f"DEBUG: Employee not found!")  # Debug
+                            auth_log.info("Failed login: no employee %s", identifier)
                             flash('Invalid employee code or password.', 'error')
                     else:  # parent or student
-                        # Look up by admission number (you may need to add this field to users table)
+                        # Look up by admission number: users.student_id links the account to its
+                        # student (unique per role, see migrations/008_add_users_student_link.py)
                         cursor.execute(
-                            "SELECT * FROM users WHERE email LIKE %s AND role = %s",
-                            (f'%{identifier}%', role)
+                            "SELECT * FROM users WHERE student_id = %s AND role = %s",
+                            (identifier, role)
                         )
                         user = cursor.fetchone()
                         
@@ -2461,7 +2516,7 @@ def login():
                         else:
                             flash('Invalid credentials. Please check your admission number and password.', 'error')
             except Exception as e:
-                print(f"Login error: {e}")
+                auth_log.error("Login error: %s", e)
                 flash('An error occurred during login. Please try again.', 'error')
             finally:
                 if connection:
@@ -2523,7 +2578,7 @@ def dashboard_parent():
                     """)
                     all_students = cursor.fetchall()
             except Exception as e:
-                print(f"Error fetching students for technician: {e}")
+                students_log.error("Error fetching students for technician: %s", e)
             finally:
                 if connection:
                     try:
@@ -2548,7 +2603,7 @@ def dashboard_parent():
                         if parent_result:
                             parent_email = parent_result.get('email', '') if isinstance(parent_result, dict) else parent_result[0]
                 except Exception as e:
-                    print(f"Error fetching parent email: {e}")
+                    students_log.error("Error fetching parent email: %s", e)
                 finally:
                     if connection:
                         try:
@@ -2574,78 +2629,46 @@ def dashboard_parent():
                 """, (parent_email,))
                 results = cursor.fetchall()
                 
+                # Levels, fee structures and payment totals for all children in a few grouped queries
+                ledger = FeeLedger.load(cursor, student_ids=[row.get('student_id') for row in results])
+                
                 if results:
                     for row in results:
                         student_grade = row.get('current_grade', '')
                         student_id = row.get('student_id', '')
                         
                         # Find the academic level for this student's grade
-                        academic_level = None
+                        academic_level = ledger.level_for_grade(student_grade)
                         fee_structure = None
                         total_paid = 0.0
                         balance = 0.0
                         
-                        if student_grade:
-                            # Try to match student's current_grade with academic_levels.level_name
-                            cursor.execute("""
-                                SELECT al.id, al.level_category, al.level_name, al.level_description
-                                FROM academic_levels al
-                                WHERE al.level_name = %s AND al.level_status = 'active'
-                                LIMIT 1
-                            """, (student_grade,))
-                            level_result = cursor.fetchone()
+                        if academic_level:
+                            # Get the most recent active fee structure for this academic level
+                            structure = ledger.latest_structure(academic_level['id'])
                             
-                            if level_result:
-                                academic_level_id = level_result.get('id')
-                                academic_level = {
-                                    'id': academic_level_id,
-                                    'level_category': level_result.get('level_category', ''),
-                                    'level_name': level_result.get('level_name', ''),
-                                    'level_description': level_result.get('level_description', '')
-                                }
+                            if structure:
+                                payment_deadline = structure.get('payment_deadline')
+                                # Format payment_deadline if it's a date object
+                                if payment_deadline and hasattr(payment_deadline, 'strftime'):
+                                    payment_deadline_formatted = payment_deadline.strftime('%B %d, %Y')
+                                elif payment_deadline:
+                                    payment_deadline_formatted = str(payment_deadline)
+                                else:
+                                    payment_deadline_formatted = None
                                 
-                                # Find active fee structure for this academic level
-                                # Get the most recent active fee structure
-                                cursor.execute("""
-                                    SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, 
-                                           fs.payment_deadline, fs.total_amount, fs.status,
-                                           fs.academic_year_id, fs.term_id
-                                    FROM fee_structures fs
-                                    WHERE fs.academic_level_id = %s 
-                                      AND fs.status = 'active'
-                                    ORDER BY fs.created_at DESC
-                                    LIMIT 1
-                                """, (academic_level_id,))
-                                fee_structure_result = cursor.fetchone()
+                                fee_structure = {
+                                    'id': structure.get('id'),
+                                    'fee_name': structure.get('fee_name', ''),
+                                    'total_amount': float(structure.get('total_amount', 0)),
+                                    'payment_deadline': payment_deadline,
+                                    'payment_deadline_formatted': payment_deadline_formatted,
+                                    'status': structure.get('status', '')
+                                }
                                 
-                                if fee_structure_result:
-                                    payment_deadline = fee_structure_result.get('payment_deadline')
-                                    # Format payment_deadline if it's a date object
-                                    if payment_deadline and hasattr(payment_deadline, 'strftime'):
-                                        payment_deadline_formatted = payment_deadline.strftime('%B %d, %Y')
-                                    elif payment_deadline:
-                                        payment_deadline_formatted = str(payment_deadline)
-                                    else:
-                                        payment_deadline_formatted = None
-                                    
-                                    fee_structure = {
-                                        'id': fee_structure_result.get('id'),
-                                        'fee_name': fee_structure_result.get('fee_name', ''),
-                                        'total_amount': float(fee_structure_result.get('total_amount', 0)),
-                                        'payment_deadline': payment_deadline,
-                                        'payment_deadline_formatted': payment_deadline_formatted,
-                                        'status': fee_structure_result.get('status', '')
-                                    }
-                                    
-                                    # Calculate total paid and balance
-                                    cursor.execute("""
-                                        SELECT COALESCE(SUM(amount_paid), 0) as total_paid
-                                        FROM student_payments
-                                        WHERE student_id = %s
-                                    """, (student_id,))
-                                    payment_result = cursor.fetchone()
-                                    total_paid = float(payment_result.get('total_paid', 0) if payment_result else 0)
-                                    balance = fee_structure['total_amount'] - total_paid
+                                # Calculate total paid and balance
+                                total_paid = ledger.total_paid(student_id)
+                                balance = fee_structure['total_amount'] - total_paid
                         
                         child_dict = {
                             'id': row.get('id'),
@@ -2660,9 +2683,7 @@ def dashboard_parent():
                         }
                         children.append(child_dict)
         except Exception as e:
-            print(f"Error fetching parent's children: {e}")
-            import traceback
-            traceback.print_exc()
+            students_log.exception("Error fetching parent's children: %s", e)
             flash('Error loading children information. Please try again.', 'error')
         finally:
             if connection:
@@ -2711,7 +2732,7 @@ def parent_student_fees():
                     """)
                     all_students = cursor.fetchall()
             except Exception as e:
-                print(f"Error fetching students for technician: {e}")
+                fees_log.error("Error fetching students for technician: %s", e)
             finally:
                 if connection:
                     try:
@@ -2736,7 +2757,7 @@ def parent_student_fees():
                         if parent_result:
                             parent_email = parent_result.get('email', '') if isinstance(parent_result, dict) else parent_result[0]
                 except Exception as e:
-                    print(f"Error fetching parent email: {e}")
+                    fees_log.error("Error fetching parent email: %s", e)
                 finally:
                     if connection:
                         try:
@@ -2762,210 +2783,82 @@ def parent_student_fees():
                 """, (parent_email,))
                 results = cursor.fetchall()
                 
+                # Levels, fee structures, items and payment totals for all children in a few grouped queries
+                student_ids = [row.get('student_id') for row in results]
+                ledger = FeeLedger.load(cursor, student_ids=student_ids)
+                
+                # Payment history for all children in one query
+                payments_by_student = {}
+                if student_ids:
+                    cursor.execute("""
+                        SELECT student_id, amount_paid, payment_date, payment_method, reference_number, notes, created_at
+                        FROM student_payments
+                        WHERE student_id IN %s
+                        ORDER BY payment_date DESC, created_at DESC
+                    """, (tuple(student_ids),))
+                    for payment in cursor.fetchall():
+                        payment_date = payment.get('payment_date')
+                        # Format payment_date if it's a date object
+                        if payment_date and hasattr(payment_date, 'strftime'):
+                            payment_date_formatted = payment_date.strftime('%B %d, %Y')
+                        elif payment_date:
+                            payment_date_formatted = str(payment_date)
+                        else:
+                            payment_date_formatted = None
+                        
+                        payments_by_student.setdefault(payment.get('student_id'), []).append({
+                            'amount_paid': float(payment.get('amount_paid', 0) or 0),
+                            'payment_date': payment_date,
+                            'payment_date_formatted': payment_date_formatted,
+                            'payment_method': payment.get('payment_method', '') or '',
+                            'reference_number': payment.get('reference_number', '') or '',
+                            'notes': payment.get('notes', '') or '',
+                            'created_at': payment.get('created_at')
+                        })
+                
                 if results:
                     for row in results:
                         student_grade = row.get('current_grade', '')
                         student_id = row.get('student_id', '')
-                        student_category = row.get('student_category', '').lower().strip() if row.get('student_category') else ''
+                        student_category = row.get('student_category')
                         
                         # Find the academic level for this student's grade
-                        academic_level = None
+                        academic_level = ledger.level_for_grade(student_grade)
                         fee_structure = None
                         fee_items = []
                         payments = []
                         total_paid = 0.0
                         balance = 0.0
                         
-                        if student_grade:
-                            # Try to match student's current_grade with academic_levels.level_name
-                            cursor.execute("""
-                                SELECT al.id, al.level_category, al.level_name, al.level_description
-                                FROM academic_levels al
-                                WHERE al.level_name = %s AND al.level_status = 'active'
-                                LIMIT 1
-                            """, (student_grade,))
-                            level_result = cursor.fetchone()
+                        if academic_level:
+                            # Find active fee structure for this academic level matching student category
+                            structure = ledger.current_structure(academic_level['id'], student_category,
+                                                                 current_term_only=False)
                             
-                            if level_result:
-                                academic_level_id = level_result.get('id')
-                                academic_level = {
-                                    'id': academic_level_id,
-                                    'level_category': level_result.get('level_category', ''),
-                                    'level_name': level_result.get('level_name', ''),
-                                    'level_description': level_result.get('level_description', '')
-                                }
-                                
-                                # Find active fee structure for this academic level matching student category
-                                if student_category == 'self sponsored':
-                                    cursor.execute("""
-                                        SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, 
-                                               fs.payment_deadline, fs.total_amount, fs.status, fs.category
-                                        FROM fee_structures fs
-                                        WHERE fs.academic_level_id = %s 
-                                          AND fs.status = 'active'
-                                          AND (fs.category = 'self sponsored' OR fs.category = 'both')
-                                        ORDER BY 
-                                          CASE 
-                                            WHEN fs.category = 'self sponsored' THEN 1
-                                            WHEN fs.category = 'both' THEN 2
-                                            ELSE 3
-                                          END,
-                                          fs.created_at DESC
-                                        LIMIT 1
-                                    """, (academic_level_id,))
-                                elif student_category == 'sponsored':
-                                    cursor.execute("""
-                                        SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, 
-                                               fs.payment_deadline, fs.total_amount, fs.status, fs.category
-                                        FROM fee_structures fs
-                                        WHERE fs.academic_level_id = %s 
-                                          AND fs.status = 'active'
-                                          AND (fs.category = 'sponsored' OR fs.category = 'both')
-                                        ORDER BY 
-                                          CASE 
-                                            WHEN fs.category = 'sponsored' THEN 1
-                                            WHEN fs.category = 'both' THEN 2
-                                            ELSE 3
-                                          END,
-                                          fs.created_at DESC
-                                        LIMIT 1
-                                    """, (academic_level_id,))
-                                elif student_category == 'both':
-                                    cursor.execute("""
-                                        SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, 
-                                               fs.payment_deadline, fs.total_amount, fs.status, fs.category
-                                        FROM fee_structures fs
-                                        WHERE fs.academic_level_id = %s 
-                                          AND fs.status = 'active'
-                                        ORDER BY 
-                                          CASE 
-                                            WHEN fs.category = 'both' THEN 1
-                                            WHEN fs.category = 'self sponsored' THEN 2
-                                            WHEN fs.category = 'sponsored' THEN 3
-                                            ELSE 4
-                                          END,
-                                          fs.created_at DESC
-                                        LIMIT 1
-                                    """, (academic_level_id,))
+                            if structure:
+                                payment_deadline = structure.get('payment_deadline')
+                                # Format payment_deadline if it's a date object
+                                if payment_deadline and hasattr(payment_deadline, 'strftime'):
+                                    payment_deadline_formatted = payment_deadline.strftime('%B %d, %Y')
+                                elif payment_deadline:
+                                    payment_deadline_formatted = str(payment_deadline)
                                 else:
-                                    cursor.execute("""
-                                        SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, 
-                                               fs.payment_deadline, fs.total_amount, fs.status, fs.category
-                                        FROM fee_structures fs
-                                        WHERE fs.academic_level_id = %s 
-                                          AND fs.status = 'active'
-                                          AND fs.category = 'both'
-                                        ORDER BY fs.created_at DESC
-                                        LIMIT 1
-                                    """, (academic_level_id,))
-                                fee_structure_result = cursor.fetchone()
+                                    payment_deadline_formatted = None
                                 
-                                if fee_structure_result:
-                                    payment_deadline = fee_structure_result.get('payment_deadline')
-                                    # Format payment_deadline if it's a date object
-                                    if payment_deadline and hasattr(payment_deadline, 'strftime'):
-                                        payment_deadline_formatted = payment_deadline.strftime('%B %d, %Y')
-                                    elif payment_deadline:
-                                        payment_deadline_formatted = str(payment_deadline)
-                                    else:
-                                        payment_deadline_formatted = None
-                                    
-                                    fee_structure = {
-                                        'id': fee_structure_result.get('id'),
-                                        'fee_name': fee_structure_result.get('fee_name'),
-                                        'total_amount': float(fee_structure_result.get('total_amount', 0)),
-                                        'payment_deadline': fee_structure_result.get('payment_deadline'),
-                                        'payment_deadline_formatted': payment_deadline_formatted,
-                                        'status': fee_structure_result.get('status')
-                                    }
-                                    
-                                    # Get fee items
-                                    cursor.execute("""
-                                        SELECT item_name, item_description, amount
-                                        FROM fee_items
-                                        WHERE fee_structure_id = %s
-                                        ORDER BY id ASC
-                                    """, (fee_structure['id'],))
-                                    fee_items_results = cursor.fetchall()
-                                    fee_items = []
-                                    for item in fee_items_results:
-                                        if isinstance(item, dict):
-                                            fee_items.append({
-                                                'item_name': item.get('item_name', '') or '',
-                                                'item_description': item.get('item_description', '') or '',
-                                                'amount': float(item.get('amount', 0) or 0)
-                                            })
-                                        else:
-                                            # Handle tuple/list format
-                                            fee_items.append({
-                                                'item_name': item[0] if len(item) > 0 else '',
-                                                'item_description': item[1] if len(item) > 1 else '',
-                                                'amount': float(item[2] if len(item) > 2 and item[2] else 0)
-                                            })
-                                    
-                                    # Get payments
-                                    cursor.execute("""
-                                        SELECT amount_paid, payment_date, payment_method, reference_number, notes, created_at
-                                        FROM student_payments
-                                        WHERE student_id = %s
-                                        ORDER BY payment_date DESC, created_at DESC
-                                    """, (student_id,))
-                                    payments_results = cursor.fetchall()
-                                    payments = []
-                                    for payment in payments_results:
-                                        if isinstance(payment, dict):
-                                            payment_date = payment.get('payment_date')
-                                            # Format payment_date if it's a date object
-                                            if payment_date and hasattr(payment_date, 'strftime'):
-                                                payment_date_formatted = payment_date.strftime('%B %d, %Y')
-                                            elif payment_date:
-                                                payment_date_formatted = str(payment_date)
-                                            else:
-                                                payment_date_formatted = None
-                                            
-                                            payments.append({
-                                                'amount_paid': float(payment.get('amount_paid', 0) or 0),
-                                                'payment_date': payment_date,
-                                                'payment_date_formatted': payment_date_formatted,
-                                                'payment_method': payment.get('payment_method', '') or '',
-                                                'reference_number': payment.get('reference_number', '') or '',
-                                                'notes': payment.get('notes', '') or '',
-                                                'created_at': payment.get('created_at')
-                                            })
-                                        else:
-                                            # Handle tuple/list format
-                                            try:
-                                                payment_date = payment[1] if len(payment) > 1 else None
-                                                # Format payment_date if it's a date object
-                                                if payment_date and hasattr(payment_date, 'strftime'):
-                                                    payment_date_formatted = payment_date.strftime('%B %d, %Y')
-                                                elif payment_date:
-                                                    payment_date_formatted = str(payment_date)
-                                                else:
-                                                    payment_date_formatted = None
-                                                
-                                                payments.append({
-                                                    'amount_paid': float(payment[0] if len(payment) > 0 and payment[0] else 0),
-                                                    'payment_date': payment_date,
-                                                    'payment_date_formatted': payment_date_formatted,
-                                                    'payment_method': payment[2] if len(payment) > 2 else '',
-                                                    'reference_number': payment[3] if len(payment) > 3 else '',
-                                                    'notes': payment[4] if len(payment) > 4 else '',
-                                                    'created_at': payment[5] if len(payment) > 5 else None
-                                                })
-                                            except (IndexError, KeyError):
-                                                # Skip invalid payment records
-                                                continue
-                                    
-                                    # Calculate total paid
-                                    cursor.execute("""
-                                        SELECT COALESCE(SUM(amount_paid), 0) as total_paid
-                                        FROM student_payments
-                                        WHERE student_id = %s
-                                    """, (student_id,))
-                                    payment_result = cursor.fetchone()
-                                    total_paid = float(payment_result.get('total_paid', 0) if payment_result else 0)
-                                    balance = fee_structure['total_amount'] - total_paid
+                                fee_structure = {
+                                    'id': structure.get('id'),
+                                    'fee_name': structure.get('fee_name'),
+                                    'total_amount': float(structure.get('total_amount', 0)),
+                                    'payment_deadline': structure.get('payment_deadline'),
+                                    'payment_deadline_formatted': payment_deadline_formatted,
+                                    'status': structure.get('status')
+                                }
+                                fee_items = ledger.items(structure['id'], order_by='id')
+                                payments = payments_by_student.get(student_id, [])
+                                
+                                # Calculate total paid
+                                total_paid = ledger.total_paid(student_id)
+                                balance = fee_structure['total_amount'] - total_paid
                         
                         child_dict = {
                             'id': row.get('id'),
@@ -2982,9 +2875,7 @@ def parent_student_fees():
                         }
                         children.append(child_dict)
         except Exception as e:
-            print(f"Error fetching parent's children fees: {e}")
-            import traceback
-            traceback.print_exc()
+            fees_log.exception("Error fetching parent's children fees: %s", e)
             flash('Error loading fees information. Please try again.', 'error')
         finally:
             if connection:
@@ -3042,7 +2933,7 @@ def dashboard_student():
                     """)
                     all_students = cursor.fetchall()
             except Exception as e:
-                print(f"Error fetching students for technician: {e}")
+                students_log.error("Error fetching students for technician: %s", e)
             finally:
                 if connection:
                     try:
@@ -3070,7 +2961,7 @@ def dashboard_student():
                         if user_result:
                             student_id = user_result.get('student_id', '') if isinstance(user_result, dict) else user_result[0]
             except Exception as e:
-                print(f"Error fetching student ID: {e}")
+                students_log.error("Error fetching student ID: %s", e)
             finally:
                 if connection:
                     try:
@@ -3293,9 +3184,7 @@ def dashboard_student():
                                     total_paid = float(payment_result.get('total_paid', 0) if payment_result else 0)
                                     balance = fee_structure['total_amount'] - total_paid
             except Exception as e:
-                print(f"Error fetching student fees: {e}")
-                import traceback
-                traceback.print_exc()
+                students_log.exception("Error fetching student fees: %s", e)
                 flash('Error loading fee information. Please try again.', 'error')
             finally:
                 if connection:
@@ -3347,7 +3236,7 @@ def dashboard_employee():
                 if employee:
                     employee_data = employee
         except Exception as e:
-            print(f"Error fetching employee data: {e}")
+            staff_log.error("Error fetching employee data: %s", e)
         finally:
             connection.close()
     
@@ -3425,7 +3314,7 @@ def finance_overview():
                 finance_summary['pending_payments'] = 0
                 finance_summary['paid_payments'] = finance_summary['total_revenue']
         except Exception as e:
-            print(f"Error fetching finance summary: {e}")
+            fees_log.error("Error fetching finance summary: %s", e)
         finally:
             connection.close()
     
@@ -3433,6 +3322,196 @@ def finance_overview():
                          finance_summary=finance_summary,
                          role=user_role)
 
+# Student fees listing (keyset pagination)
+STUDENT_FEES_PAGE_SIZE = 25
+STUDENT_FEES_MAX_PAGE_SIZE = 100
+
+# Sort key -> column; every sort is tie-broken by s.student_id so the keyset is unique
+STUDENT_FEES_SORTS = {
+    'name': 's.full_name',
+    'admission': 's.student_id',
+    'grade': 's.current_grade'
+}
+
+STUDENT_FEES_STATUSES = ('paid', 'pending', 'overdue', 'no_structure')
+
+
+def encode_page_cursor(sort_value, student_id):
+    """Opaque cursor for the last row of a page"""
+    raw = json.dumps([sort_value, student_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_page_cursor(token):
+    """(sort_value, student_id) from a cursor, or None if it is missing or malformed"""
+    if not token:
+        return None
+    try:
+        sort_value, student_id = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(student_id, str):
+        return None
+    return sort_value, student_id
+
+
+def _keyset_condition(column, sort_value, student_id, descending):
+    """WHERE clause selecting rows after (sort_value, student_id) in the listing order.
+
+    MySQL sorts NULLs first ascending and last descending, so NULL sort values
+    need their own branch.
+    """
+    op = '<' if descending else '>'
+    if sort_value is None:
+        if descending:
+            return f"({column} IS NULL AND s.student_id {op} %s)", [student_id]
+        return f"({column} IS NOT NULL OR s.student_id {op} %s)", [student_id]
+    condition = f"({column} {op} %s OR ({column} = %s AND s.student_id {op} %s))"
+    if descending:
+        condition = f"({condition} OR {column} IS NULL)"
+    return condition, [sort_value, sort_value, student_id]
+
+
+def build_student_fee_row(row, entry, ledger):
+    """Template/JSON representation of one student on the student fees page"""
+    fee_structure = None
+    structure = entry['fee_structure']
+    if structure:
+        fee_structure = {
+            'id': structure.get('id'),
+            'fee_name': structure.get('fee_name', ''),
+            'category': structure.get('category', 'both'),
+            'start_date': format_iso_date(structure.get('start_date')),
+            'end_date': format_iso_date(structure.get('end_date')),
+            'payment_deadline': format_iso_date(structure.get('payment_deadline')),
+            'total_amount': float(structure.get('total_amount', 0)),
+            'status': structure.get('status', 'active'),
+            'items': ledger.items(structure['id'])
+        }
+    
+    return {
+        'id': row.get('id'),
+        'student_id': row.get('student_id'),
+        'full_name': row.get('full_name', ''),
+        'current_grade': row.get('current_grade', ''),
+        'status': row.get('status', ''),
+        'student_category': row.get('student_category', ''),
+        'parent_name': row.get('parent_name', ''),
+        'parent_phone': row.get('parent_phone', ''),
+        'parent_email': row.get('parent_email', ''),
+        'academic_level': entry['academic_level'],
+        'fee_structure': fee_structure,
+        'payment_status': entry['payment_status'],
+        'total_paid': entry['total_paid'],  # Show all payments in paid column
+        'total_paid_current': entry['total_paid_current'],  # Payments for current fee structure (for balance calculation)
+        'carry_forward': entry['carry_forward'],
+        'previous_term_balance': entry['previous_term_balance'],
+        'total_amount_due': entry['total_amount_due'],
+        'balance': entry['balance']
+    }
+
+
+def _student_search_join(search):
+    """JOIN restricting the listing to students matching search, and its parameters.
+
+    The matches are collected by indexed lookups only: admission numbers and full names
+    starting with the term (unique student_id index, idx_status_name) and, through the
+    FULLTEXT index ft_students_full_name, names with a word starting with each word of
+    the term ("smi" finds "John Smith"). Words shorter than the FULLTEXT minimum token
+    size (3) are only matched as a prefix of the whole name.
+    """
+    prefix = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    branches = [
+        "SELECT student_id FROM students WHERE student_id LIKE %s",
+        "SELECT student_id FROM students WHERE status = 'in session' AND full_name LIKE %s"
+    ]
+    params = [prefix, prefix]
+    words = [word for word in re.findall(r'\w+', search) if len(word) >= 3]
+    if words:
+        branches.append("SELECT student_id FROM students WHERE MATCH(full_name) AGAINST (%s IN BOOLEAN MODE)")
+        params.append(' '.join(f'+{word}*' for word in words))
+    join = f"JOIN ({' UNION '.join(branches)}) matched ON matched.student_id = s.student_id"
+    return join, params
+
+
+def fetch_student_fees_page(cursor, search='', grade='', category='', payment_status='',
+                            sort='name', descending=False, after=None, limit=STUDENT_FEES_PAGE_SIZE,
+                            ledger=None):
+    """One page of in-session students with their fee ledgers.
+
+    Rows are read in index order after the `after` cursor, so the cost of a page does not
+    depend on how deep into the list it is. payment_status is derived from the ledger,
+    so that filter is applied while scanning forward batch by batch.
+    Returns (students, next_cursor); next_cursor is None on the last page.
+    """
+    column = STUDENT_FEES_SORTS.get(sort, STUDENT_FEES_SORTS['name'])
+    direction = 'DESC' if descending else 'ASC'
+    
+    filters = ["s.status = 'in session'"]
+    params = []
+    search_join = ''
+    search_params = []
+    if search:
+        search_join, search_params = _student_search_join(search)
+    if grade:
+        filters.append("s.current_grade = %s")
+        params.append(grade)
+    if category:
+        filters.append("s.student_category = %s")
+        params.append(category)
+    
+    # Structures and items are shared by every batch; payments are loaded per batch
+    if ledger is None:
+        ledger = FeeLedger.load(cursor, student_ids=[])
+    batch_size = limit + 1 if not payment_status else max(limit * 4, 100)
+    
+    students = []
+    scan_after = after
+    while len(students) <= limit:
+        where = list(filters)
+        where_params = list(params)
+        if scan_after:
+            condition, condition_params = _keyset_condition(column, scan_after[0], scan_after[1], descending)
+            where.append(condition)
+            where_params.extend(condition_params)
+        
+        # One parent per student keeps the (sort value, student_id) keyset unique
+        cursor.execute(f"""
+            SELECT s.id, s.student_id, s.full_name, s.current_grade, s.status, s.student_category,
+                   p.full_name as parent_name, p.phone as parent_phone, p.email as parent_email
+            FROM students s
+            {search_join}
+            LEFT JOIN parents p ON p.id = (
+                SELECT MIN(p2.id) FROM parents p2 WHERE p2.student_id = s.student_id
+            )
+            WHERE {' AND '.join(where)}
+            ORDER BY {column} {direction}, s.student_id {direction}
+            LIMIT %s
+        """, tuple(search_params) + tuple(where_params) + (batch_size,))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        
+        ledger.load_payments(cursor, [row.get('student_id') for row in rows])
+        sort_field = column.split('.', 1)[1]
+        for row in rows:
+            scan_after = (row.get(sort_field), row.get('student_id'))
+            entry = ledger.student_entry(row.get('student_id'), row.get('current_grade', ''), row.get('student_category'))
+            if payment_status and entry['payment_status'] != payment_status:
+                continue
+            students.append((build_student_fee_row(row, entry, ledger), scan_after))
+            if len(students) > limit:
+                break
+        if len(rows) < batch_size:
+            break
+    
+    next_cursor = None
+    if len(students) > limit:
+        students = students[:limit]
+        next_cursor = encode_page_cursor(*students[-1][1])
+    return [student for student, _ in students], next_cursor
+
+
 # Student Fees Route
 @app.route('/dashboard/employee/student-fees')
 @login_required
@@ -3441,11 +3520,8 @@ def student_fees():
     user_role = session.get('role', '').lower()
     viewing_as_role = session.get('viewing_as_employee_role', '').lower()
     
-    print(f"DEBUG Student Fees Route:")
-    print(f"  - user_role from session: {user_role}")
-    print(f"  - viewing_as_role: {viewing_as_role}")
-    print(f"  - employee_id: {session.get('employee_id')}")
-    print(f"  - user_id: {session.get('user_id')}")
+    fees_log.debug("student_fees: role=%s viewing_as=%s employee_id=%s user_id=%s", user_role, viewing_as_role,
+                   session.get('employee_id'), session.get('user_id'))
     
     # Check if user is accountant or viewing as accountant (for role switching)
     is_accountant = user_role == 'accountant' or viewing_as_role == 'accountant'
@@ -3470,13 +3546,13 @@ def student_fees():
                         if result:
                             db_role = result.get('role') if isinstance(result, dict) else result[0]
                             db_role = db_role.lower() if db_role else ''
-                            print(f"  - db_role: {db_role}")
+                            fees_log.debug("student_fees: db_role=%s", db_role)
                             if db_role == 'accountant':
                                 is_accountant = True
                             elif db_role == 'principal':
                                 is_principal = True
             except Exception as e:
-                print(f"Error fetching employee role: {e}")
+                fees_log.error("Error fetching employee role: %s", e)
             finally:
                 connection.close()
     
@@ -3496,15 +3572,17 @@ def student_fees():
     # Allow access if: technician OR has permission-based access (permission check handles role fallback)
     # Note: check_permission_or_role already handles role fallback if no permissions are assigned
     if not (is_technician or has_view_fees_permission or has_manage_fees_permission):
-        print(f"  - Access DENIED: user_role={user_role}, viewing_as_role={viewing_as_role}, is_accountant={is_accountant}, is_technician={is_technician}")
+        fees_log.warning("student_fees: access denied: user_role=%s viewing_as=%s is_accountant=%s is_technician=%s",
+                         user_role, viewing_as_role, is_accountant, is_technician)
         flash('You do not have permission to access this page. Only accountants, principals, or users with fee viewing permissions can access Student Fees.', 'error')
         return redirect(url_for('dashboard_employee'))
     
-    print(f"  - Access GRANTED: Rendering student fees page")
+    fees_log.debug("student_fees: access granted")
     
     # Get students with their fee information
     connection = get_db_connection()
     students = []
+    next_cursor = None
     academic_levels = []
     academic_years = []
     terms = []
@@ -3512,496 +3590,9 @@ def student_fees():
     if connection:
         try:
             with connection.cursor() as cursor:
-                # Get current academic year
-                cursor.execute("""
-                    SELECT id, year_name, is_current
-                    FROM academic_years
-                    WHERE is_current = TRUE AND status = 'active'
-                    LIMIT 1
-                """)
-                current_year_result = cursor.fetchone()
-                current_academic_year_id = None
-                if current_year_result:
-                    current_academic_year_id = current_year_result.get('id') if isinstance(current_year_result, dict) else current_year_result[0]
-                
-                # Get current term for the current academic year
-                current_term_id = None
-                if current_academic_year_id:
-                    cursor.execute("""
-                        SELECT id, term_name, is_current
-                        FROM terms
-                        WHERE is_current = TRUE AND status = 'active' AND academic_year_id = %s
-                        LIMIT 1
-                    """, (current_academic_year_id,))
-                    current_term_result = cursor.fetchone()
-                    if current_term_result:
-                        current_term_id = current_term_result.get('id') if isinstance(current_term_result, dict) else current_term_result[0]
-                
-                # Fetch students who are in session
-                cursor.execute("""
-                    SELECT s.id, s.student_id, s.full_name, s.current_grade, s.status, s.student_category,
-                           p.full_name as parent_name, p.phone as parent_phone, p.email as parent_email
-                    FROM students s
-                    LEFT JOIN parents p ON s.student_id = p.student_id
-                    WHERE s.status = 'in session'
-                    ORDER BY s.full_name ASC
-                """)
-                results = cursor.fetchall()
-                
-                if results:
-                    for row in results:
-                        student_grade = row.get('current_grade', '')
-                        
-                        # Find the academic level for this student's grade
-                        academic_level = None
-                        fee_structure = None
-                        
-                        if student_grade:
-                            # Try to match student's current_grade with academic_levels.level_name
-                            cursor.execute("""
-                                SELECT al.id, al.level_category, al.level_name, al.level_description
-                                FROM academic_levels al
-                                WHERE al.level_name = %s AND al.level_status = 'active'
-                                LIMIT 1
-                            """, (student_grade,))
-                            level_result = cursor.fetchone()
-                            
-                            if level_result:
-                                academic_level_id = level_result.get('id')
-                                academic_level = {
-                                    'id': academic_level_id,
-                                    'level_category': level_result.get('level_category', ''),
-                                    'level_name': level_result.get('level_name', ''),
-                                    'level_description': level_result.get('level_description', '')
-                                }
-                                
-                                # Find active fee structure for this academic level
-                                # Match fee structure category with student category
-                                # Filter by current academic year and current term
-                                # Priority: 1) Category-specific match, 2) 'both' category, 3) NULL category
-                                # A fee structure marked as 'self sponsored' ONLY applies to self sponsored students
-                                # A fee structure marked as 'sponsored' ONLY applies to sponsored students
-                                # A fee structure marked as 'both' applies to all students
-                                student_category = row.get('student_category', '').lower().strip() if row.get('student_category') else ''
-                                
-                                if student_category == 'self sponsored':
-                                    # Match fee structures for self sponsored students
-                                    # ONLY match 'self sponsored' or 'both' category structures
-                                    # Do NOT match 'sponsored' or NULL category structures
-                                    if current_academic_year_id and current_term_id:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, 
-                                                   fs.payment_deadline, fs.total_amount, fs.status, fs.category
-                                            FROM fee_structures fs
-                                            WHERE fs.academic_level_id = %s 
-                                              AND fs.status = 'active'
-                                              AND fs.academic_year_id = %s
-                                              AND fs.term_id = %s
-                                              AND (
-                                                  fs.category = 'self sponsored' 
-                                                  OR fs.category = 'both'
-                                              )
-                                            ORDER BY 
-                                              CASE 
-                                                WHEN fs.category = 'self sponsored' THEN 1
-                                                WHEN fs.category = 'both' THEN 2
-                                                ELSE 3
-                                              END,
-                                              fs.created_at DESC
-                                            LIMIT 1
-                                        """, (academic_level_id, current_academic_year_id, current_term_id))
-                                    else:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, 
-                                                   fs.payment_deadline, fs.total_amount, fs.status, fs.category
-                                            FROM fee_structures fs
-                                            WHERE fs.academic_level_id = %s 
-                                              AND fs.status = 'active'
-                                              AND (
-                                                  fs.category = 'self sponsored' 
-                                                  OR fs.category = 'both'
-                                              )
-                                            ORDER BY 
-                                              CASE 
-                                                WHEN fs.category = 'self sponsored' THEN 1
-                                                WHEN fs.category = 'both' THEN 2
-                                                ELSE 3
-                                              END,
-                                              fs.created_at DESC
-                                            LIMIT 1
-                                        """, (academic_level_id,))
-                                elif student_category == 'sponsored':
-                                    # Match fee structures for sponsored students
-                                    # ONLY match 'sponsored' or 'both' category structures
-                                    # Do NOT match 'self sponsored' or NULL category structures
-                                    if current_academic_year_id and current_term_id:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, 
-                                                   fs.payment_deadline, fs.total_amount, fs.status, fs.category
-                                            FROM fee_structures fs
-                                            WHERE fs.academic_level_id = %s 
-                                              AND fs.status = 'active'
-                                              AND fs.academic_year_id = %s
-                                              AND fs.term_id = %s
-                                              AND (
-                                                  fs.category = 'sponsored' 
-                                                  OR fs.category = 'both'
-                                              )
-                                            ORDER BY 
-                                              CASE 
-                                                WHEN fs.category = 'sponsored' THEN 1
-                                                WHEN fs.category = 'both' THEN 2
-                                                ELSE 3
-                                              END,
-                                              fs.created_at DESC
-                                            LIMIT 1
-                                        """, (academic_level_id, current_academic_year_id, current_term_id))
-                                    else:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, 
-                                                   fs.payment_deadline, fs.total_amount, fs.status, fs.category
-                                            FROM fee_structures fs
-                                            WHERE fs.academic_level_id = %s 
-                                              AND fs.status = 'active'
-                                              AND (
-                                                  fs.category = 'sponsored' 
-                                                  OR fs.category = 'both'
-                                              )
-                                            ORDER BY 
-                                              CASE 
-                                                WHEN fs.category = 'sponsored' THEN 1
-                                                WHEN fs.category = 'both' THEN 2
-                                                ELSE 3
-                                              END,
-                                              fs.created_at DESC
-                                            LIMIT 1
-                                        """, (academic_level_id,))
-                                elif student_category == 'both':
-                                    # Students with category 'both' can see all fee structures
-                                    # Priority: 'both' first, then category-specific, then NULL
-                                    if current_academic_year_id and current_term_id:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, 
-                                                   fs.payment_deadline, fs.total_amount, fs.status, fs.category
-                                            FROM fee_structures fs
-                                            WHERE fs.academic_level_id = %s 
-                                              AND fs.status = 'active'
-                                              AND fs.academic_year_id = %s
-                                              AND fs.term_id = %s
-                                            ORDER BY 
-                                              CASE 
-                                                WHEN fs.category = 'both' THEN 1
-                                                WHEN fs.category = 'self sponsored' THEN 2
-                                                WHEN fs.category = 'sponsored' THEN 3
-                                                WHEN fs.category IS NULL THEN 4
-                                                ELSE 5
-                                              END,
-                                              fs.created_at DESC
-                                            LIMIT 1
-                                        """, (academic_level_id, current_academic_year_id, current_term_id))
-                                    else:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, 
-                                                   fs.payment_deadline, fs.total_amount, fs.status, fs.category
-                                            FROM fee_structures fs
-                                            WHERE fs.academic_level_id = %s 
-                                              AND fs.status = 'active'
-                                            ORDER BY 
-                                              CASE 
-                                                WHEN fs.category = 'both' THEN 1
-                                                WHEN fs.category = 'self sponsored' THEN 2
-                                                WHEN fs.category = 'sponsored' THEN 3
-                                                WHEN fs.category IS NULL THEN 4
-                                                ELSE 5
-                                              END,
-                                              fs.created_at DESC
-                                            LIMIT 1
-                                        """, (academic_level_id,))
-                                else:
-                                    # If student has no category or unknown category, match 'both' category only
-                                    # Do not match category-specific fee structures (self sponsored or sponsored)
-                                    if current_academic_year_id and current_term_id:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, 
-                                                   fs.payment_deadline, fs.total_amount, fs.status, fs.category
-                                            FROM fee_structures fs
-                                            WHERE fs.academic_level_id = %s 
-                                              AND fs.status = 'active'
-                                              AND fs.academic_year_id = %s
-                                              AND fs.term_id = %s
-                                              AND fs.category = 'both'
-                                            ORDER BY fs.created_at DESC
-                                            LIMIT 1
-                                        """, (academic_level_id, current_academic_year_id, current_term_id))
-                                    else:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, 
-                                                   fs.payment_deadline, fs.total_amount, fs.status, fs.category
-                                            FROM fee_structures fs
-                                            WHERE fs.academic_level_id = %s 
-                                              AND fs.status = 'active'
-                                              AND fs.category = 'both'
-                                            ORDER BY fs.created_at DESC
-                                            LIMIT 1
-                                        """, (academic_level_id,))
-                                
-                                fee_structure_result = cursor.fetchone()
-                                
-                                if fee_structure_result:
-                                    # Format dates
-                                    start_date = fee_structure_result.get('start_date')
-                                    end_date = fee_structure_result.get('end_date')
-                                    payment_deadline = fee_structure_result.get('payment_deadline')
-                                    
-                                    if start_date and hasattr(start_date, 'strftime'):
-                                        start_date = start_date.strftime('%Y-%m-%d')
-                                    elif start_date:
-                                        start_date = str(start_date).split(' ')[0]
-                                    
-                                    if end_date and hasattr(end_date, 'strftime'):
-                                        end_date = end_date.strftime('%Y-%m-%d')
-                                    elif end_date:
-                                        end_date = str(end_date).split(' ')[0]
-                                    
-                                    if payment_deadline and hasattr(payment_deadline, 'strftime'):
-                                        payment_deadline = payment_deadline.strftime('%Y-%m-%d')
-                                    elif payment_deadline:
-                                        payment_deadline = str(payment_deadline).split(' ')[0]
-                                    
-                                    fee_structure = {
-                                        'id': fee_structure_result.get('id'),
-                                        'fee_name': fee_structure_result.get('fee_name', ''),
-                                        'category': fee_structure_result.get('category', 'both'),
-                                        'start_date': start_date,
-                                        'end_date': end_date,
-                                        'payment_deadline': payment_deadline,
-                                        'total_amount': float(fee_structure_result.get('total_amount', 0)),
-                                        'status': fee_structure_result.get('status', 'active')
-                                    }
-                                    
-                                    # Fetch fee items for this structure
-                                    cursor.execute("""
-                                        SELECT item_name, item_description, amount
-                                        FROM fee_items
-                                        WHERE fee_structure_id = %s
-                                        ORDER BY item_order ASC
-                                    """, (fee_structure['id'],))
-                                    fee_items = cursor.fetchall()
-                                    fee_structure['items'] = [{
-                                        'item_name': item.get('item_name', ''),
-                                        'item_description': item.get('item_description', ''),
-                                        'amount': float(item.get('amount', 0))
-                                    } for item in fee_items]
-                        
-                        # Calculate total paid and balance
-                        # First, get ALL payments for this student (for display in paid column)
-                        cursor.execute("""
-                            SELECT COALESCE(SUM(amount_paid), 0) as total_paid
-                            FROM student_payments
-                            WHERE student_id = %s
-                        """, (row.get('student_id'),))
-                        all_payments_result = cursor.fetchone()
-                        total_paid_all = 0.00
-                        if all_payments_result:
-                            total_paid_all = float(all_payments_result.get('total_paid', 0) if isinstance(all_payments_result, dict) else all_payments_result[0] or 0)
-                        
-                        # For balance calculation, use payments for current fee structure only
-                        total_paid = 0.00
-                        carry_forward = 0.00  # Overpayments from previous fee structures
-                        previous_term_balance = 0.00  # Unpaid balances from previous fee structures
-                        
-                        if fee_structure:
-                            # Get payments for current fee structure
-                            cursor.execute("""
-                                SELECT COALESCE(SUM(amount_paid), 0) as total_paid
-                                FROM student_payments
-                                WHERE student_id = %s AND fee_structure_id = %s
-                            """, (row.get('student_id'), fee_structure.get('id')))
-                            payment_result = cursor.fetchone()
-                            if payment_result:
-                                total_paid = float(payment_result.get('total_paid', 0) if isinstance(payment_result, dict) else payment_result[0] or 0)
-                            
-                            # Calculate carry-forward from previous fee structures (overpayments and unpaid balances)
-                            # Get all previous fee structures for this student's academic level that have ended
-                            # IMPORTANT: Filter by student category to only include relevant fee structures
-                            if academic_level_id:
-                                current_start_date = fee_structure.get('start_date')
-                                student_category = row.get('student_category', '').lower().strip() if row.get('student_category') else ''
-                                
-                                # Build category filter based on student category
-                                if student_category == 'self sponsored':
-                                    if current_start_date:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.total_amount,
-                                                   COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                            FROM fee_structures fs
-                                            LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                            WHERE fs.academic_level_id = %s
-                                            AND fs.id != %s
-                                            AND fs.status = 'active'
-                                            AND (fs.end_date < CURDATE() OR (fs.end_date IS NOT NULL AND fs.end_date < %s))
-                                            AND (fs.category = 'self sponsored' OR fs.category = 'both')
-                                            GROUP BY fs.id, fs.total_amount
-                                        """, (row.get('student_id'), academic_level_id, fee_structure.get('id'), current_start_date))
-                                    else:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.total_amount,
-                                                   COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                            FROM fee_structures fs
-                                            LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                            WHERE fs.academic_level_id = %s
-                                            AND fs.id != %s
-                                            AND fs.status = 'active'
-                                            AND fs.end_date < CURDATE()
-                                            AND (fs.category = 'self sponsored' OR fs.category = 'both')
-                                            GROUP BY fs.id, fs.total_amount
-                                        """, (row.get('student_id'), academic_level_id, fee_structure.get('id')))
-                                elif student_category == 'sponsored':
-                                    if current_start_date:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.total_amount,
-                                                   COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                            FROM fee_structures fs
-                                            LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                            WHERE fs.academic_level_id = %s
-                                            AND fs.id != %s
-                                            AND fs.status = 'active'
-                                            AND (fs.end_date < CURDATE() OR (fs.end_date IS NOT NULL AND fs.end_date < %s))
-                                            AND (fs.category = 'sponsored' OR fs.category = 'both')
-                                            GROUP BY fs.id, fs.total_amount
-                                        """, (row.get('student_id'), academic_level_id, fee_structure.get('id'), current_start_date))
-                                    else:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.total_amount,
-                                                   COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                            FROM fee_structures fs
-                                            LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                            WHERE fs.academic_level_id = %s
-                                            AND fs.id != %s
-                                            AND fs.status = 'active'
-                                            AND fs.end_date < CURDATE()
-                                            AND (fs.category = 'sponsored' OR fs.category = 'both')
-                                            GROUP BY fs.id, fs.total_amount
-                                        """, (row.get('student_id'), academic_level_id, fee_structure.get('id')))
-                                elif student_category == 'both':
-                                    # Include all categories for students with category 'both'
-                                    if current_start_date:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.total_amount,
-                                                   COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                            FROM fee_structures fs
-                                            LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                            WHERE fs.academic_level_id = %s
-                                            AND fs.id != %s
-                                            AND fs.status = 'active'
-                                            AND (fs.end_date < CURDATE() OR (fs.end_date IS NOT NULL AND fs.end_date < %s))
-                                            GROUP BY fs.id, fs.total_amount
-                                        """, (row.get('student_id'), academic_level_id, fee_structure.get('id'), current_start_date))
-                                    else:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.total_amount,
-                                                   COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                            FROM fee_structures fs
-                                            LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                            WHERE fs.academic_level_id = %s
-                                            AND fs.id != %s
-                                            AND fs.status = 'active'
-                                            AND fs.end_date < CURDATE()
-                                            GROUP BY fs.id, fs.total_amount
-                                        """, (row.get('student_id'), academic_level_id, fee_structure.get('id')))
-                                else:
-                                    # Only 'both' category for students with no category
-                                    if current_start_date:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.total_amount,
-                                                   COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                            FROM fee_structures fs
-                                            LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                            WHERE fs.academic_level_id = %s
-                                            AND fs.id != %s
-                                            AND fs.status = 'active'
-                                            AND (fs.end_date < CURDATE() OR (fs.end_date IS NOT NULL AND fs.end_date < %s))
-                                            AND fs.category = 'both'
-                                            GROUP BY fs.id, fs.total_amount
-                                        """, (row.get('student_id'), academic_level_id, fee_structure.get('id'), current_start_date))
-                                    else:
-                                        cursor.execute("""
-                                            SELECT fs.id, fs.total_amount,
-                                                   COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                            FROM fee_structures fs
-                                            LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                            WHERE fs.academic_level_id = %s
-                                            AND fs.id != %s
-                                            AND fs.status = 'active'
-                                            AND fs.end_date < CURDATE()
-                                            AND fs.category = 'both'
-                                            GROUP BY fs.id, fs.total_amount
-                                        """, (row.get('student_id'), academic_level_id, fee_structure.get('id')))
-                                
-                                previous_structures = cursor.fetchall()
-                                for prev_struct in previous_structures:
-                                    if isinstance(prev_struct, dict):
-                                        prev_total = float(prev_struct.get('total_amount', 0) or 0)
-                                        prev_paid = float(prev_struct.get('total_paid', 0) or 0)
-                                    else:
-                                        prev_total = float(prev_struct[1] or 0) if len(prev_struct) > 1 else 0
-                                        prev_paid = float(prev_struct[2] or 0) if len(prev_struct) > 2 else 0
-                                    
-                                    prev_balance = prev_total - prev_paid
-                                    # If there's an overpayment (negative balance), add to carry-forward
-                                    if prev_balance < 0:
-                                        carry_forward += abs(prev_balance)
-                                    # If there's an unpaid balance (positive balance), add to previous_term_balance
-                                    elif prev_balance > 0:
-                                        previous_term_balance += prev_balance
-                        
-                        balance = 0.00
-                        total_amount_due = 0.00  # Total amount student should pay (current term + previous term balance)
-                        if fee_structure:
-                            # Total amount due = Current Fee Total + Previous Term Unpaid Balance
-                            total_amount_due = float(fee_structure.get('total_amount', 0)) + previous_term_balance
-                            # Balance = Total Amount Due - (Payments + Carry Forward)
-                            balance = total_amount_due - (total_paid + carry_forward)
-                        
-                        # Determine payment status
-                        payment_status = 'no_structure'
-                        if fee_structure:
-                            if balance <= 0:
-                                payment_status = 'paid'
-                            elif fee_structure.get('payment_deadline'):
-                                deadline_str = fee_structure.get('payment_deadline')
-                                try:
-                                    deadline_date = datetime.strptime(deadline_str, '%Y-%m-%d').date()
-                                    today_date = datetime.now().date()
-                                    if deadline_date < today_date:
-                                        payment_status = 'overdue'
-                                    else:
-                                        payment_status = 'pending'
-                                except:
-                                    payment_status = 'pending'
-                            else:
-                                payment_status = 'pending'
-                        
-                        students.append({
-                            'id': row.get('id'),
-                            'student_id': row.get('student_id'),
-                            'full_name': row.get('full_name', ''),
-                            'current_grade': student_grade,
-                            'status': row.get('status', ''),
-                            'student_category': row.get('student_category', ''),
-                            'parent_name': row.get('parent_name', ''),
-                            'parent_phone': row.get('parent_phone', ''),
-                            'parent_email': row.get('parent_email', ''),
-                            'academic_level': academic_level,
-                            'fee_structure': fee_structure,
-                            'payment_status': payment_status,
-                            'total_paid': total_paid_all,  # Show all payments in paid column
-                            'total_paid_current': total_paid,  # Payments for current fee structure (for balance calculation)
-                            'carry_forward': carry_forward,
-                            'previous_term_balance': previous_term_balance,
-                            'total_amount_due': total_amount_due,
-                            'balance': balance
-                        })
+                # First page only; the page fetches further rows from student_fees_data
+                ledger = FeeLedger.load(cursor, student_ids=[])
+                students, next_cursor = fetch_student_fees_page(cursor, ledger=ledger)
                 
                 # Fetch active academic levels for fee structure creation
                 # Include information about whether they have fee structures
@@ -4010,1431 +3601,293 @@ def student_fees():
                            COUNT(DISTINCT fs.id) as fee_structure_count
                     FROM academic_levels al
                     LEFT JOIN fee_structures fs ON al.id = fs.academic_level_id 
-                        AND fs.status = 'active'
-                    WHERE al.level_status = 'active'
-                    GROUP BY al.id, al.level_category, al.level_name, al.level_description
-                    ORDER BY al.level_name ASC
-                """)
-                academic_levels_results = cursor.fetchall()
-                
-                if academic_levels_results:
-                    for row in academic_levels_results:
-                        fee_structure_count = row.get('fee_structure_count', 0) if isinstance(row, dict) else row[4]
-                        fee_structure_count = int(fee_structure_count) if fee_structure_count else 0
-                        academic_levels.append({
-                            'id': row.get('id') if isinstance(row, dict) else row[0],
-                            'level_category': row.get('level_category', '') if isinstance(row, dict) else row[1],
-                            'level_name': row.get('level_name', '') if isinstance(row, dict) else row[2],
-                            'level_description': row.get('level_description', '') if isinstance(row, dict) else row[3],
-                            'has_fee_structure': fee_structure_count > 0,
-                            'fee_structure_count': fee_structure_count
-                        })
-                
-                # Fetch ALL active academic years (ONLY filter by status='active', ignore is_current)
-                cursor.execute("""
-                    SELECT id, year_name, start_date, end_date, status, is_current, is_locked
-                    FROM academic_years
-                    WHERE status = 'active'
-                    ORDER BY start_date DESC
-                """)
-                academic_years_results = cursor.fetchall()
-                print(f"DEBUG: Found {len(academic_years_results) if academic_years_results else 0} active academic years")
-                if academic_years_results:
-                    for year in academic_years_results:
-                        year_dict = {
-                            'id': year.get('id') if isinstance(year, dict) else year[0],
-                            'year_name': year.get('year_name', '') if isinstance(year, dict) else year[1],
-                            'start_date': year.get('start_date') if isinstance(year, dict) else year[2],
-                            'end_date': year.get('end_date') if isinstance(year, dict) else year[3],
-                            'status': year.get('status', '') if isinstance(year, dict) else year[4],
-                            'is_current': year.get('is_current', False) if isinstance(year, dict) else year[5],
-                            'is_locked': year.get('is_locked', False) if isinstance(year, dict) else (year[6] if len(year) > 6 else False)
-                        }
-                        academic_years.append(year_dict)
-                        print(f"DEBUG: Added academic year: {year_dict['year_name']} (ID: {year_dict['id']}, Status: {year_dict['status']})")
-                
-                # Fetch ALL active terms that are not locked
-                cursor.execute("""
-                    SELECT t.id, t.term_name, t.academic_year_id, t.start_date, t.end_date, t.status, t.is_current, t.is_locked,
-                           ay.year_name as academic_year_name
-                    FROM terms t
-                    LEFT JOIN academic_years ay ON t.academic_year_id = ay.id
-                    WHERE t.status = 'active' AND (t.is_locked = FALSE OR t.is_locked IS NULL)
-                    ORDER BY t.academic_year_id DESC, t.start_date ASC
-                """)
-                terms_results = cursor.fetchall()
-                print(f"DEBUG: Found {len(terms_results) if terms_results else 0} active terms")
-                if terms_results:
-                    for term in terms_results:
-                        term_dict = {
-                            'id': term.get('id') if isinstance(term, dict) else term[0],
-                            'term_name': term.get('term_name', '') if isinstance(term, dict) else term[1],
-                            'academic_year_id': term.get('academic_year_id') if isinstance(term, dict) else term[2],
-                            'start_date': term.get('start_date') if isinstance(term, dict) else term[3],
-                            'end_date': term.get('end_date') if isinstance(term, dict) else term[4],
-                            'status': term.get('status', '') if isinstance(term, dict) else term[5],
-                            'is_current': term.get('is_current', False) if isinstance(term, dict) else term[6],
-                            'is_locked': term.get('is_locked', False) if isinstance(term, dict) else term[7],
-                            'academic_year_name': term.get('academic_year_name', '') if isinstance(term, dict) else term[8]
-                        }
-                        terms.append(term_dict)
-                        print(f"DEBUG: Added term: {term_dict['term_name']} (ID: {term_dict['id']}, Year ID: {term_dict['academic_year_id']}, Status: {term_dict['status']})")
-                
-                # Fetch all fee structures grouped by grade and category (for display section)
-                cursor.execute("""
-                    SELECT fs.id, fs.academic_level_id, fs.fee_name, fs.category, fs.start_date, fs.end_date, 
-                           fs.payment_deadline, fs.total_amount, fs.status, fs.created_at,
-                           al.level_name, al.level_category
-                    FROM fee_structures fs
-                    LEFT JOIN academic_levels al ON fs.academic_level_id = al.id
-                    WHERE fs.status = 'active'
-                    ORDER BY al.level_name ASC, fs.category ASC, fs.created_at DESC
-                """)
-                fee_structures_results = cursor.fetchall()
-                
-                # Group fee structures by grade and category
-                for row in fee_structures_results:
-                    level_name = row.get('level_name', 'Unknown') if isinstance(row, dict) else (row[10] if len(row) > 10 else 'Unknown')
-                    category = row.get('category', 'both') if isinstance(row, dict) else (row[3] if len(row) > 3 else 'both')
-                    
-                    if level_name not in fee_structures_by_grade:
-                        fee_structures_by_grade[level_name] = {}
-                    
-                    if category not in fee_structures_by_grade[level_name]:
-                        fee_structures_by_grade[level_name][category] = []
-                    
-                    # Format dates
-                    start_date = row.get('start_date') if isinstance(row, dict) else row[4]
-                    end_date = row.get('end_date') if isinstance(row, dict) else row[5]
-                    payment_deadline = row.get('payment_deadline') if isinstance(row, dict) else row[6]
-                    
-                    if start_date and hasattr(start_date, 'strftime'):
-                        start_date = start_date.strftime('%Y-%m-%d')
-                    elif start_date:
-                        start_date = str(start_date).split(' ')[0]
-                    
-                    if end_date and hasattr(end_date, 'strftime'):
-                        end_date = end_date.strftime('%Y-%m-%d')
-                    elif end_date:
-                        end_date = str(end_date).split(' ')[0]
-                    
-                    if payment_deadline and hasattr(payment_deadline, 'strftime'):
-                        payment_deadline = payment_deadline.strftime('%Y-%m-%d')
-                    elif payment_deadline:
-                        payment_deadline = str(payment_deadline).split(' ')[0]
-                    
-                    # Fetch fee items for this structure
-                    structure_id = row.get('id') if isinstance(row, dict) else row[0]
-                    cursor.execute("""
-                        SELECT item_name, item_description, amount
-                        FROM fee_items
-                        WHERE fee_structure_id = %s
-                        ORDER BY item_order ASC
-                    """, (structure_id,))
-                    items = cursor.fetchall()
-                    
-                    fee_structures_by_grade[level_name][category].append({
-                        'id': structure_id,
-                        'fee_name': row.get('fee_name', '') if isinstance(row, dict) else row[2],
-                        'category': category,
-                        'start_date': start_date,
-                        'end_date': end_date,
-                        'payment_deadline': payment_deadline,
-                        'total_amount': float(row.get('total_amount', 0) if isinstance(row, dict) else (row[7] if len(row) > 7 else 0)),
-                        'status': row.get('status', 'active') if isinstance(row, dict) else row[8],
-                        'items': [{
-                            'item_name': item.get('item_name', '') if isinstance(item, dict) else item[0],
-                            'item_description': item.get('item_description', '') if isinstance(item, dict) else (item[1] if len(item) > 1 else ''),
-                            'amount': float(item.get('amount', 0) if isinstance(item, dict) else (item[2] if len(item) > 2 else 0))
-                        } for item in items]
-                    })
-        except Exception as e:
-            print(f"Error fetching data: {e}")
-            import traceback
-            traceback.print_exc()
-        finally:
-            connection.close()
-    
-    from datetime import datetime
-    today = datetime.now().strftime('%Y-%m-%d')
-    
-    # Get current employee info for payment recording
-    current_employee = None
-    connection = get_db_connection()
-    if connection:
-        try:
-            with connection.cursor() as cursor:
-                employee_id = session.get('employee_id') or session.get('user_id')
-                if employee_id:
-                    cursor.execute("""
-                        SELECT id, employee_id, full_name, role
-                        FROM employees
-                        WHERE id = %s OR employee_id = %s
-                        LIMIT 1
-                    """, (employee_id, employee_id))
-                    emp_result = cursor.fetchone()
-                    if emp_result:
-                        current_employee = {
-                            'id': emp_result.get('id'),
-                            'employee_id': emp_result.get('employee_id'),
-                            'full_name': emp_result.get('full_name'),
-                            'role': emp_result.get('role')
-                        }
-        except Exception as e:
-            print(f"Error fetching employee info: {e}")
-        finally:
-            connection.close()
-    
-    # Fetch all active fee structures for assignment dropdown
-    all_fee_structures = []
-    connection = get_db_connection()
-    if connection:
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                    SELECT fs.id, fs.fee_name, fs.category, fs.total_amount,
-                           al.level_name, al.level_category
-                    FROM fee_structures fs
-                    LEFT JOIN academic_levels al ON fs.academic_level_id = al.id
-                    WHERE fs.status = 'active'
-                    ORDER BY al.level_name ASC, fs.fee_name ASC
-                """)
-                structures = cursor.fetchall()
-                for row in structures:
-                    all_fee_structures.append({
-                        'id': row.get('id') if isinstance(row, dict) else row[0],
-                        'fee_name': row.get('fee_name', '') if isinstance(row, dict) else row[1],
-                        'category': row.get('category', 'both') if isinstance(row, dict) else row[2],
-                        'total_amount': float(row.get('total_amount', 0) if isinstance(row, dict) else (row[3] if len(row) > 3 else 0)),
-                        'level_name': row.get('level_name', '') if isinstance(row, dict) else (row[4] if len(row) > 4 else ''),
-                        'level_category': row.get('level_category', '') if isinstance(row, dict) else (row[5] if len(row) > 5 else '')
-                    })
-        except Exception as e:
-            print(f"Error fetching fee structures: {e}")
-        finally:
-            connection.close()
-    
-    # Check additional permissions
-    can_generate_invoices = check_permission_or_role('generate_invoices', ['accountant', 'principal'])
-    
-    return render_template('dashboards/student_fees.html', 
-                         students=students, 
-                         academic_levels=academic_levels,
-                         academic_years=academic_years,
-                         terms=terms,
-                         today=today,
-                         current_employee=current_employee,
-                         fee_structures_by_grade=fee_structures_by_grade,
-                         can_view_students=can_view_students,
-                         can_view_fee_structure_details=can_view_fee_structure_details,
-                         can_record_payments=can_record_payments,
-                         can_add_fee_structure=can_add_fee_structure,
-                         can_edit_fee_structure=can_edit_fee_structure,
-                         can_delete_fee_structure=can_delete_fee_structure,
-                         can_generate_invoices=can_generate_invoices)
-
-@app.route('/dashboard/employee/student-fees/generate-invoice/<student_id>')
-@login_required
-def generate_invoice(student_id):
-    """Generate a professional PDF invoice for a student"""
-    user_role = session.get('role', '').lower()
-    viewing_as_role = session.get('viewing_as_employee_role', '').lower()
-    employee_id = session.get('employee_id') or session.get('user_id')
-    
-    # Check if user is accountant or viewing as accountant
-    is_accountant = user_role == 'accountant' or viewing_as_role == 'accountant'
-    is_technician = user_role == 'technician'
-    
-    # Check permission-based access
-    has_generate_invoices_permission = check_permission_or_role('generate_invoices', ['accountant'])
-    
-    # Permission check handles role fallback if no permissions are assigned
-    if not (is_technician or has_generate_invoices_permission):
-        flash('You do not have permission to generate invoices.', 'error')
-        return redirect(url_for('student_fees'))
-    
-    connection = get_db_connection()
-    if not connection:
-        flash('Database connection error.', 'error')
-        return redirect(url_for('student_fees'))
-    
-    try:
-        with connection.cursor() as cursor:
-            # Get student information
-            cursor.execute("""
-                SELECT s.id, s.student_id, s.full_name, s.current_grade, s.status, s.student_category,
-                       p.full_name as parent_name, p.phone as parent_phone, p.email as parent_email, p.relationship
-                FROM students s
-                LEFT JOIN parents p ON s.student_id = p.student_id
-                WHERE s.student_id = %s AND s.status = 'in session'
-                LIMIT 1
-            """, (student_id,))
-            student_result = cursor.fetchone()
-            
-            if not student_result:
-                flash('Student not found.', 'error')
-                return redirect(url_for('student_fees'))
-            
-            student = dict(student_result) if isinstance(student_result, dict) else {
-                'id': student_result[0],
-                'student_id': student_result[1],
-                'full_name': student_result[2],
-                'current_grade': student_result[3],
-                'status': student_result[4],
-                'student_category': student_result[5] if len(student_result) > 5 else None,
-                'parent_name': student_result[6] if len(student_result) > 6 else None,
-                'parent_phone': student_result[7] if len(student_result) > 7 else None,
-                'parent_email': student_result[8] if len(student_result) > 8 else None,
-                'relationship': student_result[9] if len(student_result) > 9 else None
-            }
-            
-            # Get student's academic level by matching current_grade with academic_levels
-            # First get the student's current_grade
-            cursor.execute("""
-                SELECT current_grade 
-                FROM students 
-                WHERE student_id = %s
-                LIMIT 1
-            """, (student_id,))
-            student_grade_result = cursor.fetchone()
-            student_grade = None
-            if student_grade_result:
-                student_grade = student_grade_result[0] if isinstance(student_grade_result, (list, tuple)) else student_grade_result.get('current_grade')
-            
-            # Get fee structure and payments
-            fee_structure = None
-            academic_level_id = None
-            if student_grade:
-                # Find academic level by matching level_name with current_grade
-                cursor.execute("""
-                    SELECT id 
-                    FROM academic_levels 
-                    WHERE level_name = %s AND level_status = 'active'
-                    LIMIT 1
-                """, (student_grade,))
-                academic_level_result = cursor.fetchone()
-                if academic_level_result:
-                    academic_level_id = academic_level_result[0] if isinstance(academic_level_result, (list, tuple)) else academic_level_result.get('id')
-            
-            if academic_level_id:
-                # Get current academic year and term for filtering
-                cursor.execute("""
-                    SELECT id, year_name, is_current
-                    FROM academic_years
-                    WHERE is_current = TRUE AND status = 'active'
-                    LIMIT 1
-                """)
-                current_year_result = cursor.fetchone()
-                current_academic_year_id = None
-                if current_year_result:
-                    current_academic_year_id = current_year_result.get('id') if isinstance(current_year_result, dict) else current_year_result[0]
-                
-                current_term_id = None
-                if current_academic_year_id:
-                    cursor.execute("""
-                        SELECT id, term_name, is_current
-                        FROM terms
-                        WHERE is_current = TRUE AND status = 'active' AND academic_year_id = %s
-                        LIMIT 1
-                    """, (current_academic_year_id,))
-                    current_term_result = cursor.fetchone()
-                    if current_term_result:
-                        current_term_id = current_term_result.get('id') if isinstance(current_term_result, dict) else current_term_result[0]
-                
-                # Match fee structure category with student category
-                student_category = student.get('student_category', '').lower().strip() if student.get('student_category') else ''
-                
-                if student_category == 'self sponsored':
-                    # Match fee structures for self sponsored students
-                    # ONLY match 'self sponsored' or 'both' category structures
-                    if current_academic_year_id and current_term_id:
-                        cursor.execute("""
-                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, fs.payment_deadline,
-                                   fs.total_amount, al.level_name, al.level_category, fs.category
-                            FROM fee_structures fs
-                            LEFT JOIN academic_levels al ON fs.academic_level_id = al.id
-                            WHERE fs.academic_level_id = %s 
-                              AND fs.status = 'active'
-                              AND fs.academic_year_id = %s
-                              AND fs.term_id = %s
-                              AND (fs.category = 'self sponsored' OR fs.category = 'both')
-                            ORDER BY 
-                              CASE 
-                                WHEN fs.category = 'self sponsored' THEN 1
-                                WHEN fs.category = 'both' THEN 2
-                                ELSE 3
-                              END,
-                              fs.created_at DESC
-                            LIMIT 1
-                        """, (academic_level_id, current_academic_year_id, current_term_id))
-                    else:
-                        cursor.execute("""
-                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, fs.payment_deadline,
-                                   fs.total_amount, al.level_name, al.level_category, fs.category
-                            FROM fee_structures fs
-                            LEFT JOIN academic_levels al ON fs.academic_level_id = al.id
-                            WHERE fs.academic_level_id = %s 
-                              AND fs.status = 'active'
-                              AND (fs.category = 'self sponsored' OR fs.category = 'both')
-                            ORDER BY 
-                              CASE 
-                                WHEN fs.category = 'self sponsored' THEN 1
-                                WHEN fs.category = 'both' THEN 2
-                                ELSE 3
-                              END,
-                              fs.created_at DESC
-                            LIMIT 1
-                        """, (academic_level_id,))
-                elif student_category == 'sponsored':
-                    # Match fee structures for sponsored students
-                    # ONLY match 'sponsored' or 'both' category structures
-                    if current_academic_year_id and current_term_id:
-                        cursor.execute("""
-                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, fs.payment_deadline,
-                                   fs.total_amount, al.level_name, al.level_category, fs.category
-                            FROM fee_structures fs
-                            LEFT JOIN academic_levels al ON fs.academic_level_id = al.id
-                            WHERE fs.academic_level_id = %s 
-                              AND fs.status = 'active'
-                              AND fs.academic_year_id = %s
-                              AND fs.term_id = %s
-                              AND (fs.category = 'sponsored' OR fs.category = 'both')
-                            ORDER BY 
-                              CASE 
-                                WHEN fs.category = 'sponsored' THEN 1
-                                WHEN fs.category = 'both' THEN 2
-                                ELSE 3
-                              END,
-                              fs.created_at DESC
-                            LIMIT 1
-                        """, (academic_level_id, current_academic_year_id, current_term_id))
-                    else:
-                        cursor.execute("""
-                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, fs.payment_deadline,
-                                   fs.total_amount, al.level_name, al.level_category, fs.category
-                            FROM fee_structures fs
-                            LEFT JOIN academic_levels al ON fs.academic_level_id = al.id
-                            WHERE fs.academic_level_id = %s 
-                              AND fs.status = 'active'
-                              AND (fs.category = 'sponsored' OR fs.category = 'both')
-                            ORDER BY 
-                              CASE 
-                                WHEN fs.category = 'sponsored' THEN 1
-                                WHEN fs.category = 'both' THEN 2
-                                ELSE 3
-                              END,
-                              fs.created_at DESC
-                            LIMIT 1
-                        """, (academic_level_id,))
-                elif student_category == 'both':
-                    # Students with category 'both' can see all fee structures
-                    if current_academic_year_id and current_term_id:
-                        cursor.execute("""
-                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, fs.payment_deadline,
-                                   fs.total_amount, al.level_name, al.level_category, fs.category
-                            FROM fee_structures fs
-                            LEFT JOIN academic_levels al ON fs.academic_level_id = al.id
-                            WHERE fs.academic_level_id = %s 
-                              AND fs.status = 'active'
-                              AND fs.academic_year_id = %s
-                              AND fs.term_id = %s
-                            ORDER BY 
-                              CASE 
-                                WHEN fs.category = 'both' THEN 1
-                                WHEN fs.category = 'self sponsored' THEN 2
-                                WHEN fs.category = 'sponsored' THEN 3
-                                ELSE 4
-                              END,
-                              fs.created_at DESC
-                            LIMIT 1
-                        """, (academic_level_id, current_academic_year_id, current_term_id))
-                    else:
-                        cursor.execute("""
-                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, fs.payment_deadline,
-                                   fs.total_amount, al.level_name, al.level_category, fs.category
-                            FROM fee_structures fs
-                            LEFT JOIN academic_levels al ON fs.academic_level_id = al.id
-                            WHERE fs.academic_level_id = %s 
-                              AND fs.status = 'active'
-                            ORDER BY 
-                              CASE 
-                                WHEN fs.category = 'both' THEN 1
-                                WHEN fs.category = 'self sponsored' THEN 2
-                                WHEN fs.category = 'sponsored' THEN 3
-                                ELSE 4
-                              END,
-                              fs.created_at DESC
-                            LIMIT 1
-                        """, (academic_level_id,))
-                else:
-                    # If student has no category, match 'both' category only
-                    if current_academic_year_id and current_term_id:
-                        cursor.execute("""
-                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, fs.payment_deadline,
-                                   fs.total_amount, al.level_name, al.level_category, fs.category
-                            FROM fee_structures fs
-                            LEFT JOIN academic_levels al ON fs.academic_level_id = al.id
-                            WHERE fs.academic_level_id = %s 
-                              AND fs.status = 'active'
-                              AND fs.academic_year_id = %s
-                              AND fs.term_id = %s
-                              AND fs.category = 'both'
-                            ORDER BY fs.created_at DESC
-                            LIMIT 1
-                        """, (academic_level_id, current_academic_year_id, current_term_id))
-                    else:
-                        cursor.execute("""
-                            SELECT fs.id, fs.fee_name, fs.start_date, fs.end_date, fs.payment_deadline,
-                                   fs.total_amount, al.level_name, al.level_category, fs.category
-                            FROM fee_structures fs
-                            LEFT JOIN academic_levels al ON fs.academic_level_id = al.id
-                            WHERE fs.academic_level_id = %s 
-                              AND fs.status = 'active'
-                              AND fs.category = 'both'
-                            ORDER BY fs.created_at DESC
-                            LIMIT 1
-                        """, (academic_level_id,))
-                
-                fee_structure_result = cursor.fetchone()
-                
-                if fee_structure_result:
-                    if isinstance(fee_structure_result, dict):
-                        fee_structure = {
-                            'id': fee_structure_result.get('id'),
-                            'fee_name': fee_structure_result.get('fee_name', ''),
-                            'start_date': fee_structure_result.get('start_date'),
-                            'end_date': fee_structure_result.get('end_date'),
-                            'payment_deadline': fee_structure_result.get('payment_deadline'),
-                            'total_amount': float(fee_structure_result.get('total_amount', 0) or 0),
-                            'level_name': fee_structure_result.get('level_name'),
-                            'level_category': fee_structure_result.get('level_category')
-                        }
-                    else:
-                        fee_structure = {
-                            'id': fee_structure_result[0],
-                            'fee_name': fee_structure_result[1] if len(fee_structure_result) > 1 else '',
-                            'start_date': fee_structure_result[2] if len(fee_structure_result) > 2 else None,
-                            'end_date': fee_structure_result[3] if len(fee_structure_result) > 3 else None,
-                            'payment_deadline': fee_structure_result[4] if len(fee_structure_result) > 4 else None,
-                            'total_amount': float(fee_structure_result[5] or 0) if len(fee_structure_result) > 5 and fee_structure_result[5] else 0,
-                            'level_name': fee_structure_result[6] if len(fee_structure_result) > 6 else None,
-                            'level_category': fee_structure_result[7] if len(fee_structure_result) > 7 else None
-                        }
-                
-                # Get fee items
-                cursor.execute("""
-                    SELECT item_name, item_description, amount
-                    FROM fee_items
-                    WHERE fee_structure_id = %s
-                    ORDER BY id ASC
-                """, (fee_structure['id'],))
-                fee_items = cursor.fetchall()
-                fee_structure['items'] = []
-                for item in fee_items:
-                    if isinstance(item, dict):
-                        item_name = item.get('item_name', '')
-                        item_description = item.get('item_description', '') or ''
-                        amount = item.get('amount', 0) or 0
-                    else:
-                        item_name = item[0] if len(item) > 0 else ''
-                        item_description = item[1] if len(item) > 1 else ''
-                        amount = item[2] if len(item) > 2 and item[2] else 0
-                    
-                    # Convert amount to float, handling Decimal types
-                    try:
-                        amount_float = float(amount) if amount else 0.0
-                    except (TypeError, ValueError):
-                        amount_float = 0.0
-                    
-                    fee_structure['items'].append({
-                        'item_name': item_name,
-                        'item_description': item_description,
-                        'amount': amount_float
-                    })
-            
-            # Get payment transactions for current fee structure
-            total_paid = 0.0
-            carry_forward = 0.0
-            payment_transactions = []
-            balance_brought_forward = 0.0  # Initialize for ledger calculation
-            
-            if fee_structure:
-                cursor.execute("""
-                    SELECT sp.amount_paid, sp.payment_date, sp.payment_method, sp.reference_number, 
-                           sp.cheque_number, sp.transaction_id, sp.notes, 
-                           e.full_name as received_by_name
-                    FROM student_payments sp
-                    LEFT JOIN employees e ON sp.received_by = e.id
-                    WHERE sp.student_id = %s AND sp.fee_structure_id = %s
-                    ORDER BY sp.payment_date DESC, sp.id DESC
-                """, (student_id, fee_structure['id']))
-                payments = cursor.fetchall()
-                
-                # Calculate total paid for current fee structure and collect transaction details
-                for payment in payments:
-                    if isinstance(payment, dict):
-                        amount = payment.get('amount_paid', 0) or 0
-                        payment_date = payment.get('payment_date')
-                        payment_method = payment.get('payment_method', '')
-                        reference_number = payment.get('reference_number', '')
-                        cheque_number = payment.get('cheque_number', '')
-                        transaction_id = payment.get('transaction_id', '')
-                        notes = payment.get('notes', '')
-                        received_by = payment.get('received_by_name', '') or 'N/A'
-                    else:
-                        amount = payment[0] if len(payment) > 0 and payment[0] else 0
-                        payment_date = payment[1] if len(payment) > 1 else None
-                        payment_method = payment[2] if len(payment) > 2 else ''
-                        reference_number = payment[3] if len(payment) > 3 else ''
-                        cheque_number = payment[4] if len(payment) > 4 else ''
-                        transaction_id = payment[5] if len(payment) > 5 else ''
-                        notes = payment[6] if len(payment) > 6 else ''
-                        received_by = payment[7] if len(payment) > 7 else 'N/A'
-                    
-                    # Convert to float, handling Decimal types
-                    try:
-                        amount_float = float(amount) if amount else 0.0
-                        total_paid += amount_float
-                        
-                        # Format payment date
-                        if payment_date:
-                            if hasattr(payment_date, 'strftime'):
-                                formatted_date = payment_date.strftime('%B %d, %Y')
-                            else:
-                                try:
-                                    date_obj = datetime.strptime(str(payment_date).split(' ')[0], '%Y-%m-%d')
-                                    formatted_date = date_obj.strftime('%B %d, %Y')
-                                except:
-                                    formatted_date = str(payment_date).split(' ')[0]
-                        else:
-                            formatted_date = 'N/A'
-                        
-                        payment_transactions.append({
-                            'amount': amount_float,
-                            'date': formatted_date,
-                            'method': payment_method,
-                            'reference': reference_number,
-                            'cheque': cheque_number,
-                            'transaction_id': transaction_id,
-                            'notes': notes,
-                            'received_by': received_by
-                        })
-                    except (TypeError, ValueError):
-                        total_paid += 0.0
-                
-                # Calculate carry-forward from previous fee structures (overpayments)
-                # IMPORTANT: Filter by student category to only include relevant fee structures
-                if academic_level_id:
-                    current_start_date = fee_structure.get('start_date')
-                    student_category = student.get('student_category', '').lower().strip() if student.get('student_category') else ''
-                    
-                    if student_category == 'self sponsored':
-                        if current_start_date:
-                            cursor.execute("""
-                                SELECT fs.id, fs.total_amount,
-                                       COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                FROM fee_structures fs
-                                LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                WHERE fs.academic_level_id = %s
-                                AND fs.id != %s
-                                AND fs.status = 'active'
-                                AND (fs.end_date < CURDATE() OR (fs.end_date IS NOT NULL AND fs.end_date < %s))
-                                AND (fs.category = 'self sponsored' OR fs.category = 'both')
-                                GROUP BY fs.id, fs.total_amount
-                            """, (student_id, academic_level_id, fee_structure['id'], current_start_date))
-                        else:
-                            cursor.execute("""
-                                SELECT fs.id, fs.total_amount,
-                                       COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                FROM fee_structures fs
-                                LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                WHERE fs.academic_level_id = %s
-                                AND fs.id != %s
-                                AND fs.status = 'active'
-                                AND fs.end_date < CURDATE()
-                                AND (fs.category = 'self sponsored' OR fs.category = 'both')
-                                GROUP BY fs.id, fs.total_amount
-                            """, (student_id, academic_level_id, fee_structure['id']))
-                    elif student_category == 'sponsored':
-                        if current_start_date:
-                            cursor.execute("""
-                                SELECT fs.id, fs.total_amount,
-                                       COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                FROM fee_structures fs
-                                LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                WHERE fs.academic_level_id = %s
-                                AND fs.id != %s
-                                AND fs.status = 'active'
-                                AND (fs.end_date < CURDATE() OR (fs.end_date IS NOT NULL AND fs.end_date < %s))
-                                AND (fs.category = 'sponsored' OR fs.category = 'both')
-                                GROUP BY fs.id, fs.total_amount
-                            """, (student_id, academic_level_id, fee_structure['id'], current_start_date))
-                        else:
-                            cursor.execute("""
-                                SELECT fs.id, fs.total_amount,
-                                       COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                FROM fee_structures fs
-                                LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                WHERE fs.academic_level_id = %s
-                                AND fs.id != %s
-                                AND fs.status = 'active'
-                                AND fs.end_date < CURDATE()
-                                AND (fs.category = 'sponsored' OR fs.category = 'both')
-                                GROUP BY fs.id, fs.total_amount
-                            """, (student_id, academic_level_id, fee_structure['id']))
-                    elif student_category == 'both':
-                        # Include all categories for students with category 'both'
-                        if current_start_date:
-                            cursor.execute("""
-                                SELECT fs.id, fs.total_amount,
-                                       COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                FROM fee_structures fs
-                                LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                WHERE fs.academic_level_id = %s
-                                AND fs.id != %s
-                                AND fs.status = 'active'
-                                AND (fs.end_date < CURDATE() OR (fs.end_date IS NOT NULL AND fs.end_date < %s))
-                                GROUP BY fs.id, fs.total_amount
-                            """, (student_id, academic_level_id, fee_structure['id'], current_start_date))
-                        else:
-                            cursor.execute("""
-                                SELECT fs.id, fs.total_amount,
-                                       COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                FROM fee_structures fs
-                                LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                WHERE fs.academic_level_id = %s
-                                AND fs.id != %s
-                                AND fs.status = 'active'
-                                AND fs.end_date < CURDATE()
-                                GROUP BY fs.id, fs.total_amount
-                            """, (student_id, academic_level_id, fee_structure['id']))
-                    else:
-                        # Only 'both' category for students with no category
-                        if current_start_date:
-                            cursor.execute("""
-                                SELECT fs.id, fs.total_amount,
-                                       COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                FROM fee_structures fs
-                                LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                WHERE fs.academic_level_id = %s
-                                AND fs.id != %s
-                                AND fs.status = 'active'
-                                AND (fs.end_date < CURDATE() OR (fs.end_date IS NOT NULL AND fs.end_date < %s))
-                                AND fs.category = 'both'
-                                GROUP BY fs.id, fs.total_amount
-                            """, (student_id, academic_level_id, fee_structure['id'], current_start_date))
-                        else:
-                            cursor.execute("""
-                                SELECT fs.id, fs.total_amount,
-                                       COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                FROM fee_structures fs
-                                LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                WHERE fs.academic_level_id = %s
-                                AND fs.id != %s
-                                AND fs.status = 'active'
-                                AND fs.end_date < CURDATE()
-                                AND fs.category = 'both'
-                                GROUP BY fs.id, fs.total_amount
-                            """, (student_id, academic_level_id, fee_structure['id']))
-                    
-                    previous_structures = cursor.fetchall()
-                    for prev_struct in previous_structures:
-                        if isinstance(prev_struct, dict):
-                            prev_total = float(prev_struct.get('total_amount', 0) or 0)
-                            prev_paid = float(prev_struct.get('total_paid', 0) or 0)
-                        else:
-                            prev_total = float(prev_struct[1] or 0) if len(prev_struct) > 1 else 0
-                            prev_paid = float(prev_struct[2] or 0) if len(prev_struct) > 2 else 0
-                        
-                        prev_balance = prev_total - prev_paid
-                        # If there's an overpayment (negative balance), add to carry-forward
-                        if prev_balance < 0:
-                            carry_forward += abs(prev_balance)
-                
-                # Calculate balance brought forward from previous fee structures (for ledger)
-                # IMPORTANT: Filter by student category to only include relevant fee structures
-                balance_brought_forward = 0.0
-                previous_term_info = None  # Store previous term's closing info
-                if academic_level_id and fee_structure:
-                    current_start_date = fee_structure.get('start_date')
-                    student_category = student.get('student_category', '').lower().strip() if student.get('student_category') else ''
-                    
-                    if current_start_date:
-                        try:
-                            if hasattr(current_start_date, 'strftime'):
-                                start_date_str = current_start_date.strftime('%Y-%m-%d')
-                            else:
-                                start_date_str = str(current_start_date).split(' ')[0]
-                            
-                            if student_category == 'self sponsored':
-                                cursor.execute("""
-                                    SELECT fs.id, fs.total_amount, fs.fee_name, fs.end_date,
-                                           COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                    FROM fee_structures fs
-                                    LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                    WHERE fs.academic_level_id = %s
-                                    AND fs.id != %s
-                                    AND fs.status = 'active'
-                                    AND (fs.end_date < CURDATE() OR (fs.end_date IS NOT NULL AND fs.end_date < %s))
-                                    AND (fs.category = 'self sponsored' OR fs.category = 'both')
-                                    GROUP BY fs.id, fs.total_amount, fs.fee_name, fs.end_date
-                                    ORDER BY fs.end_date DESC
-                                    LIMIT 1
-                                """, (student_id, academic_level_id, fee_structure['id'], start_date_str))
-                            elif student_category == 'sponsored':
-                                cursor.execute("""
-                                    SELECT fs.id, fs.total_amount, fs.fee_name, fs.end_date,
-                                           COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                    FROM fee_structures fs
-                                    LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                    WHERE fs.academic_level_id = %s
-                                    AND fs.id != %s
-                                    AND fs.status = 'active'
-                                    AND (fs.end_date < CURDATE() OR (fs.end_date IS NOT NULL AND fs.end_date < %s))
-                                    AND (fs.category = 'sponsored' OR fs.category = 'both')
-                                    GROUP BY fs.id, fs.total_amount, fs.fee_name, fs.end_date
-                                    ORDER BY fs.end_date DESC
-                                    LIMIT 1
-                                """, (student_id, academic_level_id, fee_structure['id'], start_date_str))
-                            elif student_category == 'both':
-                                cursor.execute("""
-                                    SELECT fs.id, fs.total_amount, fs.fee_name, fs.end_date,
-                                           COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                    FROM fee_structures fs
-                                    LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                    WHERE fs.academic_level_id = %s
-                                    AND fs.id != %s
-                                    AND fs.status = 'active'
-                                    AND (fs.end_date < CURDATE() OR (fs.end_date IS NOT NULL AND fs.end_date < %s))
-                                    GROUP BY fs.id, fs.total_amount, fs.fee_name, fs.end_date
-                                    ORDER BY fs.end_date DESC
-                                    LIMIT 1
-                                """, (student_id, academic_level_id, fee_structure['id'], start_date_str))
-                            else:
-                                cursor.execute("""
-                                    SELECT fs.id, fs.total_amount, fs.fee_name, fs.end_date,
-                                           COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                    FROM fee_structures fs
-                                    LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                    WHERE fs.academic_level_id = %s
-                                    AND fs.id != %s
-                                    AND fs.status = 'active'
-                                    AND (fs.end_date < CURDATE() OR (fs.end_date IS NOT NULL AND fs.end_date < %s))
-                                    AND fs.category = 'both'
-                                    GROUP BY fs.id, fs.total_amount, fs.fee_name, fs.end_date
-                                    ORDER BY fs.end_date DESC
-                                    LIMIT 1
-                                """, (student_id, academic_level_id, fee_structure['id'], start_date_str))
-                        except:
-                            if student_category == 'self sponsored':
-                                cursor.execute("""
-                                    SELECT fs.id, fs.total_amount, fs.fee_name, fs.end_date,
-                                           COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                    FROM fee_structures fs
-                                    LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                    WHERE fs.academic_level_id = %s
-                                    AND fs.id != %s
-                                    AND fs.status = 'active'
-                                    AND fs.end_date < CURDATE()
-                                    AND (fs.category = 'self sponsored' OR fs.category = 'both')
-                                    GROUP BY fs.id, fs.total_amount, fs.fee_name, fs.end_date
-                                    ORDER BY fs.end_date DESC
-                                    LIMIT 1
-                                """, (student_id, academic_level_id, fee_structure['id']))
-                            elif student_category == 'sponsored':
-                                cursor.execute("""
-                                    SELECT fs.id, fs.total_amount, fs.fee_name, fs.end_date,
-                                           COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                    FROM fee_structures fs
-                                    LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                    WHERE fs.academic_level_id = %s
-                                    AND fs.id != %s
-                                    AND fs.status = 'active'
-                                    AND fs.end_date < CURDATE()
-                                    AND (fs.category = 'sponsored' OR fs.category = 'both')
-                                    GROUP BY fs.id, fs.total_amount, fs.fee_name, fs.end_date
-                                    ORDER BY fs.end_date DESC
-                                    LIMIT 1
-                                """, (student_id, academic_level_id, fee_structure['id']))
-                            elif student_category == 'both':
-                                cursor.execute("""
-                                    SELECT fs.id, fs.total_amount, fs.fee_name, fs.end_date,
-                                           COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                    FROM fee_structures fs
-                                    LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                    WHERE fs.academic_level_id = %s
-                                    AND fs.id != %s
-                                    AND fs.status = 'active'
-                                    AND fs.end_date < CURDATE()
-                                    GROUP BY fs.id, fs.total_amount, fs.fee_name, fs.end_date
-                                    ORDER BY fs.end_date DESC
-                                    LIMIT 1
-                                """, (student_id, academic_level_id, fee_structure['id']))
-                            else:
-                                cursor.execute("""
-                                    SELECT fs.id, fs.total_amount, fs.fee_name, fs.end_date,
-                                           COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                    FROM fee_structures fs
-                                    LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                    WHERE fs.academic_level_id = %s
-                                    AND fs.id != %s
-                                    AND fs.status = 'active'
-                                    AND fs.end_date < CURDATE()
-                                    AND fs.category = 'both'
-                                    GROUP BY fs.id, fs.total_amount, fs.fee_name, fs.end_date
-                                    ORDER BY fs.end_date DESC
-                                    LIMIT 1
-                                """, (student_id, academic_level_id, fee_structure['id']))
-                    else:
-                        if student_category == 'self sponsored':
-                            cursor.execute("""
-                                SELECT fs.id, fs.total_amount, fs.fee_name, fs.end_date,
-                                       COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                FROM fee_structures fs
-                                LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                WHERE fs.academic_level_id = %s
-                                AND fs.id != %s
-                                AND fs.status = 'active'
-                                AND fs.end_date < CURDATE()
-                                AND (fs.category = 'self sponsored' OR fs.category = 'both')
-                                GROUP BY fs.id, fs.total_amount, fs.fee_name, fs.end_date
-                                ORDER BY fs.end_date DESC
-                                LIMIT 1
-                            """, (student_id, academic_level_id, fee_structure['id']))
-                        elif student_category == 'sponsored':
-                            cursor.execute("""
-                                SELECT fs.id, fs.total_amount, fs.fee_name, fs.end_date,
-                                       COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                FROM fee_structures fs
-                                LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                WHERE fs.academic_level_id = %s
-                                AND fs.id != %s
-                                AND fs.status = 'active'
-                                AND fs.end_date < CURDATE()
-                                AND (fs.category = 'sponsored' OR fs.category = 'both')
-                                GROUP BY fs.id, fs.total_amount, fs.fee_name, fs.end_date
-                                ORDER BY fs.end_date DESC
-                                LIMIT 1
-                            """, (student_id, academic_level_id, fee_structure['id']))
-                        elif student_category == 'both':
-                            cursor.execute("""
-                                SELECT fs.id, fs.total_amount, fs.fee_name, fs.end_date,
-                                       COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                FROM fee_structures fs
-                                LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                WHERE fs.academic_level_id = %s
-                                AND fs.id != %s
-                                AND fs.status = 'active'
-                                AND fs.end_date < CURDATE()
-                                GROUP BY fs.id, fs.total_amount, fs.fee_name, fs.end_date
-                                ORDER BY fs.end_date DESC
-                                LIMIT 1
-                            """, (student_id, academic_level_id, fee_structure['id']))
-                        else:
-                            cursor.execute("""
-                                SELECT fs.id, fs.total_amount, fs.fee_name, fs.end_date,
-                                       COALESCE(SUM(sp.amount_paid), 0) as total_paid
-                                FROM fee_structures fs
-                                LEFT JOIN student_payments sp ON fs.id = sp.fee_structure_id AND sp.student_id = %s
-                                WHERE fs.academic_level_id = %s
-                                AND fs.id != %s
-                                AND fs.status = 'active'
-                                AND fs.end_date < CURDATE()
-                                AND fs.category = 'both'
-                                GROUP BY fs.id, fs.total_amount, fs.fee_name, fs.end_date
-                                ORDER BY fs.end_date DESC
-                                LIMIT 1
-                            """, (student_id, academic_level_id, fee_structure['id']))
-                    
-                    previous_term_result = cursor.fetchone()
-                    if previous_term_result:
-                        if isinstance(previous_term_result, dict):
-                            prev_total = float(previous_term_result.get('total_amount', 0) or 0)
-                            prev_paid = float(previous_term_result.get('total_paid', 0) or 0)
-                            prev_end_date = previous_term_result.get('end_date')
-                            prev_fee_name = previous_term_result.get('fee_name', '')
-                        else:
-                            prev_total = float(previous_term_result[1] or 0) if len(previous_term_result) > 1 else 0
-                            prev_paid = float(previous_term_result[4] or 0) if len(previous_term_result) > 4 else 0
-                            prev_end_date = previous_term_result[3] if len(previous_term_result) > 3 else None
-                            prev_fee_name = previous_term_result[2] if len(previous_term_result) > 2 else ''
-                        
-                        prev_balance = prev_total - prev_paid
-                        balance_brought_forward = prev_balance
-                        previous_term_info = {
-                            'fee_name': prev_fee_name,
-                            'end_date': prev_end_date,
-                            'closing_balance': prev_balance
-                        }
-                    else:
-                        previous_term_info = None
-                else:
-                    balance_brought_forward = 0.0
-                    previous_term_info = None
-            
-            # Ensure both values are floats before subtraction
-            fee_total = float(fee_structure.get('total_amount', 0) or 0) if fee_structure else 0.0
-            balance = fee_total - (total_paid + carry_forward)
-            
-            # Get school settings
-            cursor.execute("SELECT school_name, school_location, school_phone, school_email, school_logo FROM school_settings ORDER BY id DESC LIMIT 1")
-            school_result = cursor.fetchone()
-            school_settings = {}
-            if school_result:
-                if isinstance(school_result, dict):
-                    school_settings = {
-                        'school_name': school_result.get('school_name', 'Modern School') or 'Modern School',
-                        'school_address': school_result.get('school_location', '') or '',
-                        'school_phone': school_result.get('school_phone', '') or '',
-                        'school_email': school_result.get('school_email', '') or '',
-                        'school_logo': school_result.get('school_logo', '') or ''
-                    }
-                else:
-                    school_settings = {
-                        'school_name': school_result[0] if len(school_result) > 0 and school_result[0] else 'Modern School',
-                        'school_address': school_result[1] if len(school_result) > 1 and school_result[1] else '',
-                        'school_phone': school_result[2] if len(school_result) > 2 and school_result[2] else '',
-                        'school_email': school_result[3] if len(school_result) > 3 and school_result[3] else '',
-                        'school_logo': school_result[4] if len(school_result) > 4 and school_result[4] else ''
-                    }
-            else:
-                # Default values if no settings found
-                school_settings = {
-                    'school_name': 'Modern School',
-                    'school_address': '',
-                    'school_phone': '',
-                    'school_email': '',
-                    'school_logo': ''
-                }
-            
-            # Get student profile image if available (check if profile_image column exists)
-            student['profile_image'] = None
-            try:
-                cursor.execute("SHOW COLUMNS FROM students LIKE 'profile_image'")
-                if cursor.fetchone():
-                    cursor.execute("SELECT profile_image FROM students WHERE student_id = %s", (student_id,))
-                    profile_result = cursor.fetchone()
-                    if profile_result:
-                        profile_image = profile_result[0] if isinstance(profile_result, (list, tuple)) else profile_result.get('profile_image')
-                        if profile_image:
-                            student['profile_image'] = url_for('static', filename=profile_image)
-            except:
-                pass  # Column doesn't exist, skip
-            
-            # Generate invoice date, number, and time
-            now = datetime.now()
-            invoice_date = now.strftime('%B %d, %Y')
-            invoice_time = now.strftime('%I:%M %p')
-            invoice_number = f"INV-{student_id}-{now.strftime('%Y%m%d%H%M%S')}"
-            
-            # Fetch all fee structures for this student (for fee breakdown table)
-            # IMPORTANT: Filter by student category to only show relevant fee structures
-            fee_breakdown = []
-            total_fees = 0.0
-            if academic_level_id:
-                student_category = student.get('student_category', '').lower().strip() if student.get('student_category') else ''
-                
-                if student_category == 'self sponsored':
-                    cursor.execute("""
-                        SELECT fs.id, fs.fee_name, fs.total_amount, fs.start_date, fs.end_date,
-                               fs.term_id, fs.academic_year_id,
-                               t.term_name, t.start_date as term_start, t.end_date as term_end,
-                               ay.year_name
-                        FROM fee_structures fs
-                        LEFT JOIN terms t ON fs.term_id = t.id
-                        LEFT JOIN academic_years ay ON fs.academic_year_id = ay.id
-                        WHERE fs.academic_level_id = %s 
-                          AND fs.status = 'active'
-                          AND (fs.category = 'self sponsored' OR fs.category = 'both')
-                        ORDER BY fs.start_date DESC, fs.created_at DESC
-                    """, (academic_level_id,))
-                elif student_category == 'sponsored':
-                    cursor.execute("""
-                        SELECT fs.id, fs.fee_name, fs.total_amount, fs.start_date, fs.end_date,
-                               fs.term_id, fs.academic_year_id,
-                               t.term_name, t.start_date as term_start, t.end_date as term_end,
-                               ay.year_name
-                        FROM fee_structures fs
-                        LEFT JOIN terms t ON fs.term_id = t.id
-                        LEFT JOIN academic_years ay ON fs.academic_year_id = ay.id
-                        WHERE fs.academic_level_id = %s 
-                          AND fs.status = 'active'
-                          AND (fs.category = 'sponsored' OR fs.category = 'both')
-                        ORDER BY fs.start_date DESC, fs.created_at DESC
-                    """, (academic_level_id,))
-                elif student_category == 'both':
-                    cursor.execute("""
-                        SELECT fs.id, fs.fee_name, fs.total_amount, fs.start_date, fs.end_date,
-                               fs.term_id, fs.academic_year_id,
-                               t.term_name, t.start_date as term_start, t.end_date as term_end,
-                               ay.year_name
-                        FROM fee_structures fs
-                        LEFT JOIN terms t ON fs.term_id = t.id
-                        LEFT JOIN academic_years ay ON fs.academic_year_id = ay.id
-                        WHERE fs.academic_level_id = %s 
-                          AND fs.status = 'active'
-                        ORDER BY fs.start_date DESC, fs.created_at DESC
-                    """, (academic_level_id,))
-                else:
-                    cursor.execute("""
-                        SELECT fs.id, fs.fee_name, fs.total_amount, fs.start_date, fs.end_date,
-                               fs.term_id, fs.academic_year_id,
-                               t.term_name, t.start_date as term_start, t.end_date as term_end,
-                               ay.year_name
-                        FROM fee_structures fs
-                        LEFT JOIN terms t ON fs.term_id = t.id
-                        LEFT JOIN academic_years ay ON fs.academic_year_id = ay.id
-                        WHERE fs.academic_level_id = %s 
-                          AND fs.status = 'active'
-                          AND fs.category = 'both'
-                        ORDER BY fs.start_date DESC, fs.created_at DESC
-                    """, (academic_level_id,))
+                        AND fs.status = 'active'
+                    WHERE al.level_status = 'active'
+                    GROUP BY al.id, al.level_category, al.level_name, al.level_description
+                    ORDER BY al.level_name ASC
+                """)
+                academic_levels_results = cursor.fetchall()
                 
-                fee_structures_results = cursor.fetchall()
+                if academic_levels_results:
+                    for row in academic_levels_results:
+                        fee_structure_count = row.get('fee_structure_count', 0) if isinstance(row, dict) else row[4]
+                        fee_structure_count = int(fee_structure_count) if fee_structure_count else 0
+                        academic_levels.append({
+                            'id': row.get('id') if isinstance(row, dict) else row[0],
+                            'level_category': row.get('level_category', '') if isinstance(row, dict) else row[1],
+                            'level_name': row.get('level_name', '') if isinstance(row, dict) else row[2],
+                            'level_description': row.get('level_description', '') if isinstance(row, dict) else row[3],
+                            'has_fee_structure': fee_structure_count > 0,
+                            'fee_structure_count': fee_structure_count
+                        })
                 
-                for fs_row in fee_structures_results:
-                    if isinstance(fs_row, dict):
-                        fee_id = fs_row.get('id')
-                        fee_name = fs_row.get('fee_name', '')
-                        total_amount = float(fs_row.get('total_amount', 0))
-                        term_name = fs_row.get('term_name', '')
-                        year_name = fs_row.get('year_name', '')
-                        start_date = fs_row.get('start_date')
-                        end_date = fs_row.get('end_date')
-                    else:
-                        fee_id = fs_row[0]
-                        fee_name = fs_row[1] if len(fs_row) > 1 else ''
-                        total_amount = float(fs_row[2] if len(fs_row) > 2 else 0)
-                        start_date = fs_row[3] if len(fs_row) > 3 else None
-                        end_date = fs_row[4] if len(fs_row) > 4 else None
-                        term_id = fs_row[5] if len(fs_row) > 5 else None
-                        academic_year_id = fs_row[6] if len(fs_row) > 6 else None
-                        term_name = fs_row[7] if len(fs_row) > 7 else ''
-                        term_start = fs_row[8] if len(fs_row) > 8 else None
-                        term_end = fs_row[9] if len(fs_row) > 9 else None
-                        year_name = fs_row[10] if len(fs_row) > 10 else ''
-                    
-                    # Format term display (e.g., "Term 3, 2025")
-                    term_display = ''
-                    if term_name and year_name:
-                        # Extract year from year_name
-                        year_part = year_name
-                        if hasattr(year_name, 'split'):
-                            year_parts = year_name.split()
-                            if len(year_parts) > 0:
-                                # Try to extract year from year_name like "2024/2025" or "2024-2025"
-                                for part in year_parts:
-                                    if '/' in part:
-                                        year_part = part.split('/')[1] if len(part.split('/')) > 1 else part.split('/')[0]
-                                        break
-                                    elif '-' in part:
-                                        year_part = part.split('-')[1] if len(part.split('-')) > 1 else part.split('-')[0]
-                                        break
-                        term_display = f"{term_name}, {year_part}"
-                    elif fee_name:
-                        term_display = fee_name
-                    else:
-                        term_display = 'Fees'
-                    
-                    fee_breakdown.append({
-                        'term': term_display,
-                        'description': 'fees',
-                        'amount': total_amount
-                    })
-                    total_fees += total_amount
-            
-            # Fetch all payments for this student (for payment details table)
-            cursor.execute("""
-                SELECT sp.id, sp.amount_paid, sp.payment_method, sp.reference_number,
-                       sp.transaction_id, sp.payment_date, sp.created_at,
-                       e.full_name as received_by_name
-                FROM student_payments sp
-                LEFT JOIN employees e ON sp.received_by = e.id
-                WHERE sp.student_id = %s
-                ORDER BY sp.payment_date DESC, sp.created_at DESC
-            """, (student_id,))
-            payments_results = cursor.fetchall()
-            
-            payment_details = []
-            total_paid_all = 0.0
-            for pay_row in payments_results:
-                if isinstance(pay_row, dict):
-                    pay_id = pay_row.get('id')
-                    amount = float(pay_row.get('amount_paid', 0))
-                    method = pay_row.get('payment_method', '')
-                    reference = pay_row.get('reference_number', '') or pay_row.get('transaction_id', '')
-                    pay_date = pay_row.get('payment_date')
-                else:
-                    pay_id = pay_row[0]
-                    amount = float(pay_row[1] if len(pay_row) > 1 else 0)
-                    method = pay_row[2] if len(pay_row) > 2 else ''
-                    reference = pay_row[3] if len(pay_row) > 3 else (pay_row[4] if len(pay_row) > 4 else '')
-                    pay_date = pay_row[5] if len(pay_row) > 5 else None
+                # Fetch ALL active academic years (ONLY filter by status='active', ignore is_current)
+                cursor.execute("""
+                    SELECT id, year_name, start_date, end_date, status, is_current, is_locked
+                    FROM academic_years
+                    WHERE status = 'active'
+                    ORDER BY start_date DESC
+                """)
+                academic_years_results = cursor.fetchall()
+                if academic_years_results:
+                    for year in academic_years_results:
+                        year_dict = {
+                            'id': year.get('id') if isinstance(year, dict) else year[0],
+                            'year_name': year.get('year_name', '') if isinstance(year, dict) else year[1],
+                            'start_date': year.get('start_date') if isinstance(year, dict) else year[2],
+                            'end_date': year.get('end_date') if isinstance(year, dict) else year[3],
+                            'status': year.get('status', '') if isinstance(year, dict) else year[4],
+                            'is_current': year.get('is_current', False) if isinstance(year, dict) else year[5],
+                            'is_locked': year.get('is_locked', False) if isinstance(year, dict) else (year[6] if len(year) > 6 else False)
+                        }
+                        academic_years.append(year_dict)
                 
-                if pay_date and hasattr(pay_date, 'strftime'):
-                    pay_date_formatted = pay_date.strftime('%d/%m/%Y')
-                else:
-                    pay_date_formatted = str(pay_date) if pay_date else ''
+                # Fetch ALL active terms that are not locked
+                cursor.execute("""
+                    SELECT t.id, t.term_name, t.academic_year_id, t.start_date, t.end_date, t.status, t.is_current, t.is_locked,
+                           ay.year_name as academic_year_name
+                    FROM terms t
+                    LEFT JOIN academic_years ay ON t.academic_year_id = ay.id
+                    WHERE t.status = 'active' AND (t.is_locked = FALSE OR t.is_locked IS NULL)
+                    ORDER BY t.academic_year_id DESC, t.start_date ASC
+                """)
+                terms_results = cursor.fetchall()
+                if terms_results:
+                    for term in terms_results:
+                        term_dict = {
+                            'id': term.get('id') if isinstance(term, dict) else term[0],
+                            'term_name': term.get('term_name', '') if isinstance(term, dict) else term[1],
+                            'academic_year_id': term.get('academic_year_id') if isinstance(term, dict) else term[2],
+                            'start_date': term.get('start_date') if isinstance(term, dict) else term[3],
+                            'end_date': term.get('end_date') if isinstance(term, dict) else term[4],
+                            'status': term.get('status', '') if isinstance(term, dict) else term[5],
+                            'is_current': term.get('is_current', False) if isinstance(term, dict) else term[6],
+                            'is_locked': term.get('is_locked', False) if isinstance(term, dict) else term[7],
+                            'academic_year_name': term.get('academic_year_name', '') if isinstance(term, dict) else term[8]
+                        }
+                        terms.append(term_dict)
+                if fees_log.isEnabledFor(logging.DEBUG):
+                    # One line for all years and terms, built only when debugging is on
+                    fees_log.debug("student_fees: %s active academic years %s, %s active terms %s",
+                                   len(academic_years), [(y['id'], y['year_name']) for y in academic_years],
+                                   len(terms), [(t['id'], t['term_name'], t['academic_year_id']) for t in terms])
                 
-                payment_details.append({
-                    'date': pay_date_formatted,
-                    'amount': amount,
-                    'method': method,
-                    'reference': reference or ''
-                })
-                total_paid_all += amount
-            
-            # Calculate balance properly:
-            # 1. Get current term fee structure
-            # 2. Calculate previous term unpaid balance (only from last term)
-            # 3. Calculate carry-forward (overpayments from all previous terms)
-            # 4. Balance = (Current Term Fee + Previous Term Unpaid Balance) - (Current Term Payments + Carry Forward)
-            
-            previous_term_balance = 0.0  # Unpaid balance from last term only
-            current_term_fee = 0.0
-            current_term_paid = 0.0
-            
-            if fee_structure:
-                current_term_fee = float(fee_structure.get('total_amount', 0) or 0)
-                current_term_paid = total_paid  # Payments for current fee structure only
+                # Fetch all fee structures grouped by grade and category (for display section)
+                cursor.execute("""
+                    SELECT fs.id, fs.academic_level_id, fs.fee_name, fs.category, fs.start_date, fs.end_date, 
+                           fs.payment_deadline, fs.total_amount, fs.status, fs.created_at,
+                           al.level_name, al.level_category
+                    FROM fee_structures fs
+                    LEFT JOIN academic_levels al ON fs.academic_level_id = al.id
+                    WHERE fs.status = 'active'
+                    ORDER BY al.level_name ASC, fs.category ASC, fs.created_at DESC
+                """)
+                fee_structures_results = cursor.fetchall()
                 
-                # Get previous term's unpaid balance (only the most recent previous term)
-                if previous_term_info:
-                    prev_balance = previous_term_info.get('closing_balance', 0.0)
-                    # Only add unpaid balance (positive), not overpayments (negative)
-                    if prev_balance > 0:
-                        previous_term_balance = prev_balance
-            
-            # Total amount due = Current Term Fee + Previous Term Unpaid Balance
-            total_amount_due = current_term_fee + previous_term_balance
-            
-            # Balance = Total Amount Due - (Current Term Payments + Carry Forward)
-            balance_due = total_amount_due - (current_term_paid + carry_forward)
-            
-    except Exception as e:
-        print(f"Error generating invoice: {e}")
-        import traceback
-        traceback.print_exc()
-        flash('Error generating invoice.', 'error')
-        return redirect(url_for('student_fees'))
-    finally:
-        connection.close()
-    
-    # Check if user wants PDF or HTML format (default to HTML for modern view)
-    format_type = request.args.get('format', 'html').lower()
-    
-    if format_type == 'html':
-        # Render HTML invoice template
-        return render_template('dashboards/invoice.html',
-                             student=student,
-                             fee_structure=fee_structure,
-                             payment_transactions=payment_transactions,
-                             fee_breakdown=fee_breakdown,
-                             payment_details=payment_details,
-                             total_fees=total_fees,
-                             total_paid=total_paid,
-                             total_paid_all=total_paid_all,
-                             carry_forward=carry_forward,
-                             balance_brought_forward=balance_brought_forward,
-                             previous_term_balance=previous_term_balance,
-                             current_term_fee=current_term_fee,
-                             current_term_paid=current_term_paid,
-                             total_amount_due=total_amount_due,
-                             balance=balance,
-                             balance_due=balance_due,
-                             previous_term_info=previous_term_info,
-                             school_settings=school_settings,
-                             invoice_date=invoice_date,
-                             invoice_time=invoice_time,
-                             invoice_number=invoice_number)
+                # Group fee structures by grade and category
+                for row in fee_structures_results:
+                    level_name = row.get('level_name', 'Unknown') if isinstance(row, dict) else (row[10] if len(row) > 10 else 'Unknown')
+                    category = row.get('category', 'both') if isinstance(row, dict) else (row[3] if len(row) > 3 else 'both')
+                    
+                    if level_name not in fee_structures_by_grade:
+                        fee_structures_by_grade[level_name] = {}
+                    
+                    if category not in fee_structures_by_grade[level_name]:
+                        fee_structures_by_grade[level_name][category] = []
+                    
+                    # Format dates
+                    start_date = row.get('start_date') if isinstance(row, dict) else row[4]
+                    end_date = row.get('end_date') if isinstance(row, dict) else row[5]
+                    payment_deadline = row.get('payment_deadline') if isinstance(row, dict) else row[6]
+                    
+                    if start_date and hasattr(start_date, 'strftime'):
+                        start_date = start_date.strftime('%Y-%m-%d')
+                    elif start_date:
+                        start_date = str(start_date).split(' ')[0]
+                    
+                    if end_date and hasattr(end_date, 'strftime'):
+                        end_date = end_date.strftime('%Y-%m-%d')
+                    elif end_date:
+                        end_date = str(end_date).split(' ')[0]
+                    
+                    if payment_deadline and hasattr(payment_deadline, 'strftime'):
+                        payment_deadline = payment_deadline.strftime('%Y-%m-%d')
+                    elif payment_deadline:
+                        payment_deadline = str(payment_deadline).split(' ')[0]
+                    
+                    # Fee items come from the ledger index loaded above
+                    structure_id = row.get('id') if isinstance(row, dict) else row[0]
+                    
+                    fee_structures_by_grade[level_name][category].append({
+                        'id': structure_id,
+                        'fee_name': row.get('fee_name', '') if isinstance(row, dict) else row[2],
+                        'category': category,
+                        'start_date': start_date,
+                        'end_date': end_date,
+                        'payment_deadline': payment_deadline,
+                        'total_amount': float(row.get('total_amount', 0) if isinstance(row, dict) else (row[7] if len(row) > 7 else 0)),
+                        'status': row.get('status', 'active') if isinstance(row, dict) else row[8],
+                        'items': ledger.items(structure_id)
+                    })
+        except Exception as e:
+            fees_log.exception("Error fetching data: %s", e)
+        finally:
+            connection.close()
     
-    # Generate PDF matching receipt format
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, 
-                           rightMargin=0.75*inch, leftMargin=0.75*inch,
-                           topMargin=0.75*inch, bottomMargin=0.75*inch)
+    from datetime import datetime
+    today = datetime.now().strftime('%Y-%m-%d')
     
-    elements = []
-    styles = getSampleStyleSheet()
+    # Get current employee info for payment recording
+    current_employee = None
+    connection = get_db_connection()
+    if connection:
+        try:
+            with connection.cursor() as cursor:
+                employee_id = session.get('employee_id') or session.get('user_id')
+                if employee_id:
+                    cursor.execute("""
+                        SELECT id, employee_id, full_name, role
+                        FROM employees
+                        WHERE id = %s OR employee_id = %s
+                        LIMIT 1
+                    """, (employee_id, employee_id))
+                    emp_result = cursor.fetchone()
+                    if emp_result:
+                        current_employee = {
+                            'id': emp_result.get('id'),
+                            'employee_id': emp_result.get('employee_id'),
+                            'full_name': emp_result.get('full_name'),
+                            'role': emp_result.get('role')
+                        }
+        except Exception as e:
+            fees_log.error("Error fetching employee info: %s", e)
+        finally:
+            connection.close()
     
-    # Header with logo and contact info (matching receipt format)
-    logo_cell = []
-    if school_settings.get('school_logo'):
+    # Fetch all active fee structures for assignment dropdown
+    all_fee_structures = []
+    connection = get_db_connection()
+    if connection:
         try:
-            logo_path = os.path.join('static', school_settings['school_logo'])
-            if os.path.exists(logo_path):
-                logo_cell.append(Image(logo_path, width=1*inch, height=1*inch))
-            else:
-                logo_cell.append(Paragraph("<b>LOGO</b>", styles['Normal']))
-        except:
-            logo_cell.append(Paragraph("<b>LOGO</b>", styles['Normal']))
-    else:
-        logo_cell.append(Paragraph("<b>LOGO</b>", styles['Normal']))
-    
-    # Contact info in middle
-    contact_info = []
-    if school_settings.get('school_address'):
-        contact_info.append(school_settings['school_address'])
-    if school_settings.get('school_phone'):
-        contact_info.append(school_settings['school_phone'])
-    contact_cell = Paragraph("<br/>".join(contact_info) if contact_info else "", styles['Normal'])
-    
-    # Title "FEE INVOICE" on the right
-    title_style = ParagraphStyle(
-        'InvoiceTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        textColor=colors.HexColor('#000000'),
-        spaceAfter=0,
-        alignment=TA_RIGHT,
-        fontName='Helvetica-Bold'
-    )
-    title_cell = Paragraph("FEE INVOICE", title_style)
-    
-    header_table = Table([[logo_cell, contact_cell, title_cell]], colWidths=[2*inch, 2.5*inch, 3*inch])
-    header_table.setStyle(TableStyle([
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('ALIGN', (2, 0), (2, 0), 'RIGHT'),
-    ]))
-    elements.append(header_table)
-    elements.append(Spacer(1, 0.3*inch))
-    
-    # Student Information
-    normal_style = ParagraphStyle(
-        'Normal',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=colors.HexColor('#000000'),
-        spaceAfter=6
-    )
-    bold_style = ParagraphStyle(
-        'Bold',
-        parent=normal_style,
-        fontName='Helvetica-Bold'
-    )
-    
-    student_data = [
-        [Paragraph("<b>NAME:</b>", bold_style), Paragraph(student['full_name'], normal_style)],
-        [Paragraph("<b>GRADE:</b>", bold_style), Paragraph(student.get('current_grade', 'N/A'), normal_style)],
-        [Paragraph("<b>DATE:</b>", bold_style), Paragraph(invoice_date, normal_style)],
-    ]
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT fs.id, fs.fee_name, fs.category, fs.total_amount,
+                           al.level_name, al.level_category
+                    FROM fee_structures fs
+                    LEFT JOIN academic_levels al ON fs.academic_level_id = al.id
+                    WHERE fs.status = 'active'
+                    ORDER BY al.level_name ASC, fs.fee_name ASC
+                """)
+                structures = cursor.fetchall()
+                for row in structures:
+                    all_fee_structures.append({
+                        'id': row.get('id') if isinstance(row, dict) else row[0],
+                        'fee_name': row.get('fee_name', '') if isinstance(row, dict) else row[1],
+                        'category': row.get('category', 'both') if isinstance(row, dict) else row[2],
+                        'total_amount': float(row.get('total_amount', 0) if isinstance(row, dict) else (row[3] if len(row) > 3 else 0)),
+                        'level_name': row.get('level_name', '') if isinstance(row, dict) else (row[4] if len(row) > 4 else ''),
+                        'level_category': row.get('level_category', '') if isinstance(row, dict) else (row[5] if len(row) > 5 else '')
+                    })
+        except Exception as e:
+            fees_log.error("Error fetching fee structures: %s", e)
+        finally:
+            connection.close()
     
-    student_table = Table(student_data, colWidths=[1.5*inch, 5.5*inch])
-    student_table.setStyle(TableStyle([
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-        ('TOPPADDING', (0, 0), (-1, -1), 6),
-    ]))
-    elements.append(student_table)
-    elements.append(Spacer(1, 0.3*inch))
-    
-    # Fee Breakdown Table
-    fee_breakdown_data = [['Fee Breakdown', 'Description', 'Amount']]
-    for fee in fee_breakdown:
-        fee_breakdown_data.append([
-            fee['term'],
-            fee['description'],
-            f"{fee['amount']:,.2f}"
-        ])
-    
-    fee_table = Table(fee_breakdown_data, colWidths=[2.5*inch, 2.5*inch, 2*inch])
-    fee_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-    ]))
-    elements.append(fee_table)
-    elements.append(Spacer(1, 0.3*inch))
-    
-    # Payment Details Table
-    payment_details_data = [['Date', 'Amount', 'Payment Method', 'Reference No.']]
-    for payment_detail in payment_details:
-        payment_details_data.append([
-            payment_detail['date'],
-            f"{payment_detail['amount']:,.2f}",
-            payment_detail['method'],
-            payment_detail['reference']
-        ])
-    
-    payment_table = Table(payment_details_data, colWidths=[1.5*inch, 1.5*inch, 2*inch, 2*inch])
-    payment_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-    ]))
-    elements.append(payment_table)
-    elements.append(Spacer(1, 0.2*inch))
-    
-    # Total Paid (right aligned)
-    total_paid_style = ParagraphStyle(
-        'TotalPaid',
-        parent=normal_style,
-        alignment=TA_RIGHT,
-        fontSize=10
-    )
-    elements.append(Paragraph(f"<b>Total Paid: {total_paid_all:,.2f}</b>", total_paid_style))
-    elements.append(Spacer(1, 0.3*inch))
-    
-    # Payment Summary (right aligned)
-    summary_style = ParagraphStyle(
-        'Summary',
-        parent=normal_style,
-        alignment=TA_RIGHT,
-        fontSize=10,
-        spaceAfter=4
-    )
-    elements.append(Paragraph("<u><b>Payment Summary</b></u>", summary_style))
-    elements.append(Paragraph(f"<b>Total fees:</b> {total_fees:,.2f}", summary_style))
-    elements.append(Paragraph(f"<b>Total Paid:</b> {total_paid_all:,.2f}", summary_style))
-    elements.append(Spacer(1, 0.1*inch))
-    elements.append(Paragraph(f"<b>Balance Due:</b> {balance_due:,.2f}", summary_style))
-    elements.append(Spacer(1, 0.3*inch))
-    
-    # Footer
-    footer_style = ParagraphStyle(
-        'Footer',
-        parent=styles['Normal'],
-        fontSize=8,
-        textColor=colors.grey,
-        alignment=TA_CENTER
-    )
-    elements.append(Spacer(1, 0.5*inch))
-    elements.append(Paragraph("Thank you for your payment!", footer_style))
-    elements.append(Paragraph("This is a computer-generated invoice. No signature required.", footer_style))
-    
-    doc.build(elements)
-    buffer.seek(0)
+    # Check additional permissions
+    can_generate_invoices = check_permission_or_role('generate_invoices', ['accountant', 'principal'])
     
-    # Create response
-    response = make_response(buffer.getvalue())
-    response.headers['Content-Type'] = 'application/pdf'
-    # Check if download parameter is present
-    if request.args.get('download', '').lower() == 'true':
-        response.headers['Content-Disposition'] = f'attachment; filename=Invoice_{student_id}_{datetime.now().strftime("%Y%m%d")}.pdf'
-    else:
-        response.headers['Content-Disposition'] = f'inline; filename=Invoice_{student_id}_{datetime.now().strftime("%Y%m%d")}.pdf'
+    return render_template('dashboards/student_fees.html', 
+                         students=students, 
+                         next_cursor=next_cursor,
+                         page_size=STUDENT_FEES_PAGE_SIZE,
+                         academic_levels=academic_levels,
+                         academic_years=academic_years,
+                         terms=terms,
+                         today=today,
+                         current_employee=current_employee,
+                         fee_structures_by_grade=fee_structures_by_grade,
+                         can_view_students=can_view_students,
+                         can_view_fee_structure_details=can_view_fee_structure_details,
+                         can_record_payments=can_record_payments,
+                         can_add_fee_structure=can_add_fee_structure,
+                         can_edit_fee_structure=can_edit_fee_structure,
+                         can_delete_fee_structure=can_delete_fee_structure,
+                         can_generate_invoices=can_generate_invoices)
+
+@app.route('/dashboard/employee/student-fees/data')
+@login_required
+def student_fees_data():
+    """JSON page of the student fees table (keyset pagination, sorting, filters and search)"""
+    user_role = session.get('role', '').lower()
+    is_technician = user_role == 'technician'
+    has_view_fees_permission = check_permission_or_role('view_student_fees', ['accountant', 'principal'])
+    has_manage_fees_permission = check_permission_or_role('manage_fees', ['accountant', 'principal'])
+    if not (is_technician or has_view_fees_permission or has_manage_fees_permission):
+        return jsonify({'success': False, 'message': 'You do not have permission to view student fees.'}), 403
+    
+    sort = request.args.get('sort', 'name')
+    if sort not in STUDENT_FEES_SORTS:
+        return jsonify({'success': False, 'message': f'Invalid sort: {sort}'}), 400
+    payment_status = request.args.get('payment_status', '').strip().lower()
+    if payment_status and payment_status not in STUDENT_FEES_STATUSES:
+        return jsonify({'success': False, 'message': f'Invalid payment status: {payment_status}'}), 400
+    cursor_token = request.args.get('cursor', '')
+    after = decode_page_cursor(cursor_token)
+    if cursor_token and after is None:
+        return jsonify({'success': False, 'message': 'Invalid cursor.'}), 400
+    try:
+        limit = int(request.args.get('limit', STUDENT_FEES_PAGE_SIZE))
+    except ValueError:
+        limit = STUDENT_FEES_PAGE_SIZE
+    limit = max(1, min(limit, STUDENT_FEES_MAX_PAGE_SIZE))
     
-    return response
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'success': False, 'message': 'Database connection error.'}), 500
+    
+    try:
+        with connection.cursor() as cursor:
+            students, next_cursor = fetch_student_fees_page(
+                cursor,
+                search=request.args.get('q', '').strip(),
+                grade=request.args.get('grade', '').strip(),
+                category=request.args.get('category', '').strip(),
+                payment_status=payment_status,
+                sort=sort,
+                descending=request.args.get('dir', 'asc').lower() == 'desc',
+                after=after,
+                limit=limit
+            )
+    except Exception as e:
+        fees_log.exception("Error fetching student fees page: %s", e)
+        return jsonify({'success': False, 'message': 'Error fetching student fees.'}), 500
+    finally:
+        connection.close()
+    
+    # Rows are rendered with the same macros as the first, server-rendered page
+    can_record_payments = check_permission_or_role('process_payments', ['accountant', 'principal'])
+    can_generate_invoices = check_permission_or_role('generate_invoices', ['accountant', 'principal'])
+    table_row = get_template_attribute('dashboards/student_fees_rows.html', 'student_fee_row')
+    card = get_template_attribute('dashboards/student_fees_rows.html', 'student_fee_card')
+    
+    return jsonify({
+        'success': True,
+        'students': students,
+        'next_cursor': next_cursor,
+        'rows_html': ''.join(str(table_row(student, can_record_payments, can_generate_invoices)) for student in students),
+        'cards_html': ''.join(str(card(student, can_record_payments, can_generate_invoices)) for student in students)
+    })
 
-@app.route('/dashboard/employee/student-fees/download-receipt/<student_id>/<int:payment_id>')
+@app.route('/dashboard/employee/student-fees/generate-invoice/<student_id>')
 @login_required
-def download_payment_receipt(student_id, payment_id):
-    """Generate a receipt for a specific payment transaction"""
+def generate_invoice(student_id):
+    """Generate a professional PDF invoice for a student"""
     user_role = session.get('role', '').lower()
     viewing_as_role = session.get('viewing_as_employee_role', '').lower()
+    employee_id = session.get('employee_id') or session.get('user_id')
     
+    # Check if user is accountant or viewing as accountant
+    is_accountant = user_role == 'accountant' or viewing_as_role == 'accountant'
     is_technician = user_role == 'technician'
     
     # Check permission-based access
@@ -5442,7 +3895,7 @@ def download_payment_receipt(student_id, payment_id):
     
     # Permission check handles role fallback if no permissions are assigned
     if not (is_technician or has_generate_invoices_permission):
-        flash('You do not have permission to download receipts.', 'error')
+        flash('You do not have permission to generate invoices.', 'error')
         return redirect(url_for('student_fees'))
     
     connection = get_db_connection()
@@ -5452,58 +3905,10 @@ def download_payment_receipt(student_id, payment_id):
     
     try:
         with connection.cursor() as cursor:
-            # Get payment transaction details
-            cursor.execute("""
-                SELECT sp.id, sp.amount_paid, sp.payment_method, sp.reference_number, 
-                       sp.cheque_number, sp.transaction_id, sp.proof_of_payment, 
-                       sp.payment_date, sp.notes, sp.created_at,
-                       sp.student_id, sp.fee_structure_id,
-                       fs.fee_name, fs.total_amount, fs.start_date, fs.end_date,
-                       fs.payment_deadline, fs.category,
-                       e.full_name as received_by_name, e.employee_id as received_by_id
-                FROM student_payments sp
-                LEFT JOIN fee_structures fs ON sp.fee_structure_id = fs.id
-                LEFT JOIN employees e ON sp.received_by = e.id
-                WHERE sp.id = %s AND sp.student_id = %s
-                LIMIT 1
-            """, (payment_id, student_id))
-            payment_result = cursor.fetchone()
-            
-            if not payment_result:
-                flash('Payment transaction not found.', 'error')
-                return redirect(url_for('student_fees'))
-            
-            # Convert to dictionary
-            if isinstance(payment_result, dict):
-                payment = payment_result
-            else:
-                payment = {
-                    'id': payment_result[0],
-                    'amount_paid': payment_result[1],
-                    'payment_method': payment_result[2],
-                    'reference_number': payment_result[3],
-                    'cheque_number': payment_result[4],
-                    'transaction_id': payment_result[5],
-                    'proof_of_payment': payment_result[6],
-                    'payment_date': payment_result[7],
-                    'notes': payment_result[8],
-                    'created_at': payment_result[9],
-                    'student_id': payment_result[10],
-                    'fee_structure_id': payment_result[11],
-                    'fee_name': payment_result[12],
-                    'total_amount': payment_result[13],
-                    'start_date': payment_result[14] if len(payment_result) > 14 else None,
-                    'end_date': payment_result[15] if len(payment_result) > 15 else None,
-                    'payment_deadline': payment_result[16] if len(payment_result) > 16 else None,
-                    'category': payment_result[17] if len(payment_result) > 17 else None,
-                    'received_by_name': payment_result[18] if len(payment_result) > 18 else None,
-                    'received_by_id': payment_result[19] if len(payment_result) > 19 else None
-                }
-            
             # Get student information
             cursor.execute("""
                 SELECT s.id, s.student_id, s.full_name, s.current_grade, s.status, s.student_category,
-                       p.full_name as parent_name, p.phone as parent_phone, p.email as parent_email
+                       p.full_name as parent_name, p.phone as parent_phone, p.email as parent_email, p.relationship
                 FROM students s
                 LEFT JOIN parents p ON s.student_id = p.student_id
                 WHERE s.student_id = %s AND s.status = 'in session'
@@ -5524,9 +3929,158 @@ def download_payment_receipt(student_id, payment_id):
                 'student_category': student_result[5] if len(student_result) > 5 else None,
                 'parent_name': student_result[6] if len(student_result) > 6 else None,
                 'parent_phone': student_result[7] if len(student_result) > 7 else None,
-                'parent_email': student_result[8] if len(student_result) > 8 else None
+                'parent_email': student_result[8] if len(student_result) > 8 else None,
+                'relationship': student_result[9] if len(student_result) > 9 else None
             }
             
+            # Resolve level, fee structure and fee items with the ledger engine
+            ledger = FeeLedger.load(cursor, student_ids=[student_id])
+            student_category = student.get('student_category')
+            fee_structure = None
+            structure = None
+            academic_level = ledger.level_for_grade(student.get('current_grade'))
+            academic_level_id = academic_level['id'] if academic_level else None
+            
+            if academic_level_id:
+                structure = ledger.current_structure(academic_level_id, student_category)
+                if structure:
+                    fee_structure = {
+                        'id': structure.get('id'),
+                        'fee_name': structure.get('fee_name', ''),
+                        'start_date': structure.get('start_date'),
+                        'end_date': structure.get('end_date'),
+                        'payment_deadline': structure.get('payment_deadline'),
+                        'total_amount': float(structure.get('total_amount', 0) or 0),
+                        'level_name': academic_level.get('level_name'),
+                        'level_category': academic_level.get('level_category'),
+                        'items': ledger.items(structure['id'], order_by='id')
+                    }
+            
+            # Get payment transactions for current fee structure
+            total_paid = 0.0
+            carry_forward = 0.0
+            payment_transactions = []
+            balance_brought_forward = 0.0  # Initialize for ledger calculation
+            
+            if fee_structure:
+                cursor.execute("""
+                    SELECT sp.amount_paid, sp.payment_date, sp.payment_method, sp.reference_number, 
+                           sp.cheque_number, sp.transaction_id, sp.notes, 
+                           e.full_name as received_by_name
+                    FROM student_payments sp
+                    LEFT JOIN employees e ON sp.received_by = e.id
+                    WHERE sp.student_id = %s AND sp.fee_structure_id = %s
+                    ORDER BY sp.payment_date DESC, sp.id DESC
+                """, (student_id, fee_structure['id']))
+                payments = cursor.fetchall()
+                
+                # Calculate total paid for current fee structure and collect transaction details
+                for payment in payments:
+                    if isinstance(payment, dict):
+                        amount = payment.get('amount_paid', 0) or 0
+                        payment_date = payment.get('payment_date')
+                        payment_method = payment.get('payment_method', '')
+                        reference_number = payment.get('reference_number', '')
+                        cheque_number = payment.get('cheque_number', '')
+                        transaction_id = payment.get('transaction_id', '')
+                        notes = payment.get('notes', '')
+                        received_by = payment.get('received_by_name', '') or 'N/A'
+                    else:
+                        amount = payment[0] if len(payment) > 0 and payment[0] else 0
+                        payment_date = payment[1] if len(payment) > 1 else None
+                        payment_method = payment[2] if len(payment) > 2 else ''
+                        reference_number = payment[3] if len(payment) > 3 else ''
+                        cheque_number = payment[4] if len(payment) > 4 else ''
+                        transaction_id = payment[5] if len(payment) > 5 else ''
+                        notes = payment[6] if len(payment) > 6 else ''
+                        received_by = payment[7] if len(payment) > 7 else 'N/A'
+                    
+                    # Convert to float, handling Decimal types
+                    try:
+                        amount_float = float(amount) if amount else 0.0
+                        total_paid += amount_float
+                        
+                        # Format payment date
+                        if payment_date:
+                            if hasattr(payment_date, 'strftime'):
+                                formatted_date = payment_date.strftime('%B %d, %Y')
+                            else:
+                                try:
+                                    date_obj = datetime.strptime(str(payment_date).split(' ')[0], '%Y-%m-%d')
+                                    formatted_date = date_obj.strftime('%B %d, %Y')
+                                except:
+                                    formatted_date = str(payment_date).split(' ')[0]
+                        else:
+                            formatted_date = 'N/A'
+                        
+                        payment_transactions.append({
+                            'amount': amount_float,
+                            'date': formatted_date,
+                            'method': payment_method,
+                            'reference': reference_number,
+                            'cheque': cheque_number,
+                            'transaction_id': transaction_id,
+                            'notes': notes,
+                            'received_by': received_by
+                        })
+                    except (TypeError, ValueError):
+                        total_paid += 0.0
+                
+                # Carry-forward (overpayments) from previous fee structures, and the most
+                # recent previous structure's closing balance for the ledger
+                previous_structures = ledger.previous_structures(student_id, academic_level_id, student_category, structure)
+                for previous in previous_structures:
+                    if previous['balance'] < 0:
+                        carry_forward += abs(previous['balance'])
+                
+                balance_brought_forward = 0.0
+                previous_term_info = None  # Store previous term's closing info
+                if previous_structures:
+                    last_structure = previous_structures[0]
+                    balance_brought_forward = last_structure['balance']
+                    previous_term_info = {
+                        'fee_name': last_structure['structure'].get('fee_name', ''),
+                        'end_date': last_structure['structure'].get('end_date'),
+                        'closing_balance': last_structure['balance']
+                    }
+            else:
+                previous_term_info = None
+            
+            # Ensure both values are floats before subtraction
+            fee_total = float(fee_structure.get('total_amount', 0) or 0) if fee_structure else 0.0
+            balance = fee_total - (total_paid + carry_forward)
+            
+            # Get school settings
+            cursor.execute("SELECT school_name, school_location, school_phone, school_email, school_logo FROM school_settings ORDER BY id DESC LIMIT 1")
+            school_result = cursor.fetchone()
+            school_settings = {}
+            if school_result:
+                if isinstance(school_result, dict):
+                    school_settings = {
+                        'school_name': school_result.get('school_name', 'Modern School') or 'Modern School',
+                        'school_address': school_result.get('school_location', '') or '',
+                        'school_phone': school_result.get('school_phone', '') or '',
+                        'school_email': school_result.get('school_email', '') or '',
+                        'school_logo': school_result.get('school_logo', '') or ''
+                    }
+                else:
+                    school_settings = {
+                        'school_name': school_result[0] if len(school_result) > 0 and school_result[0] else 'Modern School',
+                        'school_address': school_result[1] if len(school_result) > 1 and school_result[1] else '',
+                        'school_phone': school_result[2] if len(school_result) > 2 and school_result[2] else '',
+                        'school_email': school_result[3] if len(school_result) > 3 and school_result[3] else '',
+                        'school_logo': school_result[4] if len(school_result) > 4 and school_result[4] else ''
+                    }
+            else:
+                # Default values if no settings found
+                school_settings = {
+                    'school_name': 'Modern School',
+                    'school_address': '',
+                    'school_phone': '',
+                    'school_email': '',
+                    'school_logo': ''
+                }
+            
             # Get student profile image if available (check if profile_image column exists)
             student['profile_image'] = None
             try:
@@ -5538,73 +4092,23 @@ def download_payment_receipt(student_id, payment_id):
                         profile_image = profile_result[0] if isinstance(profile_result, (list, tuple)) else profile_result.get('profile_image')
                         if profile_image:
                             student['profile_image'] = url_for('static', filename=profile_image)
-            except Exception as e:
-                print(f"Note: profile_image column may not exist: {e}")
-                pass
-            
-            # Get school settings
-            cursor.execute("""
-                SELECT school_name, school_location, school_phone, school_email, school_logo
-                FROM school_settings
-                LIMIT 1
-            """)
-            school_result = cursor.fetchone()
-            
-            if isinstance(school_result, dict):
-                school_settings = school_result.copy()
-                school_settings['school_address'] = school_result.get('school_location', '')
-            else:
-                school_settings = {
-                    'school_name': school_result[0] if school_result and len(school_result) > 0 else 'Modern School',
-                    'school_location': school_result[1] if school_result and len(school_result) > 1 else None,
-                    'school_address': school_result[1] if school_result and len(school_result) > 1 else None,  # Alias for school_location
-                    'school_phone': school_result[2] if school_result and len(school_result) > 2 else None,
-                    'school_email': school_result[3] if school_result and len(school_result) > 3 else None,
-                    'school_logo': school_result[4] if school_result and len(school_result) > 4 else None
-                }
-            
-            # Format dates
-            payment_date = payment.get('payment_date')
-            if payment_date and hasattr(payment_date, 'strftime'):
-                payment_date_str = payment_date.strftime('%B %d, %Y')
-                payment_date_short = payment_date.strftime('%d/%m/%Y')
-            else:
-                payment_date_str = str(payment_date) if payment_date else 'N/A'
-                payment_date_short = payment_date_str
-            
-            created_at = payment.get('created_at')
-            if created_at and hasattr(created_at, 'strftime'):
-                receipt_time = created_at.strftime('%I:%M %p')
-                receipt_date = created_at.strftime('%B %d, %Y')
-            else:
-                receipt_time = datetime.now().strftime('%I:%M %p')
-                receipt_date = datetime.now().strftime('%B %d, %Y')
-            
-            receipt_number = f"RCP-{student_id}-{payment_id}-{datetime.now().strftime('%Y%m%d')}"
+            except:
+                pass  # Column doesn't exist, skip
             
-            # Get student's academic level to fetch fee structures
-            # First get the student's current_grade, then match it with academic_levels
-            student_grade = student.get('current_grade', '')
-            student_category = student.get('student_category', '').lower().strip() if student.get('student_category') else ''
-            academic_level_id = None
-            if student_grade:
-                cursor.execute("""
-                    SELECT al.id
-                    FROM academic_levels al
-                    WHERE al.level_name = %s AND al.level_status = 'active'
-                    LIMIT 1
-                """, (student_grade,))
-                academic_level_result = cursor.fetchone()
-                if academic_level_result:
-                    academic_level_id = academic_level_result.get('id') if isinstance(academic_level_result, dict) else academic_level_result[0]
+            # Generate invoice date, number, and time
+            now = datetime.now()
+            invoice_date = now.strftime('%B %d, %Y')
+            invoice_time = now.strftime('%I:%M %p')
+            invoice_number = f"INV-{student_id}-{now.strftime('%Y%m%d%H%M%S')}"
             
-            # Fetch fee structures for this student (based on academic level AND student category)
+            # Fetch all fee structures for this student (for fee breakdown table)
+            # IMPORTANT: Filter by student category to only show relevant fee structures
             fee_breakdown = []
             total_fees = 0.0
             if academic_level_id:
-                # Build category filter based on student category
+                student_category = student.get('student_category', '').lower().strip() if student.get('student_category') else ''
+                
                 if student_category == 'self sponsored':
-                    # Only match 'self sponsored' or 'both' category structures
                     cursor.execute("""
                         SELECT fs.id, fs.fee_name, fs.total_amount, fs.start_date, fs.end_date,
                                fs.term_id, fs.academic_year_id,
@@ -5613,12 +4117,12 @@ def download_payment_receipt(student_id, payment_id):
                         FROM fee_structures fs
                         LEFT JOIN terms t ON fs.term_id = t.id
                         LEFT JOIN academic_years ay ON fs.academic_year_id = ay.id
-                        WHERE fs.academic_level_id = %s AND fs.status = 'active'
-                        AND (fs.category = 'self sponsored' OR fs.category = 'both')
+                        WHERE fs.academic_level_id = %s 
+                          AND fs.status = 'active'
+                          AND (fs.category = 'self sponsored' OR fs.category = 'both')
                         ORDER BY fs.start_date DESC, fs.created_at DESC
                     """, (academic_level_id,))
                 elif student_category == 'sponsored':
-                    # Only match 'sponsored' or 'both' category structures
                     cursor.execute("""
                         SELECT fs.id, fs.fee_name, fs.total_amount, fs.start_date, fs.end_date,
                                fs.term_id, fs.academic_year_id,
@@ -5627,12 +4131,12 @@ def download_payment_receipt(student_id, payment_id):
                         FROM fee_structures fs
                         LEFT JOIN terms t ON fs.term_id = t.id
                         LEFT JOIN academic_years ay ON fs.academic_year_id = ay.id
-                        WHERE fs.academic_level_id = %s AND fs.status = 'active'
-                        AND (fs.category = 'sponsored' OR fs.category = 'both')
+                        WHERE fs.academic_level_id = %s 
+                          AND fs.status = 'active'
+                          AND (fs.category = 'sponsored' OR fs.category = 'both')
                         ORDER BY fs.start_date DESC, fs.created_at DESC
                     """, (academic_level_id,))
                 elif student_category == 'both':
-                    # Students with category 'both' can see all fee structures
                     cursor.execute("""
                         SELECT fs.id, fs.fee_name, fs.total_amount, fs.start_date, fs.end_date,
                                fs.term_id, fs.academic_year_id,
@@ -5641,11 +4145,11 @@ def download_payment_receipt(student_id, payment_id):
                         FROM fee_structures fs
                         LEFT JOIN terms t ON fs.term_id = t.id
                         LEFT JOIN academic_years ay ON fs.academic_year_id = ay.id
-                        WHERE fs.academic_level_id = %s AND fs.status = 'active'
+                        WHERE fs.academic_level_id = %s 
+                          AND fs.status = 'active'
                         ORDER BY fs.start_date DESC, fs.created_at DESC
                     """, (academic_level_id,))
                 else:
-                    # If student has no category or unknown category, match 'both' category only
                     cursor.execute("""
                         SELECT fs.id, fs.fee_name, fs.total_amount, fs.start_date, fs.end_date,
                                fs.term_id, fs.academic_year_id,
@@ -5654,18 +4158,19 @@ def download_payment_receipt(student_id, payment_id):
                         FROM fee_structures fs
                         LEFT JOIN terms t ON fs.term_id = t.id
                         LEFT JOIN academic_years ay ON fs.academic_year_id = ay.id
-                        WHERE fs.academic_level_id = %s AND fs.status = 'active'
-                        AND fs.category = 'both'
+                        WHERE fs.academic_level_id = %s 
+                          AND fs.status = 'active'
+                          AND fs.category = 'both'
                         ORDER BY fs.start_date DESC, fs.created_at DESC
                     """, (academic_level_id,))
+                
                 fee_structures_results = cursor.fetchall()
                 
                 for fs_row in fee_structures_results:
                     if isinstance(fs_row, dict):
                         fee_id = fs_row.get('id')
                         fee_name = fs_row.get('fee_name', '')
-                        total_amount_val = fs_row.get('total_amount')
-                        total_amount = float(total_amount_val if total_amount_val is not None else 0)
+                        total_amount = float(fs_row.get('total_amount', 0))
                         term_name = fs_row.get('term_name', '')
                         year_name = fs_row.get('year_name', '')
                         start_date = fs_row.get('start_date')
@@ -5673,8 +4178,7 @@ def download_payment_receipt(student_id, payment_id):
                     else:
                         fee_id = fs_row[0]
                         fee_name = fs_row[1] if len(fs_row) > 1 else ''
-                        total_amount_val = fs_row[2] if len(fs_row) > 2 else None
-                        total_amount = float(total_amount_val if total_amount_val is not None else 0)
+                        total_amount = float(fs_row[2] if len(fs_row) > 2 else 0)
                         start_date = fs_row[3] if len(fs_row) > 3 else None
                         end_date = fs_row[4] if len(fs_row) > 4 else None
                         term_id = fs_row[5] if len(fs_row) > 5 else None
@@ -5687,7 +4191,7 @@ def download_payment_receipt(student_id, payment_id):
                     # Format term display (e.g., "Term 3, 2025")
                     term_display = ''
                     if term_name and year_name:
-                        # Extract year from year_name or use start_year
+                        # Extract year from year_name
                         year_part = year_name
                         if hasattr(year_name, 'split'):
                             year_parts = year_name.split()
@@ -5713,7 +4217,7 @@ def download_payment_receipt(student_id, payment_id):
                     })
                     total_fees += total_amount
             
-            # Fetch all payments for this student
+            # Fetch all payments for this student (for payment details table)
             cursor.execute("""
                 SELECT sp.id, sp.amount_paid, sp.payment_method, sp.reference_number,
                        sp.transaction_id, sp.payment_date, sp.created_at,
@@ -5726,19 +4230,17 @@ def download_payment_receipt(student_id, payment_id):
             payments_results = cursor.fetchall()
             
             payment_details = []
-            total_paid = 0.0
+            total_paid_all = 0.0
             for pay_row in payments_results:
                 if isinstance(pay_row, dict):
                     pay_id = pay_row.get('id')
-                    amount_paid_val = pay_row.get('amount_paid')
-                    amount = float(amount_paid_val if amount_paid_val is not None else 0)
+                    amount = float(pay_row.get('amount_paid', 0))
                     method = pay_row.get('payment_method', '')
                     reference = pay_row.get('reference_number', '') or pay_row.get('transaction_id', '')
                     pay_date = pay_row.get('payment_date')
                 else:
                     pay_id = pay_row[0]
-                    amount_paid_val = pay_row[1] if len(pay_row) > 1 else None
-                    amount = float(amount_paid_val if amount_paid_val is not None else 0)
+                    amount = float(pay_row[1] if len(pay_row) > 1 else 0)
                     method = pay_row[2] if len(pay_row) > 2 else ''
                     reference = pay_row[3] if len(pay_row) > 3 else (pay_row[4] if len(pay_row) > 4 else '')
                     pay_date = pay_row[5] if len(pay_row) > 5 else None
@@ -5754,238 +4256,582 @@ def download_payment_receipt(student_id, payment_id):
                     'method': method,
                     'reference': reference or ''
                 })
-                total_paid += amount
-            
-            # Calculate balance
-            balance_due = total_fees - total_paid
-            
-            # Prepare single payment transaction for template (current payment)
-            amount_paid = payment.get('amount_paid')
-            payment_transaction = {
-                'date': payment_date_str,
-                'date_short': payment_date_short,
-                'method': payment.get('payment_method', ''),
-                'amount': float(amount_paid if amount_paid is not None else 0),
-                'reference': payment.get('reference_number', '') or payment.get('transaction_id', ''),
-                'transaction_id': payment.get('transaction_id', ''),
-                'cheque': payment.get('cheque_number', ''),
-                'notes': payment.get('notes', ''),
-                'received_by': payment.get('received_by_name', 'N/A')
-            }
+                total_paid_all += amount
             
-            # Prepare fee structure for template (for backward compatibility)
-            total_amount = payment.get('total_amount')
-            fee_structure = {
-                'fee_name': payment.get('fee_name', ''),
-                'total_amount': float(total_amount if total_amount is not None else 0),
-                'start_date': payment.get('start_date'),
-                'end_date': payment.get('end_date'),
-                'payment_deadline': payment.get('payment_deadline'),
-                'category': payment.get('category'),
-                'items': []
-            }
+            # Calculate balance properly:
+            # 1. Get current term fee structure
+            # 2. Calculate previous term unpaid balance (only from last term)
+            # 3. Calculate carry-forward (overpayments from all previous terms)
+            # 4. Balance = (Current Term Fee + Previous Term Unpaid Balance) - (Current Term Payments + Carry Forward)
             
-            # Check if user wants PDF format BEFORE rendering template
-            format_type = request.args.get('format', 'html').lower()
+            previous_term_balance = 0.0  # Unpaid balance from last term only
+            current_term_fee = 0.0
+            current_term_paid = 0.0
             
-            if format_type == 'pdf':
-                # Generate PDF using reportlab
-                buffer = BytesIO()
-                doc = SimpleDocTemplate(buffer, pagesize=A4, 
-                                       rightMargin=0.75*inch, leftMargin=0.75*inch,
-                                       topMargin=0.75*inch, bottomMargin=0.75*inch)
-                
-                elements = []
-                styles = getSampleStyleSheet()
-                
-                # Header with logo and contact info
-                logo_cell = []
-                if school_settings.get('school_logo'):
-                    try:
-                        logo_path = os.path.join('static', school_settings['school_logo'])
-                        if os.path.exists(logo_path):
-                            logo_cell.append(Image(logo_path, width=1*inch, height=1*inch))
-                        else:
-                            logo_cell.append(Paragraph("<b>LOGO</b>", styles['Normal']))
-                    except:
-                        logo_cell.append(Paragraph("<b>LOGO</b>", styles['Normal']))
-                else:
-                    logo_cell.append(Paragraph("<b>LOGO</b>", styles['Normal']))
-                
-                # Contact info in middle
-                contact_info = []
-                if school_settings.get('school_address'):
-                    contact_info.append(school_settings['school_address'])
-                if school_settings.get('school_phone'):
-                    contact_info.append(school_settings['school_phone'])
-                contact_cell = Paragraph("<br/>".join(contact_info) if contact_info else "", styles['Normal'])
-                
-                # Title "PAYMENT RECEIPT" on the right
-                title_style = ParagraphStyle(
-                    'ReceiptTitle',
-                    parent=styles['Heading1'],
-                    fontSize=18,
-                    textColor=colors.HexColor('#000000'),
-                    spaceAfter=0,
-                    alignment=TA_RIGHT,
-                    fontName='Helvetica-Bold'
-                )
-                title_cell = Paragraph("PAYMENT RECEIPT", title_style)
-                
-                header_table = Table([[logo_cell, contact_cell, title_cell]], colWidths=[2*inch, 2.5*inch, 3*inch])
-                header_table.setStyle(TableStyle([
-                    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                    ('ALIGN', (2, 0), (2, 0), 'RIGHT'),
-                ]))
-                elements.append(header_table)
-                elements.append(Spacer(1, 0.3*inch))
-                
-                # Student Information
-                normal_style = ParagraphStyle(
-                    'Normal',
-                    parent=styles['Normal'],
-                    fontSize=10,
-                    textColor=colors.HexColor('#000000'),
-                    spaceAfter=6
-                )
-                bold_style = ParagraphStyle(
-                    'Bold',
-                    parent=normal_style,
-                    fontName='Helvetica-Bold'
-                )
-                
-                student_data = [
-                    [Paragraph("<b>NAME:</b>", bold_style), Paragraph(student['full_name'], normal_style)],
-                    [Paragraph("<b>GRADE:</b>", bold_style), Paragraph(student.get('current_grade', 'N/A'), normal_style)],
-                    [Paragraph("<b>DATE:</b>", bold_style), Paragraph(receipt_date, normal_style)],
-                ]
-                student_table = Table(student_data, colWidths=[1.5*inch, 5.5*inch])
-                student_table.setStyle(TableStyle([
-                    ('FONTSIZE', (0, 0), (-1, -1), 10),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-                    ('TOPPADDING', (0, 0), (-1, -1), 6),
-                ]))
-                elements.append(student_table)
-                elements.append(Spacer(1, 0.3*inch))
-                
-                # Fee Breakdown Table
-                fee_breakdown_data = [['Fee Breakdown', 'Description', 'Amount']]
-                for fee in fee_breakdown:
-                    fee_breakdown_data.append([
-                        fee['term'],
-                        fee['description'],
-                        f"{fee['amount']:,.2f}"
-                    ])
-                
-                fee_table = Table(fee_breakdown_data, colWidths=[2.5*inch, 2.5*inch, 2*inch])
-                fee_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                    ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
-                    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                    ('FONTSIZE', (0, 0), (-1, -1), 10),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-                    ('TOPPADDING', (0, 0), (-1, -1), 8),
-                    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-                ]))
-                elements.append(fee_table)
-                elements.append(Spacer(1, 0.3*inch))
-                
-                # Payment Details Table
-                payment_details_data = [['Date', 'Amount', 'Payment Method', 'Reference No.']]
-                for payment_detail in payment_details:
-                    payment_details_data.append([
-                        payment_detail['date'],
-                        f"{payment_detail['amount']:,.2f}",
-                        payment_detail['method'],
-                        payment_detail['reference']
-                    ])
-                
-                payment_table = Table(payment_details_data, colWidths=[1.5*inch, 1.5*inch, 2*inch, 2*inch])
-                payment_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-                    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                    ('FONTSIZE', (0, 0), (-1, -1), 10),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-                    ('TOPPADDING', (0, 0), (-1, -1), 8),
-                    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-                ]))
-                elements.append(payment_table)
-                elements.append(Spacer(1, 0.2*inch))
-                
-                # Total Paid (right aligned)
-                total_paid_style = ParagraphStyle(
-                    'TotalPaid',
-                    parent=normal_style,
-                    alignment=TA_RIGHT,
-                    fontSize=10
-                )
-                elements.append(Paragraph(f"<b>Total Paid: {total_paid:,.2f}</b>", total_paid_style))
-                elements.append(Spacer(1, 0.3*inch))
-                
-                # Payment Summary (right aligned)
-                summary_style = ParagraphStyle(
-                    'Summary',
-                    parent=normal_style,
-                    alignment=TA_RIGHT,
-                    fontSize=10,
-                    spaceAfter=4
-                )
-                elements.append(Paragraph("<u><b>Payment Summary</b></u>", summary_style))
-                elements.append(Paragraph(f"<b>Total fees:</b> {total_fees:,.2f}", summary_style))
-                elements.append(Paragraph(f"<b>Total Paid:</b> {total_paid:,.2f}", summary_style))
-                elements.append(Spacer(1, 0.1*inch))
-                elements.append(Paragraph(f"<b>Balance Due:</b> {balance_due:,.2f}", summary_style))
-                elements.append(Spacer(1, 0.3*inch))
-                
-                # Footer
-                footer_style = ParagraphStyle(
-                    'Footer',
-                    parent=styles['Normal'],
-                    fontSize=8,
-                    textColor=colors.grey,
-                    alignment=TA_CENTER
-                )
-                elements.append(Spacer(1, 0.5*inch))
-                elements.append(Paragraph("Thank you for your payment!", footer_style))
-                elements.append(Paragraph("This is a computer-generated receipt. No signature required.", footer_style))
+            if fee_structure:
+                current_term_fee = float(fee_structure.get('total_amount', 0) or 0)
+                current_term_paid = total_paid  # Payments for current fee structure only
                 
-                doc.build(elements)
-                buffer.seek(0)
+                # Get previous term's unpaid balance (only the most recent previous term)
+                if previous_term_info:
+                    prev_balance = previous_term_info.get('closing_balance', 0.0)
+                    # Only add unpaid balance (positive), not overpayments (negative)
+                    if prev_balance > 0:
+                        previous_term_balance = prev_balance
+            
+            # Total amount due = Current Term Fee + Previous Term Unpaid Balance
+            total_amount_due = current_term_fee + previous_term_balance
+            
+            # Balance = Total Amount Due - (Current Term Payments + Carry Forward)
+            balance_due = total_amount_due - (current_term_paid + carry_forward)
+            
+    except Exception as e:
+        fees_log.exception("Error generating invoice: %s", e)
+        flash('Error generating invoice.', 'error')
+        return redirect(url_for('student_fees'))
+    finally:
+        connection.close()
+    
+    # Check if user wants PDF or HTML format (default to HTML for modern view)
+    format_type = request.args.get('format', 'html').lower()
+    
+    if format_type == 'html':
+        # Render HTML invoice template
+        return render_template('dashboards/invoice.html',
+                             student=student,
+                             fee_structure=fee_structure,
+                             payment_transactions=payment_transactions,
+                             fee_breakdown=fee_breakdown,
+                             payment_details=payment_details,
+                             total_fees=total_fees,
+                             total_paid=total_paid,
+                             total_paid_all=total_paid_all,
+                             carry_forward=carry_forward,
+                             balance_brought_forward=balance_brought_forward,
+                             previous_term_balance=previous_term_balance,
+                             current_term_fee=current_term_fee,
+                             current_term_paid=current_term_paid,
+                             total_amount_due=total_amount_due,
+                             balance=balance,
+                             balance_due=balance_due,
+                             previous_term_info=previous_term_info,
+                             school_settings=school_settings,
+                             invoice_date=invoice_date,
+                             invoice_time=invoice_time,
+                             invoice_number=invoice_number)
+    
+    # Generate PDF matching receipt format (reportlab is loaded on the first PDF request)
+    from pdf_documents import fee_statement_pdf
+    pdf_bytes = fee_statement_pdf('FEE INVOICE', school_settings, student, invoice_date, fee_breakdown,
+                                  payment_details, total_fees, total_paid_all, balance_due, document='invoice')
+    
+    # Create response
+    response = make_response(pdf_bytes)
+    response.headers['Content-Type'] = 'application/pdf'
+    # Check if download parameter is present
+    if request.args.get('download', '').lower() == 'true':
+        response.headers['Content-Disposition'] = f'attachment; filename=Invoice_{student_id}_{datetime.now().strftime("%Y%m%d")}.pdf'
+    else:
+        response.headers['Content-Disposition'] = f'inline; filename=Invoice_{student_id}_{datetime.now().strftime("%Y%m%d")}.pdf'
+    
+    return response
+
+# Class-wide invoice batches: ledgers resolved in bulk, PDFs rendered over a process pool into a zip
+invoice_batches = InvoiceBatches(os.environ.get('INVOICE_BATCH_FOLDER', os.path.join(app.root_path, 'cache', 'invoice_batches')),
+                                 workers=int(os.environ.get('INVOICE_BATCH_WORKERS', 0)) or None,
+                                 start_method=os.environ.get('INVOICE_BATCH_START_METHOD') or 'spawn')
+
+@app.route('/dashboard/employee/student-fees/invoice-batch', methods=['POST'])
+@login_required
+def start_invoice_batch():
+    """Start rendering the invoices of every student in a grade; progress is polled from invoice-batch/<id>"""
+    is_technician = session.get('role', '').lower() == 'technician'
+    if not (is_technician or check_permission_or_role('generate_invoices', ['accountant'])):
+        return jsonify({'success': False, 'message': 'You do not have permission to generate invoices.'}), 403
+    
+    data = request.get_json(silent=True) or request.form
+    grade = (data.get('grade') or '').strip()
+    term_id = data.get('term_id') or None
+    if not grade:
+        return jsonify({'success': False, 'message': 'Choose a grade.'}), 400
+    
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'success': False, 'message': 'Database connection error.'}), 500
+    try:
+        with connection.cursor() as cursor:
+            invoices = load_class_invoices(cursor, grade, term_id=int(term_id) if term_id else None)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        fees_log.error("Error loading class invoices: %s", e)
+        return jsonify({'success': False, 'message': 'Error loading the class ledgers.'}), 500
+    finally:
+        connection.close()
+    
+    if not invoices:
+        return jsonify({'success': False, 'message': f'No students in session in {grade}.'}), 404
+    
+    school_settings = get_school_settings()
+    school_settings['school_address'] = school_settings.get('school_location', '')
+    batch_id = invoice_batches.start(invoices, school_settings, grade=grade, term_id=term_id,
+                                     started_by=session.get('full_name', 'Unknown'))
+    fees_log.info("Invoice batch %s started for %s: %s invoices", batch_id, grade, len(invoices))
+    return jsonify({'success': True, 'batch_id': batch_id, 'status': invoice_batches.status(batch_id),
+                    'status_url': url_for('invoice_batch_status', batch_id=batch_id),
+                    'download_url': url_for('download_invoice_batch', batch_id=batch_id)}), 202
+
+@app.route('/dashboard/employee/student-fees/invoice-batch/<batch_id>')
+@login_required
+def invoice_batch_status(batch_id):
+    """Progress of an invoice batch"""
+    is_technician = session.get('role', '').lower() == 'technician'
+    if not (is_technician or check_permission_or_role('generate_invoices', ['accountant'])):
+        return jsonify({'success': False, 'message': 'Access denied.'}), 403
+    status = invoice_batches.status(batch_id)
+    return jsonify({'success': status['state'] != 'unknown', 'status': status}), (404 if status['state'] == 'unknown' else 200)
+
+@app.route('/dashboard/employee/student-fees/invoice-batch/<batch_id>/download')
+@login_required
+def download_invoice_batch(batch_id):
+    """The zip of a completed invoice batch"""
+    is_technician = session.get('role', '').lower() == 'technician'
+    if not (is_technician or check_permission_or_role('generate_invoices', ['accountant'])):
+        flash('You do not have permission to generate invoices.', 'error')
+        return redirect(url_for('student_fees'))
+    zip_path = invoice_batches.zip_path(batch_id)
+    if not zip_path:
+        flash('That invoice batch is not ready or has expired.', 'error')
+        return redirect(url_for('student_fees'))
+    status = invoice_batches.status(batch_id)
+    grade = re.sub(r'[^A-Za-z0-9_-]+', '_', status.get('grade') or 'Class')
+    return send_file(zip_path, mimetype='application/zip', as_attachment=True,
+                     download_name=f'Invoices_{grade}_{datetime.now().strftime("%Y%m%d")}.zip')
+
+# Rendered PDF receipts on disk, keyed by the versions of everything a receipt shows
+receipt_cache = DocumentCache(os.environ.get('RECEIPT_CACHE_DIR', os.path.join(app.root_path, 'cache', 'receipts')),
+                              max_files=int(os.environ.get('RECEIPT_CACHE_MAX_FILES', 5000)))
+
+def _payment_receipt_version(cursor, student_id, payment_id):
+    """Versions of the data a receipt shows, from one query: the payment row, the student's
+    payments (the receipt lists them all), the fee structures with their items, terms,
+    academic years and levels, the student and parent, the receiving employee and the
+    school profile. None when the payment or the student is not found."""
+    cursor.execute("""
+        SELECT sp.updated_at AS payment_version, sp.amount_paid,
+               s.updated_at AS student_version,
+               (SELECT CONCAT_WS('|', COUNT(*), SUM(p.amount_paid), MAX(p.updated_at))
+                FROM student_payments p WHERE p.student_id = sp.student_id) AS payments_version,
+               (SELECT CONCAT_WS('|', COUNT(*), MAX(f.updated_at)) FROM fee_structures f) AS structures_version,
+               (SELECT CONCAT_WS('|', COUNT(*), MAX(fi.updated_at)) FROM fee_items fi) AS items_version,
+               (SELECT CONCAT_WS('|', COUNT(*), MAX(t.updated_at)) FROM terms t) AS terms_version,
+               (SELECT CONCAT_WS('|', COUNT(*), MAX(ay.updated_at)) FROM academic_years ay) AS years_version,
+               (SELECT CONCAT_WS('|', COUNT(*), MAX(al.updated_at)) FROM academic_levels al) AS levels_version,
+               (SELECT CONCAT_WS('|', COUNT(*), MAX(pa.updated_at))
+                FROM parents pa WHERE pa.student_id = sp.student_id) AS parents_version,
+               (SELECT e.updated_at FROM employees e WHERE e.id = sp.received_by) AS receiver_version,
+               (SELECT CONCAT_WS('|', MAX(ss.updated_at), MAX(ss.school_logo)) FROM school_settings ss) AS settings_version
+        FROM student_payments sp
+        JOIN students s ON s.student_id = sp.student_id AND s.status = 'in session'
+        WHERE sp.id = %s AND sp.student_id = %s
+    """, (payment_id, student_id))
+    return cursor.fetchone()
+
+def _load_payment_receipt(cursor, student_id, payment_id):
+    """Payment, student, school profile and fee ledger shown on a payment receipt.
+
+    Returns (receipt, None) with the template variables of payment_receipt.html, or
+    (None, message) when the payment or the student is not found.
+    """
+    # Get payment transaction details
+    cursor.execute("""
+        SELECT sp.id, sp.amount_paid, sp.payment_method, sp.reference_number, 
+               sp.cheque_number, sp.transaction_id, sp.proof_of_payment, 
+               sp.payment_date, sp.notes, sp.created_at,
+               sp.student_id, sp.fee_structure_id,
+               fs.fee_name, fs.total_amount, fs.start_date, fs.end_date,
+               fs.payment_deadline, fs.category,
+               e.full_name as received_by_name, e.employee_id as received_by_id
+        FROM student_payments sp
+        LEFT JOIN fee_structures fs ON sp.fee_structure_id = fs.id
+        LEFT JOIN employees e ON sp.received_by = e.id
+        WHERE sp.id = %s AND sp.student_id = %s
+        LIMIT 1
+    """, (payment_id, student_id))
+    payment_result = cursor.fetchone()
+        
+    if not payment_result:
+        return None, 'Payment transaction not found.'
+        
+    # Convert to dictionary
+    if isinstance(payment_result, dict):
+        payment = payment_result
+    else:
+        payment = {
+            'id': payment_result[0],
+            'amount_paid': payment_result[1],
+            'payment_method': payment_result[2],
+            'reference_number': payment_result[3],
+            'cheque_number': payment_result[4],
+            'transaction_id': payment_result[5],
+            'proof_of_payment': payment_result[6],
+            'payment_date': payment_result[7],
+            'notes': payment_result[8],
+            'created_at': payment_result[9],
+            'student_id': payment_result[10],
+            'fee_structure_id': payment_result[11],
+            'fee_name': payment_result[12],
+            'total_amount': payment_result[13],
+            'start_date': payment_result[14] if len(payment_result) > 14 else None,
+            'end_date': payment_result[15] if len(payment_result) > 15 else None,
+            'payment_deadline': payment_result[16] if len(payment_result) > 16 else None,
+            'category': payment_result[17] if len(payment_result) > 17 else None,
+            'received_by_name': payment_result[18] if len(payment_result) > 18 else None,
+            'received_by_id': payment_result[19] if len(payment_result) > 19 else None
+        }
+        
+    # Get student information
+    cursor.execute("""
+        SELECT s.id, s.student_id, s.full_name, s.current_grade, s.status, s.student_category,
+               p.full_name as parent_name, p.phone as parent_phone, p.email as parent_email
+        FROM students s
+        LEFT JOIN parents p ON s.student_id = p.student_id
+        WHERE s.student_id = %s AND s.status = 'in session'
+        LIMIT 1
+    """, (student_id,))
+    student_result = cursor.fetchone()
+        
+    if not student_result:
+        return None, 'Student not found.'
+        
+    student = dict(student_result) if isinstance(student_result, dict) else {
+        'id': student_result[0],
+        'student_id': student_result[1],
+        'full_name': student_result[2],
+        'current_grade': student_result[3],
+        'status': student_result[4],
+        'student_category': student_result[5] if len(student_result) > 5 else None,
+        'parent_name': student_result[6] if len(student_result) > 6 else None,
+        'parent_phone': student_result[7] if len(student_result) > 7 else None,
+        'parent_email': student_result[8] if len(student_result) > 8 else None
+    }
+        
+    # Get student profile image if available (check if profile_image column exists)
+    student['profile_image'] = None
+    try:
+        cursor.execute("SHOW COLUMNS FROM students LIKE 'profile_image'")
+        if cursor.fetchone():
+            cursor.execute("SELECT profile_image FROM students WHERE student_id = %s", (student_id,))
+            profile_result = cursor.fetchone()
+            if profile_result:
+                profile_image = profile_result[0] if isinstance(profile_result, (list, tuple)) else profile_result.get('profile_image')
+                if profile_image:
+                    student['profile_image'] = url_for('static', filename=profile_image)
+    except Exception as e:
+        fees_log.warning("profile_image column may not exist: %s", e)
+        pass
+        
+    # Get school settings
+    cursor.execute("""
+        SELECT school_name, school_location, school_phone, school_email, school_logo
+        FROM school_settings
+        LIMIT 1
+    """)
+    school_result = cursor.fetchone()
+        
+    if isinstance(school_result, dict):
+        school_settings = school_result.copy()
+        school_settings['school_address'] = school_result.get('school_location', '')
+    else:
+        school_settings = {
+            'school_name': school_result[0] if school_result and len(school_result) > 0 else 'Modern School',
+            'school_location': school_result[1] if school_result and len(school_result) > 1 else None,
+            'school_address': school_result[1] if school_result and len(school_result) > 1 else None,  # Alias for school_location
+            'school_phone': school_result[2] if school_result and len(school_result) > 2 else None,
+            'school_email': school_result[3] if school_result and len(school_result) > 3 else None,
+            'school_logo': school_result[4] if school_result and len(school_result) > 4 else None
+        }
+        
+    # Format dates
+    payment_date = payment.get('payment_date')
+    if payment_date and hasattr(payment_date, 'strftime'):
+        payment_date_str = payment_date.strftime('%B %d, %Y')
+        payment_date_short = payment_date.strftime('%d/%m/%Y')
+    else:
+        payment_date_str = str(payment_date) if payment_date else 'N/A'
+        payment_date_short = payment_date_str
+        
+    # Dated from the payment, not the render: a cached receipt must read the same on any day
+    issued_at = payment.get('created_at')
+    if not hasattr(issued_at, 'strftime'):
+        issued_at = payment_date if hasattr(payment_date, 'strftime') else None
+    if issued_at:
+        receipt_time = issued_at.strftime('%I:%M %p') if hasattr(issued_at, 'hour') else ''
+        receipt_date = issued_at.strftime('%B %d, %Y')
+        receipt_number = f"RCP-{student_id}-{payment_id}-{issued_at.strftime('%Y%m%d')}"
+    else:
+        receipt_time = ''
+        receipt_date = 'N/A'
+        receipt_number = f"RCP-{student_id}-{payment_id}"
+        
+    # Get student's academic level to fetch fee structures
+    # First get the student's current_grade, then match it with academic_levels
+    student_grade = student.get('current_grade', '')
+    student_category = student.get('student_category', '').lower().strip() if student.get('student_category') else ''
+    academic_level_id = None
+    if student_grade:
+        cursor.execute("""
+            SELECT al.id
+            FROM academic_levels al
+            WHERE al.level_name = %s AND al.level_status = 'active'
+            LIMIT 1
+        """, (student_grade,))
+        academic_level_result = cursor.fetchone()
+        if academic_level_result:
+            academic_level_id = academic_level_result.get('id') if isinstance(academic_level_result, dict) else academic_level_result[0]
+        
+    # Fetch fee structures for this student (based on academic level AND student category)
+    fee_breakdown = []
+    total_fees = 0.0
+    if academic_level_id:
+        # Build category filter based on student category
+        if student_category == 'self sponsored':
+            # Only match 'self sponsored' or 'both' category structures
+            cursor.execute("""
+                SELECT fs.id, fs.fee_name, fs.total_amount, fs.start_date, fs.end_date,
+                       fs.term_id, fs.academic_year_id,
+                       t.term_name, t.start_date as term_start, t.end_date as term_end,
+                       ay.year_name
+                FROM fee_structures fs
+                LEFT JOIN terms t ON fs.term_id = t.id
+                LEFT JOIN academic_years ay ON fs.academic_year_id = ay.id
+                WHERE fs.academic_level_id = %s AND fs.status = 'active'
+                AND (fs.category = 'self sponsored' OR fs.category = 'both')
+                ORDER BY fs.start_date DESC, fs.created_at DESC
+            """, (academic_level_id,))
+        elif student_category == 'sponsored':
+            # Only match 'sponsored' or 'both' category structures
+            cursor.execute("""
+                SELECT fs.id, fs.fee_name, fs.total_amount, fs.start_date, fs.end_date,
+                       fs.term_id, fs.academic_year_id,
+                       t.term_name, t.start_date as term_start, t.end_date as term_end,
+                       ay.year_name
+                FROM fee_structures fs
+                LEFT JOIN terms t ON fs.term_id = t.id
+                LEFT JOIN academic_years ay ON fs.academic_year_id = ay.id
+                WHERE fs.academic_level_id = %s AND fs.status = 'active'
+                AND (fs.category = 'sponsored' OR fs.category = 'both')
+                ORDER BY fs.start_date DESC, fs.created_at DESC
+            """, (academic_level_id,))
+        elif student_category == 'both':
+            # Students with category 'both' can see all fee structures
+            cursor.execute("""
+                SELECT fs.id, fs.fee_name, fs.total_amount, fs.start_date, fs.end_date,
+                       fs.term_id, fs.academic_year_id,
+                       t.term_name, t.start_date as term_start, t.end_date as term_end,
+                       ay.year_name
+                FROM fee_structures fs
+                LEFT JOIN terms t ON fs.term_id = t.id
+                LEFT JOIN academic_years ay ON fs.academic_year_id = ay.id
+                WHERE fs.academic_level_id = %s AND fs.status = 'active'
+                ORDER BY fs.start_date DESC, fs.created_at DESC
+            """, (academic_level_id,))
+        else:
+            # If student has no category or unknown category, match 'both' category only
+            cursor.execute("""
+                SELECT fs.id, fs.fee_name, fs.total_amount, fs.start_date, fs.end_date,
+                       fs.term_id, fs.academic_year_id,
+                       t.term_name, t.start_date as term_start, t.end_date as term_end,
+                       ay.year_name
+                FROM fee_structures fs
+                LEFT JOIN terms t ON fs.term_id = t.id
+                LEFT JOIN academic_years ay ON fs.academic_year_id = ay.id
+                WHERE fs.academic_level_id = %s AND fs.status = 'active'
+                AND fs.category = 'both'
+                ORDER BY fs.start_date DESC, fs.created_at DESC
+            """, (academic_level_id,))
+        fee_structures_results = cursor.fetchall()
+            
+        for fs_row in fee_structures_results:
+            if isinstance(fs_row, dict):
+                fee_id = fs_row.get('id')
+                fee_name = fs_row.get('fee_name', '')
+                total_amount_val = fs_row.get('total_amount')
+                total_amount = float(total_amount_val if total_amount_val is not None else 0)
+                term_name = fs_row.get('term_name', '')
+                year_name = fs_row.get('year_name', '')
+                start_date = fs_row.get('start_date')
+                end_date = fs_row.get('end_date')
+            else:
+                fee_id = fs_row[0]
+                fee_name = fs_row[1] if len(fs_row) > 1 else ''
+                total_amount_val = fs_row[2] if len(fs_row) > 2 else None
+                total_amount = float(total_amount_val if total_amount_val is not None else 0)
+                start_date = fs_row[3] if len(fs_row) > 3 else None
+                end_date = fs_row[4] if len(fs_row) > 4 else None
+                term_id = fs_row[5] if len(fs_row) > 5 else None
+                academic_year_id = fs_row[6] if len(fs_row) > 6 else None
+                term_name = fs_row[7] if len(fs_row) > 7 else ''
+                term_start = fs_row[8] if len(fs_row) > 8 else None
+                term_end = fs_row[9] if len(fs_row) > 9 else None
+                year_name = fs_row[10] if len(fs_row) > 10 else ''
+                
+            # Format term display (e.g., "Term 3, 2025")
+            term_display = ''
+            if term_name and year_name:
+                # Extract year from year_name or use start_year
+                year_part = year_name
+                if hasattr(year_name, 'split'):
+                    year_parts = year_name.split()
+                    if len(year_parts) > 0:
+                        # Try to extract year from year_name like "2024/2025" or "2024-2025"
+                        for part in year_parts:
+                            if '/' in part:
+                                year_part = part.split('/')[1] if len(part.split('/')) > 1 else part.split('/')[0]
+                                break
+                            elif '-' in part:
+                                year_part = part.split('-')[1] if len(part.split('-')) > 1 else part.split('-')[0]
+                                break
+                term_display = f"{term_name}, {year_part}"
+            elif fee_name:
+                term_display = fee_name
+            else:
+                term_display = 'Fees'
                 
-                response = make_response(buffer.getvalue())
-                response.headers['Content-Type'] = 'application/pdf'
-                if request.args.get('download', '').lower() == 'true':
-                    response.headers['Content-Disposition'] = f'attachment; filename=Receipt_{student_id}_{payment_id}_{datetime.now().strftime("%Y%m%d")}.pdf'
-                else:
-                    response.headers['Content-Disposition'] = f'inline; filename=Receipt_{student_id}_{payment_id}_{datetime.now().strftime("%Y%m%d")}.pdf'
-                
-                return response
-            
-            # Render HTML receipt template (if not PDF)
-            return render_template('dashboards/payment_receipt.html',
-                                 student=student,
-                                 payment=payment,
-                                 payment_transaction=payment_transaction,
-                                 fee_structure=fee_structure,
-                                 fee_breakdown=fee_breakdown,
-                                 payment_details=payment_details,
-                                 total_fees=total_fees,
-                                 total_paid=total_paid,
-                                 balance_due=balance_due,
-                                 school_settings=school_settings,
-                                 receipt_date=receipt_date,
-                                 receipt_time=receipt_time,
-                                 receipt_number=receipt_number)
+            fee_breakdown.append({
+                'term': term_display,
+                'description': 'fees',
+                'amount': total_amount
+            })
+            total_fees += total_amount
+        
+    # Fetch all payments for this student
+    cursor.execute("""
+        SELECT sp.id, sp.amount_paid, sp.payment_method, sp.reference_number,
+               sp.transaction_id, sp.payment_date, sp.created_at,
+               e.full_name as received_by_name
+        FROM student_payments sp
+        LEFT JOIN employees e ON sp.received_by = e.id
+        WHERE sp.student_id = %s
+        ORDER BY sp.payment_date DESC, sp.created_at DESC
+    """, (student_id,))
+    payments_results = cursor.fetchall()
+        
+    payment_details = []
+    total_paid = 0.0
+    for pay_row in payments_results:
+        if isinstance(pay_row, dict):
+            pay_id = pay_row.get('id')
+            amount_paid_val = pay_row.get('amount_paid')
+            amount = float(amount_paid_val if amount_paid_val is not None else 0)
+            method = pay_row.get('payment_method', '')
+            reference = pay_row.get('reference_number', '') or pay_row.get('transaction_id', '')
+            pay_date = pay_row.get('payment_date')
+        else:
+            pay_id = pay_row[0]
+            amount_paid_val = pay_row[1] if len(pay_row) > 1 else None
+            amount = float(amount_paid_val if amount_paid_val is not None else 0)
+            method = pay_row[2] if len(pay_row) > 2 else ''
+            reference = pay_row[3] if len(pay_row) > 3 else (pay_row[4] if len(pay_row) > 4 else '')
+            pay_date = pay_row[5] if len(pay_row) > 5 else None
+            
+        if pay_date and hasattr(pay_date, 'strftime'):
+            pay_date_formatted = pay_date.strftime('%d/%m/%Y')
+        else:
+            pay_date_formatted = str(pay_date) if pay_date else ''
+            
+        payment_details.append({
+            'date': pay_date_formatted,
+            'amount': amount,
+            'method': method,
+            'reference': reference or ''
+        })
+        total_paid += amount
+        
+    # Calculate balance
+    balance_due = total_fees - total_paid
+        
+    # Prepare single payment transaction for template (current payment)
+    amount_paid = payment.get('amount_paid')
+    payment_transaction = {
+        'date': payment_date_str,
+        'date_short': payment_date_short,
+        'method': payment.get('payment_method', ''),
+        'amount': float(amount_paid if amount_paid is not None else 0),
+        'reference': payment.get('reference_number', '') or payment.get('transaction_id', ''),
+        'transaction_id': payment.get('transaction_id', ''),
+        'cheque': payment.get('cheque_number', ''),
+        'notes': payment.get('notes', ''),
+        'received_by': payment.get('received_by_name', 'N/A')
+    }
+        
+    # Prepare fee structure for template (for backward compatibility)
+    total_amount = payment.get('total_amount')
+    fee_structure = {
+        'fee_name': payment.get('fee_name', ''),
+        'total_amount': float(total_amount if total_amount is not None else 0),
+        'start_date': payment.get('start_date'),
+        'end_date': payment.get('end_date'),
+        'payment_deadline': payment.get('payment_deadline'),
+        'category': payment.get('category'),
+        'items': []
+    }
+    
+    return {
+        'student': student,
+        'payment': payment,
+        'payment_transaction': payment_transaction,
+        'fee_structure': fee_structure,
+        'fee_breakdown': fee_breakdown,
+        'payment_details': payment_details,
+        'total_fees': total_fees,
+        'total_paid': total_paid,
+        'balance_due': balance_due,
+        'school_settings': school_settings,
+        'receipt_date': receipt_date,
+        'receipt_time': receipt_time,
+        'receipt_number': receipt_number
+    }, None
+
+@app.route('/dashboard/employee/student-fees/download-receipt/<student_id>/<int:payment_id>')
+@login_required
+def download_payment_receipt(student_id, payment_id):
+    """Generate a receipt for a specific payment transaction"""
+    user_role = session.get('role', '').lower()
+    viewing_as_role = session.get('viewing_as_employee_role', '').lower()
+    
+    is_technician = user_role == 'technician'
+    
+    # Check permission-based access
+    has_generate_invoices_permission = check_permission_or_role('generate_invoices', ['accountant'])
+    
+    # Permission check handles role fallback if no permissions are assigned
+    if not (is_technician or has_generate_invoices_permission):
+        flash('You do not have permission to download receipts.', 'error')
+        return redirect(url_for('student_fees'))
+    
+    # PDF receipts are rendered (and cached) by download_payment_receipt_pdf
+    if request.args.get('format', 'html').lower() == 'pdf':
+        return redirect(url_for('download_payment_receipt_pdf', student_id=student_id, payment_id=payment_id,
+                                download=request.args.get('download', '')))
+    
+    connection = get_db_connection()
+    if not connection:
+        flash('Database connection error.', 'error')
+        return redirect(url_for('student_fees'))
+    
+    try:
+        with connection.cursor() as cursor:
+            receipt, error = _load_payment_receipt(cursor, student_id, payment_id)
+            if error:
+                flash(error, 'error')
+                return redirect(url_for('student_fees'))
+            
+            # Render HTML receipt template
+            return render_template('dashboards/payment_receipt.html', **receipt)
                                  
     except Exception as e:
-        print(f"Error generating payment receipt: {e}")
-        import traceback
-        traceback.print_exc()
+        fees_log.exception("Error generating payment receipt: %s", e)
         flash('Error generating receipt.', 'error')
         return redirect(url_for('student_fees'))
     finally:
@@ -6008,9 +4854,55 @@ def download_payment_receipt_pdf(student_id, payment_id):
         flash('You do not have permission to download receipts.', 'error')
         return redirect(url_for('student_fees'))
     
-    # For PDF, we'll use the browser's print-to-PDF functionality
-    # Redirect to the HTML version with a print parameter
-    return redirect(url_for('download_payment_receipt', student_id=student_id, payment_id=payment_id) + '?print=true')
+    connection = get_db_connection()
+    if not connection:
+        flash('Database connection error.', 'error')
+        return redirect(url_for('student_fees'))
+    
+    try:
+        with connection.cursor() as cursor:
+            version = _payment_receipt_version(cursor, student_id, payment_id)
+            if not version:
+                flash('Payment transaction not found.', 'error')
+                return redirect(url_for('student_fees'))
+            
+            cache_key = receipt_cache.key('receipt', student_id, payment_id, *version.values())
+            cached_path = receipt_cache.path_for(cache_key)
+            pdf_bytes = None
+            if cached_path is None:
+                receipt, error = _load_payment_receipt(cursor, student_id, payment_id)
+                if error:
+                    flash(error, 'error')
+                    return redirect(url_for('student_fees'))
+                
+                # Generate PDF using reportlab (loaded on the first PDF request)
+                from pdf_documents import fee_statement_pdf
+                pdf_bytes = fee_statement_pdf('PAYMENT RECEIPT', receipt['school_settings'], receipt['student'],
+                                              receipt['receipt_date'], receipt['fee_breakdown'],
+                                              receipt['payment_details'], receipt['total_fees'],
+                                              receipt['total_paid'], receipt['balance_due'], document='receipt')
+                try:
+                    receipt_cache.put(cache_key, pdf_bytes)
+                except OSError as e:
+                    fees_log.warning("Could not cache receipt %s: %s", payment_id, e)
+    except Exception as e:
+        fees_log.exception("Error generating PDF receipt: %s", e)
+        flash('Error generating receipt.', 'error')
+        return redirect(url_for('student_fees'))
+    finally:
+        connection.close()
+    
+    filename = f'Receipt_{student_id}_{payment_id}_{datetime.now().strftime("%Y%m%d")}.pdf'
+    as_attachment = request.args.get('download', '').lower() == 'true'
+    if pdf_bytes is None:
+        response = send_file(cached_path, mimetype='application/pdf', as_attachment=as_attachment,
+                             download_name=filename, max_age=0)
+    else:
+        response = make_response(pdf_bytes)
+        response.headers['Content-Type'] = 'application/pdf'
+        response.headers['Content-Disposition'] = f'{"attachment" if as_attachment else "inline"}; filename={filename}'
+    response.headers['X-Receipt-Cache'] = 'miss' if pdf_bytes is not None else 'hit'
+    return response
 
 @app.route('/dashboard/employee/student-fees/fee-items', methods=['GET'])
 @login_required
@@ -6045,7 +4937,7 @@ def get_fee_items():
             
             return jsonify({'success': True, 'items': items}), 200
     except Exception as e:
-        print(f"Error fetching fee items: {e}")
+        fees_log.error("Error fetching fee items: %s", e)
         return jsonify({'success': False, 'items': []}), 200
     finally:
         connection.close()
@@ -6157,7 +5049,7 @@ def check_fee_structure():
             else:
                 return jsonify({'exists': False}), 200
     except Exception as e:
-        print(f"Error checking fee structure: {e}")
+        fees_log.error("Error checking fee structure: %s", e)
         return jsonify({'exists': False}), 200
     finally:
         connection.close()
@@ -6204,7 +5096,7 @@ def check_fee_structures_for_term():
                 'academic_levels_with_structure': academic_level_ids
             }), 200
     except Exception as e:
-        print(f"Error checking fee structures for term: {e}")
+        fees_log.error("Error checking fee structures for term: %s", e)
         return jsonify({'academic_levels_with_structure': []}), 200
     finally:
         connection.close()
@@ -6404,13 +5296,13 @@ def create_fee_structure():
                 
         except Exception as e:
             connection.rollback()
-            print(f"Error creating fee structure: {e}")
+            fees_log.error("Error creating fee structure: %s", e)
             return jsonify({'success': False, 'message': f'Error creating fee structure: {str(e)}'}), 500
         finally:
             connection.close()
             
     except Exception as e:
-        print(f"Error in create_fee_structure: {e}")
+        fees_log.error("Error in create_fee_structure: %s", e)
         return jsonify({'success': False, 'message': 'An error occurred'}), 500
 
 @app.route('/dashboard/employee/student-fees/fee-structures')
@@ -6548,7 +5440,7 @@ def fee_structures():
                         'is_current': row.get('is_current', False)
                     })
         except Exception as e:
-            print(f"Error fetching fee structures: {e}")
+            fees_log.error("Error fetching fee structures: %s", e)
         finally:
             connection.close()
     
@@ -6557,134 +5449,310 @@ def fee_structures():
                          academic_levels=academic_levels,
                          academic_years=academic_years)
 
+# Payments audit (keyset pagination on (changed_at, id), newest first; see migration 009)
+PAYMENT_AUDIT_PAGE_SIZE = 50
+PAYMENT_AUDIT_MAX_PAGE_SIZE = 200
+PAYMENT_AUDIT_EXPORT_BATCH = 2000
+PAYMENT_AUDIT_ACTIONS = ('INSERT', 'UPDATE', 'DELETE')
+PAYMENT_AUDIT_CSV_HEADERS = ['Date & Time', 'Student ID', 'Student Name', 'Action', 'Field', 'From', 'To',
+                             'Employee', 'Employee Code', 'Amount', 'Payment Method', 'Payment Date', 'Fee Name']
+
+_PAYMENT_AUDIT_SELECT = """
+    SELECT 
+        spa.id,
+        spa.payment_id,
+        spa.student_id,
+        spa.action_type,
+        spa.field_name,
+        spa.old_value,
+        spa.new_value,
+        spa.changed_at,
+        s.full_name as student_name,
+        e.full_name as employee_name,
+        e.employee_id as employee_code,
+        sp.amount_paid,
+        sp.payment_method,
+        sp.payment_date,
+        fs.fee_name
+    FROM student_payment_audit spa
+    LEFT JOIN students s ON spa.student_id = s.student_id
+    LEFT JOIN employees e ON spa.changed_by = e.id
+    LEFT JOIN student_payments sp ON spa.payment_id = sp.id
+    LEFT JOIN fee_structures fs ON sp.fee_structure_id = fs.id
+"""
+
+
+def encode_audit_cursor(changed_at, audit_id):
+    """Opaque cursor for the last audit row of a page"""
+    raw = json.dumps([changed_at.strftime('%Y-%m-%d %H:%M:%S'), audit_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_audit_cursor(token):
+    """(changed_at, id) from a cursor, or None if it is missing or malformed"""
+    if not token:
+        return None
+    try:
+        changed_at, audit_id = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+        return datetime.strptime(changed_at, '%Y-%m-%d %H:%M:%S'), int(audit_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_payment_audit_filters(args):
+    """Validated audit filters from request args; raises ValueError with a message for the user"""
+    filters = {
+        'student': args.get('student', '').strip(),
+        'employee': args.get('employee', '').strip(),
+        'action': args.get('action', '').strip().upper(),
+        'date_from': args.get('date_from', '').strip(),
+        'date_to': args.get('date_to', '').strip()
+    }
+    if filters['action'] and filters['action'] not in PAYMENT_AUDIT_ACTIONS:
+        raise ValueError(f"Invalid action type: {filters['action']}")
+    if filters['employee'] and not filters['employee'].isdigit():
+        raise ValueError('Invalid employee.')
+    for key in ('date_from', 'date_to'):
+        if filters[key]:
+            try:
+                datetime.strptime(filters[key], '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f'Invalid date: {filters[key]}')
+    return filters
+
+
+def fetch_payment_audit_page(cursor, filters, after=None, limit=PAYMENT_AUDIT_PAGE_SIZE):
+    """One page of audit rows, newest first, and the cursor of the next page (None on the last page).
+
+    Every filter combination is served by an index ending in (changed_at, id), so a page
+    costs one index range scan however far back it is.
+    """
+    where = []
+    params = []
+    if filters.get('student'):
+        where.append("spa.student_id = %s")
+        params.append(filters['student'])
+    if filters.get('employee'):
+        where.append("spa.changed_by = %s")
+        params.append(int(filters['employee']))
+    if filters.get('action'):
+        where.append("spa.action_type = %s")
+        params.append(filters['action'])
+    if filters.get('date_from'):
+        where.append("spa.changed_at >= %s")
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        where.append("spa.changed_at < DATE_ADD(%s, INTERVAL 1 DAY)")
+        params.append(filters['date_to'])
+    if after:
+        where.append("(spa.changed_at < %s OR (spa.changed_at = %s AND spa.id < %s))")
+        params.extend([after[0], after[0], after[1]])
+    
+    cursor.execute(_PAYMENT_AUDIT_SELECT
+                   + (" WHERE " + " AND ".join(where) if where else "")
+                   + " ORDER BY spa.changed_at DESC, spa.id DESC LIMIT %s",
+                   params + [limit + 1])
+    rows = cursor.fetchall()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_audit_cursor(rows[-1]['changed_at'], rows[-1]['id'])
+    return [_format_payment_audit_row(row) for row in rows], next_cursor
+
+
+def _format_payment_audit_row(row):
+    changed_at = row.get('changed_at')
+    if changed_at and hasattr(changed_at, 'strftime'):
+        changed_at_str = changed_at.strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        changed_at_str = str(changed_at) if changed_at else ''
+    
+    payment_date = row.get('payment_date')
+    if payment_date and hasattr(payment_date, 'strftime'):
+        payment_date_str = payment_date.strftime('%Y-%m-%d')
+    else:
+        payment_date_str = str(payment_date).split(' ')[0] if payment_date else ''
+    
+    return {
+        'id': row.get('id'),
+        'payment_id': row.get('payment_id'),
+        'student_id': row.get('student_id'),
+        'student_name': row.get('student_name', 'Unknown'),
+        'action_type': row.get('action_type', ''),
+        'field_name': row.get('field_name', ''),
+        'old_value': row.get('old_value', ''),
+        'new_value': row.get('new_value', ''),
+        'changed_at': changed_at_str,
+        'employee_name': row.get('employee_name', 'Unknown'),
+        'employee_code': row.get('employee_code', ''),
+        'amount_paid': float(row.get('amount_paid', 0)) if row.get('amount_paid') else 0,
+        'payment_method': row.get('payment_method', ''),
+        'payment_date': payment_date_str,
+        'fee_name': row.get('fee_name', '')
+    }
+
+
+def log_payment_audit(cursor, payment_id, student_id, action_type, field_name, old_value, new_value, changed_by):
+    """Record a payment change in student_payment_audit and in the unified audit_log"""
+    cursor.execute("""
+        INSERT INTO student_payment_audit
+        (payment_id, student_id, action_type, field_name, old_value, new_value, changed_by)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, (payment_id, student_id, action_type, field_name, old_value, new_value, changed_by))
+    audit_id = cursor.lastrowid
+    # audit_log keeps the names: its rows outlive the students and employees they mention
+    cursor.execute("""
+        SELECT (SELECT full_name FROM students WHERE student_id = %s) AS student_name,
+               (SELECT full_name FROM employees WHERE id = %s) AS employee_name
+    """, (student_id, changed_by))
+    names = cursor.fetchone()
+    try:
+        record_audit(cursor, 'payment', action_type, actor_id=changed_by, actor_name=names['employee_name'],
+                     subject_id=student_id, subject_name=names['student_name'], field_name=field_name,
+                     old_value=old_value, new_value=new_value, source_id=audit_id)
+    except pymysql.err.MySQLError as e:
+        if e.args and e.args[0] == 1213:
+            raise  # a deadlock rolled back the whole transaction, payment included
+        # audit_log only exists once migration 010 has run (and may lack a partition): the
+        # payment must not depend on it; student_payment_audit above still holds the change
+        payments_log.warning("Payment audit %s not added to audit_log: %s", audit_id, e)
+
+
+def _can_view_payments_audit():
+    if session.get('role', '').lower() == 'technician':
+        return True
+    return (check_permission_or_role('view_student_fees', ['accountant', 'principal'])
+            or check_permission_or_role('manage_fees', ['accountant', 'principal']))
+
+
 @app.route('/dashboard/employee/student-fees/payments-audit')
 @login_required
 def payments_audit():
     """Display payments audit log showing all changes to student fees"""
     user_role = session.get('role', '').lower()
-    viewing_as_role = session.get('viewing_as_employee_role', '').lower()
-    employee_id = session.get('employee_id') or session.get('user_id')
-    
-    # Check if user is accountant or viewing as accountant
-    is_accountant = user_role == 'accountant' or viewing_as_role == 'accountant'
-    is_technician = user_role == 'technician'
-    
-    # Check permission-based access
-    has_view_fees_permission = check_permission_or_role('view_student_fees', ['accountant', 'principal'])
-    has_manage_fees_permission = check_permission_or_role('manage_fees', ['accountant', 'principal'])
     
     # Permission check handles role fallback if no permissions are assigned
-    if not (is_technician or has_view_fees_permission or has_manage_fees_permission):
+    if not _can_view_payments_audit():
         flash('You do not have permission to access this page.', 'error')
         return redirect(url_for('dashboard_employee'))
     
+    try:
+        filters = parse_payment_audit_filters(request.args)
+    except ValueError as e:
+        flash(str(e), 'error')
+        filters = parse_payment_audit_filters({})
+    
     connection = get_db_connection()
     audit_logs = []
+    next_cursor = None
+    employees = []
     
     if connection:
         try:
             with connection.cursor() as cursor:
-                # Check if audit table exists, if not create it
-                try:
-                    cursor.execute("SHOW TABLES LIKE 'student_payment_audit'")
-                    table_exists = cursor.fetchone()
-                    
-                    if not table_exists:
-                        # Create the audit table if it doesn't exist
-                        cursor.execute("""
-                            CREATE TABLE IF NOT EXISTS student_payment_audit (
-                                id INT AUTO_INCREMENT PRIMARY KEY,
-                                payment_id INT,
-                                student_id VARCHAR(20) NOT NULL,
-                                action_type ENUM('INSERT', 'UPDATE', 'DELETE') NOT NULL,
-                                field_name VARCHAR(100),
-                                old_value TEXT,
-                                new_value TEXT,
-                                changed_by INT,
-                                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                FOREIGN KEY (payment_id) REFERENCES student_payments(id) ON DELETE SET NULL,
-                                FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE,
-                                FOREIGN KEY (changed_by) REFERENCES employees(id) ON DELETE SET NULL,
-                                INDEX idx_payment_id (payment_id),
-                                INDEX idx_student_id (student_id),
-                                INDEX idx_changed_at (changed_at),
-                                INDEX idx_action_type (action_type)
-                            )
-                        """)
-                        connection.commit()
-                except Exception as e:
-                    print(f"Error checking/creating audit table: {e}")
-                
-                # Fetch all audit logs with student and employee information
+                audit_logs, next_cursor = fetch_payment_audit_page(cursor, filters)
+                # Employees who changed payments (a loose scan of idx_changed_by_changed)
                 cursor.execute("""
-                    SELECT 
-                        spa.id,
-                        spa.payment_id,
-                        spa.student_id,
-                        spa.action_type,
-                        spa.field_name,
-                        spa.old_value,
-                        spa.new_value,
-                        spa.changed_at,
-                        s.full_name as student_name,
-                        e.full_name as employee_name,
-                        e.employee_id as employee_code,
-                        sp.amount_paid,
-                        sp.payment_method,
-                        sp.payment_date,
-                        fs.fee_name
-                    FROM student_payment_audit spa
-                    LEFT JOIN students s ON spa.student_id = s.student_id
-                    LEFT JOIN employees e ON spa.changed_by = e.id
-                    LEFT JOIN student_payments sp ON spa.payment_id = sp.id
-                    LEFT JOIN fee_structures fs ON sp.fee_structure_id = fs.id
-                    ORDER BY spa.changed_at DESC
-                    LIMIT 1000
+                    SELECT e.id, e.full_name, e.employee_id
+                    FROM employees e
+                    WHERE e.id IN (SELECT DISTINCT changed_by FROM student_payment_audit)
+                    ORDER BY e.full_name
                 """)
-                
-                results = cursor.fetchall()
-                
-                for row in results:
-                    changed_at = row.get('changed_at')
-                    if changed_at and hasattr(changed_at, 'strftime'):
-                        changed_at_str = changed_at.strftime('%Y-%m-%d %H:%M:%S')
-                    else:
-                        changed_at_str = str(changed_at) if changed_at else ''
-                    
-                    payment_date = row.get('payment_date')
-                    if payment_date and hasattr(payment_date, 'strftime'):
-                        payment_date_str = payment_date.strftime('%Y-%m-%d')
-                    else:
-                        payment_date_str = str(payment_date).split(' ')[0] if payment_date else ''
-                    
-                    audit_logs.append({
-                        'id': row.get('id'),
-                        'payment_id': row.get('payment_id'),
-                        'student_id': row.get('student_id'),
-                        'student_name': row.get('student_name', 'Unknown'),
-                        'action_type': row.get('action_type', ''),
-                        'field_name': row.get('field_name', ''),
-                        'old_value': row.get('old_value', ''),
-                        'new_value': row.get('new_value', ''),
-                        'changed_at': changed_at_str,
-                        'employee_name': row.get('employee_name', 'Unknown'),
-                        'employee_code': row.get('employee_code', ''),
-                        'amount_paid': float(row.get('amount_paid', 0)) if row.get('amount_paid') else 0,
-                        'payment_method': row.get('payment_method', ''),
-                        'payment_date': payment_date_str,
-                        'fee_name': row.get('fee_name', '')
-                    })
+                employees = cursor.fetchall()
         except Exception as e:
-            print(f"Error fetching audit logs: {e}")
-            import traceback
-            traceback.print_exc()
+            payments_log.exception("Error fetching audit logs: %s", e)
         finally:
             connection.close()
     
     return render_template('dashboards/payments_audit.html',
                          audit_logs=audit_logs,
+                         next_cursor=next_cursor,
+                         filters=filters,
+                         employees=employees,
+                         page_size=PAYMENT_AUDIT_PAGE_SIZE,
                          role=user_role)
 
+@app.route('/dashboard/employee/student-fees/payments-audit/data')
+@login_required
+def payments_audit_data():
+    """One page of the payments audit as JSON (filters and cursor in the query string)"""
+    if not _can_view_payments_audit():
+        return jsonify({'success': False, 'message': 'You do not have permission to view the payments audit.'}), 403
+    try:
+        filters = parse_payment_audit_filters(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    cursor_token = request.args.get('cursor', '')
+    after = decode_audit_cursor(cursor_token)
+    if cursor_token and after is None:
+        return jsonify({'success': False, 'message': 'Invalid cursor.'}), 400
+    try:
+        limit = int(request.args.get('limit', PAYMENT_AUDIT_PAGE_SIZE))
+    except ValueError:
+        limit = PAYMENT_AUDIT_PAGE_SIZE
+    limit = max(1, min(limit, PAYMENT_AUDIT_MAX_PAGE_SIZE))
+    
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'success': False, 'message': 'Database connection error.'}), 500
+    try:
+        with connection.cursor() as cursor:
+            logs, next_cursor = fetch_payment_audit_page(cursor, filters, after, limit)
+    except Exception as e:
+        payments_log.error("Error fetching audit logs page: %s", e)
+        return jsonify({'success': False, 'message': 'Error fetching audit logs.'}), 500
+    finally:
+        connection.close()
+    
+    return jsonify({'success': True, 'logs': logs, 'next_cursor': next_cursor})
+
+@app.route('/dashboard/employee/student-fees/payments-audit/export.csv')
+@login_required
+def payments_audit_export():
+    """Stream every audit row matching the filters as CSV, a keyset batch at a time"""
+    if not _can_view_payments_audit():
+        flash('You do not have permission to access this page.', 'error')
+        return redirect(url_for('dashboard_employee'))
+    try:
+        filters = parse_payment_audit_filters(request.args)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('payments_audit'))
+    
+    def generate():
+        # A dedicated connection: a long export must not hold a pool slot
+        connection = pymysql.connect(**DB_CONFIG)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        try:
+            buffer.write('\ufeff')
+            writer.writerow(PAYMENT_AUDIT_CSV_HEADERS)
+            after = None
+            while True:
+                with connection.cursor() as cursor:
+                    logs, next_cursor = fetch_payment_audit_page(cursor, filters, after, PAYMENT_AUDIT_EXPORT_BATCH)
+                connection.commit()   # end the read snapshot between batches
+                for log in logs:
+                    writer.writerow([log['changed_at'], log['student_id'] or '', log['student_name'] or '',
+                                     log['action_type'] or '', log['field_name'] or '', log['old_value'] or '',
+                                     log['new_value'] or '', log['employee_name'] or '', log['employee_code'] or '',
+                                     f"{log['amount_paid']:.2f}" if log['amount_paid'] else '',
+                                     log['payment_method'] or '', log['payment_date'], log['fee_name'] or ''])
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                if not next_cursor:
+                    break
+                after = decode_audit_cursor(next_cursor)
+        finally:
+            connection.close()
+    
+    filename = f'payments_audit_{datetime.now().strftime("%Y-%m-%d")}.csv'
+    return app.response_class(stream_with_context(generate()), mimetype='text/csv; charset=utf-8',
+                              headers={'Content-Disposition': f'attachment; filename={filename}',
+                                       'X-Accel-Buffering': 'no'})
+
 @app.route('/dashboard/employee/student-fees/record-payment', methods=['POST'])
 @login_required
 def record_payment():
@@ -6698,19 +5766,13 @@ def record_payment():
     # Check permission-based access
     has_process_payments_permission = check_permission_or_role('process_payments', ['accountant'])
     
-    # Debug logging
-    print(f"DEBUG record_payment:")
-    print(f"  - user_role: {user_role}")
-    print(f"  - employee_id: {employee_id}")
-    print(f"  - is_technician: {is_technician}")
-    print(f"  - has_process_payments_permission: {has_process_payments_permission}")
-    
     # Permission check handles role fallback if no permissions are assigned
     if not (is_technician or has_process_payments_permission):
-        print(f"  - ACCESS DENIED: No permission to record payments")
+        payments_log.info("record_payment denied: role=%s employee_id=%s", user_role, employee_id)
         return jsonify({'success': False, 'message': 'You do not have permission to record payments.'}), 403
     
-    print(f"  - ACCESS GRANTED: Allowing payment recording")
+    payments_log.debug("record_payment: role=%s employee_id=%s technician=%s has_permission=%s",
+                       user_role, employee_id, is_technician, has_process_payments_permission)
     
     try:
         # Get form data
@@ -6791,11 +5853,10 @@ def record_payment():
                 if notes:
                     payment_details += f", Notes: {notes[:100]}"
                 
-                cursor.execute("""
-                    INSERT INTO student_payment_audit 
-                    (payment_id, student_id, action_type, field_name, old_value, new_value, changed_by)
-                    VALUES (%s, %s, 'INSERT', 'Payment Created', NULL, %s, %s)
-                """, (payment_id, student_id, payment_details, received_by_id))
+                log_payment_audit(cursor, payment_id, student_id, 'INSERT', 'Payment Created', None, payment_details,
+                                  received_by_id)
+                
+                refresh_fee_balance(cursor, student_id, fee_structure_id)
                 
                 connection.commit()
                 
@@ -6805,17 +5866,13 @@ def record_payment():
                 })
         except Exception as e:
             connection.rollback()
-            print(f"Error recording payment: {e}")
-            import traceback
-            traceback.print_exc()
+            payments_log.exception("Error recording payment: %s", e)
             return jsonify({'success': False, 'message': f'Error recording payment: {str(e)}'}), 500
         finally:
             connection.close()
             
     except Exception as e:
-        print(f"Error in record_payment: {e}")
-        import traceback
-        traceback.print_exc()
+        payments_log.exception("Error in record_payment: %s", e)
         return jsonify({'success': False, 'message': 'An error occurred while recording payment.'}), 500
 
 @app.route('/dashboard/employee/student-fees/transactions/<student_id>', methods=['GET'])
@@ -6907,9 +5964,7 @@ def get_student_transactions(student_id):
                 'transactions': transactions_list
             })
     except Exception as e:
-        print(f"Error fetching transactions: {e}")
-        import traceback
-        traceback.print_exc()
+        payments_log.exception("Error fetching transactions: %s", e)
         return jsonify({'success': False, 'message': 'Error fetching transactions.'}), 500
     finally:
         connection.close()
@@ -6953,7 +6008,7 @@ def update_payment_amount():
         try:
             with connection.cursor() as cursor:
                 cursor.execute(
-                    "SELECT amount_paid FROM student_payments WHERE id = %s AND student_id = %s",
+                    "SELECT amount_paid, fee_structure_id FROM student_payments WHERE id = %s AND student_id = %s",
                     (payment_id, student_id)
                 )
                 row = cursor.fetchone()
@@ -6983,28 +6038,23 @@ def update_payment_amount():
                     if emp:
                         received_by_id = emp.get('id') if isinstance(emp, dict) else emp[0]
 
-                cursor.execute("""
-                    INSERT INTO student_payment_audit
-                    (payment_id, student_id, action_type, field_name, old_value, new_value, changed_by)
-                    VALUES (%s, %s, 'UPDATE', 'amount_paid', %s, %s, %s)
-                """, (payment_id, student_id, str(old_value), str(amount_paid), received_by_id))
+                log_payment_audit(cursor, payment_id, student_id, 'UPDATE', 'amount_paid', str(old_value),
+                                  str(amount_paid), received_by_id)
+
+                refresh_fee_balance(cursor, student_id, row.get('fee_structure_id'))
 
                 connection.commit()
                 return jsonify({'success': True, 'amount_paid': amount_paid})
         except Exception as e:
             connection.rollback()
-            print(f"Error updating payment: {e}")
-            import traceback
-            traceback.print_exc()
+            payments_log.exception("Error updating payment: %s", e)
             return jsonify({'success': False, 'message': str(e)}), 500
         finally:
             connection.close()
     except ValueError as e:
         return jsonify({'success': False, 'message': 'Invalid amount.'}), 400
     except Exception as e:
-        print(f"Error in update_payment_amount: {e}")
-        import traceback
-        traceback.print_exc()
+        payments_log.exception("Error in update_payment_amount: %s", e)
         return jsonify({'success': False, 'message': 'An error occurred while updating payment.'}), 500
 
 @app.route('/dashboard/employee/student-fees/delete-payment', methods=['POST'])
@@ -7071,11 +6121,8 @@ def delete_payment():
                 
                 # Log audit entry for payment deletion BEFORE deleting the payment
                 # This ensures the foreign key constraint is satisfied
-                cursor.execute("""
-                    INSERT INTO student_payment_audit 
-                    (payment_id, student_id, action_type, field_name, old_value, new_value, changed_by)
-                    VALUES (%s, %s, 'DELETE', 'Payment Deleted', %s, NULL, %s)
-                """, (payment_id, student_id, payment_details, received_by_id))
+                log_payment_audit(cursor, payment_id, student_id, 'DELETE', 'Payment Deleted', payment_details, None,
+                                  received_by_id)
                 
                 # Delete the payment after audit log is created
                 cursor.execute("""
@@ -7083,6 +6130,8 @@ def delete_payment():
                     WHERE id = %s AND student_id = %s
                 """, (payment_id, student_id))
 
+                refresh_fee_balance(cursor, student_id, payment_result.get('fee_structure_id'))
+
                 connection.commit()
                 return jsonify({
                     'success': True,
@@ -7090,16 +6139,12 @@ def delete_payment():
                 })
         except Exception as e:
             connection.rollback()
-            print(f"Error deleting payment: {e}")
-            import traceback
-            traceback.print_exc()
+            payments_log.exception("Error deleting payment: %s", e)
             return jsonify({'success': False, 'message': f'Error deleting payment: {str(e)}'}), 500
         finally:
             connection.close()
     except Exception as e:
-        print(f"Error in delete_payment: {e}")
-        import traceback
-        traceback.print_exc()
+        payments_log.exception("Error in delete_payment: %s", e)
         return jsonify({'success': False, 'message': 'An error occurred while deleting payment.'}), 500
 
 @app.route('/dashboard/employee/student-fees/fee-structure/<int:structure_id>/update', methods=['POST'])
@@ -7311,6 +6356,8 @@ def update_fee_structure(structure_id):
                         'message': 'No valid fee items were provided. Please ensure all items have a name and amount greater than 0.'
                     }), 400
                 
+                reprice_fee_balances(cursor, structure_id, total_amount)
+                
                 connection.commit()
                 
                 # Verify items were saved
@@ -7326,13 +6373,13 @@ def update_fee_structure(structure_id):
                 
         except Exception as e:
             connection.rollback()
-            print(f"Error updating fee structure: {e}")
+            fees_log.error("Error updating fee structure: %s", e)
             return jsonify({'success': False, 'message': f'Error updating fee structure: {str(e)}'}), 500
         finally:
             connection.close()
             
     except Exception as e:
-        print(f"Error in update_fee_structure: {e}")
+        fees_log.error("Error in update_fee_structure: %s", e)
         return jsonify({'success': False, 'message': 'An error occurred'}), 500
 
 @app.route('/dashboard/employee/student-fees/fee-structure/<int:structure_id>/delete', methods=['POST'])
@@ -7362,11 +6409,13 @@ def delete_fee_structure(structure_id):
         with connection.cursor() as cursor:
             # Delete fee structure (cascade will delete items)
             cursor.execute("DELETE FROM fee_structures WHERE id = %s", (structure_id,))
+            # Payments against it are now unassigned (ON DELETE SET NULL)
+            remove_fee_structure_balances(cursor, structure_id)
             connection.commit()
             return jsonify({'success': True, 'message': 'Fee structure deleted successfully'}), 200
     except Exception as e:
         connection.rollback()
-        print(f"Error deleting fee structure: {e}")
+        fees_log.error("Error deleting fee structure: %s", e)
         return jsonify({'success': False, 'message': f'Error deleting fee structure: {str(e)}'}), 500
     finally:
         connection.close()
@@ -7596,12 +6645,10 @@ def staff_and_salaries():
                 except Exception as e:
                     # Table might not exist yet
                     audits = []
-                    print(f"Salary audits table might not exist: {e}")
+                    staff_log.warning("Salary audits table might not exist: %s", e)
                     
         except Exception as e:
-            print(f"Error fetching data: {e}")
-            import traceback
-            traceback.print_exc()
+            staff_log.exception("Error fetching data: %s", e)
             flash('Error loading data. Please try again.', 'error')
         finally:
             if connection:
@@ -7868,9 +6915,7 @@ def salary_records():
                     })
         
         except Exception as e:
-            print(f"Error fetching salary records: {e}")
-            import traceback
-            traceback.print_exc()
+            staff_log.exception("Error fetching salary records: %s", e)
             flash('Error loading salary records. Please try again.', 'error')
         finally:
             if connection:
@@ -8021,18 +7066,14 @@ def register_salary():
         
         except Exception as e:
             connection.rollback()
-            print(f"Error registering salary: {e}")
-            import traceback
-            traceback.print_exc()
+            staff_log.exception("Error registering salary: %s", e)
             return jsonify({'success': False, 'message': f'Error registering salary: {str(e)}'}), 500
         
         finally:
             connection.close()
     
     except Exception as e:
-        print(f"Error in register_salary route: {e}")
-        import traceback
-        traceback.print_exc()
+        staff_log.exception("Error in register_salary route: %s", e)
         return jsonify({'success': False, 'message': 'An error occurred. Please try again.'}), 500
 
 @app.route('/dashboard/employee/staff-and-salaries/get-salary/<int:salary_id>', methods=['GET'])
@@ -8094,9 +7135,7 @@ def get_salary(salary_id):
                 }
             })
     except Exception as e:
-        print(f"Error fetching salary: {e}")
-        import traceback
-        traceback.print_exc()
+        staff_log.exception("Error fetching salary: %s", e)
         return jsonify({'success': False, 'message': 'Error fetching salary details.'}), 500
     finally:
         connection.close()
@@ -8268,6 +7307,9 @@ def update_salary():
                 
                 # Insert audit records (only if we have a valid editor_id)
                 if audit_records and editor_id:
+                    cursor.execute("SELECT employee_id, full_name FROM employees WHERE id = %s",
+                                   (old_salary.get('employee_id'),))
+                    salary_employee = cursor.fetchone() or {}
                     for audit in audit_records:
                         try:
                             cursor.execute("""
@@ -8283,13 +7325,16 @@ def update_salary():
                                 editor_id,  # Use the resolved database ID
                                 editor_name
                             ))
+                            record_audit(cursor, 'salary', 'UPDATE', actor_id=editor_id, actor_name=editor_name,
+                                         subject_id=salary_employee.get('employee_id') or audit['employee_id'],
+                                         subject_name=salary_employee.get('full_name'),
+                                         field_name=audit['field_name'], old_value=audit['old_value'],
+                                         new_value=audit['new_value'], source_id=cursor.lastrowid)
                         except Exception as audit_error:
                             # Log audit error but don't fail the update
-                            print(f"Error creating audit record: {audit_error}")
-                            import traceback
-                            traceback.print_exc()
+                            staff_log.exception("Error creating audit record: %s", audit_error)
                 elif audit_records and not editor_id:
-                    print("Warning: Audit records skipped because editor_id could not be resolved.")
+                    staff_log.warning("Audit records skipped because editor_id could not be resolved.")
                 
                 connection.commit()
                 
@@ -8300,18 +7345,14 @@ def update_salary():
         
         except Exception as e:
             connection.rollback()
-            print(f"Error updating salary: {e}")
-            import traceback
-            traceback.print_exc()
+            staff_log.exception("Error updating salary: %s", e)
             return jsonify({'success': False, 'message': f'Error updating salary: {str(e)}'}), 500
         
         finally:
             connection.close()
     
     except Exception as e:
-        print(f"Error in update_salary route: {e}")
-        import traceback
-        traceback.print_exc()
+        staff_log.exception("Error in update_salary route: %s", e)
         return jsonify({'success': False, 'message': 'An error occurred. Please try again.'}), 500
 
 @app.route('/dashboard/employee/staff-and-salaries/get-employees-with-salaries')
@@ -8355,9 +7396,7 @@ def get_employees_with_salaries():
                 } for emp in employees]
             })
     except Exception as e:
-        print(f"Error fetching employees with salaries: {e}")
-        import traceback
-        traceback.print_exc()
+        staff_log.exception("Error fetching employees with salaries: %s", e)
         return jsonify({'success': False, 'message': 'Error fetching employees'}), 500
     finally:
         connection.close()
@@ -8470,9 +7509,7 @@ def get_employee_salary(employee_id):
                 }
             })
     except Exception as e:
-        print(f"Error fetching employee salary: {e}")
-        import traceback
-        traceback.print_exc()
+        staff_log.exception("Error fetching employee salary: %s", e)
         return jsonify({'success': False, 'message': 'Error fetching salary information'}), 500
     finally:
         connection.close()
@@ -8612,16 +7649,12 @@ def record_salary_payment():
                 })
         except Exception as e:
             connection.rollback()
-            print(f"Error recording salary payment: {e}")
-            import traceback
-            traceback.print_exc()
+            staff_log.exception("Error recording salary payment: %s", e)
             return jsonify({'success': False, 'message': f'Error recording payment: {str(e)}'}), 500
         finally:
             connection.close()
     except Exception as e:
-        print(f"Error in record_salary_payment: {e}")
-        import traceback
-        traceback.print_exc()
+        staff_log.exception("Error in record_salary_payment: %s", e)
         return jsonify({'success': False, 'message': 'An error occurred'}), 500
 
 @app.route('/dashboard/employee/staff-and-salaries/get-payment-history/<int:employee_id>/<int:salary_id>')
@@ -8695,9 +7728,7 @@ def get_payment_history(employee_id, salary_id):
                 } for p in payments]
             })
     except Exception as e:
-        print(f"Error fetching payment history: {e}")
-        import traceback
-        traceback.print_exc()
+        staff_log.exception("Error fetching payment history: %s", e)
         return jsonify({'success': False, 'message': 'Error fetching payment history'}), 500
     finally:
         connection.close()
@@ -8744,9 +7775,7 @@ def salary_audits():
                 """)
                 audits = cursor.fetchall()
         except Exception as e:
-            print(f"Error fetching salary audits: {e}")
-            import traceback
-            traceback.print_exc()
+            staff_log.exception("Error fetching salary audits: %s", e)
             flash('Error loading salary audits. Please try again.', 'error')
         finally:
             if connection:
@@ -8793,7 +7822,7 @@ def staff_management():
                 """)
                 employees = cursor.fetchall()
         except Exception as e:
-            print(f"Error fetching employees: {e}")
+            staff_log.error("Error fetching employees: %s", e)
             flash('Error loading employees. Please try again.', 'error')
         finally:
             if connection:
@@ -8808,6 +7837,10 @@ def staff_management():
                          can_edit=can_edit,
                          can_delete=can_delete)
 
+# Roles an approver may assign (the options of the Assign Roles & Approve page)
+ASSIGNABLE_EMPLOYEE_ROLES = ('employee', 'super admin', 'principal', 'deputy principal', 'academic coordinator',
+                             'teachers', 'accountant', 'librarian', 'warden', 'transport manager', 'technician')
+
 @app.route('/assign-roles-approve')
 @login_required
 def assign_roles_approve():
@@ -8837,7 +7870,7 @@ def assign_roles_approve():
                 """)
                 employees = cursor.fetchall()
         except Exception as e:
-            print(f"Error fetching employees: {e}")
+            staff_log.error("Error fetching employees: %s", e)
             flash('Error loading employees. Please try again.', 'error')
         finally:
             if connection:
@@ -8866,6 +7899,8 @@ def approve_employee(employee_id):
     
     if not role:
         return jsonify({'success': False, 'message': 'Please select a role for the employee.'}), 400
+    if role not in ASSIGNABLE_EMPLOYEE_ROLES:
+        return jsonify({'success': False, 'message': f'Unknown role: {role}.'}), 400
     
     connection = get_db_connection()
     if not connection:
@@ -8906,15 +7941,15 @@ def approve_employee(employee_id):
             )
             
             if not email_sent:
-                print(f"Warning: Failed to send approval email to {employee.get('email')}")
+                staff_log.warning("Failed to queue approval email to %s", employee.get('email'))
             
             return jsonify({
                 'success': True, 
-                'message': f'Employee {employee.get("full_name")} has been approved and assigned the role of {role.title()}. Email notification sent.'
+                'message': f'Employee {employee.get("full_name")} has been approved and assigned the role of {role.title()}. Email notification queued.'
             })
             
     except Exception as e:
-        print(f"Error approving employee: {e}")
+        staff_log.error("Error approving employee: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'An error occurred while approving the employee.'}), 500
     finally:
@@ -8973,7 +8008,7 @@ def update_employee(employee_id):
             return jsonify({'success': True, 'message': 'Employee updated successfully.'})
             
     except Exception as e:
-        print(f"Error updating employee: {e}")
+        staff_log.error("Error updating employee: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'An error occurred while updating the employee.'}), 500
     finally:
@@ -9015,7 +8050,7 @@ def delete_employee(employee_id):
             return jsonify({'success': True, 'message': f'Employee {employee.get("full_name")} has been deleted successfully.'})
             
     except Exception as e:
-        print(f"Error deleting employee: {e}")
+        staff_log.error("Error deleting employee: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'An error occurred while deleting the employee.'}), 500
     finally:
@@ -9066,7 +8101,7 @@ def toggle_suspend_employee(employee_id):
             })
             
     except Exception as e:
-        print(f"Error toggling suspend employee: {e}")
+        staff_log.error("Error toggling suspend employee: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'An error occurred while updating the employee status.'}), 500
     finally:
@@ -9104,7 +8139,7 @@ def get_employee(employee_id):
             return jsonify({'success': True, 'employee': employee})
             
     except Exception as e:
-        print(f"Error fetching employee: {e}")
+        staff_log.error("Error fetching employee: %s", e)
         return jsonify({'success': False, 'message': 'An error occurred while fetching employee details.'}), 500
     finally:
         connection.close()
@@ -9149,7 +8184,7 @@ def student_management():
                 """)
                 students = cursor.fetchall()
         except Exception as e:
-            print(f"Error fetching students: {e}")
+            students_log.error("Error fetching students: %s", e)
             flash('Error loading students. Please try again.', 'error')
         finally:
             if connection:
@@ -9230,7 +8265,7 @@ def get_student(student_id):
                 }
             })
     except Exception as e:
-        print(f"Error fetching student: {e}")
+        students_log.error("Error fetching student: %s", e)
         return jsonify({'success': False, 'message': 'Error fetching student details.'}), 500
     finally:
         connection.close()
@@ -9256,7 +8291,7 @@ def check_student_id(student_id):
             result = cursor.fetchone()
             return jsonify({'exists': result is not None})
     except Exception as e:
-        print(f"Error checking student ID: {e}")
+        students_log.error("Error checking student ID: %s", e)
         return jsonify({'exists': False, 'message': 'Error checking student ID'}), 500
     finally:
         connection.close()
@@ -9381,7 +8416,7 @@ def update_student(student_id):
             connection.commit()
             return jsonify({'success': True, 'message': 'Student updated successfully.'})
     except Exception as e:
-        print(f"Error updating student: {e}")
+        students_log.error("Error updating student: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'Error updating student details.'}), 500
     finally:
@@ -9422,7 +8457,7 @@ def delete_student(student_id):
             
             return jsonify({'success': True, 'message': 'Student deleted successfully.'})
     except Exception as e:
-        print(f"Error deleting student: {e}")
+        students_log.error("Error deleting student: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'Error deleting student.'}), 500
     finally:
@@ -9482,24 +8517,22 @@ def approve_student(student_id):
             
             # Send approval email to parent
             if student.get('parent_email') and student.get('parent_name'):
-                try:
-                    send_student_approval_email(
-                        student.get('parent_email'),
-                        student.get('parent_name'),
-                        student.get('full_name'),
-                        student_id
-                    )
-                except Exception as email_error:
-                    print(f"Error sending approval email: {email_error}")
-                    # Don't fail the approval if email fails, but log it
-                    flash(f'Student approved successfully, but email could not be sent: {email_error}', 'warning')
+                email_queued = send_student_approval_email(
+                    student.get('parent_email'),
+                    student.get('parent_name'),
+                    student.get('full_name'),
+                    student_id
+                )
+                if email_queued:
+                    flash(f'Student {student.get("full_name")} has been approved successfully! Congratulations email queued for the parent.', 'success')
                 else:
-                    flash(f'Student {student.get("full_name")} has been approved successfully! Congratulations email sent to parent.', 'success')
+                    # Don't fail the approval if the email cannot be queued, but report it
+                    flash('Student approved successfully, but the notification email could not be queued.', 'warning')
             else:
                 flash(f'Student {student.get("full_name")} has been approved successfully! (No parent email found to send notification.)', 'success')
             
     except Exception as e:
-        print(f"Error approving student: {e}")
+        students_log.error("Error approving student: %s", e)
         connection.rollback()
         flash('An error occurred while approving the student. Please try again.', 'error')
     finally:
@@ -9511,6 +8544,245 @@ def approve_student(student_id):
     
     return redirect(url_for('student_management'))
 
+def _bulk_id_list(data, key, cast=str):
+    """Unique, non-empty ids from a bulk request payload, in the order given"""
+    ids = []
+    for value in (data or {}).get(key) or []:
+        try:
+            value = cast(str(value).strip())
+        except (TypeError, ValueError):
+            continue
+        if value != '' and value not in ids:
+            ids.append(value)
+    return ids
+
+def _deliver_bulk_emails(message_ids):
+    """Send a bulk approval's notifications together over one SMTP session"""
+    if message_ids and EMAIL_WORKER_ENABLED:
+        email_worker.deliver_async(message_ids, send_interval=EMAIL_BULK_SEND_INTERVAL)
+
+@app.route('/students/bulk-approve', methods=['POST'])
+@login_required
+def bulk_approve_students():
+    """Approve a set of pending students in one transaction and notify their parents"""
+    has_access = check_permission_or_role('edit_students', 
+                                         allowed_roles=['employee', 'super admin', 'principal', 'deputy principal', 
+                                                       'academic coordinator', 'teachers', 'accountant', 'librarian', 
+                                                       'warden', 'transport manager', 'technician'])
+    
+    if not has_access:
+        return jsonify({'success': False, 'message': 'You do not have permission to approve students.'}), 403
+    
+    student_ids = _bulk_id_list(request.get_json(silent=True), 'student_ids')
+    if not student_ids:
+        return jsonify({'success': False, 'message': 'Please select at least one student.'}), 400
+    
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'success': False, 'message': 'Database connection error.'}), 500
+    
+    results = []
+    message_ids = []
+    try:
+        render_email = student_approval_email_renderer()
+        with connection.cursor() as cursor:
+            # One parent per student (the first registered), locked so concurrent approvals cannot double-send
+            cursor.execute("""
+                SELECT s.student_id, s.full_name, s.status,
+                       p.full_name as parent_name, p.email as parent_email
+                FROM students s
+                LEFT JOIN parents p ON p.id = (
+                    SELECT MIN(p2.id) FROM parents p2 WHERE p2.student_id = s.student_id
+                )
+                WHERE s.student_id IN %s
+                FOR UPDATE
+            """, (tuple(student_ids),))
+            students = {row['student_id']: row for row in cursor.fetchall()}
+            
+            pending = [sid for sid in student_ids
+                       if sid in students and students[sid].get('status') == 'pending approval']
+            if pending:
+                cursor.execute("""
+                    UPDATE students 
+                    SET status = 'in session', updated_at = CURRENT_TIMESTAMP
+                    WHERE student_id IN %s AND status = 'pending approval'
+                """, (tuple(pending),))
+            
+            for student_id in student_ids:
+                student = students.get(student_id)
+                if not student:
+                    results.append({'id': student_id, 'status': 'not_found', 'email': None})
+                    continue
+                if student_id not in pending:
+                    results.append({'id': student_id, 'name': student.get('full_name'),
+                                    'status': 'skipped', 'message': f'Already {student.get("status")}', 'email': None})
+                    continue
+                
+                result = {'id': student_id, 'name': student.get('full_name'), 'status': 'approved', 'email': None}
+                if student.get('parent_email') and student.get('parent_name'):
+                    subject, html_body, text_body = render_email(
+                        student.get('parent_name'), student.get('full_name'), student_id
+                    )
+                    outbox_id = enqueue_email(cursor, student.get('parent_email'), subject, html_body, text_body,
+                                              category='student_approval')
+                    message_ids.append(outbox_id)
+                    result.update({'email': 'pending', 'recipient': student.get('parent_email'), 'outbox_id': outbox_id})
+                else:
+                    result['message'] = 'No parent email found to send notification'
+                results.append(result)
+        
+        # Approvals and their notifications commit together
+        connection.commit()
+    except Exception as e:
+        students_log.error("Error bulk approving students: %s", e)
+        connection.rollback()
+        return jsonify({'success': False, 'message': 'An error occurred while approving the students.'}), 500
+    finally:
+        connection.close()
+    
+    _deliver_bulk_emails(message_ids)
+    
+    approved = sum(1 for result in results if result['status'] == 'approved')
+    return jsonify({
+        'success': True,
+        'message': f'{approved} student(s) approved, {len(message_ids)} notification email(s) queued.',
+        'approved': approved,
+        'results': results
+    })
+
+@app.route('/employees/bulk-approve', methods=['POST'])
+@login_required
+def bulk_approve_employees():
+    """Approve a set of pending employees in one transaction, assign roles and notify them"""
+    user_role = session.get('role', '').lower()
+    
+    employee_roles = ['employee', 'super admin', 'principal', 'deputy principal', 'academic coordinator', 
+                     'teachers', 'accountant', 'librarian', 'warden', 'transport manager', 'technician']
+    
+    if user_role not in employee_roles:
+        return jsonify({'success': False, 'message': 'You do not have permission to approve employees.'}), 403
+    
+    # Either {"approvals": [{"employee_id": 1, "role": "teachers"}, ...]} or {"employee_ids": [...], "role": "..."}
+    data = request.get_json(silent=True) or {}
+    roles = {}
+    for approval in data.get('approvals') or []:
+        try:
+            roles[int(approval.get('employee_id'))] = (approval.get('role') or '').strip()
+        except (AttributeError, TypeError, ValueError):
+            continue
+    default_role = (data.get('role') or '').strip()
+    for employee_id in _bulk_id_list(data, 'employee_ids', cast=int):
+        roles.setdefault(employee_id, default_role)
+    
+    if not roles:
+        return jsonify({'success': False, 'message': 'Please select at least one employee.'}), 400
+    if not all(roles.values()):
+        return jsonify({'success': False, 'message': 'Please select a role for every employee.'}), 400
+    unknown = sorted(set(roles.values()) - set(ASSIGNABLE_EMPLOYEE_ROLES))
+    if unknown:
+        return jsonify({'success': False, 'message': f'Unknown role(s): {", ".join(unknown)}.'}), 400
+    
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'success': False, 'message': 'Database connection error.'}), 500
+    
+    results = []
+    message_ids = []
+    try:
+        render_email = employee_approval_email_renderer()
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT id, employee_id, full_name, email, status
+                FROM employees 
+                WHERE id IN %s
+                FOR UPDATE
+            """, (tuple(roles),))
+            employees = {row['id']: row for row in cursor.fetchall()}
+            
+            for employee_id, role in roles.items():
+                employee = employees.get(employee_id)
+                if not employee:
+                    results.append({'id': employee_id, 'status': 'not_found', 'email': None})
+                    continue
+                if employee.get('status') == 'active':
+                    results.append({'id': employee_id, 'name': employee.get('full_name'),
+                                    'status': 'skipped', 'message': 'Already active', 'email': None})
+                    continue
+                
+                cursor.execute("""
+                    UPDATE employees 
+                    SET status = 'active', role = %s, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                """, (role, employee_id))
+                
+                result = {'id': employee_id, 'name': employee.get('full_name'), 'role': role,
+                          'status': 'approved', 'email': None}
+                if employee.get('email'):
+                    subject, html_body, text_body = render_email(
+                        employee.get('full_name'), employee.get('employee_id'), role
+                    )
+                    outbox_id = enqueue_email(cursor, employee.get('email'), subject, html_body, text_body,
+                                              category='employee_approval')
+                    message_ids.append(outbox_id)
+                    result.update({'email': 'pending', 'recipient': employee.get('email'), 'outbox_id': outbox_id})
+                results.append(result)
+        
+        # Approvals and their notifications commit together
+        connection.commit()
+    except Exception as e:
+        staff_log.error("Error bulk approving employees: %s", e)
+        connection.rollback()
+        return jsonify({'success': False, 'message': 'An error occurred while approving the employees.'}), 500
+    finally:
+        connection.close()
+    
+    _deliver_bulk_emails(message_ids)
+    
+    approved = sum(1 for result in results if result['status'] == 'approved')
+    return jsonify({
+        'success': True,
+        'message': f'{approved} employee(s) approved, {len(message_ids)} notification email(s) queued.',
+        'approved': approved,
+        'results': results
+    })
+
+@app.route('/email-outbox/status')
+@login_required
+def email_outbox_status():
+    """Per-recipient delivery status of queued emails, e.g. after a bulk approval"""
+    user_role = session.get('role', '').lower()
+    employee_roles = ['employee', 'super admin', 'principal', 'deputy principal', 'academic coordinator', 
+                     'teachers', 'accountant', 'librarian', 'warden', 'transport manager', 'technician']
+    
+    if user_role not in employee_roles:
+        return jsonify({'success': False, 'message': 'Access denied.'}), 403
+    
+    message_ids = _bulk_id_list({'ids': request.args.get('ids', '').split(',')}, 'ids', cast=int)[:500]
+    
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'success': False, 'message': 'Database connection error.'}), 500
+    
+    try:
+        with connection.cursor() as cursor:
+            statuses = message_statuses(cursor, message_ids)
+        return jsonify({
+            'success': True,
+            'messages': [{
+                'id': message_id,
+                'recipient': row['recipient'],
+                'status': row['status'],
+                'attempts': row['attempts'],
+                'error': row['last_error'],
+                'sent_at': row['sent_at'].isoformat() if row['sent_at'] else None
+            } for message_id, row in statuses.items()]
+        })
+    except Exception as e:
+        email_log.error("Error loading email outbox status: %s", e)
+        return jsonify({'success': False, 'message': 'Error loading email status.'}), 500
+    finally:
+        connection.close()
+
 # Profile and Settings Routes
 @app.route('/profile/<role>')
 @login_required
@@ -9539,7 +8811,7 @@ def profile(role):
                     if employee:
                         user_data = employee
             except Exception as e:
-                print(f"Error fetching employee data: {e}")
+                staff_log.error("Error fetching employee data: %s", e)
             finally:
                 connection.close()
         
@@ -9562,7 +8834,7 @@ def profile(role):
                     if user:
                         user_data = user
             except Exception as e:
-                print(f"Error fetching user data: {e}")
+                staff_log.error("Error fetching user data: %s", e)
             finally:
                 connection.close()
         
@@ -9677,7 +8949,7 @@ def update_employee_profile():
                             try:
                                 os.remove(old_file_path)
                             except Exception as e:
-                                print(f"Error deleting old profile picture: {e}")
+                                staff_log.error("Error deleting old profile picture: %s", e)
                     
                     # Update session with new profile picture
                     session['profile_picture'] = profile_picture
@@ -9696,9 +8968,7 @@ def update_employee_profile():
                 
                 flash('Profile updated successfully!', 'success')
         except Exception as e:
-            print(f"Error updating employee profile: {e}")
-            import traceback
-            traceback.print_exc()
+            staff_log.exception("Error updating employee profile: %s", e)
             connection.rollback()
             flash('An error occurred while updating your profile. Please try again.', 'error')
         finally:
@@ -9759,7 +9029,7 @@ def update_password(role):
                     else:
                         flash('Current password is incorrect.', 'error')
             except Exception as e:
-                print(f"Error updating password: {e}")
+                staff_log.error("Error updating password: %s", e)
                 connection.rollback()
                 flash('An error occurred while updating your password. Please try again.', 'error')
             finally:
@@ -9813,7 +9083,7 @@ def update_password(role):
                     else:
                         flash('Current password is incorrect.', 'error')
             except Exception as e:
-                print(f"Error updating password: {e}")
+                staff_log.error("Error updating password: %s", e)
                 connection.rollback()
                 flash('An error occurred while updating your password. Please try again.', 'error')
             finally:
@@ -10024,7 +9294,7 @@ def system_settings():
                     """)
                     results = cursor.fetchall()
                     
-                    print(f"DEBUG: Query returned {len(results) if results else 0} rows")
+                    settings_log.debug("Academic levels query returned %s rows", len(results) if results else 0)
                     
                     if results:
                         for row in results:
@@ -10039,22 +9309,18 @@ def system_settings():
                                 'updated_at': row.get('updated_at')
                             }
                             academic_levels.append(level_data)
-                        print(f"OK: Successfully fetched {len(academic_levels)} academic level(s)")
+                        settings_log.debug("Successfully fetched %s academic level(s)", len(academic_levels))
                     else:
-                        print("Info: No academic levels found in database (table exists but is empty)")
+                        settings_log.debug("No academic levels found in database (table exists but is empty)")
                 except pymysql.err.ProgrammingError as e:
                     # Table doesn't exist (error 1146)
                     error_code = e.args[0] if e.args else 0
                     if error_code == 1146 or "doesn't exist" in str(e).lower():
-                        print("Warning: Academic levels table does not exist yet")
+                        settings_log.warning("Academic levels table does not exist yet")
                     else:
-                        print(f"Warning: SQL Error: {e}")
-                        import traceback
-                        traceback.print_exc()
+                        settings_log.exception("SQL error fetching academic levels: %s", e)
                 except Exception as e:
-                    print(f"Warning: Error fetching academic levels: {e}")
-                    import traceback
-                    traceback.print_exc()
+                    settings_log.exception("Error fetching academic levels: %s", e)
                 
                 # Get academic years
                 try:
@@ -10068,7 +9334,7 @@ def system_settings():
                     """, (today,))
                     if cursor.rowcount > 0:
                         connection.commit()
-                        print(f"OK: Auto-locked {cursor.rowcount} academic year(s) that have ended")
+                        settings_log.debug("Auto-locked %s academic year(s) that have ended", cursor.rowcount)
                     
                     cursor.execute("""
                         SELECT id, year_name, start_date, end_date, status, is_current, is_locked, locked_at
@@ -10118,7 +9384,7 @@ def system_settings():
                         current_academic_year = None
                 except Exception as e:
                     # Tables might not exist yet
-                    print(f"Note: academic_years table may not exist yet: {e}")
+                    settings_log.warning("academic_years table may not exist yet: %s", e)
                     academic_years = []
                 
                 # Get terms with their academic levels
@@ -10184,14 +9450,10 @@ def system_settings():
                         terms.append(term_dict)
                 except Exception as e:
                     # Tables might not exist yet
-                    print(f"Note: terms table may not exist yet: {e}")
+                    settings_log.warning("terms table may not exist yet: %s", e)
                     terms = []
         except Exception as e:
-            print(f"Error fetching data: {e}")
-            print(f"Error type: {type(e).__name__}")
-            print(f"Error args: {e.args}")
-            import traceback
-            traceback.print_exc()
+            settings_log.exception("Error fetching data: %s", e)
         finally:
             if connection:
                 connection.close()
@@ -10262,6 +9524,18 @@ def system_settings():
         else:
             term['days_remaining'] = None
     
+    # Email delivery status (email_outbox)
+    email_outbox = None
+    connection = get_db_connection()
+    if connection:
+        try:
+            with connection.cursor() as cursor:
+                email_outbox = outbox_summary(cursor)
+        except Exception as e:
+            settings_log.error("Error loading email outbox status: %s", e)
+        finally:
+            connection.close()
+    
     return render_template('dashboards/system_settings.html', 
                          school_data=school_data, 
                          academic_levels=academic_levels,
@@ -10271,7 +9545,37 @@ def system_settings():
                          today=today,
                          is_accountant=is_accountant,
                          theme_settings=theme_settings,
-                         login_settings=login_settings)
+                         login_settings=login_settings,
+                         email_outbox=email_outbox)
+
+@app.route('/system-settings/email-outbox/<int:message_id>/retry', methods=['POST'])
+@login_required
+def retry_outbox_email(message_id):
+    """Re-queue a failed email from the outbox"""
+    if not check_permission_or_role('system_settings', allowed_roles=['technician']):
+        return jsonify({'success': False, 'message': 'You do not have permission to manage email delivery.'}), 403
+    
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'success': False, 'message': 'Database connection error.'}), 500
+    
+    try:
+        with connection.cursor() as cursor:
+            retried = retry_failed_email(cursor, message_id)
+        connection.commit()
+    except Exception as e:
+        connection.rollback()
+        email_log.error("Error retrying email %s: %s", message_id, e)
+        return jsonify({'success': False, 'message': f'Error retrying email: {str(e)}'}), 500
+    finally:
+        connection.close()
+    
+    if not retried:
+        return jsonify({'success': False, 'message': 'Email not found or not in failed state.'}), 404
+    if EMAIL_WORKER_ENABLED:
+        email_worker.start()
+        email_worker.wake()
+    return jsonify({'success': True, 'message': 'Email queued for another delivery attempt.'})
 
 @app.route('/dashboard/employee/academic-settings')
 @login_required
@@ -10345,7 +9649,7 @@ def academic_settings():
                         if year_dict.get('is_current'):
                             current_academic_year = year_dict
                 except Exception as e:
-                    print(f"Note: academic_years table may not exist yet: {e}")
+                    settings_log.warning("academic_years table may not exist yet: %s", e)
                     academic_years = []
                 
                 # Get terms with their academic levels
@@ -10371,10 +9675,10 @@ def academic_settings():
                         }
                         terms.append(term_dict)
                 except Exception as e:
-                    print(f"Note: terms table may not exist yet: {e}")
+                    settings_log.warning("terms table may not exist yet: %s", e)
                     terms = []
         except Exception as e:
-            print(f"Error fetching academic settings: {e}")
+            settings_log.error("Error fetching academic settings: %s", e)
         finally:
             connection.close()
     
@@ -10458,7 +9762,7 @@ def integration_settings():
                         pass
         except Exception as e:
             # Table might not exist yet, that's okay
-            print(f"Integration settings table may not exist: {e}")
+            settings_log.warning("Integration settings table may not exist: %s", e)
         finally:
             connection.close()
     
@@ -10520,90 +9824,40 @@ def database_management():
                 db_result = cursor.fetchone()
                 db_info['name'] = db_result.get('db_name', DB_CONFIG['database']) if db_result else DB_CONFIG['database']
                 
-                # Get total database size
-                cursor.execute("""
-                    SELECT 
-                        ROUND(SUM(data_length + index_length) / 1024 / 1024, 2) AS total_size_mb
-                    FROM information_schema.TABLES 
-                    WHERE table_schema = DATABASE()
-                """)
-                db_size_result = cursor.fetchone()
-                data_analysis['database_size_mb'] = db_size_result.get('total_size_mb', 0) if db_size_result else 0
-                
-                # Get all tables
-                cursor.execute("SHOW TABLES")
-                table_results = cursor.fetchall()
-                data_analysis['total_tables'] = len(table_results)
-                
-                table_stats = []
+                # Table sizes, estimated row counts and columns: two information_schema queries,
+                # cached alongside the health snapshot
+                schema = db_health_cache.get('schema', lambda: {
+                    'tables': table_stats(cursor),
+                    'columns': table_columns(cursor)
+                }, refresh=request.args.get('refresh') == '1')
                 
-                # Get table information
-                for table_result in table_results:
-                    table_name = list(table_result.values())[0] if isinstance(table_result, dict) else table_result[0]
-                    
-                    # Get row count
-                    cursor.execute(f"SELECT COUNT(*) as count FROM `{table_name}`")
-                    count_result = cursor.fetchone()
-                    row_count = count_result.get('count', 0) if count_result else 0
-                    data_analysis['total_records'] += row_count
-                    
-                    # Get table size
-                    cursor.execute(f"""
-                        SELECT 
-                            ROUND(((data_length + index_length) / 1024 / 1024), 2) AS size_mb
-                        FROM information_schema.TABLES 
-                        WHERE table_schema = DATABASE() 
-                        AND table_name = %s
-                    """, (table_name,))
-                    size_result = cursor.fetchone()
-                    size_mb = size_result.get('size_mb', 0) if size_result else 0
-                    data_analysis['total_size_mb'] += size_mb
+                for table in schema['tables']:
+                    data_analysis['total_records'] += table['rows']
+                    data_analysis['total_size_mb'] += table['size_mb']
                     
                     # Track largest table
-                    if row_count > data_analysis['largest_table']['rows']:
+                    if table['rows'] > data_analysis['largest_table']['rows']:
                         data_analysis['largest_table'] = {
-                            'name': table_name,
-                            'rows': row_count,
-                            'size_mb': size_mb
-                        }
-                    
-                    # Store table stats for most active tables
-                    table_stats.append({
-                        'name': table_name,
-                        'rows': row_count,
-                        'size_mb': size_mb
-                    })
-                    
-                    # Get table structure
-                    cursor.execute(f"DESCRIBE `{table_name}`")
-                    columns_result = cursor.fetchall()
-                    
-                    # Convert columns to list of dicts if needed
-                    columns = []
-                    for col in columns_result:
-                        if isinstance(col, dict):
-                            columns.append(col)
-                        else:
-                            # Handle tuple results
-                            columns.append({
-                                'Field': col[0] if len(col) > 0 else '',
-                                'Type': col[1] if len(col) > 1 else '',
-                                'Null': col[2] if len(col) > 2 else '',
-                                'Key': col[3] if len(col) > 3 else '',
-                                'Default': col[4] if len(col) > 4 else None,
-                                'Extra': col[5] if len(col) > 5 else ''
-                            })
+                            'name': table['name'],
+                            'rows': table['rows'],
+                            'size_mb': table['size_mb']
+                        }
                     
                     tables.append({
-                        'name': table_name,
-                        'row_count': row_count,
-                        'size_mb': size_mb,
-                        'columns': columns
+                        'name': table['name'],
+                        'row_count': table['rows'],
+                        'size_mb': table['size_mb'],
+                        'columns': schema['columns'].get(table['name'], [])
                     })
                 
+                data_analysis['total_tables'] = len(tables)
+                data_analysis['database_size_mb'] = round(data_analysis['total_size_mb'], 2)
+                data_analysis['rows_estimated'] = True
+                
                 # Get top 5 most active tables by row count
-                table_stats_sorted = sorted(table_stats, key=lambda x: x['rows'], reverse=True)
-                data_analysis['most_active_tables'] = table_stats_sorted[:5]
+                data_analysis['most_active_tables'] = sorted(
+                    ({'name': t['name'], 'rows': t['row_count'], 'size_mb': t['size_mb']} for t in tables),
+                    key=lambda x: x['rows'], reverse=True)[:5]
                 
                 # Business Metrics - Students
                 try:
@@ -10623,7 +9877,7 @@ def database_management():
                         count = row.get('count', 0) if isinstance(row, dict) else row[1]
                         data_analysis['students_by_status'][status] = count
                 except Exception as e:
-                    print(f"Error fetching students data: {e}")
+                    db_log.error("Error fetching students data: %s", e)
                 
                 # Business Metrics - Employees
                 try:
@@ -10655,7 +9909,7 @@ def database_management():
                         count = row.get('count', 0) if isinstance(row, dict) else row[1]
                         data_analysis['employees_by_status'][status] = count
                 except Exception as e:
-                    print(f"Error fetching employees data: {e}")
+                    db_log.error("Error fetching employees data: %s", e)
                 
                 # Business Metrics - Parents
                 try:
@@ -10663,7 +9917,7 @@ def database_management():
                     result = cursor.fetchone()
                     data_analysis['total_parents'] = result.get('count', 0) if result else 0
                 except Exception as e:
-                    print(f"Error fetching parents data: {e}")
+                    db_log.error("Error fetching parents data: %s", e)
                 
                 # Business Metrics - Academic Levels (Classes)
                 try:
@@ -10679,7 +9933,7 @@ def database_management():
                     result = cursor.fetchone()
                     data_analysis['active_academic_levels'] = result.get('count', 0) if result else 0
                 except Exception as e:
-                    print(f"Error fetching academic levels data: {e}")
+                    db_log.error("Error fetching academic levels data: %s", e)
                 
                 # Business Metrics - Fees
                 try:
@@ -10743,9 +9997,9 @@ def database_management():
                         # student_fees table might not exist
                         pass
                 except Exception as e:
-                    print(f"Error fetching fees data: {e}")
+                    db_log.error("Error fetching fees data: %s", e)
         except Exception as e:
-            print(f"Error fetching database information: {e}")
+            db_log.error("Error fetching database information: %s", e)
             flash('Error loading database information. Please try again.', 'error')
         finally:
             if connection:
@@ -10815,7 +10069,7 @@ def database_backup_restore():
                     except:
                         backup_history = []
         except Exception as e:
-            print(f"Error fetching backup settings: {e}")
+            backup_log.error("Error fetching backup settings: %s", e)
         finally:
             if connection:
                 try:
@@ -10864,183 +10118,215 @@ def database_backup_restore():
         backup_file_info = {'exists': False}
     
     return render_template('dashboards/database_backup_restore.html', 
+                         backup_job_status=backup_job.status(),
+                         backup_files=list_backup_files(BACKUP_FOLDER),
                          backup_settings=backup_settings,
                          backup_history=backup_history,
                          excel_available=EXCEL_AVAILABLE,
                          backup_file_info=backup_file_info)
 
 # Database Backup Export Route
+backup_job = BackupJob(BACKUP_FOLDER)
+
+# Automatic backups: a scheduler thread in each web process (or `python backup_scheduler.py`)
+BACKUP_SCHEDULER_ENABLED = os.environ.get('BACKUP_SCHEDULER_ENABLED', 'True').lower() in ['true', '1', 'yes']
+BACKUP_RETENTION = int(os.environ.get('BACKUP_RETENTION', 7))
+BACKUP_PRE_RESTORE_RETENTION = int(os.environ.get('BACKUP_PRE_RESTORE_RETENTION', 3))
+# Scheduled backups: 'full', 'incremental' or 'differential', with a full snapshot every BACKUP_FULL_EVERY runs
+BACKUP_SCHEDULED_MODE = os.environ.get('BACKUP_SCHEDULED_MODE', 'incremental').lower()
+BACKUP_FULL_EVERY = int(os.environ.get('BACKUP_FULL_EVERY', 7))
+
+def run_database_backup(progress, created_by='System', trigger='manual'):
+    """Export the database to BACKUP_FOLDER and record it; runs outside any request.
+
+    Manual backups refresh database_backup.xlsx with a full export. Scheduled backups
+    write timestamped files chained by watermarks (see db_backup.create_backup); only
+    the newest BACKUP_RETENTION of those are kept, plus the current chain.
+    """
+    fmt = 'xlsx' if EXCEL_AVAILABLE else 'zip'
+    scheduled = trigger == 'scheduled'
+    filename = (lambda mode: scheduled_backup_filename(fmt, mode)) if scheduled else None
+    # A dedicated connection: the export streams for minutes and must not hold a pool slot
+    connection = pymysql.connect(**DB_CONFIG)
+    try:
+        if not acquire_backup_lock(connection):
+            raise BackupInProgressError('Another database backup is already running.')
+        started_at = time.time()
+        try:
+            try:
+                if scheduled:
+                    result = create_backup(connection, BACKUP_FOLDER, fmt=fmt, filename=filename,
+                                           mode=BACKUP_SCHEDULED_MODE, full_every=BACKUP_FULL_EVERY,
+                                           progress=progress)
+                else:
+                    result = export_database(connection, BACKUP_FOLDER, fmt=fmt, progress=progress)
+            except Exception as e:
+                connection.rollback()
+                try:
+                    with connection.cursor() as cursor:
+                        failed_name = scheduled_backup_filename(fmt) if scheduled else f"database_backup.{fmt}"
+                        record_failed_backup(cursor, failed_name, created_by, e, trigger=trigger,
+                                             duration_seconds=round(time.time() - started_at, 2))
+                    connection.commit()
+                except Exception as record_error:
+                    backup_log.error("Error saving backup record: %s", record_error)
+                raise
+            result['duration_seconds'] = round(time.time() - started_at, 2)
+            current_chain = None
+            try:
+                with connection.cursor() as cursor:
+                    backup_id = record_backup(cursor, result, created_by, trigger=trigger)
+                    current_chain = chain_filenames(cursor, result.get('base_backup_id') or backup_id)
+                connection.commit()
+            except Exception as e:
+                connection.rollback()
+                backup_log.error("Error saving backup record: %s", e)
+            if scheduled and current_chain is not None:
+                # Never delete a file the newest backup still depends on
+                removed = prune_backups(BACKUP_FOLDER, BACKUP_RETENTION, protect=current_chain | {result['filename']})
+                if removed:
+                    backup_log.info("Removed %s old scheduled backup(s): %s", len(removed), ', '.join(removed))
+            return result
+        finally:
+            release_backup_lock(connection)
+    finally:
+        connection.close()
+
+def run_scheduled_backup():
+    """Run a due automatic backup in the scheduler's thread; True if it completed"""
+    if backup_job.is_running():
+        backup_log.info("Scheduled backup postponed: another backup is already running")
+        return False
+    return backup_job.run(lambda progress: run_database_backup(progress, 'Automatic backup', trigger='scheduled'),
+                          kind='backup', started_by='Automatic backup')
+
+backup_scheduler = BackupScheduler(_open_pooled_connection, run_scheduled_backup,
+                                   poll_interval=int(os.environ.get('BACKUP_SCHEDULER_INTERVAL', 60)),
+                                   retry_delay=int(os.environ.get('BACKUP_RETRY_DELAY', 300)),
+                                   max_retry_delay=int(os.environ.get('BACKUP_RETRY_MAX_DELAY', 21600)))
+
+@app.before_request
+def start_backup_scheduler():
+    """Run the backup scheduler thread in every web process (unless a separate scheduler is used)"""
+    if BACKUP_SCHEDULER_ENABLED:
+        backup_scheduler.start()
+
 @app.route('/database/backup-export', methods=['POST'])
 @login_required
 def database_backup_export():
-    """Export database to Excel format"""
-    user_role = session.get('role', '').lower()
-    employee_id = session.get('employee_id') or session.get('user_id')
-    
-    # Check permission OR role-based access
+    """Start a database export in the background; progress is polled from backup-export/status"""
     has_access = check_permission_or_role('manage_backups', 
                                          allowed_roles=['technician', 'principal'])
+    wants_json = request.is_json or request.accept_mimetypes.best == 'application/json'
     
     if not has_access:
+        if wants_json:
+            return jsonify({'success': False, 'message': 'You do not have permission to perform this action.'}), 403
         flash('You do not have permission to perform this action.', 'error')
         return redirect(url_for('dashboard_employee'))
     
-    connection = get_db_connection()
-    if not connection:
-        flash('Database connection error.', 'error')
-        return redirect(url_for('database_backup_restore'))
+    created_by = session.get('full_name', 'Unknown')
+    started = backup_job.start(lambda progress: run_database_backup(progress, created_by),
+                               kind='backup', started_by=created_by)
+    message = ('Database backup started. This page shows its progress.' if started
+               else 'A database backup is already running.')
     
+    if wants_json:
+        return jsonify({'success': started, 'message': message, 'status': backup_job.status()}), (202 if started else 409)
+    flash(message, 'success' if started else 'info')
+    return redirect(url_for('database_backup_restore'))
+
+@app.route('/database/backup-export/status')
+@login_required
+def database_backup_export_status():
+    """Progress of the running (or last) database export"""
+    has_access = check_permission_or_role('manage_backups', 
+                                         allowed_roles=['technician', 'principal'])
+    if not has_access:
+        return jsonify({'success': False, 'message': 'Access denied.'}), 403
+    return jsonify({'success': True, 'status': backup_job.status()})
+
+# Restoring these would rewrite the backup chain or the applied-migration state, or re-send
+# emails that were still queued when the backup was taken
+RESTORE_EXCLUDED_TABLES = ('audit_log', 'backup_history', 'backup_settings', 'database_health_samples', 'migrations',
+                           'schema_state', 'email_outbox')
+
+def take_pre_restore_backup(connection, created_by):
+    """Full export of the live data before a restore empties it; returns the backup's file name.
+
+    It is recorded in backup_history without watermarks, so it never becomes the base
+    of a scheduled incremental chain. Pre-restore snapshots do not count against
+    BACKUP_RETENTION; the newest BACKUP_PRE_RESTORE_RETENTION of them are kept.
+    """
+    result = export_database(connection, BACKUP_FOLDER, fmt='zip', filename=pre_restore_backup_filename('zip'))
+    with connection.cursor() as cursor:
+        record_backup(cursor, result, created_by)
+    connection.commit()
+    backup_log.info("Pre-restore backup written to %s (%s records)", result['filename'], result['record_count'])
+    removed = prune_backups(BACKUP_FOLDER, BACKUP_PRE_RESTORE_RETENTION, protect={result['filename']},
+                            pattern=PRE_RESTORE_BACKUP_RE)
+    if removed:
+        backup_log.info("Removed %s old pre-restore backup(s): %s", len(removed), ', '.join(removed))
+    return result['filename']
+
+def run_database_restore(progress, filename, dry_run=False, started_by='System'):
+    """Restore a backup archive (and the chain it builds on); runs outside any request"""
+    from db_restore import RestoreFailedError, restore_backup
+    connection = pymysql.connect(**DB_CONFIG)
     try:
-        with connection.cursor() as cursor:
-            # Get all tables
-            cursor.execute("SHOW TABLES")
-            table_results = cursor.fetchall()
-            total_tables = len(table_results)
-            total_records = 0
-            
-            if EXCEL_AVAILABLE:
-                # Create Excel workbook
-                wb = Workbook()
-                wb.remove(wb.active)  # Remove default sheet
-                
-                # Export each table to a separate sheet
-                for table_result in table_results:
-                    table_name = list(table_result.values())[0] if isinstance(table_result, dict) else table_result[0]
-                    
-                    # Create sheet for this table
-                    ws = wb.create_sheet(title=table_name[:31])  # Excel sheet name limit
-                    
-                    # Get table data
-                    cursor.execute(f"SELECT * FROM `{table_name}`")
-                    columns = [desc[0] for desc in cursor.description]
-                    rows = cursor.fetchall()
-                    total_records += len(rows)
-                    
-                    # Write headers
-                    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-                    header_font = Font(bold=True, color="FFFFFF")
-                    
-                    for col_idx, col_name in enumerate(columns, 1):
-                        cell = ws.cell(row=1, column=col_idx, value=col_name)
-                        cell.fill = header_fill
-                        cell.font = header_font
-                        cell.alignment = Alignment(horizontal="center", vertical="center")
-                    
-                    # Write data rows
-                    for row_idx, row_data in enumerate(rows, 2):
-                        for col_idx, value in enumerate(row_data, 1):
-                            if isinstance(value, datetime):
-                                value = value.strftime('%Y-%m-%d %H:%M:%S')
-                            elif value is None:
-                                value = ''
-                            ws.cell(row=row_idx, column=col_idx, value=value)
-                    
-                    # Auto-adjust column widths
-                    for column in ws.columns:
-                        max_length = 0
-                        column_letter = column[0].column_letter
-                        for cell in column:
-                            try:
-                                if len(str(cell.value)) > max_length:
-                                    max_length = len(str(cell.value))
-                            except:
-                                pass
-                        adjusted_width = min(max_length + 2, 50)
-                        ws.column_dimensions[column_letter].width = adjusted_width
-                
-                # Save to file on server (fixed filename that gets updated)
-                filename = "database_backup.xlsx"
-                filepath = os.path.join(BACKUP_FOLDER, filename)
-                
-                # Save workbook to file
-                wb.save(filepath)
-                file_size = os.path.getsize(filepath)
-                
-                # Save backup record
-                try:
-                    with connection.cursor() as cursor2:
-                        # Create backup_history table if it doesn't exist
-                        cursor2.execute("""
-                            CREATE TABLE IF NOT EXISTS backup_history (
-                                id INT AUTO_INCREMENT PRIMARY KEY,
-                                filename VARCHAR(255) NOT NULL,
-                                file_path VARCHAR(500),
-                                file_size BIGINT,
-                                table_count INT,
-                                record_count INT,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                created_by VARCHAR(255)
-                            )
-                        """)
-                        connection.commit()
-                        
-                        # Insert backup record
-                        cursor2.execute("""
-                            INSERT INTO backup_history (filename, file_path, file_size, table_count, record_count, created_by)
-                            VALUES (%s, %s, %s, %s, %s, %s)
-                        """, (filename, filepath, file_size, total_tables, total_records, session.get('full_name', 'Unknown')))
-                        connection.commit()
-                        
-                        # Update last_backup in settings
-                        cursor2.execute("""
-                            UPDATE backup_settings 
-                            SET last_backup = NOW() 
-                            WHERE id = (SELECT id FROM (SELECT id FROM backup_settings ORDER BY id DESC LIMIT 1) AS tmp)
-                        """)
-                        connection.commit()
-                except Exception as e:
-                    print(f"Error saving backup record: {e}")
-                
-                flash('Database backup updated successfully!', 'success')
-                return redirect(url_for('database_backup_restore'))
-            else:
-                # Fallback to CSV (zip multiple files)
-                import zipfile
-                from io import StringIO
-                
-                zip_buffer = BytesIO()
-                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                    for table_result in table_results:
-                        table_name = list(table_result.values())[0] if isinstance(table_result, dict) else table_result[0]
-                        
-                        cursor.execute(f"SELECT * FROM `{table_name}`")
-                        columns = [desc[0] for desc in cursor.description]
-                        rows = cursor.fetchall()
-                        total_records += len(rows)
-                        
-                        # Create CSV in memory
-                        csv_buffer = StringIO()
-                        writer = csv.writer(csv_buffer)
-                        writer.writerow(columns)
-                        for row in rows:
-                            writer.writerow([str(v) if v is not None else '' for v in row])
-                        
-                        zip_file.writestr(f"{table_name}.csv", csv_buffer.getvalue())
-                
-                # Save to file on server (fixed filename that gets updated)
-                filename = "database_backup.zip"
-                filepath = os.path.join(BACKUP_FOLDER, filename)
-                
-                with open(filepath, 'wb') as f:
-                    f.write(zip_buffer.getvalue())
-                
-                file_size = os.path.getsize(filepath)
-                
-                flash('Database backup updated successfully!', 'success')
-                return redirect(url_for('database_backup_restore'))
-                
-    except Exception as e:
-        print(f"Error exporting database: {e}")
-        import traceback
-        traceback.print_exc()
-        flash(f'Error exporting database: {str(e)}', 'error')
-        return redirect(url_for('database_backup_restore'))
-    finally:
-        if connection:
+        if not acquire_backup_lock(connection):
+            raise BackupInProgressError('A database backup or restore is already running.')
+        try:
             try:
-                connection.close()
-            except:
-                pass
+                report = restore_backup(connection, BACKUP_FOLDER, filename, dry_run=dry_run,
+                                        exclude=RESTORE_EXCLUDED_TABLES, progress=progress,
+                                        snapshot=lambda: take_pre_restore_backup(connection,
+                                                                                 f"{started_by} (before restore)"))
+            except RestoreFailedError:
+                # Some tables may already be reloaded: cached pages must not outlive them
+                db_health_cache.invalidate()
+                receipt_cache.clear()
+                raise
+            if not dry_run:
+                db_health_cache.invalidate()
+                receipt_cache.clear()
+            backup_log.info("Database %s from %s: %s rows in %ss (%s rows/s)", 'restore check' if dry_run else 'restore',
+                            filename, report['rows'], report['seconds'], report['rows_per_second'])
+            return report
+        finally:
+            release_backup_lock(connection)
+    finally:
+        connection.close()
+
+@app.route('/database/backup-restore/restore', methods=['POST'])
+@login_required
+def database_restore():
+    """Start restoring (or, with dry_run, verifying) a backup file in the background"""
+    has_access = check_permission_or_role('manage_backups', 
+                                         allowed_roles=['technician', 'principal'])
+    if not has_access:
+        return jsonify({'success': False, 'message': 'You do not have permission to perform this action.'}), 403
+    
+    data = request.get_json(silent=True) or request.form
+    filename = (data.get('filename') or '').strip()
+    dry_run = str(data.get('dry_run', '')).lower() in ['true', '1', 'yes', 'on']
+    
+    # Only archives listed in the backup folder can be restored
+    if filename not in {f['filename'] for f in list_backup_files(BACKUP_FOLDER)}:
+        return jsonify({'success': False, 'message': 'Backup file not found.'}), 404
+    
+    started_by = session.get('full_name', 'Unknown')
+    started = backup_job.start(lambda progress: run_database_restore(progress, filename, dry_run, started_by),
+                               kind='restore', filename=filename, dry_run=dry_run, started_by=started_by)
+    if not started:
+        return jsonify({'success': False, 'message': 'A database backup or restore is already running.',
+                        'status': backup_job.status()}), 409
+    backup_log.info("Database %s of %s started by %s", 'restore check' if dry_run else 'restore', filename, started_by)
+    return jsonify({
+        'success': True,
+        'message': 'Restore check started.' if dry_run else 'Database restore started.',
+        'status': backup_job.status()
+    }), 202
 
 # Database Backup Settings Route
 @app.route('/database/backup-settings', methods=['POST'])
@@ -11084,13 +10370,8 @@ def database_backup_settings():
             
             # Calculate next backup time
             next_backup = None
-            if auto_backup:
-                if frequency == 'daily':
-                    next_backup = datetime.now() + timedelta(days=1)
-                elif frequency == 'weekly':
-                    next_backup = datetime.now() + timedelta(weeks=1)
-                elif frequency == 'monthly':
-                    next_backup = datetime.now() + timedelta(days=30)
+            if auto_backup and frequency in BACKUP_FREQUENCIES:
+                next_backup = datetime.now() + BACKUP_FREQUENCIES[frequency]
             
             # Check if settings exist
             cursor.execute("SELECT COUNT(*) as count FROM backup_settings")
@@ -11116,7 +10397,7 @@ def database_backup_settings():
             connection.commit()
             flash('Backup settings updated successfully.', 'success')
     except Exception as e:
-        print(f"Error updating backup settings: {e}")
+        backup_log.error("Error updating backup settings: %s", e)
         flash('Error updating backup settings.', 'error')
     finally:
         if connection:
@@ -11127,20 +10408,45 @@ def database_backup_settings():
     
     return redirect(url_for('database_backup_restore'))
 
-# Database Health & Status Route
-@app.route('/database/health-status')
-@login_required
-def database_health_status():
-    """Database health and status analysis page for technicians and principals"""
-    user_role = session.get('role', '').lower()
-    
-    # Only technicians and principals can access this page
-    if user_role not in ['technician', 'principal']:
-        flash('You do not have permission to access this page.', 'error')
-        return redirect(url_for('dashboard_employee'))
-    
-    connection = get_db_connection()
-    health_status = {
+# Health snapshots (information_schema statistics) are cached for DB_HEALTH_CACHE_TTL seconds;
+# ?refresh=1 on the pages rebuilds them
+db_health_cache = HealthCache(ttl=int(os.environ.get('DB_HEALTH_CACHE_TTL', 300)))
+
+# Health history: a sample every DB_HEALTH_SAMPLE_INTERVAL seconds in database_health_samples,
+# rolled up to hourly averages after DB_HEALTH_RAW_DAYS and to daily ones after DB_HEALTH_HOURLY_DAYS
+DB_HEALTH_SAMPLING_ENABLED = os.environ.get('DB_HEALTH_SAMPLING_ENABLED', 'True').lower() in ['true', '1', 'yes']
+health_sampler = HealthSampler(_open_pooled_connection,
+                               interval=int(os.environ.get('DB_HEALTH_SAMPLE_INTERVAL', 900)),
+                               raw_days=int(os.environ.get('DB_HEALTH_RAW_DAYS', 2)),
+                               hourly_days=int(os.environ.get('DB_HEALTH_HOURLY_DAYS', 60)))
+
+# Tables whose growth is forecast on the health page, and the sizes (MB) to forecast
+GROWTH_FORECAST_TABLES = ('student_payments', 'student_payment_audit', 'employee_salary_audits', 'audit_log')
+GROWTH_THRESHOLDS_MB = tuple(int(mb) for mb in os.environ.get('DB_GROWTH_THRESHOLDS_MB', '100,500').split(',') if mb.strip())
+
+@app.before_request
+def start_health_sampler():
+    """Run the health sampler thread in every web process (samples are taken once per interval)"""
+    if DB_HEALTH_SAMPLING_ENABLED:
+        health_sampler.start()
+
+# Unified audit log: months older than AUDIT_HOT_MONTHS are moved from audit_log to
+# gzipped files in AUDIT_ARCHIVE_FOLDER (one per month) by an archiver thread
+AUDIT_ARCHIVE_ENABLED = os.environ.get('AUDIT_ARCHIVE_ENABLED', 'True').lower() in ['true', '1', 'yes']
+AUDIT_ARCHIVE_FOLDER = os.environ.get('AUDIT_ARCHIVE_FOLDER', os.path.join(app.root_path, 'audit_archives'))
+audit_archiver = AuditArchiver(lambda: pymysql.connect(**DB_CONFIG), AUDIT_ARCHIVE_FOLDER,
+                               hot_months=int(os.environ.get('AUDIT_HOT_MONTHS', 12)),
+                               interval=int(os.environ.get('AUDIT_ARCHIVE_INTERVAL', 21600)))
+
+@app.before_request
+def start_audit_archiver():
+    """Run the audit archiver thread in every web process (one at a time holds its lock)"""
+    if AUDIT_ARCHIVE_ENABLED:
+        audit_archiver.start()
+
+def _unavailable_health_status(message):
+    """Health snapshot shown when the database cannot be analysed"""
+    return {
         'connection_status': False,
         'overall_status': 'critical',
         'db_name': '',
@@ -11154,166 +10460,42 @@ def database_health_status():
         'index_size_mb': 0,
         'total_tables': 0,
         'total_records': 0,
+        'rows_estimated': False,
         'tables': [],
         'largest_tables': [],
-        'recommendations': []
+        'recommendations': [message]
     }
+
+# Database Health & Status Route
+@app.route('/database/health-status')
+@login_required
+def database_health_status():
+    """Database health and status analysis page for technicians and principals"""
+    user_role = session.get('role', '').lower()
+    
+    # Only technicians and principals can access this page
+    if user_role not in ['technician', 'principal']:
+        flash('You do not have permission to access this page.', 'error')
+        return redirect(url_for('dashboard_employee'))
     
+    refresh = request.args.get('refresh') == '1'
+    growth = []
+    connection = get_db_connection()
     if connection:
         try:
-            health_status['connection_status'] = True
             with connection.cursor() as cursor:
-                # Get database name
-                cursor.execute("SELECT DATABASE() as db_name")
-                db_result = cursor.fetchone()
-                health_status['db_name'] = db_result.get('db_name', 'Unknown') if db_result else 'Unknown'
-                
-                # Get MySQL version
-                cursor.execute("SELECT VERSION() as version")
-                version_result = cursor.fetchone()
-                health_status['mysql_version'] = version_result.get('version', 'Unknown') if version_result else 'Unknown'
-                
-                # Get character set and collation
-                cursor.execute("""
-                    SELECT DEFAULT_CHARACTER_SET_NAME, DEFAULT_COLLATION_NAME 
-                    FROM information_schema.SCHEMATA 
-                    WHERE SCHEMA_NAME = DATABASE()
-                """)
-                charset_result = cursor.fetchone()
-                if charset_result:
-                    health_status['character_set'] = charset_result.get('DEFAULT_CHARACTER_SET_NAME', 'Unknown')
-                    health_status['collation'] = charset_result.get('DEFAULT_COLLATION_NAME', 'Unknown')
-                
-                # Get uptime
+                # Sizes, estimated row counts and index counts come from one information_schema
+                # query; the snapshot is cached so repeated views do not touch the database
+                health_status = dict(db_health_cache.get(
+                    'health_status', lambda: build_health_status(cursor), refresh=refresh))
                 try:
-                    cursor.execute("SHOW STATUS LIKE 'Uptime'")
-                    uptime_result = cursor.fetchone()
-                    if uptime_result:
-                        if isinstance(uptime_result, dict):
-                            uptime_seconds = int(uptime_result.get('Value', 0))
-                        elif isinstance(uptime_result, tuple):
-                            uptime_seconds = int(uptime_result[1] if len(uptime_result) > 1 else 0)
-                        else:
-                            uptime_seconds = 0
-                        days = uptime_seconds // 86400
-                        hours = (uptime_seconds % 86400) // 3600
-                        minutes = (uptime_seconds % 3600) // 60
-                        health_status['uptime'] = f"{days}d {hours}h {minutes}m"
-                except:
-                    health_status['uptime'] = 'Unknown'
-                
-                # Get database size
-                cursor.execute("""
-                    SELECT 
-                        ROUND(SUM(data_length + index_length) / 1024 / 1024, 2) AS total_size_mb,
-                        ROUND(SUM(data_length) / 1024 / 1024, 2) AS data_size_mb,
-                        ROUND(SUM(index_length) / 1024 / 1024, 2) AS index_size_mb
-                    FROM information_schema.TABLES 
-                    WHERE table_schema = DATABASE()
-                """)
-                size_result = cursor.fetchone()
-                if size_result:
-                    health_status['database_size_mb'] = size_result.get('total_size_mb', 0) or 0
-                    health_status['data_size_mb'] = size_result.get('data_size_mb', 0) or 0
-                    health_status['index_size_mb'] = size_result.get('index_size_mb', 0) or 0
-                
-                # Get all tables
-                cursor.execute("SHOW TABLES")
-                table_results = cursor.fetchall()
-                health_status['total_tables'] = len(table_results)
-                
-                table_list = []
-                largest_tables = []
-                
-                # Analyze each table
-                for table_result in table_results:
-                    table_name = list(table_result.values())[0] if isinstance(table_result, dict) else table_result[0]
-                    
-                    # Get row count
-                    try:
-                        cursor.execute(f"SELECT COUNT(*) as count FROM `{table_name}`")
-                        count_result = cursor.fetchone()
-                        row_count = count_result.get('count', 0) if count_result else 0
-                        health_status['total_records'] += row_count
-                    except:
-                        row_count = 0
-                    
-                    # Get table size and index count
-                    cursor.execute("""
-                        SELECT 
-                            ROUND(((data_length + index_length) / 1024 / 1024), 2) AS size_mb,
-                            ROUND((data_length / 1024 / 1024), 2) AS data_mb,
-                            ROUND((index_length / 1024 / 1024), 2) AS index_mb
-                        FROM information_schema.TABLES 
-                        WHERE table_schema = DATABASE() 
-                        AND table_name = %s
-                    """, (table_name,))
-                    size_result = cursor.fetchone()
-                    size_mb = size_result.get('size_mb', 0) or 0 if size_result else 0
-                    
-                    # Get index count
-                    cursor.execute(f"SHOW INDEX FROM `{table_name}`")
-                    indexes = cursor.fetchall()
-                    index_count = len(set([idx.get('Key_name', '') if isinstance(idx, dict) else idx[2] if isinstance(idx, tuple) else '' for idx in indexes]))
-                    
-                    # Determine table status
-                    table_status = 'healthy'
-                    if size_mb > 100:  # Large table warning
-                        table_status = 'warning'
-                    if row_count == 0 and size_mb > 0:  # Empty but has size (possible issue)
-                        table_status = 'warning'
-                    
-                    table_info = {
-                        'name': table_name,
-                        'rows': row_count,
-                        'size_mb': size_mb,
-                        'index_count': index_count,
-                        'status': table_status
-                    }
-                    table_list.append(table_info)
-                    largest_tables.append(table_info)
-                
-                # Sort by size
-                largest_tables.sort(key=lambda x: x['size_mb'], reverse=True)
-                health_status['tables'] = sorted(table_list, key=lambda x: x['size_mb'], reverse=True)
-                health_status['largest_tables'] = largest_tables
-                
-                # Determine overall health status
-                issues = 0
-                warnings = 0
-                
-                # Check for large database
-                if health_status['database_size_mb'] > 1000:
-                    warnings += 1
-                    health_status['recommendations'].append(f"Database size is {health_status['database_size_mb']:.2f} MB. Consider archiving old data.")
-                
-                # Check for tables without indexes
-                tables_without_indexes = [t for t in table_list if t['index_count'] == 0 and t['rows'] > 100]
-                if tables_without_indexes:
-                    warnings += 1
-                    health_status['recommendations'].append(f"{len(tables_without_indexes)} table(s) with >100 rows have no indexes. Consider adding indexes for better performance.")
-                
-                # Check for very large tables
-                very_large_tables = [t for t in table_list if t['size_mb'] > 500]
-                if very_large_tables:
-                    warnings += 1
-                    health_status['recommendations'].append(f"{len(very_large_tables)} table(s) exceed 500 MB. Consider partitioning or archiving.")
-                
-                # Determine overall status
-                if issues > 0:
-                    health_status['overall_status'] = 'critical'
-                elif warnings > 0:
-                    health_status['overall_status'] = 'warning'
-                else:
-                    health_status['overall_status'] = 'healthy'
-                
+                    growth = db_health_cache.get('growth_forecast', lambda: growth_forecast(
+                        cursor, GROWTH_FORECAST_TABLES, GROWTH_THRESHOLDS_MB), refresh=refresh)
+                except Exception as e:
+                    db_log.error("Error forecasting table growth: %s", e)
         except Exception as e:
-            print(f"Error analyzing database health: {e}")
-            import traceback
-            traceback.print_exc()
-            health_status['connection_status'] = False
-            health_status['overall_status'] = 'critical'
-            health_status['recommendations'].append(f"Error analyzing database: {str(e)}")
+            db_log.exception("Error analyzing database health: %s", e)
+            health_status = _unavailable_health_status(f"Error analyzing database: {str(e)}")
         finally:
             if connection:
                 try:
@@ -11321,130 +10503,254 @@ def database_health_status():
                 except:
                     pass
     else:
-        health_status['connection_status'] = False
-        health_status['overall_status'] = 'critical'
-        health_status['recommendations'].append("Unable to connect to database. Check database configuration.")
+        health_status = _unavailable_health_status("Unable to connect to database. Check database configuration.")
+    
+    health_status['connection_pool'] = db_pool.stats()
+    
+    log_levels = log_level_store.levels(APP_LOGGERS) if user_role == 'technician' else None
+    return render_template('dashboards/database_health_status.html', health_status=health_status,
+                         growth_forecast=growth,
+                         app_loggers=APP_LOGGERS,
+                         log_levels=log_levels)
+
+@app.route('/database/log-levels', methods=['GET', 'POST'])
+@login_required
+def database_log_levels():
+    """Read or change the diagnostic log level of an app module in every worker process (technicians)"""
+    if session.get('role', '').lower() != 'technician':
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or request.form
+        logger_name = data.get('logger', '')
+        level = (data.get('level') or '').upper() or None
+        if logger_name not in APP_LOGGERS:
+            return jsonify({'success': False, 'message': 'Unknown logger'}), 400
+        if level and level not in ('DEBUG', 'INFO', 'WARNING', 'ERROR'):
+            return jsonify({'success': False, 'message': 'Invalid level'}), 400
+        try:
+            log_level_store.set_level(logger_name, level)
+        except OSError as e:
+            return jsonify({'success': False, 'message': f'Could not save log level: {e}'}), 500
+        settings_log.warning("Log level of %s set to %s by %s", logger_name, level or 'default',
+                             session.get('full_name', 'Unknown'))
+    
+    return jsonify({'success': True, 'loggers': APP_LOGGERS, 'levels': log_level_store.levels(APP_LOGGERS)})
+
+@app.route('/database/health-status/row-counts')
+@login_required
+def database_table_row_counts():
+    """Exact row counts (COUNT(*)) of the requested tables; the health pages show estimates"""
+    if session.get('role', '').lower() not in ['technician', 'principal']:
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    
+    table_names = request.args.getlist('table')
+    if not table_names:
+        return jsonify({'success': False, 'message': 'No tables given'}), 400
     
-    return render_template('dashboards/database_health_status.html', health_status=health_status)
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'success': False, 'message': 'Database connection failed'}), 500
+    try:
+        with connection.cursor() as cursor:
+            counts = exact_row_counts(cursor, table_names)
+        return jsonify({'success': True, 'counts': counts})
+    except Exception as e:
+        db_log.error("Error counting table rows: %s", e)
+        return jsonify({'success': False, 'message': str(e)}), 500
+    finally:
+        connection.close()
+
+# Logs & Audit Trails (the unified audit_log, newest first by (occurred_at, id); see migration 010)
+AUDIT_LOG_PAGE_SIZE = 50
+AUDIT_LOG_MAX_PAGE_SIZE = 200
+AUDIT_SOURCE_LABELS = {
+    'payment': 'Payments',
+    'salary': 'Salaries',
+    'migration': 'Migrations',
+    'backup': 'Backups',
+    'archive': 'Archival'
+}
+
+
+def _can_view_audit_logs():
+    return check_permission_or_role('view_audit_logs', allowed_roles=['technician', 'principal'])
+
+
+def parse_audit_log_filters(args):
+    """Validated audit log filters from request args; raises ValueError with a message for the user"""
+    filters = {
+        'source': args.get('source', '').strip().lower(),
+        'subject': args.get('subject', '').strip(),
+        'date_from': args.get('date_from', '').strip(),
+        'date_to': args.get('date_to', '').strip()
+    }
+    if filters['source'] and filters['source'] not in AUDIT_SOURCES:
+        raise ValueError(f"Invalid source: {filters['source']}")
+    for key in ('date_from', 'date_to'):
+        if filters[key]:
+            try:
+                datetime.strptime(filters[key], '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f'Invalid date: {filters[key]}')
+    return filters
+
+
+def fetch_audit_log_page(cursor, filters, after=None, limit=AUDIT_LOG_PAGE_SIZE):
+    """One page of audit_log, newest first, and the cursor of the next page (None on the last page).
+
+    Each filter has an index ending in (occurred_at, id), and a date range only reads
+    the partitions of its months.
+    """
+    where = []
+    params = []
+    if filters.get('source'):
+        where.append("source = %s")
+        params.append(filters['source'])
+    if filters.get('subject'):
+        where.append("subject_id = %s")
+        params.append(filters['subject'])
+    if filters.get('date_from'):
+        where.append("occurred_at >= %s")
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        where.append("occurred_at < DATE_ADD(%s, INTERVAL 1 DAY)")
+        params.append(filters['date_to'])
+    if after:
+        where.append("(occurred_at < %s OR (occurred_at = %s AND id < %s))")
+        params.extend([after[0], after[0], after[1]])
+    
+    cursor.execute("""
+        SELECT id, occurred_at, source, action, actor_name, subject_id, subject_name,
+               field_name, old_value, new_value, details
+        FROM audit_log
+    """ + (" WHERE " + " AND ".join(where) if where else "")
+                   + " ORDER BY occurred_at DESC, id DESC LIMIT %s",
+                   params + [limit + 1])
+    rows = cursor.fetchall()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_audit_cursor(rows[-1]['occurred_at'], rows[-1]['id'])
+    return [_format_audit_log_row(row) for row in rows], next_cursor
+
+
+def _format_audit_log_row(row):
+    occurred_at = row.get('occurred_at')
+    return {
+        'id': row.get('id'),
+        'occurred_at': occurred_at.strftime('%Y-%m-%d %H:%M:%S') if hasattr(occurred_at, 'strftime') else str(occurred_at or ''),
+        'source': row.get('source', ''),
+        'source_label': AUDIT_SOURCE_LABELS.get(row.get('source'), row.get('source', '')),
+        'action': row.get('action', ''),
+        'actor_name': row.get('actor_name') or 'System',
+        'subject_id': row.get('subject_id') or '',
+        'subject_name': row.get('subject_name') or '',
+        'field_name': row.get('field_name') or '',
+        'old_value': row.get('old_value') or '',
+        'new_value': row.get('new_value') or '',
+        'details': row.get('details') or ''
+    }
+
 
-# Logs & Audit Trails Route
 @app.route('/database/logs-audit-trails')
 @login_required
 def logs_audit_trails():
     """Logs and audit trails page for technicians and principals"""
-    user_role = session.get('role', '').lower()
-    employee_id = session.get('employee_id') or session.get('user_id')
-    
-    # Check permission OR role-based access
-    has_access = check_permission_or_role('view_audit_logs', 
-                                         allowed_roles=['technician', 'principal'])
-    
-    if not has_access:
+    if not _can_view_audit_logs():
         flash('You do not have permission to access this page.', 'error')
         return redirect(url_for('dashboard_employee'))
     
+    try:
+        filters = parse_audit_log_filters(request.args)
+    except ValueError as e:
+        flash(str(e), 'error')
+        filters = parse_audit_log_filters({})
+    
     connection = get_db_connection()
-    salary_audits = []
-    migrations = []
-    backups = []
+    audit_logs = []
+    next_cursor = None
     audit_summary = {
-        'salary_audits_count': 0,
-        'migrations_count': 0,
-        'backups_count': 0,
-        'total_records': 0
+        'counts': {source: 0 for source in AUDIT_SOURCE_LABELS},
+        'total_records': 0,
+        'oldest_event': None,
+        'hot_months': 0,
+        'archives': list_archives(AUDIT_ARCHIVE_FOLDER)
     }
     
     if connection:
         try:
             with connection.cursor() as cursor:
-                # Get salary audits
-                try:
-                    cursor.execute("""
-                        SELECT 
-                            esa.id,
-                            esa.salary_id,
-                            esa.employee_id,
-                            esa.field_name,
-                            esa.old_value,
-                            esa.new_value,
-                            esa.edited_by,
-                            esa.edited_by_name,
-                            esa.edited_at,
-                            e.full_name as employee_name,
-                            e.employee_id as employee_code
-                        FROM employee_salary_audits esa
-                        LEFT JOIN employees e ON esa.employee_id = e.id
-                        ORDER BY esa.edited_at DESC
-                        LIMIT 500
-                    """)
-                    salary_audits = cursor.fetchall()
-                    audit_summary['salary_audits_count'] = len(salary_audits)
-                except Exception as e:
-                    print(f"Error fetching salary audits: {e}")
-                    salary_audits = []
-                
-                # Get migrations
-                try:
-                    cursor.execute("""
-                        SELECT 
-                            id,
-                            migration_name,
-                            status,
-                            applied_at,
-                            execution_time_ms,
-                            applied_by,
-                            error_message
-                        FROM migrations
-                        ORDER BY applied_at DESC
-                        LIMIT 100
-                    """)
-                    migrations = cursor.fetchall()
-                    audit_summary['migrations_count'] = len(migrations)
-                except Exception as e:
-                    print(f"Error fetching migrations: {e}")
-                    migrations = []
-                
-                # Get backup history
-                try:
-                    cursor.execute("""
-                        SELECT 
-                            id,
-                            filename,
-                            file_path,
-                            file_size,
-                            table_count,
-                            record_count,
-                            created_at,
-                            created_by
-                        FROM backup_history
-                        ORDER BY created_at DESC
-                        LIMIT 50
-                    """)
-                    backups = cursor.fetchall()
-                    audit_summary['backups_count'] = len(backups)
-                except Exception as e:
-                    print(f"Error fetching backup history: {e}")
-                    backups = []
-                
-                audit_summary['total_records'] = len(salary_audits) + len(migrations) + len(backups)
-                
+                audit_logs, next_cursor = fetch_audit_log_page(cursor, filters)
+                # Counts of the hot table only: archived months have left it
+                cursor.execute("SELECT source, COUNT(*) AS count FROM audit_log GROUP BY source")
+                for row in cursor.fetchall():
+                    audit_summary['counts'][row['source']] = row['count']
+                audit_summary['total_records'] = sum(audit_summary['counts'].values())
+                cursor.execute("SELECT MIN(occurred_at) AS oldest FROM audit_log")
+                audit_summary['oldest_event'] = cursor.fetchone()['oldest']
+                audit_summary['hot_months'] = len([month for month in monthly_partitions(cursor)
+                                                   if month <= datetime.now().date()])
         except Exception as e:
-            print(f"Error fetching audit trails: {e}")
-            import traceback
-            traceback.print_exc()
+            settings_log.exception("Error fetching audit trails: %s", e)
         finally:
-            if connection:
-                try:
-                    connection.close()
-                except:
-                    pass
+            connection.close()
     
-    return render_template('dashboards/logs_audit_trails.html', 
-                         salary_audits=salary_audits,
-                         migrations=migrations,
-                         backups=backups,
+    return render_template('dashboards/logs_audit_trails.html',
+                         audit_logs=audit_logs,
+                         next_cursor=next_cursor,
+                         filters=filters,
+                         source_labels=AUDIT_SOURCE_LABELS,
                          audit_summary=audit_summary)
 
+@app.route('/database/logs-audit-trails/data')
+@login_required
+def logs_audit_trails_data():
+    """One page of the audit log as JSON (filters and cursor in the query string)"""
+    if not _can_view_audit_logs():
+        return jsonify({'success': False, 'message': 'You do not have permission to view the audit log.'}), 403
+    try:
+        filters = parse_audit_log_filters(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    cursor_token = request.args.get('cursor', '')
+    after = decode_audit_cursor(cursor_token)
+    if cursor_token and after is None:
+        return jsonify({'success': False, 'message': 'Invalid cursor.'}), 400
+    try:
+        limit = int(request.args.get('limit', AUDIT_LOG_PAGE_SIZE))
+    except ValueError:
+        limit = AUDIT_LOG_PAGE_SIZE
+    limit = max(1, min(limit, AUDIT_LOG_MAX_PAGE_SIZE))
+    
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'success': False, 'message': 'Database connection error.'}), 500
+    try:
+        with connection.cursor() as cursor:
+            logs, next_cursor = fetch_audit_log_page(cursor, filters, after, limit)
+    except Exception as e:
+        settings_log.error("Error fetching audit log page: %s", e)
+        return jsonify({'success': False, 'message': 'Error fetching audit logs.'}), 500
+    finally:
+        connection.close()
+    
+    return jsonify({'success': True, 'logs': logs, 'next_cursor': next_cursor})
+
+@app.route('/database/logs-audit-trails/archives/<filename>')
+@login_required
+def download_audit_archive(filename):
+    """Download one archived month of the audit log (gzipped JSON lines)"""
+    if not _can_view_audit_logs():
+        flash('You do not have permission to access this page.', 'error')
+        return redirect(url_for('dashboard_employee'))
+    path = os.path.join(AUDIT_ARCHIVE_FOLDER, filename)
+    if not ARCHIVE_FILENAME_RE.match(filename) or not os.path.isfile(path):
+        flash('Archive not found.', 'error')
+        return redirect(url_for('logs_audit_trails'))
+    return send_file(path, mimetype='application/gzip', as_attachment=True, download_name=filename)
+
 # Users & Roles Route
 @app.route('/users-roles')
 @login_required
@@ -11496,9 +10802,7 @@ def users_roles():
                 summary['total_roles'] = len(employees_by_role)
                 
         except Exception as e:
-            print(f"Error fetching users and roles: {e}")
-            import traceback
-            traceback.print_exc()
+            settings_log.exception("Error fetching users and roles: %s", e)
         finally:
             if connection:
                 try:
@@ -11594,7 +10898,7 @@ def get_employee_permissions(employee_id):
                 """, (employee_id,))
                 employee_permissions = cursor.fetchall()
         except Exception as e:
-            print(f"Error fetching employee permissions: {e}")
+            settings_log.error("Error fetching employee permissions: %s", e)
         finally:
             if connection:
                 try:
@@ -11615,10 +10919,11 @@ def get_employee_permissions(employee_id):
             if employee_role in perm_roles_lower:
                 filtered_permissions.append(perm)
         
-        print(f"DEBUG: Filtered {len(filtered_permissions)} permissions for role '{employee_role}' out of {len(all_permissions)} total")
+        settings_log.debug("Filtered %s permissions for role %r out of %s total", len(filtered_permissions),
+                           employee_role, len(all_permissions))
     else:
         # If role not found, show all permissions (fallback)
-        print(f"DEBUG: Employee role not found, showing all permissions")
+        settings_log.debug("Employee role not found, showing all permissions")
         filtered_permissions = all_permissions
     
     # Convert employee_permissions to list of permission keys
@@ -11681,12 +10986,11 @@ def update_employee_permissions(employee_id):
                     """, (employee_id, permission_key, granted_by))
             
             connection.commit()
+            invalidate_request_permissions()
             return jsonify({'success': True, 'message': 'Permissions updated successfully'})
             
     except Exception as e:
-        print(f"Error updating permissions: {e}")
-        import traceback
-        traceback.print_exc()
+        settings_log.exception("Error updating permissions: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': f'Error updating permissions: {str(e)}'}), 500
     finally:
@@ -11780,12 +11084,13 @@ def update_school_profile():
                           whatsapp_number, school_location))
                 
                 connection.commit()
+                invalidate_school_settings_cache()
+                if school_logo and 'pdf_documents' in sys.modules:
+                    # A new logo: drop the PDF kit's pre-scaled copy (only loaded once a PDF was rendered)
+                    sys.modules['pdf_documents'].invalidate_logo()
                 flash('School profile updated successfully!', 'success')
         except Exception as e:
-            import traceback
-            error_details = traceback.format_exc()
-            print(f"Error updating school profile: {e}")
-            print(f"Full traceback:\n{error_details}")
+            settings_log.exception("Error updating school profile: %s", e)
             connection.rollback()
             flash(f'An error occurred while updating the school profile: {str(e)}. Please try again.', 'error')
         finally:
@@ -11843,9 +11148,10 @@ def add_academic_level():
                 """, (level_category, level_name, level_description, level_status_value))
                 
                 connection.commit()
+                invalidate_school_settings_cache()
                 flash(f'Academic level "{level_name}" added successfully!', 'success')
         except Exception as e:
-            print(f"Error adding academic level: {e}")
+            settings_log.error("Error adding academic level: %s", e)
             connection.rollback()
             flash('An error occurred while adding the academic level. Please try again.', 'error')
         finally:
@@ -11895,13 +11201,14 @@ def toggle_academic_level_status(level_id):
             """, (new_status, level_id))
             
             connection.commit()
+            invalidate_school_settings_cache()
             return jsonify({
                 'success': True, 
                 'message': f'Status updated to {new_status}.',
                 'new_status': new_status
             })
     except Exception as e:
-        print(f"Error updating academic level status: {e}")
+        settings_log.error("Error updating academic level status: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'An error occurred while updating the status.'}), 500
     finally:
@@ -11966,12 +11273,13 @@ def update_academic_level(level_id):
             """, (level_category, level_name, level_description, level_status, level_id))
             
             connection.commit()
+            invalidate_school_settings_cache()
             return jsonify({
                 'success': True, 
                 'message': f'Academic level "{level_name}" updated successfully!'
             })
     except Exception as e:
-        print(f"Error updating academic level: {e}")
+        settings_log.error("Error updating academic level: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'An error occurred while updating the academic level.'}), 500
     finally:
@@ -12017,12 +11325,13 @@ def delete_academic_level(level_id):
             cursor.execute("DELETE FROM academic_levels WHERE id = %s", (level_id,))
             
             connection.commit()
+            invalidate_school_settings_cache()
             return jsonify({
                 'success': True, 
                 'message': f'Academic level "{level_name}" deleted successfully!'
             })
     except Exception as e:
-        print(f"Error deleting academic level: {e}")
+        settings_log.error("Error deleting academic level: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'An error occurred while deleting the academic level.'}), 500
     finally:
@@ -12078,7 +11387,7 @@ def create_academic_year():
             connection.commit()
             flash(f'Academic year "{year_name}" created successfully!', 'success')
     except Exception as e:
-        print(f"Error creating academic year: {e}")
+        settings_log.error("Error creating academic year: %s", e)
         connection.rollback()
         flash('An error occurred while creating the academic year.', 'error')
     finally:
@@ -12151,7 +11460,7 @@ def update_academic_year(year_id):
             connection.commit()
             return jsonify({'success': True, 'message': 'Academic year updated successfully!'})
     except Exception as e:
-        print(f"Error updating academic year: {e}")
+        settings_log.error("Error updating academic year: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'An error occurred while updating the academic year.'}), 500
     finally:
@@ -12206,7 +11515,7 @@ def toggle_suspend_academic_year(year_id):
                 'new_status': new_status
             })
     except Exception as e:
-        print(f"Error toggling academic year suspend status: {e}")
+        settings_log.error("Error toggling academic year suspend status: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'An error occurred while updating the status.'}), 500
     finally:
@@ -12264,7 +11573,7 @@ def toggle_lock_academic_year(year_id):
                 'is_locked': new_locked
             })
     except Exception as e:
-        print(f"Error toggling academic year lock status: {e}")
+        settings_log.error("Error toggling academic year lock status: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'An error occurred while updating the lock status.'}), 500
     finally:
@@ -12324,7 +11633,7 @@ def delete_academic_year(year_id):
                 'message': f'Academic year "{year_name}" deleted successfully!'
             })
     except Exception as e:
-        print(f"Error deleting academic year: {e}")
+        settings_log.error("Error deleting academic year: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'An error occurred while deleting the academic year.'}), 500
     finally:
@@ -12439,7 +11748,7 @@ def create_term():
             connection.commit()
             flash(f'Term "{term_name}" created successfully!', 'success')
     except Exception as e:
-        print(f"Error creating term: {e}")
+        settings_log.error("Error creating term: %s", e)
         connection.rollback()
         flash('An error occurred while creating the term.', 'error')
     finally:
@@ -12597,7 +11906,7 @@ def update_term(term_id):
             connection.commit()
             return jsonify({'success': True, 'message': 'Term updated successfully!'})
     except Exception as e:
-        print(f"Error updating term: {e}")
+        settings_log.error("Error updating term: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'An error occurred while updating the term.'}), 500
     finally:
@@ -12652,7 +11961,7 @@ def delete_term(term_id):
                 'message': f'Term "{term_name}" deleted successfully!'
             })
     except Exception as e:
-        print(f"Error deleting term: {e}")
+        settings_log.error("Error deleting term: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'An error occurred while deleting the term.'}), 500
     finally:
@@ -12709,7 +12018,7 @@ def toggle_term_suspend(term_id):
                 'new_status': new_status
             })
     except Exception as e:
-        print(f"Error toggling term suspend: {e}")
+        settings_log.error("Error toggling term suspend: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'An error occurred while updating the term status.'}), 500
     finally:
@@ -12768,35 +12077,24 @@ def toggle_term_lock(term_id):
                 'is_locked': new_locked
             })
     except Exception as e:
-        print(f"Error toggling term lock: {e}")
+        settings_log.error("Error toggling term lock: %s", e)
         connection.rollback()
         return jsonify({'success': False, 'message': 'An error occurred while updating the term lock status.'}), 500
     finally:
         connection.close()
 
 if __name__ == '__main__':
-    # Initialize database on startup
-    print("Initializing database...")
+    # Initialize the database and run migrations, only when the schema fingerprint changed
     try:
-        if init_db():
-            print("Database initialized successfully!")
+        print("Checking database schema...")
+        from migrations.migration_manager import ensure_schema
+        if ensure_schema(init_db):
+            print("Database schema is up to date.")
         else:
-            print("Database initialization failed. Please check your database configuration.")
+            print("Database initialization or migrations failed. Please check your database configuration.")
             print("The application will continue, but some features may not work correctly.")
     except Exception as e:
-        print(f"Error during database initialization: {e}")
-        import traceback
-        traceback.print_exc()
-        print("The application will continue, but some features may not work correctly.")
-    
-    # Run database migrations automatically on startup
-    try:
-        print("Running database migrations...")
-        from migrations.migration_manager import run_all_migrations
-        run_all_migrations()
-        print("Migrations completed.")
-    except Exception as e:
-        print(f"Warning: Error running migrations: {e}")
+        print(f"Warning: Error checking database schema: {e}")
         import traceback
         traceback.print_exc()
         print("The application will continue, but database may not be up to date.")
@@ -0,0 +1,259 @@
+"""
+App Logging
+Leveled, sampled, non-blocking logging for the application's "school.*" loggers.
+
+Records are put on a bounded in-memory queue by the request thread and written to
+stderr by a listener thread, so a log call never waits on the log file; when the queue
+is full, records are dropped rather than blocking. Every record carries the id of the
+request that produced it. DEBUG/INFO records of a logger can be sampled: a sampled
+request keeps all of its lines, the others keep none.
+
+Levels are set per logger and can be changed at runtime for every worker process
+through a small JSON file (LogLevelStore), without a restart.
+
+Usage:
+    configure_logging(level='WARNING', module_levels={'school.fees': 'DEBUG'},
+                      sample_rates={'school.permissions': 0.01})
+    log = logging.getLogger('school.fees')
+    log.debug("Found %s active terms", len(terms))
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import zlib
+
+
+ROOT_LOGGER = 'school'
+LEVEL_NAMES = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'
+
+request_id_var = contextvars.ContextVar('request_id', default='-')
+
+
+def parse_levels(value):
+    """'school.fees=DEBUG,school.auth=INFO' -> {'school.fees': 'DEBUG', 'school.auth': 'INFO'}"""
+    levels = {}
+    for item in (value or '').split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip().upper() in LEVEL_NAMES:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def parse_rates(value):
+    """'school.permissions=0.01' -> {'school.permissions': 0.01}"""
+    rates = {}
+    for item in (value or '').split(','):
+        name, _, rate = item.partition('=')
+        try:
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            continue
+    return rates
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds the current request id to every record"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of the DEBUG/INFO records of sampled loggers.
+
+    rates maps logger names to the fraction kept; a rate applies to the logger and its
+    children. Records are sampled by request id, so a kept request keeps all its lines.
+    WARNING and above are never dropped.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = dict(rates or {})
+
+    def rate_for(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        if rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        request_id = getattr(record, 'request_id', '-')
+        if request_id == '-':
+            return random.random() < rate
+        return zlib.crc32(request_id.encode()) % 10000 < rate * 10000
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; extra={'fields': {...}} adds structured fields"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of waiting when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _LogPipeline:
+    """The queue handler and its listener thread; restarted in forked worker processes"""
+
+    def __init__(self, target, queue_size):
+        self.target = target
+        self.queue_size = queue_size
+        self.handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+        self.listener = None
+        self.start()
+        if hasattr(os, 'register_at_fork'):
+            # A listener thread does not survive a fork (e.g. Passenger's smart spawning)
+            os.register_at_fork(after_in_child=self.start)
+
+    def start(self):
+        self.handler.queue = queue.Queue(self.queue_size)
+        self.listener = logging.handlers.QueueListener(self.handler.queue, self.target,
+                                                       respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener:
+            self.listener.stop()
+
+
+_pipeline = None
+
+
+def configure_logging(level='WARNING', module_levels=None, sample_rates=None, fmt='text', stream=None,
+                      queue_size=10000):
+    """Route the "school.*" loggers through the non-blocking queue; returns the queue handler"""
+    global _pipeline
+    target = logging.StreamHandler(stream or sys.stderr)
+    target.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger(ROOT_LOGGER)
+    if _pipeline:
+        root.removeHandler(_pipeline.handler)
+        _pipeline.stop()
+    _pipeline = _LogPipeline(target, queue_size)
+    _pipeline.handler.addFilter(RequestContextFilter())
+    _pipeline.handler.addFilter(SamplingFilter(sample_rates))
+
+    root.addHandler(_pipeline.handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
+    for name, module_level in (module_levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+    return _pipeline.handler
+
+
+class LogLevelStore:
+    """Runtime level overrides shared by all worker processes through a JSON file.
+
+    set_level() writes the file; every process calls refresh() (cheap: one stat every
+    poll_interval seconds) and applies changed overrides. Removing an override restores
+    the level the logger had at start-up.
+    """
+
+    def __init__(self, path, poll_interval=5):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._base_levels = {}
+        self._applied = {}
+        self._mtime = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def overrides(self):
+        try:
+            with open(self.path) as f:
+                levels = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {name: level for name, level in levels.items() if level in LEVEL_NAMES}
+
+    def refresh(self, force=False):
+        """Apply the overrides file if it changed since the last check"""
+        now = time.time()
+        if not force and now - self._checked_at < self.poll_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self._mtime and not force:
+            return
+        with self._lock:
+            self._mtime = mtime
+            self._apply(self.overrides())
+
+    def _apply(self, levels):
+        for name in set(self._applied) - set(levels):
+            logging.getLogger(name).setLevel(self._base_levels.pop(name))
+        for name, level in levels.items():
+            logger = logging.getLogger(name)
+            self._base_levels.setdefault(name, logger.level)
+            logger.setLevel(level)
+        self._applied = dict(levels)
+
+    def set_level(self, name, level=None):
+        """Override the level of a logger in every process; level None removes the override"""
+        with self._lock:
+            levels = self.overrides()
+            if level:
+                levels[name] = level.upper()
+            else:
+                levels.pop(name, None)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(levels, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.path)
+        self.refresh(force=True)
+        return levels
+
+    def _default_level(self, name):
+        logger = logging.getLogger(name)
+        level = self._base_levels.get(name, logger.level)
+        return logging.getLevelName(level or logger.parent.getEffectiveLevel())
+
+    def levels(self, names):
+        """{name: {'level', 'default', 'override'}} of the given loggers"""
+        overrides = self.overrides()
+        return {name: {'level': logging.getLevelName(logging.getLogger(name).getEffectiveLevel()),
+                       'default': self._default_level(name),
+                       'override': overrides.get(name)} for name in names}
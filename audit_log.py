@@ -0,0 +1,359 @@
+"""
+Audit Log
+One append-only audit_log table for every audited event: payment and salary changes,
+migrations, backups and the archival runs themselves. Each writer adds its event with
+record_audit() in the same transaction as the change it describes.
+
+audit_log is partitioned by month (RANGE on TO_DAYS(occurred_at), partitions named
+pYYYYMM plus a catch-all pmax; see migration 010). An archiver keeps partitions a few
+months ahead and moves months older than hot_months to gzipped JSON-lines files, one
+per month, then drops their partition, so the hot table stays bounded however many
+years accumulate.
+
+The older per-feature audit tables (student_payment_audit, employee_salary_audits) still
+back the payments audit and salary history pages and are still written alongside
+audit_log. The archiver trims them to the same hot_months: older rows go to their own
+monthly files (e.g. student_payment_audit_2025-01.jsonl.gz) and are deleted.
+
+Usage:
+    record_audit(cursor, 'payment', 'INSERT', actor_id=employee_id, actor_name='...',
+                 subject_id=student_id, new_value='Amount: ...')
+    archiver = AuditArchiver(get_connection, '/path/to/archives', hot_months=12)
+    archiver.start()
+"""
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+from datetime import date, datetime
+
+AUDIT_SOURCES = ('payment', 'salary', 'migration', 'backup', 'archive')
+ARCHIVE_LOCK_NAME = 'audit_log_archive'
+ARCHIVE_BATCH = 5000
+ARCHIVE_FILENAME_RE = re.compile(r'^audit_log_(\d{4})-(\d{2})\.jsonl\.gz$')
+PARTITION_RE = re.compile(r'^p(\d{4})(\d{2})$')
+# (table, timestamp column) of the per-feature audit tables written alongside audit_log
+LEGACY_AUDIT_TABLES = (('student_payment_audit', 'changed_at'), ('employee_salary_audits', 'edited_at'))
+
+log = logging.getLogger('school.db')
+
+
+def record_audit(cursor, source, action, actor_id=None, actor_name=None, subject_id=None, subject_name=None,
+                 field_name=None, old_value=None, new_value=None, details=None, source_id=None, occurred_at=None):
+    """Append one event to audit_log (occurred_at defaults to NOW())"""
+    cursor.execute("""
+        INSERT INTO audit_log (occurred_at, source, action, actor_id, actor_name, subject_id, subject_name,
+                               field_name, old_value, new_value, details, source_id)
+        VALUES (COALESCE(%s, NOW()), %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (occurred_at, source, action, actor_id, actor_name,
+          str(subject_id)[:100] if subject_id is not None else None, subject_name, field_name,
+          old_value, new_value, details, source_id))
+
+
+def month_start(value, offset=0):
+    """First day of value's month, moved offset months"""
+    months = value.year * 12 + value.month - 1 + offset
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"p{month.year:04d}{month.month:02d}"
+
+
+def partition_definition(month):
+    """PARTITION clause holding one month"""
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN (TO_DAYS('{month_start(month, 1).isoformat()}'))"
+
+
+def monthly_partitions(cursor):
+    """{month (first day): partition name} of audit_log, without pmax"""
+    cursor.execute("""
+        SELECT PARTITION_NAME AS name FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'audit_log' AND PARTITION_NAME IS NOT NULL
+    """)
+    partitions = {}
+    for row in cursor.fetchall():
+        match = PARTITION_RE.match(row['name'] or '')
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = row['name']
+    return partitions
+
+
+def ensure_partitions(cursor, months_ahead=2, today=None):
+    """Split pmax so that every month up to months_ahead from now has its own partition.
+
+    Returns the names of the partitions added. pmax only holds rows when maintenance
+    lapsed; reorganizing it then moves them into their months.
+    """
+    this_month = month_start(today or date.today())
+    existing = monthly_partitions(cursor)
+    start = month_start(max(existing), 1) if existing else this_month
+    months = []
+    month = start
+    while month <= month_start(this_month, months_ahead):
+        months.append(month)
+        month = month_start(month, 1)
+    if not months:
+        return []
+    cursor.execute(f"""
+        ALTER TABLE audit_log REORGANIZE PARTITION pmax INTO (
+            {', '.join(partition_definition(month) for month in months)},
+            PARTITION pmax VALUES LESS THAN MAXVALUE
+        )
+    """)
+    return [partition_name(month) for month in months]
+
+
+def archive_filename(month):
+    return f"audit_log_{month.year:04d}-{month.month:02d}.jsonl.gz"
+
+
+def list_archives(folder):
+    """Archived months, newest first: [{'filename', 'month', 'size', 'modified'}]"""
+    archives = []
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return archives
+    for name in names:
+        match = ARCHIVE_FILENAME_RE.match(name)
+        if not match:
+            continue
+        stat = os.stat(os.path.join(folder, name))
+        archives.append({'filename': name, 'month': f"{match.group(1)}-{match.group(2)}", 'size': stat.st_size,
+                         'modified': datetime.fromtimestamp(stat.st_mtime)})
+    return sorted(archives, key=lambda archive: archive['month'], reverse=True)
+
+
+def _partition_count(cursor, partition):
+    cursor.execute(f"SELECT COUNT(*) AS count FROM audit_log PARTITION ({partition})")
+    return cursor.fetchone()['count']
+
+
+def archive_partition(connection, folder, month):
+    """Write one month to folder as gzipped JSON lines, then drop its partition.
+
+    The file is written under a temporary name and only replaces the archive once
+    complete; the partition is dropped only if it still holds exactly the rows written.
+    Returns the number of rows archived, or None when the partition changed meanwhile.
+    """
+    partition = partition_name(month)
+    path = os.path.join(folder, archive_filename(month))
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    written = 0
+    try:
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as archive:
+            after = None
+            while True:
+                with connection.cursor() as cursor:
+                    if after:
+                        cursor.execute(f"""
+                            SELECT * FROM audit_log PARTITION ({partition})
+                            WHERE occurred_at > %s OR (occurred_at = %s AND id > %s)
+                            ORDER BY occurred_at, id LIMIT %s
+                        """, (after[0], after[0], after[1], ARCHIVE_BATCH))
+                    else:
+                        cursor.execute(f"""
+                            SELECT * FROM audit_log PARTITION ({partition})
+                            ORDER BY occurred_at, id LIMIT %s
+                        """, (ARCHIVE_BATCH,))
+                    rows = cursor.fetchall()
+                connection.commit()   # end the read snapshot between batches
+                for row in rows:
+                    archive.write(json.dumps(row, default=str) + '\n')
+                written += len(rows)
+                if len(rows) < ARCHIVE_BATCH:
+                    break
+                after = (rows[-1]['occurred_at'], rows[-1]['id'])
+        with open(temp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        with connection.cursor() as cursor:
+            if _partition_count(cursor, partition) != written:
+                os.remove(temp_path)
+                return None
+            os.replace(temp_path, path)
+            cursor.execute(f"ALTER TABLE audit_log DROP PARTITION {partition}")
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return written
+
+
+def archive_closed_partitions(connection, folder, hot_months=12, today=None):
+    """Archive every month older than the newest hot_months (the current one included).
+
+    Returns [(month 'YYYY-MM', rows archived)]; each archived month is also recorded
+    in audit_log itself.
+    """
+    cutoff = month_start(today or date.today(), -(max(hot_months, 1) - 1))
+    with connection.cursor() as cursor:
+        closed = sorted(month for month in monthly_partitions(cursor) if month < cutoff)
+    os.makedirs(folder, exist_ok=True)
+    archived = []
+    for month in closed:
+        rows = archive_partition(connection, folder, month)
+        if rows is None:
+            log.warning("Audit archive of %s skipped: rows changed while it was being written", f"{month:%Y-%m}")
+            continue
+        with connection.cursor() as cursor:
+            record_audit(cursor, 'archive', 'ARCHIVE', actor_name='Audit archiver', subject_id=f"{month:%Y-%m}",
+                         new_value=archive_filename(month), details=f"{rows:,} event(s) moved to the archive")
+        connection.commit()
+        archived.append((f"{month:%Y-%m}", rows))
+    return archived
+
+
+def legacy_archive_filename(table, month):
+    return f"{table}_{month.year:04d}-{month.month:02d}.jsonl.gz"
+
+
+def archive_legacy_month(connection, folder, table, column, month):
+    """Write one month of a per-feature audit table to folder as gzipped JSON lines, then delete it.
+
+    Same safeguards as archive_partition: the rows are deleted only if the month still
+    holds exactly the rows written. Returns the number of rows archived, or None when
+    the month changed meanwhile.
+    """
+    start, end = month, month_start(month, 1)
+    path = os.path.join(folder, legacy_archive_filename(table, month))
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    written = 0
+    try:
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as archive:
+            after = 0
+            while True:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"""
+                        SELECT * FROM {table}
+                        WHERE {column} >= %s AND {column} < %s AND id > %s
+                        ORDER BY id LIMIT %s
+                    """, (start, end, after, ARCHIVE_BATCH))
+                    rows = cursor.fetchall()
+                connection.commit()   # end the read snapshot between batches
+                for row in rows:
+                    archive.write(json.dumps(row, default=str) + '\n')
+                written += len(rows)
+                if len(rows) < ARCHIVE_BATCH:
+                    break
+                after = rows[-1]['id']
+        if not written:
+            os.remove(temp_path)
+            return 0
+        with open(temp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) AS count FROM {table} WHERE {column} >= %s AND {column} < %s FOR UPDATE",
+                           (start, end))
+            if cursor.fetchone()['count'] != written:
+                connection.rollback()
+                os.remove(temp_path)
+                return None
+            os.replace(temp_path, path)
+            cursor.execute(f"DELETE FROM {table} WHERE {column} >= %s AND {column} < %s", (start, end))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return written
+
+
+def archive_legacy_audit_rows(connection, folder, hot_months=12, today=None):
+    """Archive the months of LEGACY_AUDIT_TABLES older than the newest hot_months.
+
+    Returns [(table, month 'YYYY-MM', rows archived)].
+    """
+    cutoff = month_start(today or date.today(), -(max(hot_months, 1) - 1))
+    os.makedirs(folder, exist_ok=True)
+    archived = []
+    for table, column in LEGACY_AUDIT_TABLES:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT MIN({column}) AS oldest FROM {table} WHERE {column} < %s", (cutoff,))
+            oldest = cursor.fetchone()['oldest']
+        connection.commit()
+        if not oldest:
+            continue
+        month = month_start(oldest)
+        while month < cutoff:
+            rows = archive_legacy_month(connection, folder, table, column, month)
+            if rows is None:
+                log.warning("Archive of %s for %s skipped: rows changed while it was being written",
+                            table, f"{month:%Y-%m}")
+            elif rows:
+                archived.append((table, f"{month:%Y-%m}", rows))
+            month = month_start(month, 1)
+    return archived
+
+
+class AuditArchiver:
+    """Maintains audit_log's partitions every interval seconds.
+
+    get_connection() must return a new DB connection (closed by the archiver). Every web
+    worker may run an archiver: a named lock makes sure only one of them reorganizes or
+    drops partitions at a time.
+    """
+
+    def __init__(self, get_connection, folder, hot_months=12, months_ahead=2, interval=21600):
+        self.get_connection = get_connection
+        self.folder = folder
+        self.hot_months = hot_months
+        self.months_ahead = months_ahead
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the background thread (once per process; restarts after a fork)"""
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name='audit-archiver', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception:
+                log.exception("Audit archiver error")
+            self._stop.wait(self.interval)
+
+    def run_pending(self):
+        """Add upcoming partitions and archive closed ones; returns False if another worker holds the lock"""
+        connection = self.get_connection()
+        if not connection:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT GET_LOCK(%s, 0) AS acquired", (ARCHIVE_LOCK_NAME,))
+                row = cursor.fetchone()
+                if not row or not row['acquired']:
+                    return False
+            try:
+                with connection.cursor() as cursor:
+                    added = ensure_partitions(cursor, self.months_ahead)
+                if added:
+                    log.info("Added audit_log partition(s): %s", ', '.join(added))
+                for month, rows in archive_closed_partitions(connection, self.folder, self.hot_months):
+                    log.info("Archived %s audit event(s) of %s", rows, month)
+                for table, month, rows in archive_legacy_audit_rows(connection, self.folder, self.hot_months):
+                    log.info("Archived %s %s row(s) of %s", rows, table, month)
+                return True
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (ARCHIVE_LOCK_NAME,))
+        finally:
+            connection.close()
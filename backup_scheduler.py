@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+Run the automatic backup scheduler as a separate process
+Usage: python backup_scheduler.py
+
+Set BACKUP_SCHEDULER_ENABLED=false for the web app when this process runs the backups,
+otherwise every web worker also runs its own scheduler thread.
+"""
+import logging
+
+from app import backup_scheduler
+
+log = logging.getLogger('school.backup')
+
+if __name__ == '__main__':
+    log.info("Backup scheduler started")
+    try:
+        backup_scheduler.run_forever()
+    except KeyboardInterrupt:
+        log.info("Backup scheduler stopped")
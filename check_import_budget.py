@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Check that the app still starts cheaply
+Usage: python check_import_budget.py [--budget-ms 2000] [--requests]
+
+Imports app.py in a fresh interpreter and fails (exit code 1) when the import takes
+longer than the budget (IMPORT_BUDGET_MS, default 2000 ms) or when it loads one of the
+subsystems that are meant to load on first use: reportlab/PDF documents, openpyxl,
+Flask-Mail, dateutil and the restore module. With --requests, / and /login are also
+fetched through the test client (needs the database) and must not load them either.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+LAZY_MODULES = ('reportlab', 'openpyxl', 'flask_mail', 'dateutil', 'pdf_documents', 'db_restore')
+RESULT_MARKER = 'IMPORT_BUDGET_RESULT '
+
+CHILD_CODE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+import_ms = round((time.perf_counter() - started) * 1000, 1)
+lazy = %(lazy)r
+loaded = lambda: sorted(name for name in lazy if name in sys.modules)
+result = {'import_ms': import_ms, 'loaded_at_import': loaded()}
+if %(requests)r:
+    client = app.app.test_client()
+    result['status'] = {path: client.get(path).status_code for path in ('/', '/login')}
+    result['loaded_after_requests'] = loaded()
+print(%(marker)r + json.dumps(result))
+"""
+
+
+def measure(with_requests=False):
+    """Import the app in a new interpreter; returns the child's result dict"""
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    code = CHILD_CODE % {'lazy': LAZY_MODULES, 'requests': with_requests, 'marker': RESULT_MARKER}
+    completed = subprocess.run([sys.executable, '-c', code], cwd=project_dir, capture_output=True, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    raise RuntimeError(f"Importing app failed:\n{completed.stderr[-4000:]}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('IMPORT_BUDGET_MS', 2000)))
+    parser.add_argument('--requests', action='store_true', help='also request / and /login')
+    args = parser.parse_args()
+
+    result = measure(args.requests)
+    failures = []
+    print(f"app import: {result['import_ms']} ms (budget {args.budget_ms:.0f} ms)")
+    if result['import_ms'] > args.budget_ms:
+        failures.append(f"import took {result['import_ms']} ms, over the {args.budget_ms:.0f} ms budget")
+    if result['loaded_at_import']:
+        failures.append(f"loaded at import: {', '.join(result['loaded_at_import'])}")
+    if args.requests:
+        print(f"requests: {result['status']}")
+        if result['loaded_after_requests']:
+            failures.append(f"loaded by / and /login: {', '.join(result['loaded_after_requests'])}")
+
+    for failure in failures:
+        print(f"✗ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✓ Start-up within budget")
@@ -0,0 +1,751 @@
+"""
+Database Backup
+Streaming export of every table to an Excel workbook (one sheet per table) or a zip of CSV files.
+
+Rows are read with an unbuffered server-side cursor (SSCursor) and written in chunks,
+so memory stays bounded whatever the table sizes. The file is written next to its
+final path and renamed into place when complete. BackupJob runs an export in a
+background thread and publishes its progress to a status file every web worker can read.
+BackupScheduler starts automatic backups when backup_settings.next_backup is due.
+
+Usage:
+    result = export_database(connection, BACKUP_FOLDER, fmt='xlsx', progress=callback)
+    job = BackupJob(BACKUP_FOLDER)
+    job.start(run)   # run(progress) performs the export and returns its summary
+    BackupScheduler(get_connection, run_scheduled_backup).start()
+"""
+import csv
+import importlib.util
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta
+import pymysql
+
+from audit_log import record_audit
+
+log = logging.getLogger('school.backup')
+
+# openpyxl is only imported when a workbook is actually written (it is slow to import)
+EXCEL_AVAILABLE = importlib.util.find_spec('openpyxl') is not None
+# Control characters rejected by the xlsx format (same set as openpyxl's ILLEGAL_CHARACTERS_RE)
+ILLEGAL_CHARACTERS_RE = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+
+
+CHUNK_SIZE = 2000
+WIDTH_SAMPLE_ROWS = 200      # column widths are estimated from the header and the first rows only
+MAX_COLUMN_WIDTH = 50
+EXCEL_MAX_ROWS = 1048576     # rows per worksheet, header included
+BACKUP_LOCK_NAME = 'school_database_backup'
+BACKUP_FREQUENCIES = {
+    'daily': timedelta(days=1),
+    'weekly': timedelta(weeks=1),
+    'monthly': timedelta(days=30)
+}
+SCHEDULED_BACKUP_RE = re.compile(r'^database_backup_\d{8}_\d{6}(_(full|inc|diff))?\.(xlsx|zip)$')
+# Full snapshots taken before a restore empties the live tables; kept apart from the scheduled files
+PRE_RESTORE_BACKUP_RE = re.compile(r'^database_backup_\d{8}_\d{6}_pre\.(xlsx|zip)$')
+BACKUP_MODE_SUFFIXES = {'full': 'full', 'incremental': 'inc', 'differential': 'diff'}
+
+
+class BackupInProgressError(Exception):
+    """Raised when another process already holds the backup lock"""
+    pass
+
+
+def list_tables(cursor):
+    """Names of every table in the current database"""
+    cursor.execute("SHOW TABLES")
+    return [list(row.values())[0] if isinstance(row, dict) else row[0] for row in cursor.fetchall()]
+
+
+def acquire_backup_lock(connection, timeout=0):
+    """Take the server-wide backup lock on this connection; False if another backup holds it"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, %s) AS acquired", (BACKUP_LOCK_NAME, timeout))
+        row = cursor.fetchone()
+    acquired = row.get('acquired') if isinstance(row, dict) else row[0]
+    return acquired == 1
+
+
+def release_backup_lock(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (BACKUP_LOCK_NAME,))
+        cursor.fetchone()
+
+
+def column_widths(columns, sample_rows):
+    """Excel column widths from the header and a sample of rows"""
+    widths = [len(str(column)) for column in columns]
+    for row in sample_rows:
+        for index, value in enumerate(row):
+            if value is not None:
+                widths[index] = max(widths[index], len(str(value)))
+    return [min(width + 2, MAX_COLUMN_WIDTH) for width in widths]
+
+
+def _excel_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    if isinstance(value, str):
+        # Control characters are rejected by the xlsx format
+        return ILLEGAL_CHARACTERS_RE.sub('', value)
+    return value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    return str(value)
+
+
+def _open_stream(connection, table_name, filters):
+    """Unbuffered cursor positioned on SELECT * FROM table [WHERE ...]; returns (cursor, column names)"""
+    where, params = filters.get(table_name) or (None, ())
+    cursor = connection.cursor(pymysql.cursors.SSCursor)
+    cursor.execute(f"SELECT * FROM `{table_name}`" + (f" WHERE {where}" if where else ""), params)
+    return cursor, [desc[0] for desc in cursor.description]
+
+
+def _write_workbook(connection, tables, path, chunk_size, report, filters):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill, Alignment
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+    header_font = Font(bold=True, color="FFFFFF")
+    header_alignment = Alignment(horizontal="center", vertical="center")
+
+    def add_sheet(title, columns, widths):
+        ws = wb.create_sheet(title=title)
+        # Write-only sheets need their column widths before the first row is appended
+        for index, width in enumerate(widths, 1):
+            ws.column_dimensions[get_column_letter(index)].width = width
+        header = []
+        for column in columns:
+            cell = WriteOnlyCell(ws, value=column)
+            cell.fill = header_fill
+            cell.font = header_font
+            cell.alignment = header_alignment
+            header.append(cell)
+        ws.append(header)
+        return ws
+
+    records = 0
+    table_rows = {}
+    for index, table_name in enumerate(tables):
+        cursor, columns = _open_stream(connection, table_name, filters)
+        table_rows[table_name] = 0
+        try:
+            rows = cursor.fetchmany(WIDTH_SAMPLE_ROWS)
+            widths = column_widths(columns, rows)
+            ws = add_sheet(table_name[:31], columns, widths)  # Excel sheet name limit
+            sheet_rows, part = 1, 1
+            while rows:
+                for row in rows:
+                    if sheet_rows >= EXCEL_MAX_ROWS:
+                        # Tables larger than one worksheet continue on "<table>_2", "<table>_3", ...
+                        part += 1
+                        ws = add_sheet(f"{table_name[:28]}_{part}", columns, widths)
+                        sheet_rows = 1
+                    ws.append([_excel_value(value) for value in row])
+                    sheet_rows += 1
+                records += len(rows)
+                table_rows[table_name] += len(rows)
+                report(table_name, index, records)
+                rows = cursor.fetchmany(chunk_size)
+        finally:
+            cursor.close()
+        report(table_name, index + 1, records)
+    wb.save(path)
+    return table_rows
+
+
+def _write_csv_zip(connection, tables, path, chunk_size, report, filters):
+    records = 0
+    table_rows = {}
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for index, table_name in enumerate(tables):
+            cursor, columns = _open_stream(connection, table_name, filters)
+            table_rows[table_name] = 0
+            try:
+                with zip_file.open(f"{table_name}.csv", 'w', force_zip64=True) as raw, \
+                        io.TextIOWrapper(raw, encoding='utf-8', newline='') as text:
+                    writer = csv.writer(text)
+                    writer.writerow(columns)
+                    while True:
+                        rows = cursor.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                        writer.writerows([_csv_value(value) for value in row] for row in rows)
+                        records += len(rows)
+                        table_rows[table_name] += len(rows)
+                        report(table_name, index, records)
+            finally:
+                cursor.close()
+            report(table_name, index + 1, records)
+    return table_rows
+
+
+def export_database(connection, folder, fmt='xlsx', filename=None, chunk_size=CHUNK_SIZE, progress=None,
+                    filters=None):
+    """Export every table to folder/filename, streaming rows in chunks; returns a summary dict.
+
+    fmt is 'xlsx' (needs openpyxl) or 'zip' (one CSV per table). progress, if given, is
+    called as progress(table=..., tables_done=..., total_tables=..., records=...).
+    filters maps a table name to a (where_sql, params) pair restricting its rows.
+    """
+    if fmt == 'xlsx' and not EXCEL_AVAILABLE:
+        fmt = 'zip'
+    with connection.cursor() as cursor:
+        tables = list_tables(cursor)
+    filename = filename or ('database_backup.xlsx' if fmt == 'xlsx' else 'database_backup.zip')
+    filepath = os.path.join(folder, filename)
+    partial_path = filepath + '.part'
+
+    def report(table_name, tables_done, records):
+        if progress:
+            progress(table=table_name, tables_done=tables_done, total_tables=len(tables), records=records)
+
+    writer = _write_workbook if fmt == 'xlsx' else _write_csv_zip
+    try:
+        table_rows = writer(connection, tables, partial_path, chunk_size, report, filters or {})
+        os.replace(partial_path, filepath)
+    except Exception:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+    return {
+        'filename': filename,
+        'filepath': filepath,
+        'file_size': os.path.getsize(filepath),
+        'table_count': len(tables),
+        'record_count': sum(table_rows.values()),
+        'table_rows': table_rows
+    }
+
+
+def watermark_columns(cursor):
+    """Per table, the column that tells which rows changed: {table: (column, 'timestamp'|'id')}.
+
+    updated_at / changed_at catch inserts and updates. An auto-increment id only catches
+    inserts, so it is recorded but never used to filter: tables with an id watermark, or
+    with none, are copied whole by every backup.
+    """
+    cursor.execute("""
+        SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name, DATA_TYPE AS data_type, EXTRA AS extra
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND (COLUMN_NAME IN ('updated_at', 'changed_at') OR EXTRA LIKE '%auto_increment%')
+    """)
+    columns = {}
+    for row in cursor.fetchall():
+        table_name = row['table_name']
+        if row['column_name'] in ('updated_at', 'changed_at') and row['data_type'] in ('timestamp', 'datetime'):
+            if columns.get(table_name, (None, None))[1] != 'timestamp' or row['column_name'] == 'updated_at':
+                columns[table_name] = (row['column_name'], 'timestamp')
+        elif 'auto_increment' in (row['extra'] or '') and table_name not in columns:
+            columns[table_name] = (row['column_name'], 'id')
+    return columns
+
+
+def current_watermarks(cursor, columns):
+    """Highest value of each table's watermark column, in one query: {table: value or None}"""
+    if not columns:
+        return {}
+    parts = [f"SELECT %s AS table_name, CAST(MAX(`{column}`) AS CHAR) AS value FROM `{table_name}`"
+             for table_name, (column, kind) in columns.items()]
+    cursor.execute(" UNION ALL ".join(parts), tuple(columns))
+    return {row['table_name']: row['value'] for row in cursor.fetchall()}
+
+
+def last_backup_chain(cursor):
+    """The newest chained backup and the full backup it builds on: (latest, base), or (None, None)"""
+    cursor.execute("""
+        SELECT id, filename, backup_mode, base_backup_id, watermarks
+        FROM backup_history
+        WHERE status = 'completed' AND watermarks IS NOT NULL
+        ORDER BY id DESC
+        LIMIT 1
+    """)
+    latest = cursor.fetchone()
+    if not latest:
+        return None, None
+    if latest['backup_mode'] == 'full':
+        return latest, latest
+    cursor.execute("""
+        SELECT id, filename, backup_mode, base_backup_id, watermarks
+        FROM backup_history
+        WHERE id = %s AND status = 'completed'
+    """, (latest['base_backup_id'],))
+    base = cursor.fetchone()
+    return (latest, base) if base else (None, None)
+
+
+def plan_backup(cursor, mode='full', full_every=7):
+    """Decide what a chained backup exports.
+
+    mode is 'full', 'incremental' (changes since the previous backup of the chain) or
+    'differential' (changes since the chain's full backup). A full snapshot is taken
+    instead when there is no chain yet or the chain already holds full_every backups.
+    Returns {'mode', 'base', 'parent', 'watermarks', 'since', 'filters'}.
+    """
+    columns = watermark_columns(cursor)
+    values = current_watermarks(cursor, columns)
+    watermarks = {table_name: {'column': column, 'kind': kind, 'value': values.get(table_name)}
+                  for table_name, (column, kind) in columns.items()}
+
+    latest, base = (None, None) if mode == 'full' else last_backup_chain(cursor)
+    if latest and full_every:
+        cursor.execute("SELECT COUNT(*) AS count FROM backup_history WHERE status = 'completed' "
+                       "AND (id = %s OR base_backup_id = %s)", (base['id'], base['id']))
+        if cursor.fetchone()['count'] >= full_every:
+            latest = base = None
+    if not latest:
+        return {'mode': 'full', 'base': None, 'parent': None, 'watermarks': watermarks, 'since': {}, 'filters': {}}
+
+    parent = latest if mode == 'incremental' else base
+    previous = json.loads(parent['watermarks'])
+    since, filters = {}, {}
+    for table_name, mark in watermarks.items():
+        before = previous.get(table_name)
+        if mark['kind'] != 'timestamp':
+            continue  # an id watermark misses updates to existing rows: copied whole
+        if not before or before.get('column') != mark['column'] or before.get('value') is None:
+            continue  # new table or new watermark column: copied whole
+        column, start, end = mark['column'], before['value'], mark['value']
+        since[table_name] = start
+        # Inclusive lower bound: rows changed later in the same second as the last backup are not lost
+        filters[table_name] = (f"`{column}` >= %s AND `{column}` <= %s", (start, end or start))
+    return {'mode': mode, 'base': base, 'parent': parent, 'watermarks': watermarks, 'since': since,
+            'filters': filters}
+
+
+def manifest_path(filepath):
+    """Manifest written next to a chained backup file"""
+    return os.path.splitext(filepath)[0] + '.manifest.json'
+
+
+def create_backup(connection, folder, fmt='xlsx', filename=None, mode='full', full_every=7, progress=None):
+    """Export a full, incremental or differential backup with its manifest; returns the summary.
+
+    Watermarks and rows are read from one consistent snapshot. filename may be a function
+    of the mode actually used (a full snapshot can replace a requested incremental). The
+    summary also carries the chain details record_backup() stores (mode, base/parent ids,
+    watermarks, manifest).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+        plan = plan_backup(cursor, mode, full_every)
+    if callable(filename):
+        filename = filename(plan['mode'])
+    try:
+        result = export_database(connection, folder, fmt=fmt, filename=filename, progress=progress,
+                                 filters=plan['filters'])
+    finally:
+        connection.commit()
+
+    manifest = {
+        'format': 1,
+        'filename': result['filename'],
+        'mode': plan['mode'],
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'base': plan['base']['filename'] if plan['base'] else None,
+        'parent': plan['parent']['filename'] if plan['parent'] else None,
+        # Rows deleted since the base are not in incremental files; the next full snapshot drops them
+        'tables': {
+            table_name: {
+                'rows': rows,
+                'copy': 'changes' if table_name in plan['filters'] else 'full',
+                'watermark': plan['watermarks'].get(table_name),
+                'since': plan['since'].get(table_name)
+            }
+            for table_name, rows in result['table_rows'].items()
+        }
+    }
+    with open(manifest_path(result['filepath']), 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+
+    result.update({
+        'mode': plan['mode'],
+        'base_backup_id': plan['base']['id'] if plan['base'] else None,
+        'parent_backup_id': plan['parent']['id'] if plan['parent'] else None,
+        'watermarks': plan['watermarks'],
+        'manifest': manifest
+    })
+    return result
+
+
+def scheduled_backup_filename(fmt, mode=None, now=None):
+    """Timestamped file name for a scheduled backup, e.g. database_backup_20260101_020000_inc.xlsx"""
+    suffix = f"_{BACKUP_MODE_SUFFIXES[mode]}" if mode in BACKUP_MODE_SUFFIXES else ''
+    return f"database_backup_{(now or datetime.now()).strftime('%Y%m%d_%H%M%S')}{suffix}.{fmt}"
+
+
+def pre_restore_backup_filename(fmt, now=None):
+    """Timestamped file name for the snapshot taken before a restore, e.g. database_backup_20260101_020000_pre.zip"""
+    return f"database_backup_{(now or datetime.now()).strftime('%Y%m%d_%H%M%S')}_pre.{fmt}"
+
+
+def prune_backups(folder, keep, protect=(), pattern=SCHEDULED_BACKUP_RE):
+    """Delete all but the newest `keep` backup files matching pattern (and their manifests).
+
+    pattern defaults to the scheduled backups; pre-restore snapshots are pruned on their
+    own (PRE_RESTORE_BACKUP_RE). Files in protect, e.g. the current chain's full backup
+    and its increments, are always kept. Returns the removed names.
+    """
+    names = sorted((name for name in os.listdir(folder) if pattern.match(name)), reverse=True)
+    removed = []
+    for name in names[max(keep, 1):]:
+        if name in protect:
+            continue
+        try:
+            path = os.path.join(folder, name)
+            os.remove(path)
+            if os.path.exists(manifest_path(path)):
+                os.remove(manifest_path(path))
+            removed.append(name)
+        except OSError:
+            log.exception("Error removing old backup %s", name)
+    return removed
+
+
+def list_backup_files(folder):
+    """Backup archives in the folder, newest first: [{'filename', 'size', 'modified', 'mode'}].
+
+    mode is 'full', 'incremental', 'differential' or 'pre-restore'.
+    """
+    files = []
+    for name in os.listdir(folder):
+        pre_restore = bool(PRE_RESTORE_BACKUP_RE.match(name))
+        if not (pre_restore or SCHEDULED_BACKUP_RE.match(name)
+                or name in ('database_backup.xlsx', 'database_backup.zip')):
+            continue
+        path = os.path.join(folder, name)
+        mode = 'pre-restore' if pre_restore else 'full'
+        if not pre_restore and os.path.exists(manifest_path(path)):
+            try:
+                with open(manifest_path(path)) as f:
+                    mode = json.load(f).get('mode', 'full')
+            except (OSError, ValueError):
+                pass
+        stat = os.stat(path)
+        files.append({'filename': name, 'size': stat.st_size,
+                      'modified': datetime.fromtimestamp(stat.st_mtime), 'mode': mode})
+    return sorted(files, key=lambda f: f['modified'], reverse=True)
+
+
+def chain_filenames(cursor, base_backup_id):
+    """Files of a full backup and every backup built on it"""
+    if not base_backup_id:
+        return set()
+    cursor.execute("""
+        SELECT filename FROM backup_history
+        WHERE status = 'completed' AND (id = %s OR base_backup_id = %s)
+    """, (base_backup_id, base_backup_id))
+    return {row['filename'] for row in cursor.fetchall()}
+
+
+def _record_backup_audit(cursor, filename, **fields):
+    """Add a backup run to audit_log; backup_history must not depend on it"""
+    try:
+        record_audit(cursor, 'backup', 'BACKUP', subject_id=filename, **fields)
+    except pymysql.err.MySQLError as e:
+        if e.args and e.args[0] == 1213:
+            raise  # a deadlock rolled back the whole transaction, backup_history row included
+        # audit_log only exists once migration 010 has run (and may lack a partition);
+        # backup_history still holds the run
+        log.warning("Backup %s not added to audit_log: %s", filename, e)
+
+
+def record_backup(cursor, result, created_by, trigger='manual'):
+    """Add the export to backup_history and stamp backup_settings.last_backup"""
+    cursor.execute("""
+        INSERT INTO backup_history (filename, file_path, file_size, table_count, record_count, created_by,
+                                    backup_trigger, status, duration_seconds, backup_mode, base_backup_id,
+                                    parent_backup_id, watermarks, manifest)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, 'completed', %s, %s, %s, %s, %s, %s)
+    """, (result['filename'], result['filepath'], result['file_size'], result['table_count'],
+          result['record_count'], created_by, trigger, result.get('duration_seconds'),
+          result.get('mode', 'full'), result.get('base_backup_id'), result.get('parent_backup_id'),
+          json.dumps(result['watermarks'], default=str) if result.get('watermarks') else None,
+          json.dumps(result['manifest'], default=str) if result.get('manifest') else None))
+    backup_id = cursor.lastrowid
+    details = [result.get('mode', 'full'), trigger, f"{result['table_count']} tables",
+               f"{result['record_count']} records"]
+    if result.get('duration_seconds') is not None:
+        details.append(f"{result['duration_seconds']:.1f} s")
+    _record_backup_audit(cursor, result['filename'], actor_name=created_by, new_value='completed',
+                         details=', '.join(details), source_id=backup_id)
+    if result.get('mode') == 'full' and result.get('watermarks'):
+        # A full snapshot starts its own chain
+        cursor.execute("UPDATE backup_history SET base_backup_id = id WHERE id = %s", (backup_id,))
+    cursor.execute("""
+        UPDATE backup_settings
+        SET last_backup = NOW()
+        WHERE id = (SELECT id FROM (SELECT id FROM backup_settings ORDER BY id DESC LIMIT 1) AS tmp)
+    """)
+    return backup_id
+
+
+def record_failed_backup(cursor, filename, created_by, error, trigger='manual', duration_seconds=None):
+    """Add a failed run to backup_history"""
+    cursor.execute("""
+        INSERT INTO backup_history (filename, created_by, backup_trigger, status, error_message, duration_seconds)
+        VALUES (%s, %s, %s, 'failed', %s, %s)
+    """, (filename, created_by, trigger, str(error)[:2000], duration_seconds))
+    _record_backup_audit(cursor, filename, actor_name=created_by, new_value='failed',
+                         details=f"{trigger}, {str(error)[:2000]}", source_id=cursor.lastrowid)
+
+
+def next_backup_after(due, frequency, now=None):
+    """The first slot after now in the frequency's cadence, starting from the due time.
+
+    Slots missed while the application was down are skipped, not replayed.
+    """
+    step = BACKUP_FREQUENCIES.get(frequency, BACKUP_FREQUENCIES['daily'])
+    now = now or datetime.now()
+    next_backup = due + step
+    while next_backup <= now:
+        next_backup += step
+    return next_backup
+
+
+class BackupJob:
+    """Runs one backup at a time in a background thread of this process.
+
+    Progress is written to a JSON status file in the backup folder (at most every
+    update_interval seconds), so a status request served by any web worker can report it.
+    """
+
+    def __init__(self, folder, update_interval=1.0, stale_after=900):
+        self.status_path = os.path.join(folder, 'backup_status.json')
+        self.update_interval = update_interval
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._active = False
+
+    def status(self):
+        """Current or last job: {'state': 'idle'|'running'|'completed'|'failed', ...}"""
+        try:
+            with open(self.status_path) as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return {'state': 'idle'}
+        if status.get('state') == 'running' and time.time() - status.get('updated_at', 0) > self.stale_after:
+            # The process running it died without reporting back
+            status.update({'state': 'failed', 'error': 'The backup stopped responding.'})
+        return status
+
+    def is_running(self):
+        return self.status().get('state') == 'running'
+
+    def start(self, run, **info):
+        """Run run(progress) in the background; False if a backup is already running.
+
+        Extra keyword arguments (e.g. started_by) are kept in the status.
+        """
+        if not self._claim(info):
+            return False
+        threading.Thread(target=self._run, args=(run, info), name='database-backup', daemon=True).start()
+        return True
+
+    def run(self, run, **info):
+        """Run run(progress) in the calling thread, e.g. the scheduler's.
+
+        Returns True once the backup completed; False if it failed or a backup is already running.
+        """
+        if not self._claim(info):
+            return False
+        return self._run(run, info)
+
+    def _claim(self, info):
+        with self._lock:
+            if self._active or self.is_running():
+                return False
+            self._active = True
+            self._write({'state': 'running', 'started_at': time.time(), 'table': None,
+                         'tables_done': 0, 'total_tables': 0, 'records': 0, **info})
+            return True
+
+    def _run(self, run, info):
+        started_at = time.time()
+        last_update = [0.0]
+
+        def progress(**state):
+            now = time.time()
+            if now - last_update[0] < self.update_interval:
+                return
+            last_update[0] = now
+            self._write({'state': 'running', 'started_at': started_at, **info, **state})
+
+        try:
+            result = run(progress)
+            self._write({'state': 'completed', 'started_at': started_at, 'finished_at': time.time(),
+                         **info, **result})
+            return True
+        except BackupInProgressError:
+            # Another worker process won the race; its job owns the status file
+            return False
+        except Exception as e:
+            log.exception("Database backup failed")
+            self._write({'state': 'failed', 'started_at': started_at, 'finished_at': time.time(),
+                         'error': str(e), **info})
+            return False
+        finally:
+            self._active = False
+
+    def _write(self, status):
+        status['updated_at'] = time.time()
+        temp_path = f"{self.status_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(status, f, default=str)
+        os.replace(temp_path, self.status_path)
+
+
+class BackupScheduler:
+    """Starts automatic backups when backup_settings.next_backup is due.
+
+    get_connection() must return a new DB connection (closed by the scheduler) and
+    run_backup() performs one scheduled backup, returning True if it completed. Every web
+    worker may run a scheduler: a due slot is leased by moving next_backup to the end of
+    the lease with a conditional UPDATE, so only one of them starts the backup. The slot
+    is consumed (next_backup moved to the following slot) only once the backup
+    succeeded; a failed or skipped backup puts the slot back, and failed attempts are
+    retried with exponential backoff (retry_delay doubling up to max_retry_delay),
+    counted from the failed scheduled runs in backup_history so every worker sees them.
+    If a worker dies mid-backup, the slot becomes due again when its lease runs out.
+    """
+
+    def __init__(self, get_connection, run_backup, poll_interval=60, retry_delay=300, max_retry_delay=21600,
+                 lease=21600):
+        self.get_connection = get_connection
+        self.run_backup = run_backup
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lease = lease
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the background thread (once per process; restarts after a fork)"""
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name='backup-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception:
+                log.exception("Backup scheduler error")
+            self._stop.wait(self.poll_interval)
+
+    def run_pending(self):
+        """Run the scheduled backup if it is due; returns True if this process ran it successfully"""
+        claim = self._claim_due()
+        if not claim:
+            return False
+        succeeded = False
+        try:
+            succeeded = bool(self.run_backup())
+        finally:
+            self._release(claim, succeeded)
+        return succeeded
+
+    def retry_wait(self, failures):
+        """Seconds to wait after the given number of consecutive failed attempts"""
+        if failures <= 0:
+            return 0
+        return min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay)
+
+    def _claim_due(self):
+        connection = self.get_connection()
+        if not connection:
+            return None
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT id, auto_backup_enabled, backup_frequency, next_backup
+                    FROM backup_settings
+                    ORDER BY id DESC
+                    LIMIT 1
+                """)
+                settings = cursor.fetchone()
+                if not settings or not settings.get('auto_backup_enabled') or not settings.get('next_backup'):
+                    return None
+                due = settings['next_backup']
+                now = datetime.now()
+                if due > now:
+                    return None
+                # Back off after failed attempts at this slot
+                cursor.execute("""
+                    SELECT COUNT(*) AS failures, MAX(created_at) AS last_failure
+                    FROM backup_history
+                    WHERE backup_trigger = 'scheduled' AND status = 'failed' AND created_at >= %s
+                """, (due,))
+                attempts = cursor.fetchone()
+                if attempts and attempts['failures'] and attempts['last_failure']:
+                    retry_at = attempts['last_failure'] + timedelta(seconds=self.retry_wait(attempts['failures']))
+                    if retry_at > now:
+                        return None
+                lease_until = (now + timedelta(seconds=self.lease)).replace(microsecond=0)
+                cursor.execute("""
+                    UPDATE backup_settings
+                    SET next_backup = %s
+                    WHERE id = %s AND next_backup = %s
+                """, (lease_until, settings['id'], due))
+                claimed = cursor.rowcount == 1
+            connection.commit()
+            if not claimed:
+                return None
+            return {'id': settings['id'], 'due': due, 'lease_until': lease_until,
+                    'frequency': settings.get('backup_frequency')}
+        finally:
+            connection.close()
+
+    def _release(self, claim, succeeded):
+        """Move to the next slot after a successful backup, otherwise put the slot back for a retry.
+
+        Settings saved while the backup ran (next_backup no longer the lease) are left alone.
+        """
+        next_backup = next_backup_after(claim['due'], claim['frequency']) if succeeded else claim['due']
+        connection = self.get_connection()
+        if not connection:
+            return
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE backup_settings
+                    SET next_backup = %s
+                    WHERE id = %s AND next_backup = %s
+                """, (next_backup, claim['id'], claim['lease_until']))
+            connection.commit()
+        finally:
+            connection.close()
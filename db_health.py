@@ -0,0 +1,416 @@
+"""
+Database Health
+Collects the health snapshot shown on the database pages from information_schema:
+sizes, estimated row counts and index counts of every table come from one query instead
+of COUNT(*) and SHOW INDEX per table. Exact row counts are only computed on demand.
+
+Snapshots are cached per process for a few minutes, so repeated page views cost nothing.
+
+A sampler also records the snapshot periodically in database_health_samples; old raw
+samples are rolled up into hourly and then daily averages, and the history drives the
+growth forecasts (when will a table cross a size threshold).
+
+Usage:
+    health = health_cache.get('health', lambda: build_health_status(cursor))
+    counts = exact_row_counts(cursor, ['students', 'student_payments'])
+    forecast = growth_forecast(cursor, ['student_payments'], thresholds_mb=(100, 500))
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+log = logging.getLogger('school.db')
+
+
+TABLE_STATS_SQL = """
+    SELECT t.TABLE_NAME AS name,
+           COALESCE(t.TABLE_ROWS, 0) AS estimated_rows,
+           ROUND((COALESCE(t.DATA_LENGTH, 0) + COALESCE(t.INDEX_LENGTH, 0)) / 1024 / 1024, 2) AS size_mb,
+           ROUND(COALESCE(t.DATA_LENGTH, 0) / 1024 / 1024, 2) AS data_mb,
+           ROUND(COALESCE(t.INDEX_LENGTH, 0) / 1024 / 1024, 2) AS index_mb,
+           ROUND(COALESCE(t.DATA_FREE, 0) / 1024 / 1024, 2) AS free_mb,
+           t.ENGINE AS engine,
+           COALESCE(s.index_count, 0) AS index_count
+    FROM information_schema.TABLES t
+    LEFT JOIN (
+        SELECT TABLE_NAME, COUNT(DISTINCT INDEX_NAME) AS index_count
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE()
+        GROUP BY TABLE_NAME
+    ) s ON s.TABLE_NAME = t.TABLE_NAME
+    WHERE t.TABLE_SCHEMA = DATABASE() AND t.TABLE_TYPE = 'BASE TABLE'
+    ORDER BY size_mb DESC, t.TABLE_NAME
+"""
+
+
+class HealthCache:
+    """Per-process cache of health snapshots, each kept for ttl seconds"""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, build, refresh=False):
+        """Cached value for key, rebuilt with build() when missing, expired or refresh is set"""
+        entry = self._entries.get(key)
+        if entry and not refresh and time.time() - entry[0] < self.ttl:
+            return entry[1]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and not refresh and time.time() - entry[0] < self.ttl:
+                return entry[1]
+            value = build()
+            self._entries[key] = (time.time(), value)
+            return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+def _refresh_statistics(cursor):
+    # MySQL 8 caches information_schema table statistics (24h by default); read them fresh.
+    # Older servers and MariaDB have no such variable and always report current values.
+    try:
+        cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+    except Exception:
+        pass
+
+
+def server_info(cursor):
+    """Database name, server version, character set, collation and uptime (seconds)"""
+    cursor.execute("""
+        SELECT DATABASE() AS db_name, VERSION() AS version,
+               @@character_set_database AS character_set, @@collation_database AS collation_name
+    """)
+    info = dict(cursor.fetchone() or {})
+    try:
+        cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name IN ('Uptime', 'Threads_connected')")
+        for row in cursor.fetchall():
+            name = row.get('Variable_name') if isinstance(row, dict) else row[0]
+            value = row.get('Value') if isinstance(row, dict) else row[1]
+            info[name.lower()] = int(value)
+    except Exception:
+        pass
+    return info
+
+
+def table_stats(cursor):
+    """Size, estimated rows and index count of every table, largest first, in one query"""
+    _refresh_statistics(cursor)
+    cursor.execute(TABLE_STATS_SQL)
+    return [{
+        'name': row['name'],
+        'rows': int(row['estimated_rows'] or 0),
+        'size_mb': float(row['size_mb'] or 0),
+        'data_mb': float(row['data_mb'] or 0),
+        'index_mb': float(row['index_mb'] or 0),
+        'free_mb': float(row['free_mb'] or 0),
+        'engine': row['engine'],
+        'index_count': int(row['index_count'] or 0)
+    } for row in cursor.fetchall()]
+
+
+def table_columns(cursor):
+    """{table: [column, ...]} in the shape of DESCRIBE rows, for every table in one query"""
+    cursor.execute("""
+        SELECT TABLE_NAME AS table_name, COLUMN_NAME AS Field, COLUMN_TYPE AS Type,
+               IS_NULLABLE AS `Null`, COLUMN_KEY AS `Key`, COLUMN_DEFAULT AS `Default`, EXTRA AS Extra
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE()
+        ORDER BY TABLE_NAME, ORDINAL_POSITION
+    """)
+    columns = {}
+    for row in cursor.fetchall():
+        row = dict(row)
+        columns.setdefault(row.pop('table_name'), []).append(row)
+    return columns
+
+
+def exact_row_counts(cursor, tables):
+    """COUNT(*) of the given tables (a full scan each on InnoDB: on demand only)"""
+    cursor.execute("""
+        SELECT TABLE_NAME AS name FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE'
+    """)
+    known = {row['name'] for row in cursor.fetchall()}
+    counts = {}
+    for table_name in tables:
+        if table_name in known:
+            cursor.execute(f"SELECT COUNT(*) AS count FROM `{table_name}`")
+            counts[table_name] = int(cursor.fetchone()['count'])
+    return counts
+
+
+def format_uptime(seconds):
+    if seconds is None:
+        return 'Unknown'
+    return f"{seconds // 86400}d {(seconds % 86400) // 3600}h {(seconds % 3600) // 60}m"
+
+
+def build_health_status(cursor):
+    """Health snapshot for the Database Health & Status page"""
+    info = server_info(cursor)
+    tables = table_stats(cursor)
+    for table in tables:
+        table['status'] = 'healthy'
+        if table['size_mb'] > 100:  # Large table warning
+            table['status'] = 'warning'
+        if table['rows'] == 0 and table['data_mb'] > 1:  # Looks empty but holds data pages (possible issue)
+            table['status'] = 'warning'
+
+    health_status = {
+        'connection_status': True,
+        'db_name': info.get('db_name') or 'Unknown',
+        'mysql_version': info.get('version') or 'Unknown',
+        'character_set': info.get('character_set') or 'Unknown',
+        'collation': info.get('collation_name') or 'Unknown',
+        'uptime': format_uptime(info.get('uptime')),
+        'uptime_seconds': info.get('uptime'),
+        'threads_connected': info.get('threads_connected'),
+        'last_checked': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'database_size_mb': round(sum(t['size_mb'] for t in tables), 2),
+        'data_size_mb': round(sum(t['data_mb'] for t in tables), 2),
+        'index_size_mb': round(sum(t['index_mb'] for t in tables), 2),
+        'total_tables': len(tables),
+        'total_records': sum(t['rows'] for t in tables),
+        'rows_estimated': True,
+        'tables': tables,
+        'largest_tables': tables,
+        'recommendations': []
+    }
+
+    warnings = 0
+    # Check for large database
+    if health_status['database_size_mb'] > 1000:
+        warnings += 1
+        health_status['recommendations'].append(
+            f"Database size is {health_status['database_size_mb']:.2f} MB. Consider archiving old data.")
+
+    # Check for tables without indexes
+    tables_without_indexes = [t for t in tables if t['index_count'] == 0 and t['rows'] > 100]
+    if tables_without_indexes:
+        warnings += 1
+        health_status['recommendations'].append(
+            f"{len(tables_without_indexes)} table(s) with >100 rows have no indexes. "
+            f"Consider adding indexes for better performance.")
+
+    # Check for very large tables
+    very_large_tables = [t for t in tables if t['size_mb'] > 500]
+    if very_large_tables:
+        warnings += 1
+        health_status['recommendations'].append(
+            f"{len(very_large_tables)} table(s) exceed 500 MB. Consider partitioning or archiving.")
+
+    health_status['overall_status'] = 'warning' if warnings else 'healthy'
+    return health_status
+
+
+SAMPLE_LOCK_NAME = 'database_health_sample'
+SAMPLE_COLUMNS = ('sampled_at', 'granularity', 'table_name', 'row_estimate', 'data_mb', 'index_mb',
+                  'uptime_seconds', 'threads_connected')
+# Raw samples older than raw_days become hourly averages, hourly ones older than hourly_days daily averages
+ROLLUPS = (
+    ('raw', 'hourly', "DATE_FORMAT(sampled_at, '%%Y-%%m-%%d %%H:00:00')"),
+    ('hourly', 'daily', "DATE(sampled_at)")
+)
+
+
+def record_health_sample(cursor, now=None):
+    """Store the current size and row estimate of every table, plus the server-wide totals
+    (table_name ''). Returns the number of tables sampled."""
+    now = (now or datetime.now()).replace(microsecond=0)
+    info = server_info(cursor)
+    tables = table_stats(cursor)
+    rows = [(now, 'raw', '', sum(t['rows'] for t in tables), round(sum(t['data_mb'] for t in tables), 2),
+             round(sum(t['index_mb'] for t in tables), 2), info.get('uptime'), info.get('threads_connected'))]
+    rows.extend((now, 'raw', t['name'], t['rows'], t['data_mb'], t['index_mb'], None, None) for t in tables)
+    cursor.executemany(f"""
+        INSERT INTO database_health_samples ({', '.join(SAMPLE_COLUMNS)})
+        VALUES ({', '.join(['%s'] * len(SAMPLE_COLUMNS))})
+    """, rows)
+    return len(tables)
+
+
+def downsample_health_samples(cursor, raw_days=2, hourly_days=60, now=None):
+    """Replace aged samples by their hourly/daily averages; returns {granularity: rows removed}"""
+    now = now or datetime.now()
+    cutoffs = {
+        # Aligned to the bucket boundary so a bucket is never split between two rollups
+        'raw': (now - timedelta(days=raw_days)).replace(minute=0, second=0, microsecond=0),
+        'hourly': (now - timedelta(days=hourly_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    }
+    removed = {}
+    for source, target, bucket in ROLLUPS:
+        cursor.execute(f"""
+            INSERT INTO database_health_samples ({', '.join(SAMPLE_COLUMNS)})
+            SELECT {bucket} AS bucket, %s, table_name, ROUND(AVG(row_estimate)), ROUND(AVG(data_mb), 2),
+                   ROUND(AVG(index_mb), 2), MAX(uptime_seconds), ROUND(AVG(threads_connected))
+            FROM database_health_samples
+            WHERE granularity = %s AND sampled_at < %s
+            GROUP BY bucket, table_name
+        """, (target, source, cutoffs[source]))
+        cursor.execute("""
+            DELETE FROM database_health_samples
+            WHERE granularity = %s AND sampled_at < %s
+        """, (source, cutoffs[source]))
+        removed[source] = cursor.rowcount
+    return removed
+
+
+def _daily_points(samples):
+    """Average the samples of each day, so dense raw samples do not outweigh old daily ones"""
+    days = {}
+    for sample in samples:
+        days.setdefault(sample['sampled_at'].date(), []).append(sample)
+    points = []
+    for day in sorted(days):
+        group = days[day]
+        points.append((day, sum(float(s['size_mb']) for s in group) / len(group),
+                       sum(int(s['row_estimate']) for s in group) / len(group)))
+    return points
+
+
+def _slope(xs, ys):
+    """Least squares slope of ys over xs (None with fewer than two distinct xs)"""
+    n = len(xs)
+    if n < 2:
+        return None
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    spread = sum((x - mean_x) ** 2 for x in xs)
+    if not spread:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread
+
+
+def growth_forecast(cursor, table_names, thresholds_mb, window_days=90, now=None):
+    """Growth trend of each table over the last window_days and when it crosses each threshold.
+
+    Returns [{'name', 'current_mb', 'current_rows', 'mb_per_day', 'rows_per_day', 'days_of_history',
+    'thresholds': [{'mb', 'status' ('reached'|'projected'|'not growing'|'no data'), 'date', 'days'}]}].
+    The trend is a straight line fitted through one averaged point per day.
+    """
+    now = now or datetime.now()
+    history = {table_name: [] for table_name in table_names}
+    if table_names:
+        cursor.execute("""
+            SELECT table_name, sampled_at, row_estimate, data_mb + index_mb AS size_mb
+            FROM database_health_samples
+            WHERE table_name IN %s AND sampled_at >= %s
+            ORDER BY sampled_at
+        """, (tuple(table_names), now - timedelta(days=window_days)))
+        for row in cursor.fetchall():
+            history[row['table_name']].append(row)
+
+    forecast = []
+    for table_name in table_names:
+        samples = history[table_name]
+        points = _daily_points(samples)
+        xs = [(day - points[0][0]).days for day, _, _ in points]
+        mb_per_day = _slope(xs, [size for _, size, _ in points])
+        rows_per_day = _slope(xs, [rows for _, _, rows in points])
+        latest = samples[-1] if samples else None
+        current_mb = float(latest['size_mb']) if latest else None
+        entry = {
+            'name': table_name,
+            'current_mb': current_mb,
+            'current_rows': int(latest['row_estimate']) if latest else None,
+            'mb_per_day': round(mb_per_day, 3) if mb_per_day is not None else None,
+            'rows_per_day': int(round(rows_per_day)) if rows_per_day is not None else None,
+            'days_of_history': xs[-1] if xs else 0,
+            'thresholds': []
+        }
+        for threshold in thresholds_mb:
+            if current_mb is None:
+                status, days = 'no data', None
+            elif current_mb >= threshold:
+                status, days = 'reached', 0
+            elif not mb_per_day or mb_per_day <= 0:
+                status, days = 'not growing', None
+            else:
+                status, days = 'projected', int((threshold - current_mb) / mb_per_day)
+            entry['thresholds'].append({
+                'mb': threshold,
+                'status': status,
+                'days': days,
+                'date': (now + timedelta(days=days)).strftime('%Y-%m-%d') if days is not None else None
+            })
+        forecast.append(entry)
+    return forecast
+
+
+class HealthSampler:
+    """Records a health sample every interval seconds and rolls up old samples.
+
+    get_connection() must return a new DB connection (closed by the sampler). Every web
+    worker may run a sampler: a named lock and the time of the newest sample make sure
+    only one of them records each interval.
+    """
+
+    def __init__(self, get_connection, interval=900, raw_days=2, hourly_days=60):
+        self.get_connection = get_connection
+        self.interval = interval
+        self.raw_days = raw_days
+        self.hourly_days = hourly_days
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the background thread (once per process; restarts after a fork)"""
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name='health-sampler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception:
+                log.exception("Health sampler error")
+            # Wake up a few times per interval; run_pending skips until a sample is due
+            self._stop.wait(max(self.interval // 4, 30))
+
+    def run_pending(self):
+        """Record a sample if the newest one is older than the interval; returns True if recorded"""
+        connection = self.get_connection()
+        if not connection:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT GET_LOCK(%s, 0) AS acquired", (SAMPLE_LOCK_NAME,))
+                row = cursor.fetchone()
+                if not row or not row['acquired']:
+                    return False
+                try:
+                    cursor.execute("""
+                        SELECT MAX(sampled_at) AS latest FROM database_health_samples WHERE granularity = 'raw'
+                    """)
+                    latest = cursor.fetchone()['latest']
+                    if latest and (datetime.now() - latest).total_seconds() < self.interval:
+                        return False
+                    record_health_sample(cursor)
+                    downsample_health_samples(cursor, self.raw_days, self.hourly_days)
+                    connection.commit()
+                    return True
+                finally:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (SAMPLE_LOCK_NAME,))
+        finally:
+            connection.close()
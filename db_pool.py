@@ -0,0 +1,212 @@
+"""
+Database Connection Pool
+Bounded, thread-safe pool of PyMySQL connections shared by every get_db_connection() caller
+"""
+import os
+import threading
+import time
+import pymysql
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes available within the checkout timeout"""
+    pass
+
+
+class PooledConnection:
+    """Proxy around a pooled PyMySQL connection.
+
+    Behaves like the underlying connection (cursor(), commit(), rollback(), ...),
+    but close() hands the connection back to the pool instead of closing the socket.
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Return the connection to the pool"""
+        if self._released:
+            return
+        self._released = True
+        self._pool._release(self._raw, self._created_at)
+
+    def discard(self):
+        """Close the underlying connection instead of returning it to the pool"""
+        if self._released:
+            return
+        self._released = True
+        self._pool._release(self._raw, self._created_at, discard=True)
+
+    def __del__(self):
+        # A caller that forgot close() must not leak a pool slot
+        try:
+            if not self._released:
+                self.discard()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """Bounded pool with ping-on-checkout and idle/lifetime eviction"""
+
+    def __init__(self, connect_kwargs, max_size=10, max_idle=300, max_lifetime=3600,
+                 checkout_timeout=10, ping_interval=30):
+        self.connect_kwargs = connect_kwargs
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.ping_interval = ping_interval
+        self._lock = threading.Condition(threading.Lock())
+        self._reset_state()
+
+    def _reset_state(self):
+        # Idle entries are (raw_connection, created_at, returned_at), most recent last
+        self._idle = []
+        self._in_use = 0
+        self._pid = os.getpid()
+        self._metrics = {
+            'created': 0,
+            'checkouts': 0,
+            'reused': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'ping_failures': 0,
+            'evicted_idle': 0,
+            'evicted_lifetime': 0,
+            'discarded': 0,
+        }
+
+    def _check_fork(self):
+        """Forget connections inherited from a parent process (Passenger smart spawning)"""
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    def _connect(self):
+        return pymysql.connect(**self.connect_kwargs)
+
+    def _close_raw(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _is_expired(self, created_at, now):
+        return self.max_lifetime and now - created_at > self.max_lifetime
+
+    def acquire(self, timeout=None):
+        """Borrow a connection, waiting up to timeout seconds when the pool is exhausted"""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        candidate = None
+        with self._lock:
+            self._check_fork()
+            while True:
+                now = time.monotonic()
+                # Evict idle/expired connections before deciding what to hand out
+                while self._idle:
+                    raw, created_at, returned_at = self._idle.pop()
+                    if self._is_expired(created_at, now):
+                        self._metrics['evicted_lifetime'] += 1
+                        self._close_raw(raw)
+                    elif self.max_idle and now - returned_at > self.max_idle:
+                        self._metrics['evicted_idle'] += 1
+                        self._close_raw(raw)
+                    else:
+                        candidate = (raw, created_at, returned_at)
+                        break
+                if candidate or self._in_use + len(self._idle) < self.max_size:
+                    self._in_use += 1
+                    self._metrics['checkouts'] += 1
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._metrics['timeouts'] += 1
+                    raise PoolTimeoutError(
+                        f"No database connection available after {timeout}s "
+                        f"(pool size {self.max_size})")
+                self._metrics['waits'] += 1
+                self._lock.wait(remaining)
+
+        try:
+            if candidate:
+                raw, created_at, returned_at = candidate
+                # Ping connections that sat idle long enough to have been dropped by the server
+                if time.monotonic() - returned_at >= self.ping_interval:
+                    try:
+                        raw.ping(reconnect=False)
+                    except Exception:
+                        with self._lock:
+                            self._metrics['ping_failures'] += 1
+                        self._close_raw(raw)
+                        candidate = None
+                if candidate:
+                    with self._lock:
+                        self._metrics['reused'] += 1
+                    return PooledConnection(self, raw, created_at)
+            raw = self._connect()
+            with self._lock:
+                self._metrics['created'] += 1
+            return PooledConnection(self, raw, time.monotonic())
+        except Exception:
+            # Give the slot back so a failed connect does not shrink the pool
+            with self._lock:
+                self._in_use -= 1
+                self._lock.notify()
+            raise
+
+    def _release(self, raw, created_at, discard=False):
+        now = time.monotonic()
+        if not discard:
+            if self._is_expired(created_at, now):
+                discard = True
+            else:
+                try:
+                    # End any open transaction so the next borrower sees fresh data
+                    raw.rollback()
+                except Exception:
+                    discard = True
+        with self._lock:
+            if self._pid != os.getpid():
+                # Connection belongs to another process' pool state
+                return
+            self._in_use = max(self._in_use - 1, 0)
+            if discard:
+                self._metrics['discarded'] += 1
+            else:
+                self._idle.append((raw, created_at, now))
+            self._lock.notify()
+        if discard:
+            self._close_raw(raw)
+
+    def clear(self):
+        """Close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for raw, _, _ in idle:
+            self._close_raw(raw)
+
+    def stats(self):
+        """Snapshot of pool size and usage counters"""
+        with self._lock:
+            self._check_fork()
+            stats = dict(self._metrics)
+            stats.update({
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'size': self._in_use + len(self._idle),
+            })
+            return stats
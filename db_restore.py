@@ -0,0 +1,396 @@
+"""
+Database Restore
+Reloads tables from the archives written by db_backup: an Excel workbook (one sheet per
+table) or a zip of CSV files, plus any incremental/differential files chained to them.
+
+Archives are read as a stream (read-only workbook, CSV straight out of the zip) and rows
+are inserted in batches with executemany. Tables are loaded parents first with foreign key
+checks switched off; rows left pointing at a missing parent are counted afterwards and
+reported. Unique checks stay on, so duplicate rows fail the restore rather than load.
+
+A restore empties live tables, so the caller passes a snapshot function that takes a
+backup of the current data first; the restore does not start if it fails. The restore
+stops at the first table that fails and raises RestoreError naming the tables already
+changed and the pre-restore backup to restore them from. A dry run reads the whole chain
+and reports row counts against the manifest and the live tables without writing anything.
+
+Usage:
+    report = restore_backup(connection, BACKUP_FOLDER, 'database_backup_20260101_020000_full.xlsx',
+                            snapshot=lambda: take_backup(connection))
+    report = restore_backup(connection, BACKUP_FOLDER, 'database_backup.xlsx', dry_run=True)
+"""
+import csv
+import importlib.util
+import io
+import json
+import os
+import re
+import sys
+import time
+import zipfile
+from db_backup import list_tables, manifest_path
+
+# openpyxl is only imported when an Excel archive is opened
+EXCEL_AVAILABLE = importlib.util.find_spec('openpyxl') is not None
+
+
+BATCH_SIZE = 1000
+BINARY_TYPES = ('binary', 'varbinary', 'tinyblob', 'blob', 'mediumblob', 'longblob')
+TEXT_TYPES = ('char', 'varchar', 'tinytext', 'text', 'mediumtext', 'longtext', 'enum', 'set', 'json')
+
+
+class RestoreError(Exception):
+    """Raised when a backup archive cannot be restored"""
+    pass
+
+
+class RestoreFailedError(RestoreError):
+    """Raised when a restore stopped partway; changed_tables were already emptied or written"""
+
+    def __init__(self, message, table_name=None, changed_tables=(), pre_restore_backup=None):
+        super().__init__(message)
+        self.table_name = table_name
+        self.changed_tables = list(changed_tables)
+        self.pre_restore_backup = pre_restore_backup
+
+
+def restore_chain(folder, filename):
+    """Files to apply, oldest first: the full backup, then each increment up to filename.
+
+    Follows the parent links in the manifests; a file without a manifest (e.g. the manual
+    database_backup.xlsx) is a full backup on its own.
+    """
+    chain = []
+    seen = set()
+    while filename:
+        if filename in seen:
+            raise RestoreError(f"Backup chain loops at {filename}")
+        seen.add(filename)
+        path = os.path.join(folder, filename)
+        if not os.path.exists(path):
+            raise RestoreError(f"Backup file {filename} is missing")
+        manifest = None
+        if os.path.exists(manifest_path(path)):
+            with open(manifest_path(path)) as f:
+                manifest = json.load(f)
+        chain.append((path, manifest))
+        filename = manifest.get('parent') if manifest and manifest.get('mode') != 'full' else None
+    chain.reverse()
+    return chain
+
+
+def _column_types(cursor):
+    """{table: {column: (data_type, nullable)}} for the current database, in one query"""
+    cursor.execute("""
+        SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name, DATA_TYPE AS data_type,
+               IS_NULLABLE AS is_nullable
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE()
+    """)
+    types = {}
+    for row in cursor.fetchall():
+        types.setdefault(row['table_name'], {})[row['column_name']] = (row['data_type'], row['is_nullable'] == 'YES')
+    return types
+
+
+def load_order(cursor, tables):
+    """Tables sorted so every table comes after the tables its foreign keys reference"""
+    cursor.execute("""
+        SELECT TABLE_NAME AS table_name, REFERENCED_TABLE_NAME AS referenced_table
+        FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL
+    """)
+    parents = {table_name: set() for table_name in tables}
+    for row in cursor.fetchall():
+        if row['table_name'] in parents and row['referenced_table'] in parents \
+                and row['referenced_table'] != row['table_name']:
+            parents[row['table_name']].add(row['referenced_table'])
+
+    ordered, placed = [], set()
+    while len(ordered) < len(parents):
+        ready = sorted(t for t, refs in parents.items() if t not in placed and refs <= placed)
+        if not ready:
+            # Circular references: load the rest as they are (foreign key checks are off)
+            ready = sorted(t for t in parents if t not in placed)
+        ordered.extend(ready)
+        placed.update(ready)
+    return ordered
+
+
+def _converter(data_type, nullable):
+    """Turn an exported cell back into a column value (the export wrote NULL as '' and bytes as hex)"""
+    binary = data_type in BINARY_TYPES
+    textual = data_type in TEXT_TYPES
+
+    def convert(value):
+        if value is None or value == '':
+            return '' if textual and not nullable else None
+        if binary and isinstance(value, str):
+            try:
+                return bytes.fromhex(value)
+            except ValueError:
+                return value.encode('utf-8')
+        return value
+    return convert
+
+
+def _sheet_tables(sheet_names, tables):
+    """Map worksheet titles to table names (titles are truncated to 31 characters and
+    tables larger than one sheet continue on "<table>_2", "<table>_3", ...)"""
+    by_title = {table_name[:31]: table_name for table_name in tables}
+    mapping, previous = {}, None
+    for title in sheet_names:
+        table_name = by_title.get(title)
+        match = re.match(r'^(.*)_(\d+)$', title)
+        if table_name is None and match and previous and previous[:28] == match.group(1):
+            table_name = previous
+        mapping[title] = table_name
+        if table_name:
+            previous = table_name
+    return mapping
+
+
+class BackupArchive:
+    """Streaming reader for an exported workbook or CSV zip.
+
+    Tables can be read in any order (sheets and zip members are opened on demand), so
+    a restore can follow foreign key order rather than the file's order.
+    """
+
+    def __init__(self, path, tables):
+        self.path = path
+        self.parts = {}   # table -> worksheet titles or zip member names, in file order
+        if path.endswith('.zip'):
+            self._zip = zipfile.ZipFile(path)
+            self._wb = None
+            for name in self._zip.namelist():
+                if name.endswith('.csv'):
+                    self.parts.setdefault(name[:-4], []).append(name)
+        else:
+            if not EXCEL_AVAILABLE:
+                raise RestoreError("openpyxl is required to restore Excel backups")
+            from openpyxl import load_workbook
+            self._zip = None
+            self._wb = load_workbook(path, read_only=True, data_only=True)
+            for title, table_name in _sheet_tables(self._wb.sheetnames, tables).items():
+                self.parts.setdefault(table_name or title, []).append(title)
+
+    def close(self):
+        if self._zip:
+            self._zip.close()
+        if self._wb:
+            self._wb.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read(self, table_name):
+        """Yield (columns, rows) per part of the table; rows is an iterator of tuples"""
+        for part in self.parts.get(table_name, []):
+            if self._zip:
+                csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+                with self._zip.open(part) as raw:
+                    reader = csv.reader(io.TextIOWrapper(raw, encoding='utf-8', newline=''))
+                    columns = next(reader, None)
+                    if columns:
+                        yield columns, (tuple(row) for row in reader)
+            else:
+                rows = self._wb[part].iter_rows(values_only=True)
+                header = next(rows, None)
+                if header:
+                    yield [column for column in header if column is not None], rows
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def orphan_counts(cursor, tables):
+    """Rows of tables whose foreign key points at a missing parent row: {table: [(constraint, rows)]}"""
+    cursor.execute("""
+        SELECT TABLE_NAME AS table_name, CONSTRAINT_NAME AS constraint_name, COLUMN_NAME AS column_name,
+               REFERENCED_TABLE_NAME AS referenced_table, REFERENCED_COLUMN_NAME AS referenced_column
+        FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL
+        ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION
+    """)
+    keys = {}
+    for row in cursor.fetchall():
+        if row['table_name'] in tables:
+            key = keys.setdefault((row['table_name'], row['constraint_name']), (row['referenced_table'], []))
+            key[1].append((row['column_name'], row['referenced_column']))
+
+    orphans = {}
+    for (table_name, constraint), (referenced_table, pairs) in keys.items():
+        joined = ' AND '.join(f"p.`{parent}` = c.`{child}`" for child, parent in pairs)
+        not_null = ' AND '.join(f"c.`{child}` IS NOT NULL" for child, _ in pairs)
+        cursor.execute(f"""
+            SELECT COUNT(*) AS count FROM `{table_name}` c
+            LEFT JOIN `{referenced_table}` p ON {joined}
+            WHERE {not_null} AND p.`{pairs[0][1]}` IS NULL
+        """)
+        count = int(cursor.fetchone()['count'])
+        if count:
+            orphans.setdefault(table_name, []).append((constraint, count))
+    return orphans
+
+
+def _table_counts(cursor, tables):
+    counts = {}
+    for table_name in tables:
+        cursor.execute(f"SELECT COUNT(*) AS count FROM `{table_name}`")
+        counts[table_name] = int(cursor.fetchone()['count'])
+    return counts
+
+
+def restore_backup(connection, folder, filename, dry_run=False, tables=None, exclude=(), batch_size=BATCH_SIZE,
+                   progress=None, snapshot=None):
+    """Restore filename (and the full backup it builds on) into the current database.
+
+    Tables copied whole are emptied and reloaded; rows from incremental files are upserted.
+    tables limits the restore to those table names and exclude leaves tables untouched. With dry_run, the archives are only
+    read and counted. Otherwise snapshot(), if given, is called before anything is written
+    and its return value (the safety backup's file name) is kept in the report; if it
+    raises, nothing is restored. A table that fails to load stops the restore with
+    RestoreFailedError. Returns a report: {'files', 'dry_run', 'tables': {table: {...}},
+    'unknown_tables', 'rows', 'seconds', 'rows_per_second', 'pre_restore_backup'}.
+    """
+    started_at = time.time()
+    chain = restore_chain(folder, filename)
+    with connection.cursor() as cursor:
+        existing = list_tables(cursor)
+        column_types = _column_types(cursor)
+        order = load_order(cursor, existing)
+    wanted = [table_name for table_name in order
+              if (not tables or table_name in tables) and table_name not in exclude]
+    report = {table_name: {'rows': 0, 'status': 'ok', 'skipped_columns': [], 'seconds': 0} for table_name in wanted}
+    unknown = set()
+    total_rows = 0
+    steps_done = 0
+
+    pre_restore_backup = None
+    changed = []
+    table_name = path = None
+    previous_checks = None
+    if not dry_run:
+        if snapshot:
+            try:
+                pre_restore_backup = snapshot()
+            except Exception as e:
+                raise RestoreError(f"Restore not started: the pre-restore backup failed: {e}") from e
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT @@SESSION.foreign_key_checks AS fk")
+            previous_checks = cursor.fetchone()
+            # Parents may be reloaded after their children (circular references); orphans are counted afterwards
+            cursor.execute("SET SESSION foreign_key_checks = 0")
+
+    try:
+        for path, manifest in chain:
+            table_name = None
+            copies = (manifest or {}).get('tables', {})
+            incremental = bool(manifest) and manifest.get('mode') != 'full'
+            with BackupArchive(path, existing) as archive:
+                unknown.update(name for name in archive.parts if name not in column_types)
+                for table_name in wanted:
+                    entry = report[table_name]
+                    upsert = incremental and copies.get(table_name, {}).get('copy') == 'changes'
+                    file_rows = 0
+                    table_started = time.time()
+                    for part_index, (columns, rows) in enumerate(archive.read(table_name)):
+                        known = column_types[table_name]
+                        positions = [i for i, column in enumerate(columns) if column in known]
+                        load_columns = [columns[i] for i in positions]
+                        converters = [_converter(*known[column]) for column in load_columns]
+                        entry['skipped_columns'] = sorted(set(entry['skipped_columns']) |
+                                                          {column for column in columns if column not in known})
+
+                        if not dry_run and table_name not in changed:
+                            changed.append(table_name)
+                        if not dry_run and part_index == 0 and not upsert:
+                            with connection.cursor() as cursor:
+                                cursor.execute(f"TRUNCATE TABLE `{table_name}`")
+
+                        column_sql = ', '.join(f"`{column}`" for column in load_columns)
+                        placeholders = ', '.join(['%s'] * len(load_columns))
+                        sql = f"INSERT INTO `{table_name}` ({column_sql}) VALUES ({placeholders})"
+                        if upsert:
+                            sql += " ON DUPLICATE KEY UPDATE " + ', '.join(
+                                f"`{column}` = VALUES(`{column}`)" for column in load_columns)
+
+                        for batch in _batches(rows, batch_size):
+                            values = [tuple(convert(row[i] if i < len(row) else None)
+                                            for i, convert in zip(positions, converters)) for row in batch]
+                            if not dry_run:
+                                with connection.cursor() as cursor:
+                                    cursor.executemany(sql, values)
+                                connection.commit()
+                            file_rows += len(values)
+                            total_rows += len(values)
+                            if progress:
+                                progress(table=table_name, tables_done=steps_done,
+                                         total_tables=len(wanted) * len(chain), records=total_rows)
+
+                    steps_done += 1
+                    entry['rows'] += file_rows
+                    entry['seconds'] = round(entry['seconds'] + time.time() - table_started, 2)
+                    expected = copies.get(table_name, {}).get('rows')
+                    if expected is not None and expected != file_rows:
+                        entry['status'] = 'mismatch'
+                        entry['message'] = (f"{os.path.basename(path)} holds {file_rows} rows, "
+                                            f"its manifest lists {expected}")
+    except Exception as e:
+        if dry_run:
+            raise
+        try:
+            connection.rollback()
+        except Exception:
+            pass
+        where = f"{table_name} from {os.path.basename(path)}" if table_name and path else "the start"
+        message = f"Restore stopped at {where}: {e}."
+        message += (f" Tables already changed: {', '.join(changed)}." if changed
+                    else " No table was changed.")
+        if pre_restore_backup and changed:
+            message += f" Restore {pre_restore_backup} to put them back."
+        raise RestoreFailedError(message, table_name=table_name, changed_tables=changed,
+                                 pre_restore_backup=pre_restore_backup) from e
+    finally:
+        if previous_checks is not None:
+            with connection.cursor() as cursor:
+                cursor.execute("SET SESSION foreign_key_checks = %s", (previous_checks['fk'],))
+
+    with connection.cursor() as cursor:
+        current = _table_counts(cursor, wanted)
+        orphans = {} if dry_run else orphan_counts(cursor, set(wanted))
+    single_full = len(chain) == 1
+    for table_name, entry in report.items():
+        entry['current_rows'] = current.get(table_name)
+        if single_full and entry['status'] == 'ok' and entry['rows'] != entry['current_rows']:
+            # Dry run: the live table differs from the backup; restore: rows were not all loaded
+            entry['status'] = 'differs' if dry_run else 'mismatch'
+            entry['message'] = (f"Backup holds {entry['rows']} rows, the table holds {entry['current_rows']}")
+        if table_name in orphans and entry['status'] == 'ok':
+            entry['status'] = 'orphans'
+            entry['message'] = '; '.join(f"{count} row(s) break {constraint}"
+                                         for constraint, count in orphans[table_name])
+
+    seconds = round(time.time() - started_at, 2)
+    return {
+        'files': [os.path.basename(path) for path, _ in chain],
+        'dry_run': dry_run,
+        'tables': report,
+        'unknown_tables': sorted(unknown),
+        'rows': total_rows,
+        'seconds': seconds,
+        'rows_per_second': int(total_rows / seconds) if seconds else total_rows,
+        'pre_restore_backup': pre_restore_backup
+    }
@@ -0,0 +1,91 @@
+"""
+Document Cache
+Rendered documents (PDF receipts) stored on disk under a key built from the versions of
+everything the document shows, so re-printing an unchanged document is a file read.
+
+A changed payment, ledger or school profile changes the key, so stale entries are never
+served; they simply stop being read and are pruned once the cache holds more than
+max_files documents.
+
+Usage:
+    cache = DocumentCache('/path/to/cache/receipts')
+    key = cache.key('receipt', payment_id, payment_version, settings_version)
+    path = cache.path_for(key)             # None on a miss
+    if path is None:
+        path = cache.put(key, render_pdf())
+"""
+import hashlib
+import os
+import threading
+
+
+class DocumentCache:
+    """Write-once files named by a hash of their key parts; safe across worker processes"""
+
+    def __init__(self, directory, max_files=5000, suffix='.pdf'):
+        self.directory = directory
+        self.max_files = max_files
+        self.suffix = suffix
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256('\x1f'.join(str(part) for part in parts).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def path_for(self, key):
+        """Path of the cached document, or None when it has not been rendered yet"""
+        path = self._path(key)
+        return path if os.path.isfile(path) else None
+
+    def put(self, key, data):
+        """Store a rendered document atomically; returns its path"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % 100 == 0
+        if prune:
+            self.prune()
+        return path
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(self.suffix):
+                    yield os.path.join(root, name)
+
+    def prune(self):
+        """Delete the least recently written documents beyond max_files; returns the number removed"""
+        entries = []
+        for path in self._files():
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        removed = 0
+        for _, path in sorted(entries, reverse=True)[self.max_files:]:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def clear(self):
+        """Delete every cached document (e.g. after a database restore)"""
+        removed = 0
+        for path in list(self._files()):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+        return removed
@@ -0,0 +1,245 @@
+"""
+Email Outbox
+Durable queue of outgoing emails (email_outbox table) and the worker that delivers them.
+
+Requests only enqueue messages, inside their own transaction. A worker claims due
+messages, sends them in batches over a single SMTP connection and retries failures
+with exponential backoff.
+
+Usage:
+    enqueue_email(cursor, recipient, subject, html_body, text_body, category='...')
+    worker = EmailOutboxWorker(get_connection, send_batch)
+    worker.start()   # background thread, or worker.run_forever() in a separate process
+"""
+import logging
+import os
+import random
+import threading
+import uuid
+
+log = logging.getLogger('school.email')
+
+
+OUTBOX_STATUSES = ('pending', 'sending', 'sent', 'failed')
+
+
+def enqueue_email(cursor, recipient, subject, html_body, text_body=None, category=None, max_attempts=5):
+    """Queue an email; it is sent once the caller's transaction commits. Returns the outbox id."""
+    cursor.execute("""
+        INSERT INTO email_outbox (category, recipient, subject, html_body, text_body, max_attempts)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, (category, recipient, subject, html_body, text_body, max_attempts))
+    return cursor.lastrowid
+
+
+def retry_delay(attempts, base=60, maximum=3600):
+    """Seconds to wait before the next attempt: exponential backoff with jitter"""
+    delay = min(base * (2 ** max(attempts - 1, 0)), maximum)
+    return int(delay * random.uniform(0.8, 1.2))
+
+
+def outbox_summary(cursor, recent=20):
+    """Message counts by status and the most recent messages, for the admin UI"""
+    cursor.execute("SELECT status, COUNT(*) AS count FROM email_outbox GROUP BY status")
+    counts = {status: 0 for status in OUTBOX_STATUSES}
+    for row in cursor.fetchall():
+        counts[row['status']] = int(row['count'])
+    cursor.execute("""
+        SELECT id, category, recipient, subject, status, attempts, max_attempts, last_error,
+               next_attempt_at, sent_at, created_at
+        FROM email_outbox
+        ORDER BY id DESC
+        LIMIT %s
+    """, (recent,))
+    return {'counts': counts, 'recent': cursor.fetchall()}
+
+
+def message_statuses(cursor, message_ids):
+    """Delivery status of specific messages: {id: {recipient, status, attempts, last_error, sent_at}}"""
+    if not message_ids:
+        return {}
+    cursor.execute("""
+        SELECT id, recipient, status, attempts, last_error, sent_at
+        FROM email_outbox
+        WHERE id IN %s
+    """, (tuple(message_ids),))
+    return {row['id']: row for row in cursor.fetchall()}
+
+
+def retry_failed_email(cursor, message_id):
+    """Put a failed message back in the queue with a fresh set of attempts"""
+    cursor.execute("""
+        UPDATE email_outbox
+        SET status = 'pending', attempts = 0, next_attempt_at = NOW(), last_error = NULL
+        WHERE id = %s AND status = 'failed'
+    """, (message_id,))
+    return cursor.rowcount > 0
+
+
+class EmailOutboxWorker:
+    """Delivers queued emails in batches.
+
+    get_connection() must return a new DB connection (closed by the worker) and
+    send_batch(messages, send_interval) must send the message dicts over one SMTP
+    connection, pausing send_interval seconds between messages, and return
+    {message_id: error_or_None}. Messages are claimed with a per-batch
+    token, so several workers (threads or processes) never send the same message, and a
+    worker only records results for messages it still holds. A message left in
+    'sending' (its worker died mid-send) is claimed again after claim_timeout as a
+    further attempt, so a message that keeps killing its worker still ends up failed.
+    """
+
+    def __init__(self, get_connection, send_batch, batch_size=20, poll_interval=30,
+                 send_interval=0, claim_timeout=600, retry_base=60, retry_max=3600):
+        self.get_connection = get_connection
+        self.send_batch = send_batch
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.send_interval = send_interval
+        self.claim_timeout = claim_timeout
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the background thread (once per process; restarts after a fork)"""
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name='email-outbox', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        """Deliver newly queued messages now instead of at the next poll"""
+        self._wake.set()
+
+    def deliver_async(self, message_ids, send_interval=None):
+        """Send the given messages over one SMTP session in a background thread"""
+        if not message_ids:
+            return
+        threading.Thread(target=self._deliver, args=(list(message_ids), send_interval),
+                         name='email-outbox-bulk', daemon=True).start()
+
+    def _deliver(self, message_ids, send_interval):
+        try:
+            self.process_batch(message_ids, send_interval)
+        except Exception:
+            log.exception("Email outbox bulk delivery error")
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.process_batch()
+            except Exception:
+                log.exception("Email outbox worker error")
+                processed = 0
+            # Keep draining while full batches come back; otherwise sleep until woken or the next poll
+            if processed < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _claim(self, connection, message_ids=None):
+        """Claim due messages under a new token; returns (token, messages)"""
+        # Fixed length: a host name can be longer than locked_by (VARCHAR(64)) allows
+        token = uuid.uuid4().hex
+        with connection.cursor() as cursor:
+            if message_ids:
+                cursor.execute("""
+                    UPDATE email_outbox
+                    SET status = 'sending', locked_by = %s, locked_at = NOW()
+                    WHERE id IN %s AND status = 'pending'
+                """, (token, tuple(message_ids)))
+            else:
+                # A message stuck in 'sending' (its worker died mid-batch) used up an attempt:
+                # fail it when that was the last one, otherwise claim it again below
+                cursor.execute("""
+                    UPDATE email_outbox
+                    SET attempts = attempts + 1, status = 'failed',
+                        last_error = 'Delivery interrupted: the sending worker stopped responding',
+                        locked_by = NULL, locked_at = NULL
+                    WHERE status = 'sending' AND locked_at < NOW() - INTERVAL %s SECOND
+                      AND attempts + 1 >= max_attempts
+                """, (self.claim_timeout,))
+                # Assignments apply left to right: attempts and last_error still see the old status
+                cursor.execute("""
+                    UPDATE email_outbox
+                    SET attempts = attempts + (status = 'sending'),
+                        last_error = IF(status = 'sending',
+                                        'Delivery interrupted: the sending worker stopped responding', last_error),
+                        status = 'sending', locked_by = %s, locked_at = NOW()
+                    WHERE (status = 'pending' AND next_attempt_at <= NOW())
+                       OR (status = 'sending' AND locked_at < NOW() - INTERVAL %s SECOND)
+                    ORDER BY id
+                    LIMIT %s
+                """, (token, self.claim_timeout, self.batch_size))
+            connection.commit()
+            cursor.execute("""
+                SELECT id, category, recipient, subject, html_body, text_body, attempts, max_attempts
+                FROM email_outbox
+                WHERE locked_by = %s AND status = 'sending'
+                ORDER BY id
+            """, (token,))
+            return token, cursor.fetchall()
+
+    def process_batch(self, message_ids=None, send_interval=None):
+        """Send one batch of due messages; returns how many were attempted.
+
+        With message_ids, exactly those (still pending) messages are sent as one batch,
+        whatever the batch size, e.g. all notifications of a bulk approval.
+        send_interval overrides the worker's pause between messages.
+        """
+        if send_interval is None:
+            send_interval = self.send_interval
+        connection = self.get_connection()
+        if not connection:
+            return 0
+        try:
+            token, messages = self._claim(connection, message_ids)
+            if not messages:
+                return 0
+
+            try:
+                results = self.send_batch(messages, send_interval)
+            except Exception as e:
+                # Could not open the SMTP connection at all: every message in the batch failed
+                results = {message['id']: str(e) for message in messages}
+
+            with connection.cursor() as cursor:
+                for message in messages:
+                    error = results.get(message['id'], 'Not attempted')
+                    if error is None:
+                        cursor.execute("""
+                            UPDATE email_outbox
+                            SET status = 'sent', attempts = attempts + 1, sent_at = NOW(),
+                                last_error = NULL, locked_by = NULL, locked_at = NULL
+                            WHERE id = %s AND locked_by = %s
+                        """, (message['id'], token))
+                        continue
+                    attempts = (message.get('attempts') or 0) + 1
+                    status = 'failed' if attempts >= (message.get('max_attempts') or 1) else 'pending'
+                    delay = retry_delay(attempts, self.retry_base, self.retry_max)
+                    cursor.execute("""
+                        UPDATE email_outbox
+                        SET status = %s, attempts = %s, last_error = %s,
+                            next_attempt_at = NOW() + INTERVAL %s SECOND,
+                            locked_by = NULL, locked_at = NULL
+                        WHERE id = %s AND locked_by = %s
+                    """, (status, attempts, str(error)[:2000], delay, message['id'], token))
+                    log.warning("Email %s to %s failed (attempt %s, %s): %s",
+                                message['id'], message['recipient'], attempts, status, error)
+            connection.commit()
+            return len(messages)
+        finally:
+            connection.close()
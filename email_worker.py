@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+Run the email outbox worker as a separate process
+Usage: python email_worker.py
+
+Set EMAIL_WORKER_ENABLED=false for the web app when this process does the sending,
+otherwise every web worker also runs its own delivery thread.
+"""
+import logging
+
+from app import email_worker
+
+log = logging.getLogger('school.email')
+
+if __name__ == '__main__':
+    log.info("Email outbox worker started")
+    try:
+        email_worker.run_forever()
+    except KeyboardInterrupt:
+        log.info("Email outbox worker stopped")
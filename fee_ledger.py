@@ -0,0 +1,507 @@
+"""
+Fee Ledger Engine
+Resolves fee structures, carry-forward, previous-term balances and payment status
+for any number of students from a handful of grouped queries.
+
+Usage:
+    ledger = FeeLedger.load(cursor, student_ids=[...])
+    entry = ledger.student_entry(student_id, current_grade, student_category)
+
+Payment totals come from the student_fee_balances summary table, which payment and
+fee structure writes keep current via refresh_fee_balance() and friends.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+import pymysql
+
+# student_fee_balances row that collects payments not tied to any fee structure
+UNASSIGNED_STRUCTURE_ID = 0
+
+
+def normalize_category(value):
+    """Normalize a fee/student category for comparison (MySQL compares them case-insensitively)"""
+    if value is None:
+        return None
+    return str(value).strip().lower()
+
+
+def category_rank(student_category, structure_category):
+    """Rank of a fee structure category for a student category, or None if it does not apply.
+
+    - 'self sponsored' students: 'self sponsored' structures first, then 'both'
+    - 'sponsored' students: 'sponsored' structures first, then 'both'
+    - 'both' students: every structure ('both', 'self sponsored', 'sponsored', NULL, anything else)
+    - students with no/unknown category: 'both' structures only
+    """
+    student_category = normalize_category(student_category) or ''
+    structure_category = normalize_category(structure_category)
+    if student_category == 'self sponsored':
+        return {'self sponsored': 1, 'both': 2}.get(structure_category)
+    if student_category == 'sponsored':
+        return {'sponsored': 1, 'both': 2}.get(structure_category)
+    if student_category == 'both':
+        if structure_category is None:
+            return 4
+        return {'both': 1, 'self sponsored': 2, 'sponsored': 3}.get(structure_category, 5)
+    return 1 if structure_category == 'both' else None
+
+
+def to_date(value):
+    """Convert a DATE/DATETIME/'YYYY-MM-DD' value to a date (None if it cannot be parsed)"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value).split(' ')[0], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def format_iso_date(value):
+    """Format a date value as 'YYYY-MM-DD' (passes None through)"""
+    if value and hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%d')
+    elif value:
+        return str(value).split(' ')[0]
+    return value
+
+
+def _money(value):
+    return Decimal(str(value)) if value is not None else Decimal('0')
+
+
+class FeeLedger:
+    """In-memory index of academic levels, active fee structures, fee items and payment totals"""
+
+    def __init__(self, today=None):
+        self.today = today or date.today()
+        self.current_academic_year_id = None
+        self.current_term_id = None
+        self.levels_by_id = {}
+        self.levels_by_name = {}
+        self.structures_by_id = {}
+        self.structures_by_level = {}
+        self.items_by_structure = {}
+        self.paid_by_student = {}
+        self.paid_by_student_structure = {}
+
+    @classmethod
+    def load(cls, cursor, student_ids=None, today=None):
+        """Load everything needed to resolve ledgers.
+
+        student_ids limits the payment aggregation to those students; None loads every student.
+        """
+        ledger = cls(today)
+        ledger._load_current_period(cursor)
+        ledger._load_levels(cursor)
+        ledger._load_structures(cursor)
+        ledger._load_items(cursor)
+        ledger.load_payments(cursor, student_ids)
+        return ledger
+
+    def _load_current_period(self, cursor):
+        cursor.execute("""
+            SELECT ay.id AS academic_year_id, t.id AS term_id
+            FROM academic_years ay
+            LEFT JOIN terms t ON t.academic_year_id = ay.id
+                AND t.is_current = TRUE AND t.status = 'active'
+            WHERE ay.is_current = TRUE AND ay.status = 'active'
+            ORDER BY t.id IS NULL, t.id
+            LIMIT 1
+        """)
+        result = cursor.fetchone()
+        if result:
+            self.current_academic_year_id = result.get('academic_year_id')
+            self.current_term_id = result.get('term_id')
+
+    def _load_levels(self, cursor):
+        cursor.execute("""
+            SELECT id, level_category, level_name, level_description
+            FROM academic_levels
+            WHERE level_status = 'active'
+            ORDER BY id ASC
+        """)
+        for row in cursor.fetchall():
+            level = {
+                'id': row.get('id'),
+                'level_category': row.get('level_category', ''),
+                'level_name': row.get('level_name', ''),
+                'level_description': row.get('level_description', '')
+            }
+            self.levels_by_id[level['id']] = level
+            self.levels_by_name.setdefault(self._grade_key(level['level_name']), level)
+
+    def _load_structures(self, cursor):
+        cursor.execute("""
+            SELECT id, academic_level_id, fee_name, category, start_date, end_date,
+                   payment_deadline, total_amount, status, academic_year_id, term_id, created_at
+            FROM fee_structures
+            WHERE status = 'active'
+        """)
+        for row in cursor.fetchall():
+            structure = dict(row)
+            structure['total_amount'] = _money(structure.get('total_amount'))
+            self.structures_by_id[structure['id']] = structure
+            self.structures_by_level.setdefault(structure['academic_level_id'], []).append(structure)
+        # Newest first, so a stable sort by rank keeps "created_at DESC" as the tie-breaker
+        for structures in self.structures_by_level.values():
+            structures.sort(key=lambda s: (s.get('created_at') or datetime.min, s['id']), reverse=True)
+
+    def _load_items(self, cursor):
+        cursor.execute("""
+            SELECT fi.id, fi.fee_structure_id, fi.item_name, fi.item_description, fi.amount, fi.item_order
+            FROM fee_items fi
+            INNER JOIN fee_structures fs ON fi.fee_structure_id = fs.id
+            WHERE fs.status = 'active'
+            ORDER BY fi.fee_structure_id, fi.id
+        """)
+        for row in cursor.fetchall():
+            self.items_by_structure.setdefault(row['fee_structure_id'], []).append(row)
+
+    def load_payments(self, cursor, student_ids=None):
+        """Add payment totals for student_ids (None loads every student).
+
+        Can be called again with further students, e.g. one page of a listing at a time.
+        """
+        if student_ids is not None:
+            student_ids = [sid for sid in student_ids if sid]
+            if not student_ids:
+                return
+        try:
+            rows = self._fetch_balances(cursor, student_ids)
+        except pymysql.err.ProgrammingError:
+            # student_fee_balances not migrated yet: aggregate the raw payments instead
+            rows = self._fetch_payment_totals(cursor, student_ids)
+        for row in rows:
+            amount = _money(row.get('total_paid'))
+            student_id = row.get('student_id')
+            self.paid_by_student[student_id] = self.paid_by_student.get(student_id, Decimal('0')) + amount
+            if row.get('fee_structure_id') not in (None, UNASSIGNED_STRUCTURE_ID):
+                key = (student_id, row['fee_structure_id'])
+                self.paid_by_student_structure[key] = self.paid_by_student_structure.get(key, Decimal('0')) + amount
+
+    @staticmethod
+    def _fetch_balances(cursor, student_ids):
+        if student_ids is not None:
+            cursor.execute("""
+                SELECT student_id, fee_structure_id, paid AS total_paid
+                FROM student_fee_balances
+                WHERE student_id IN %s
+            """, (tuple(student_ids),))
+        else:
+            cursor.execute("""
+                SELECT student_id, fee_structure_id, paid AS total_paid
+                FROM student_fee_balances
+            """)
+        return cursor.fetchall()
+
+    @staticmethod
+    def _fetch_payment_totals(cursor, student_ids):
+        if student_ids is not None:
+            cursor.execute("""
+                SELECT student_id, fee_structure_id, COALESCE(SUM(amount_paid), 0) AS total_paid
+                FROM student_payments
+                WHERE student_id IN %s
+                GROUP BY student_id, fee_structure_id
+            """, (tuple(student_ids),))
+        else:
+            cursor.execute("""
+                SELECT student_id, fee_structure_id, COALESCE(SUM(amount_paid), 0) AS total_paid
+                FROM student_payments
+                GROUP BY student_id, fee_structure_id
+            """)
+        return cursor.fetchall()
+
+    @staticmethod
+    def _grade_key(grade):
+        return (grade or '').strip().lower()
+
+    # Lookups
+
+    def level_for_grade(self, grade):
+        """Active academic level whose level_name matches a student's current_grade"""
+        if not grade:
+            return None
+        return self.levels_by_name.get(self._grade_key(grade))
+
+    def current_structure(self, level_id, student_category, current_term_only=True):
+        """Best active fee structure for a level and student category.
+
+        With current_term_only, structures are limited to the current academic year
+        and term whenever both are set (as on the accountant's student fees page).
+        """
+        candidates = []
+        for structure in self.structures_by_level.get(level_id, []):
+            if (current_term_only and self.current_academic_year_id and self.current_term_id
+                    and (structure.get('academic_year_id') != self.current_academic_year_id
+                         or structure.get('term_id') != self.current_term_id)):
+                continue
+            rank = category_rank(student_category, structure.get('category'))
+            if rank is not None:
+                candidates.append((rank, structure))
+        if not candidates:
+            return None
+        candidates.sort(key=lambda candidate: candidate[0])
+        return candidates[0][1]
+
+    def latest_structure(self, level_id):
+        """Most recently created active fee structure for a level, regardless of category"""
+        structures = self.structures_by_level.get(level_id, [])
+        return structures[0] if structures else None
+
+    def structures_for(self, level_id, student_category):
+        """Every active fee structure of a level that applies to the student category"""
+        return [s for s in self.structures_by_level.get(level_id, [])
+                if category_rank(student_category, s.get('category')) is not None]
+
+    def items(self, structure_id, order_by='item_order'):
+        """Fee items of a structure, ordered by item_order (default) or by id"""
+        items = self.items_by_structure.get(structure_id, [])
+        if order_by == 'item_order':
+            items = sorted(items, key=lambda item: (item.get('item_order') or 0, item['id']))
+        return [{
+            'item_name': item.get('item_name', '') or '',
+            'item_description': item.get('item_description', '') or '',
+            'amount': float(item.get('amount', 0) or 0)
+        } for item in items]
+
+    def total_paid(self, student_id):
+        """All payments recorded for a student"""
+        return float(self.paid_by_student.get(student_id, 0))
+
+    def paid_for_structure(self, student_id, structure_id):
+        """Payments recorded for a student against one fee structure"""
+        return float(self.paid_by_student_structure.get((student_id, structure_id), 0))
+
+    def previous_structures(self, student_id, level_id, student_category, current):
+        """Ended fee structures before the current one, most recent end date first.
+
+        A structure counts as previous when it has ended before today or before the
+        current structure starts. Each entry carries the student's payments and balance.
+        """
+        if not current:
+            return []
+        current_start = to_date(current.get('start_date'))
+        previous = []
+        for structure in self.structures_for(level_id, student_category):
+            if structure['id'] == current['id']:
+                continue
+            end_date = to_date(structure.get('end_date'))
+            if end_date is None:
+                continue
+            if not (end_date < self.today or (current_start and end_date < current_start)):
+                continue
+            paid = self.paid_for_structure(student_id, structure['id'])
+            previous.append({
+                'structure': structure,
+                'total_paid': paid,
+                'balance': float(structure['total_amount']) - paid
+            })
+        previous.sort(key=lambda entry: (to_date(entry['structure'].get('end_date')), entry['structure']['id']),
+                      reverse=True)
+        return previous
+
+    def payment_status(self, structure, balance):
+        """'paid', 'overdue', 'pending' or 'no_structure'"""
+        if not structure:
+            return 'no_structure'
+        if balance <= 0:
+            return 'paid'
+        deadline = to_date(structure.get('payment_deadline'))
+        if deadline and deadline < self.today:
+            return 'overdue'
+        return 'pending'
+
+    def student_entry(self, student_id, grade, student_category, current_term_only=True):
+        """Full ledger for one student.
+
+        Balance = (current fee + unpaid balances of previous structures)
+                  - (payments against the current fee + overpayments on previous structures)
+        """
+        level = self.level_for_grade(grade)
+        structure = None
+        if level:
+            structure = self.current_structure(level['id'], student_category, current_term_only)
+
+        total_paid_current = 0.0
+        carry_forward = 0.0
+        previous_term_balance = 0.0
+        previous = []
+        if structure:
+            total_paid_current = self.paid_for_structure(student_id, structure['id'])
+            previous = self.previous_structures(student_id, level['id'], student_category, structure)
+            for entry in previous:
+                if entry['balance'] < 0:
+                    carry_forward += abs(entry['balance'])
+                elif entry['balance'] > 0:
+                    previous_term_balance += entry['balance']
+
+        total_amount_due = 0.0
+        balance = 0.0
+        if structure:
+            total_amount_due = float(structure['total_amount']) + previous_term_balance
+            balance = total_amount_due - (total_paid_current + carry_forward)
+
+        return {
+            'academic_level': level,
+            'fee_structure': structure,
+            'total_paid': self.total_paid(student_id),
+            'total_paid_current': total_paid_current,
+            'carry_forward': carry_forward,
+            'previous_term_balance': previous_term_balance,
+            'previous_structures': previous,
+            'total_amount_due': total_amount_due,
+            'balance': balance,
+            'payment_status': self.payment_status(structure, balance)
+        }
+
+
+# Materialized balances
+#
+# student_fee_balances holds one row per (student, fee structure) the student has paid
+# against, plus an UNASSIGNED_STRUCTURE_ID row for payments without a structure.
+# The helpers below run inside the caller's transaction, before its commit.
+
+_BALANCES_SELECT = """
+    SELECT sp.student_id,
+           COALESCE(fs.id, 0) AS fee_structure_id,
+           COALESCE(MAX(fs.total_amount), 0) AS billed,
+           COALESCE(SUM(sp.amount_paid), 0) AS paid
+    FROM student_payments sp
+    LEFT JOIN fee_structures fs ON sp.fee_structure_id = fs.id
+"""
+
+
+def refresh_fee_balance(cursor, student_id, fee_structure_id):
+    """Recompute one student's balance row for a fee structure from student_payments.
+
+    The payment rows are read with FOR UPDATE so concurrent writers for the same
+    student serialize instead of overwriting each other's totals.
+    """
+    structure_id = fee_structure_id or UNASSIGNED_STRUCTURE_ID
+    billed = Decimal('0')
+    if structure_id != UNASSIGNED_STRUCTURE_ID:
+        cursor.execute("SELECT total_amount FROM fee_structures WHERE id = %s", (structure_id,))
+        structure = cursor.fetchone()
+        if structure:
+            billed = _money(structure.get('total_amount'))
+        else:
+            # The structure is gone; its payments were set to NULL by the foreign key
+            cursor.execute("""
+                DELETE FROM student_fee_balances
+                WHERE student_id = %s AND fee_structure_id = %s
+            """, (student_id, structure_id))
+            structure_id = UNASSIGNED_STRUCTURE_ID
+
+    if structure_id == UNASSIGNED_STRUCTURE_ID:
+        cursor.execute("""
+            SELECT COUNT(*) AS payment_count, COALESCE(SUM(amount_paid), 0) AS paid
+            FROM student_payments
+            WHERE student_id = %s AND fee_structure_id IS NULL
+            FOR UPDATE
+        """, (student_id,))
+    else:
+        cursor.execute("""
+            SELECT COUNT(*) AS payment_count, COALESCE(SUM(amount_paid), 0) AS paid
+            FROM student_payments
+            WHERE student_id = %s AND fee_structure_id = %s
+            FOR UPDATE
+        """, (student_id, structure_id))
+    totals = cursor.fetchone() or {}
+
+    if not totals.get('payment_count'):
+        cursor.execute("""
+            DELETE FROM student_fee_balances
+            WHERE student_id = %s AND fee_structure_id = %s
+        """, (student_id, structure_id))
+        return
+
+    paid = _money(totals.get('paid'))
+    cursor.execute("""
+        INSERT INTO student_fee_balances (student_id, fee_structure_id, billed, paid, balance)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            billed = VALUES(billed),
+            paid = VALUES(paid),
+            balance = VALUES(balance)
+    """, (student_id, structure_id, billed, paid, billed - paid))
+
+
+def reprice_fee_balances(cursor, fee_structure_id, total_amount):
+    """Apply a fee structure's new total to every balance row billed against it"""
+    cursor.execute("""
+        UPDATE student_fee_balances
+        SET billed = %s, balance = %s - paid
+        WHERE fee_structure_id = %s
+    """, (total_amount, total_amount, fee_structure_id))
+
+
+def remove_fee_structure_balances(cursor, fee_structure_id):
+    """Move the balances of a deleted fee structure onto the students' unassigned rows.
+
+    Call after the fee structure has been deleted (its payments are then unassigned).
+    """
+    cursor.execute("""
+        SELECT student_id FROM student_fee_balances WHERE fee_structure_id = %s
+    """, (fee_structure_id,))
+    student_ids = [row['student_id'] for row in cursor.fetchall()]
+    cursor.execute("DELETE FROM student_fee_balances WHERE fee_structure_id = %s", (fee_structure_id,))
+    for student_id in student_ids:
+        refresh_fee_balance(cursor, student_id, UNASSIGNED_STRUCTURE_ID)
+
+
+def rebuild_fee_balances(cursor):
+    """Recompute every balance row from student_payments; returns the number of rows written"""
+    # DELETE rather than TRUNCATE so the rebuild stays inside the caller's transaction
+    cursor.execute("DELETE FROM student_fee_balances")
+    cursor.execute(f"""
+        INSERT INTO student_fee_balances (student_id, fee_structure_id, billed, paid, balance)
+        SELECT student_id, fee_structure_id, billed, paid, billed - paid
+        FROM ({_BALANCES_SELECT}
+              GROUP BY sp.student_id, COALESCE(fs.id, 0)) AS totals
+    """)
+    return cursor.rowcount
+
+
+def reconcile_fee_balances(cursor, fix=False):
+    """Compare student_fee_balances with student_payments.
+
+    Returns a list of drifted rows (student_id, fee_structure_id, expected, stored).
+    With fix=True every drifted row is rewritten.
+    """
+    cursor.execute(f"{_BALANCES_SELECT} GROUP BY sp.student_id, COALESCE(fs.id, 0)")
+    expected = {}
+    for row in cursor.fetchall():
+        billed = _money(row.get('billed'))
+        paid = _money(row.get('paid'))
+        expected[(row['student_id'], row['fee_structure_id'])] = (billed, paid, billed - paid)
+
+    cursor.execute("SELECT student_id, fee_structure_id, billed, paid, balance FROM student_fee_balances")
+    stored = {}
+    for row in cursor.fetchall():
+        stored[(row['student_id'], row['fee_structure_id'])] = (
+            _money(row.get('billed')), _money(row.get('paid')), _money(row.get('balance')))
+
+    drift = []
+    for key in sorted(set(expected) | set(stored), key=lambda k: (str(k[0]), k[1])):
+        if expected.get(key) != stored.get(key):
+            drift.append({
+                'student_id': key[0],
+                'fee_structure_id': key[1],
+                'expected': expected.get(key),
+                'stored': stored.get(key)
+            })
+
+    if fix:
+        for entry in drift:
+            if entry['expected'] is None:
+                cursor.execute("""
+                    DELETE FROM student_fee_balances
+                    WHERE student_id = %s AND fee_structure_id = %s
+                """, (entry['student_id'], entry['fee_structure_id']))
+            else:
+                refresh_fee_balance(cursor, entry['student_id'], entry['fee_structure_id'])
+    return drift
@@ -0,0 +1,280 @@
+"""
+Invoice Batches
+Fee invoices for a whole class at once. The ledgers of every student in a grade are
+resolved from a handful of set-based queries (FeeLedger plus one query for all their
+payments), PDF rendering is fanned out over a process pool and the invoices are
+streamed into one zip file.
+
+Progress is written to a JSON status file per batch (at most every update_interval
+seconds), so a status request served by any web worker can report it.
+
+Usage:
+    invoices = load_class_invoices(cursor, 'Grade 4', term_id=7)
+    batch_id = invoice_batches.start(invoices, school_settings, grade='Grade 4', started_by='...')
+    invoice_batches.status(batch_id)     # {'state': 'running'|'completed'|'failed', 'done', 'total', ...}
+    invoice_batches.zip_path(batch_id)   # the zip, once the batch has completed
+"""
+import json
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+
+from fee_ledger import FeeLedger, to_date
+
+BATCH_ID_RE = re.compile(r'^[0-9a-f]{16}$')
+
+log = logging.getLogger('school.fees')
+
+_worker_school_settings = None
+
+
+def term_display(term_name, year_name, fee_name):
+    """'Term 3, 2025' for a structure of term 3 in "2024/2025"; the fee name when it has no term"""
+    if term_name and year_name:
+        year_part = year_name
+        for part in str(year_name).split():
+            if '/' in part or '-' in part:
+                year_part = re.split(r'[/-]', part)[-1] or part
+                break
+        return f"{term_name}, {year_part}"
+    return fee_name or 'Fees'
+
+
+def load_class_invoices(cursor, grade, term_id=None, today=None):
+    """Invoice data of every in-session student of a grade, in name order.
+
+    term_id bills the fee structures of that term instead of the current term. Balances
+    follow generate_invoice: (current fee + last previous term's unpaid balance) -
+    (payments against the current fee + overpayments on previous structures).
+    """
+    cursor.execute("""
+        SELECT student_id, full_name, current_grade, student_category
+        FROM students
+        WHERE current_grade = %s AND status = 'in session'
+        ORDER BY full_name, student_id
+    """, (grade,))
+    students = cursor.fetchall()
+    if not students:
+        return []
+    student_ids = [student['student_id'] for student in students]
+
+    ledger = FeeLedger.load(cursor, student_ids=student_ids, today=today)
+    if term_id:
+        cursor.execute("SELECT id, academic_year_id FROM terms WHERE id = %s", (term_id,))
+        term = cursor.fetchone()
+        if not term:
+            raise ValueError('Term not found.')
+        ledger.current_term_id = term['id']
+        ledger.current_academic_year_id = term['academic_year_id']
+
+    level = ledger.level_for_grade(grade)
+    term_names = {}
+    if level:
+        cursor.execute("""
+            SELECT fs.id, t.term_name, ay.year_name
+            FROM fee_structures fs
+            LEFT JOIN terms t ON fs.term_id = t.id
+            LEFT JOIN academic_years ay ON fs.academic_year_id = ay.id
+            WHERE fs.academic_level_id = %s AND fs.status = 'active'
+        """, (level['id'],))
+        term_names = {row['id']: (row['term_name'], row['year_name']) for row in cursor.fetchall()}
+
+    cursor.execute("""
+        SELECT student_id, amount_paid, payment_method, reference_number, transaction_id, payment_date
+        FROM student_payments
+        WHERE student_id IN %s
+        ORDER BY payment_date DESC, created_at DESC
+    """, (tuple(student_ids),))
+    payments_by_student = {}
+    for row in cursor.fetchall():
+        payments_by_student.setdefault(row['student_id'], []).append(row)
+
+    invoice_date = (today or date.today()).strftime('%B %d, %Y')
+    stamp = (today or date.today()).strftime('%Y%m%d')
+    return [_student_invoice(ledger, level, term_names, student, payments_by_student.get(student['student_id'], []),
+                             invoice_date, stamp) for student in students]
+
+
+def _student_invoice(ledger, level, term_names, student, payments, invoice_date, stamp):
+    student_id = student['student_id']
+    category = student.get('student_category')
+
+    fee_breakdown = []
+    structure = None
+    if level:
+        structures = sorted(ledger.structures_for(level['id'], category),
+                            key=lambda s: (to_date(s.get('start_date')) or date.min, s.get('created_at') or datetime.min),
+                            reverse=True)
+        for fee in structures:
+            term_name, year_name = term_names.get(fee['id'], (None, None))
+            fee_breakdown.append({'term': term_display(term_name, year_name, fee.get('fee_name')),
+                                  'description': 'fees', 'amount': float(fee['total_amount'])})
+        structure = ledger.current_structure(level['id'], category)
+
+    balance_due = 0.0
+    if structure:
+        paid_current = ledger.paid_for_structure(student_id, structure['id'])
+        previous = ledger.previous_structures(student_id, level['id'], category, structure)
+        carry_forward = sum(abs(entry['balance']) for entry in previous if entry['balance'] < 0)
+        previous_term_balance = max(previous[0]['balance'], 0.0) if previous else 0.0
+        balance_due = float(structure['total_amount']) + previous_term_balance - (paid_current + carry_forward)
+
+    payment_details = []
+    for payment in payments:
+        payment_date = payment.get('payment_date')
+        payment_details.append({
+            'date': payment_date.strftime('%d/%m/%Y') if hasattr(payment_date, 'strftime') else str(payment_date or ''),
+            'amount': float(payment.get('amount_paid') or 0),
+            'method': payment.get('payment_method') or '',
+            'reference': payment.get('reference_number') or payment.get('transaction_id') or ''
+        })
+
+    return {
+        'filename': f"Invoice_{re.sub(r'[^A-Za-z0-9_-]', '_', student_id)}_{stamp}.pdf",
+        'student': {'student_id': student_id, 'full_name': student['full_name'],
+                    'current_grade': student.get('current_grade') or 'N/A'},
+        'invoice_date': invoice_date,
+        'fee_breakdown': fee_breakdown,
+        'payment_details': payment_details,
+        'total_fees': sum(fee['amount'] for fee in fee_breakdown),
+        'total_paid': sum(payment['amount'] for payment in payment_details),
+        'balance_due': balance_due
+    }
+
+
+def _init_worker(school_settings):
+    global _worker_school_settings
+    _worker_school_settings = school_settings
+
+
+def render_invoice(invoice):
+    """Process pool task: (filename, PDF bytes) of one invoice"""
+    from pdf_documents import fee_statement_pdf
+    pdf_bytes = fee_statement_pdf('FEE INVOICE', _worker_school_settings, invoice['student'], invoice['invoice_date'],
+                                  invoice['fee_breakdown'], invoice['payment_details'], invoice['total_fees'],
+                                  invoice['total_paid'], invoice['balance_due'], document='invoice')
+    return invoice['filename'], pdf_bytes
+
+
+class InvoiceBatches:
+    """Renders invoice batches in background threads of this process, each over a process pool.
+
+    Every batch has a status file and, once completed, a zip in folder; both are removed
+    keep_for seconds after the batch finished. start_method picks the multiprocessing
+    start method of the pool. It defaults to 'spawn': the pool is started from a thread
+    of a multithreaded web worker, and a forked child could inherit a lock held by
+    another thread (logging, the connection pool) and hang. The workers only need
+    pdf_documents and plain-dict invoices, so nothing requires fork.
+    """
+
+    def __init__(self, folder, workers=None, start_method='spawn', keep_for=86400,
+                 update_interval=1.0, stale_after=900):
+        self.folder = folder
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.start_method = start_method
+        self.keep_for = keep_for
+        self.update_interval = update_interval
+        self.stale_after = stale_after
+
+    def _status_path(self, batch_id):
+        return os.path.join(self.folder, f'invoice_batch_{batch_id}.json')
+
+    def zip_path(self, batch_id):
+        """Path of a completed batch's zip, or None"""
+        if not BATCH_ID_RE.match(batch_id or ''):
+            return None
+        path = os.path.join(self.folder, f'invoice_batch_{batch_id}.zip')
+        return path if os.path.isfile(path) else None
+
+    def status(self, batch_id):
+        """{'state': 'unknown'|'running'|'completed'|'failed', 'done', 'total', ...}"""
+        if not BATCH_ID_RE.match(batch_id or ''):
+            return {'state': 'unknown'}
+        try:
+            with open(self._status_path(batch_id)) as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return {'state': 'unknown'}
+        if status.get('state') == 'running' and time.time() - status.get('updated_at', 0) > self.stale_after:
+            # The process running it died without reporting back
+            status.update({'state': 'failed', 'error': 'The invoice batch stopped responding.'})
+        return status
+
+    def start(self, invoices, school_settings, **info):
+        """Render invoices in the background; returns the batch id.
+
+        Extra keyword arguments (e.g. grade, started_by) are kept in the status.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        self.prune()
+        batch_id = uuid.uuid4().hex[:16]
+        self._write(batch_id, {'state': 'running', 'started_at': time.time(), 'done': 0,
+                               'total': len(invoices), 'failed': [], **info})
+        threading.Thread(target=self._run, args=(batch_id, invoices, school_settings, info),
+                         name='invoice-batch', daemon=True).start()
+        return batch_id
+
+    def _run(self, batch_id, invoices, school_settings, info):
+        started_at = time.time()
+        zip_path = os.path.join(self.folder, f'invoice_batch_{batch_id}.zip')
+        temp_path = f'{zip_path}.tmp'
+        done, failed, last_update = 0, [], 0.0
+        try:
+            context = multiprocessing.get_context(self.start_method)
+            with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as archive, \
+                    ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                        initializer=_init_worker, initargs=(school_settings,)) as pool:
+                futures = {pool.submit(render_invoice, invoice): invoice for invoice in invoices}
+                for future in as_completed(futures):
+                    try:
+                        filename, pdf_bytes = future.result()
+                        archive.writestr(filename, pdf_bytes)
+                    except Exception as e:
+                        failed.append({'student_id': futures[future]['student']['student_id'], 'error': str(e)})
+                    done += 1
+                    now = time.time()
+                    if now - last_update >= self.update_interval:
+                        last_update = now
+                        self._write(batch_id, {'state': 'running', 'started_at': started_at, 'done': done,
+                                               'total': len(invoices), 'failed': failed, **info})
+            os.replace(temp_path, zip_path)
+            self._write(batch_id, {'state': 'completed', 'started_at': started_at, 'finished_at': time.time(),
+                                   'done': done, 'total': len(invoices), 'failed': failed, **info})
+        except Exception as e:
+            log.exception("Invoice batch %s failed: %s", batch_id, e)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            self._write(batch_id, {'state': 'failed', 'started_at': started_at, 'finished_at': time.time(),
+                                   'done': done, 'total': len(invoices), 'failed': failed, 'error': str(e), **info})
+
+    def _write(self, batch_id, status):
+        status['updated_at'] = time.time()
+        path = self._status_path(batch_id)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(status, f, default=str)
+        os.replace(temp_path, path)
+
+    def prune(self):
+        """Remove the status files and zips of batches that finished more than keep_for seconds ago"""
+        cutoff = time.time() - self.keep_for
+        try:
+            names = os.listdir(self.folder)
+        except OSError:
+            return
+        for name in names:
+            if not name.startswith('invoice_batch_'):
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
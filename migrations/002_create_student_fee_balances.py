@@ -0,0 +1,37 @@
+"""
+Migration: Create student_fee_balances summary table and backfill it from student_payments
+Date: 2026-10-XX
+"""
+
+def up():
+    """SQL statements to create and populate the fee balance summary"""
+    return [
+        """
+        CREATE TABLE IF NOT EXISTS student_fee_balances (
+            student_id VARCHAR(20) NOT NULL,
+            fee_structure_id INT NOT NULL DEFAULT 0,
+            billed DECIMAL(12, 2) NOT NULL DEFAULT 0,
+            paid DECIMAL(12, 2) NOT NULL DEFAULT 0,
+            balance DECIMAL(12, 2) NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (student_id, fee_structure_id),
+            INDEX idx_fee_structure (fee_structure_id),
+            FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE
+        )
+        """,
+        """
+        INSERT INTO student_fee_balances (student_id, fee_structure_id, billed, paid, balance)
+        SELECT sp.student_id,
+               COALESCE(fs.id, 0),
+               COALESCE(MAX(fs.total_amount), 0),
+               COALESCE(SUM(sp.amount_paid), 0),
+               COALESCE(MAX(fs.total_amount), 0) - COALESCE(SUM(sp.amount_paid), 0)
+        FROM student_payments sp
+        LEFT JOIN fee_structures fs ON sp.fee_structure_id = fs.id
+        GROUP BY sp.student_id, COALESCE(fs.id, 0)
+        ON DUPLICATE KEY UPDATE
+            billed = VALUES(billed),
+            paid = VALUES(paid),
+            balance = VALUES(balance)
+        """
+    ]
@@ -0,0 +1,50 @@
+"""
+Migration: Add indexes backing the paginated student fees listing
+Date: 2026-10-XX
+
+The listing always filters on status and orders by (sort column, student_id),
+so each sort has an index that serves both the filter and the keyset seek.
+The search matches admission-number and name prefixes through those indexes and
+name words through the FULLTEXT index ft_students_full_name.
+
+Each index is added only if it is missing, so a run that failed partway can be retried.
+"""
+import pymysql
+
+INDEXES = [
+    ('idx_status_name', "ADD INDEX idx_status_name (status, full_name, student_id)"),
+    ('idx_status_student_id', "ADD INDEX idx_status_student_id (status, student_id)"),
+    ('idx_status_grade', "ADD INDEX idx_status_grade (status, current_grade, student_id)"),
+    ('idx_status_category_name', "ADD INDEX idx_status_category_name (status, student_category, full_name, student_id)"),
+    ('ft_students_full_name', "ADD FULLTEXT INDEX ft_students_full_name (full_name)")
+]
+
+
+def _index_exists(cursor, table, index):
+    cursor.execute("""
+        SELECT COUNT(*) AS count FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index))
+    return cursor.fetchone()['count'] > 0
+
+
+def migrate(connection):
+    """Add the student fees listing and search indexes that students does not have yet"""
+    try:
+        with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+            missing = [clause for name, clause in INDEXES if not _index_exists(cursor, 'students', name)]
+            regular = [clause for clause in missing if 'FULLTEXT' not in clause]
+            if regular:
+                cursor.execute(f"ALTER TABLE students {', '.join(regular)}")
+            # InnoDB builds one FULLTEXT index per ALTER
+            for clause in missing:
+                if 'FULLTEXT' in clause:
+                    cursor.execute(f"ALTER TABLE students {clause}")
+            if not missing:
+                print("  Student fees listing indexes already exist")
+            connection.commit()
+            return True
+    except Exception as e:
+        connection.rollback()
+        print(f"Migration error: {e}")
+        return False
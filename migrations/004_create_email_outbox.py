@@ -0,0 +1,32 @@
+"""
+Migration: Create email_outbox table for queued transactional email
+Date: 2026-10-XX
+"""
+
+def up():
+    """SQL statements to create the email outbox"""
+    return [
+        """
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            category VARCHAR(50),
+            recipient VARCHAR(255) NOT NULL,
+            subject VARCHAR(500) NOT NULL,
+            html_body MEDIUMTEXT,
+            text_body MEDIUMTEXT,
+            status ENUM('pending', 'sending', 'sent', 'failed') NOT NULL DEFAULT 'pending',
+            attempts INT NOT NULL DEFAULT 0,
+            max_attempts INT NOT NULL DEFAULT 5,
+            last_error TEXT,
+            next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            locked_by VARCHAR(64),
+            locked_at DATETIME NULL,
+            sent_at DATETIME NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_status_next_attempt (status, next_attempt_at),
+            INDEX idx_locked_by (locked_by),
+            INDEX idx_created_at (created_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """
+    ]
@@ -0,0 +1,19 @@
+"""
+Migration: Record how and how well each backup ran in backup_history
+Date: 2026-10-XX
+
+Scheduled backups run unattended, so failed runs are kept in the history too.
+"""
+
+def up():
+    """SQL statements to add the run details to backup_history"""
+    return [
+        """
+        ALTER TABLE backup_history
+            MODIFY file_path VARCHAR(500) NULL,
+            ADD COLUMN backup_trigger ENUM('manual', 'scheduled') NOT NULL DEFAULT 'manual' AFTER created_by,
+            ADD COLUMN status ENUM('completed', 'failed') NOT NULL DEFAULT 'completed' AFTER backup_trigger,
+            ADD COLUMN error_message TEXT NULL AFTER status,
+            ADD COLUMN duration_seconds DECIMAL(10, 2) NULL AFTER error_message
+        """
+    ]
@@ -0,0 +1,21 @@
+"""
+Migration: Track incremental/differential backup chains in backup_history
+Date: 2026-10-XX
+
+watermarks holds each table's high-water mark (updated_at/changed_at or auto-increment id)
+at the time of the backup; the next incremental exports only rows past it.
+"""
+
+def up():
+    """SQL statements to add the backup chain columns to backup_history"""
+    return [
+        """
+        ALTER TABLE backup_history
+            ADD COLUMN backup_mode ENUM('full', 'incremental', 'differential') NOT NULL DEFAULT 'full' AFTER backup_trigger,
+            ADD COLUMN base_backup_id INT NULL AFTER backup_mode,
+            ADD COLUMN parent_backup_id INT NULL AFTER base_backup_id,
+            ADD COLUMN watermarks MEDIUMTEXT NULL,
+            ADD COLUMN manifest MEDIUMTEXT NULL,
+            ADD INDEX idx_base_backup (base_backup_id)
+        """
+    ]
@@ -0,0 +1,27 @@
+"""
+Migration: Create database_health_samples for health history and growth forecasts
+Date: 2026-10-XX
+
+One row per table per sample (table_name '' holds the server-wide figures).
+Raw samples are rolled up into hourly and then daily rows as they age.
+"""
+
+def up():
+    """SQL statements to create the database_health_samples table"""
+    return [
+        """
+        CREATE TABLE IF NOT EXISTS database_health_samples (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            sampled_at DATETIME NOT NULL,
+            granularity ENUM('raw', 'hourly', 'daily') NOT NULL DEFAULT 'raw',
+            table_name VARCHAR(64) NOT NULL DEFAULT '',
+            row_estimate BIGINT NOT NULL DEFAULT 0,
+            data_mb DECIMAL(12, 2) NOT NULL DEFAULT 0,
+            index_mb DECIMAL(12, 2) NOT NULL DEFAULT 0,
+            uptime_seconds BIGINT NULL,
+            threads_connected INT NULL,
+            INDEX idx_table_sampled (table_name, sampled_at),
+            INDEX idx_granularity_sampled (granularity, sampled_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """
+    ]
@@ -0,0 +1,110 @@
+"""
+Migration: Link parent/student users to their student's admission number
+Date: 2026-10-XX
+
+Adds users.student_id (the students.student_id admission number) with a unique index on
+(student_id, role), so parent and student logins are an indexed equality lookup instead of
+an email LIKE scan. Existing accounts are backfilled where the match is unambiguous:
+  1. parent users whose email is the email of a parent of exactly one student
+  2. users whose email contains an admission number (the longest one, when only one is longest)
+Accounts that match nothing, match ambiguously, or would claim an admission number that
+another account of the same role already holds are left unlinked and listed.
+"""
+import pymysql
+
+
+def _column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT COUNT(*) AS count FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return cursor.fetchone()['count'] > 0
+
+
+def _index_exists(cursor, table, index):
+    cursor.execute("""
+        SELECT COUNT(*) AS count FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index))
+    return cursor.fetchone()['count'] > 0
+
+
+def _backfill_links(cursor):
+    """{user_id: admission number} for unlinked parent/student users with one clear match"""
+    links = {}
+
+    cursor.execute("""
+        SELECT u.id, MIN(p.student_id) AS student_id
+        FROM users u
+        JOIN parents p ON p.email = u.email
+        WHERE u.role = 'parent' AND u.student_id IS NULL AND u.email <> ''
+        GROUP BY u.id
+        HAVING COUNT(DISTINCT p.student_id) = 1
+    """)
+    for row in cursor.fetchall():
+        links[row['id']] = row['student_id']
+
+    cursor.execute("""
+        SELECT u.id, s.student_id
+        FROM users u
+        JOIN students s ON LOCATE(s.student_id, u.email) > 0
+        WHERE u.role IN ('parent', 'student') AND u.student_id IS NULL
+    """)
+    candidates = {}
+    for row in cursor.fetchall():
+        candidates.setdefault(row['id'], set()).add(row['student_id'])
+    for user_id, student_ids in candidates.items():
+        if user_id in links:
+            continue
+        # 'STU0010' also contains 'STU001': the longest admission number is the intended one
+        longest = max(len(student_id) for student_id in student_ids)
+        best = [student_id for student_id in student_ids if len(student_id) == longest]
+        if len(best) == 1:
+            links[user_id] = best[0]
+    return links
+
+
+def migrate(connection):
+    """Add users.student_id, backfill it and index (student_id, role) as unique"""
+    try:
+        with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+            if not _column_exists(cursor, 'users', 'student_id'):
+                cursor.execute("ALTER TABLE users ADD COLUMN student_id VARCHAR(20) NULL AFTER role")
+
+            links = _backfill_links(cursor)
+            cursor.execute("SELECT id, role FROM users WHERE role IN ('parent', 'student')")
+            roles = {row['id']: row['role'] for row in cursor.fetchall()}
+            cursor.execute("SELECT student_id, role FROM users WHERE student_id IS NOT NULL")
+            taken = {(row['student_id'], row['role']) for row in cursor.fetchall()}
+
+            claims = {}
+            for user_id, student_id in links.items():
+                claims.setdefault((student_id, roles[user_id]), []).append(user_id)
+            linked = 0
+            for key, user_ids in claims.items():
+                if len(user_ids) > 1 or key in taken:
+                    print(f"  Not linked (admission number {key[0]} already claimed for role {key[1]}): "
+                          f"users {', '.join(str(user_id) for user_id in sorted(user_ids))}")
+                    continue
+                cursor.execute("UPDATE users SET student_id = %s WHERE id = %s", (key[0], user_ids[0]))
+                linked += 1
+
+            cursor.execute("""
+                SELECT id, role FROM users
+                WHERE role IN ('parent', 'student') AND student_id IS NULL
+            """)
+            unlinked = cursor.fetchall()
+            print(f"  Linked {linked} user(s) to an admission number")
+            if unlinked:
+                print(f"  {len(unlinked)} parent/student user(s) left unlinked: "
+                      f"{', '.join(str(row['id']) for row in unlinked[:50])}"
+                      f"{' ...' if len(unlinked) > 50 else ''}")
+
+            if not _index_exists(cursor, 'users', 'uq_users_student_role'):
+                cursor.execute("ALTER TABLE users ADD UNIQUE INDEX uq_users_student_role (student_id, role)")
+            connection.commit()
+            return True
+    except Exception as e:
+        connection.rollback()
+        print(f"Migration error: {e}")
+        return False
@@ -0,0 +1,53 @@
+"""
+Migration: Add indexes backing the paginated, filterable payments audit
+Date: 2026-10-XX
+
+The audit is read newest first by (changed_at, id), optionally filtered on one of
+student, employee or action type and a date range, so each filter has an index that
+serves both the filter and the keyset seek. The single-column indexes they replace
+are dropped (student_id's foreign key is served by idx_student_changed).
+
+Indexes are added only if missing and dropped only if present, so a run that failed
+partway can be retried.
+"""
+import pymysql
+
+INDEXES = [
+    ('idx_changed_at_id', "ADD INDEX idx_changed_at_id (changed_at, id)"),
+    ('idx_student_changed', "ADD INDEX idx_student_changed (student_id, changed_at, id)"),
+    ('idx_changed_by_changed', "ADD INDEX idx_changed_by_changed (changed_by, changed_at, id)"),
+    ('idx_action_changed', "ADD INDEX idx_action_changed (action_type, changed_at, id)")
+]
+
+REPLACED_INDEXES = ['idx_changed_at', 'idx_student_id', 'idx_action_type']
+
+
+def _index_exists(cursor, table, index):
+    cursor.execute("""
+        SELECT COUNT(*) AS count FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index))
+    return cursor.fetchone()['count'] > 0
+
+
+def migrate(connection):
+    """Add the payments audit keyset indexes, then drop the single-column ones they replace"""
+    try:
+        with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+            missing = [clause for name, clause in INDEXES
+                       if not _index_exists(cursor, 'student_payment_audit', name)]
+            if missing:
+                cursor.execute(f"ALTER TABLE student_payment_audit {', '.join(missing)}")
+            # Dropped only after idx_student_changed exists to serve student_id's foreign key
+            replaced = [name for name in REPLACED_INDEXES if _index_exists(cursor, 'student_payment_audit', name)]
+            if replaced:
+                cursor.execute("ALTER TABLE student_payment_audit "
+                               + ', '.join(f"DROP INDEX {name}" for name in replaced))
+            if not missing and not replaced:
+                print("  Payments audit keyset indexes already in place")
+            connection.commit()
+            return True
+    except Exception as e:
+        connection.rollback()
+        print(f"Migration error: {e}")
+        return False
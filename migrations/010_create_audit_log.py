@@ -0,0 +1,148 @@
+"""
+Migration: Create the unified, month-partitioned audit_log and backfill it
+Date: 2026-10-XX
+
+audit_log holds every audited event (payment and salary changes, migrations, backups)
+in one append-only table, partitioned by RANGE on TO_DAYS(occurred_at) with one
+partition per month (pYYYYMM) and a catch-all pmax. MySQL requires the partitioning
+column in every unique key, so the primary key is (id, occurred_at), and partitioned
+InnoDB tables cannot have foreign keys: actor and subject names are copied in, so an
+archived month still reads on its own.
+
+Partitions are created from the oldest month found in the source tables up to two
+months ahead; the audit archiver (audit_log.AuditArchiver) adds later months and
+archives old ones. The existing rows of student_payment_audit, employee_salary_audits,
+migrations and backup_history are copied in when the table is created.
+"""
+from datetime import date
+
+import pymysql
+
+from audit_log import month_start, partition_definition
+
+BACKFILL = [
+    ('student_payment_audit', """
+    INSERT INTO audit_log (occurred_at, source, action, actor_id, actor_name, subject_id, subject_name,
+                           field_name, old_value, new_value, source_id)
+    SELECT spa.changed_at, 'payment', spa.action_type, spa.changed_by, e.full_name, spa.student_id, s.full_name,
+           spa.field_name, spa.old_value, spa.new_value, spa.id
+    FROM student_payment_audit spa
+    LEFT JOIN employees e ON spa.changed_by = e.id
+    LEFT JOIN students s ON spa.student_id = s.student_id
+    WHERE spa.changed_at IS NOT NULL
+    ORDER BY spa.changed_at, spa.id
+    """),
+    ('employee_salary_audits', """
+    INSERT INTO audit_log (occurred_at, source, action, actor_id, actor_name, subject_id, subject_name,
+                           field_name, old_value, new_value, source_id)
+    SELECT esa.edited_at, 'salary', 'UPDATE', esa.edited_by, esa.edited_by_name,
+           COALESCE(e.employee_id, esa.employee_id), e.full_name, esa.field_name, esa.old_value, esa.new_value, esa.id
+    FROM employee_salary_audits esa
+    LEFT JOIN employees e ON esa.employee_id = e.id
+    WHERE esa.edited_at IS NOT NULL
+    ORDER BY esa.edited_at, esa.id
+    """),
+    ('migrations', """
+    INSERT INTO audit_log (occurred_at, source, action, actor_name, subject_id, new_value, details, source_id)
+    SELECT applied_at, 'migration', 'MIGRATE', applied_by, LEFT(migration_name, 100), status,
+           NULLIF(CONCAT_WS(' - ', CONCAT(execution_time_ms, ' ms'), error_message), ''), id
+    FROM migrations
+    WHERE applied_at IS NOT NULL
+    ORDER BY applied_at, id
+    """),
+    ('backup_history', """
+    INSERT INTO audit_log (occurred_at, source, action, actor_name, subject_id, new_value, details, source_id)
+    SELECT created_at, 'backup', 'BACKUP', created_by, LEFT(filename, 100), status,
+           NULLIF(CONCAT_WS(', ', backup_mode, backup_trigger,
+                            CONCAT(table_count, ' tables'), CONCAT(record_count, ' records'),
+                            CONCAT(ROUND(duration_seconds, 1), ' s'), error_message), ''), id
+    FROM backup_history
+    WHERE created_at IS NOT NULL
+    ORDER BY created_at, id
+    """)
+]
+
+BACKFILL_TIMESTAMPS = (('student_payment_audit', 'changed_at'), ('employee_salary_audits', 'edited_at'),
+                       ('migrations', 'applied_at'), ('backup_history', 'created_at'))
+
+
+def _table_exists(cursor, table):
+    cursor.execute("""
+        SELECT COUNT(*) AS count FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table,))
+    return cursor.fetchone()['count'] > 0
+
+
+def _oldest_event(cursor):
+    oldest = None
+    for table, column in BACKFILL_TIMESTAMPS:
+        if not _table_exists(cursor, table):
+            continue
+        cursor.execute(f"SELECT MIN({column}) AS oldest FROM {table}")
+        value = cursor.fetchone()['oldest']
+        if value and (oldest is None or value < oldest):
+            oldest = value
+    return oldest
+
+
+def migrate(connection):
+    """Create audit_log with monthly partitions and copy the existing audit rows into it"""
+    try:
+        with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+            if not _table_exists(cursor, 'audit_log'):
+                _create_audit_log(cursor)
+
+            # The CREATE TABLE commits on its own: a re-run after a failed copy copies again
+            cursor.execute("SELECT id FROM audit_log LIMIT 1")
+            if cursor.fetchone():
+                print("  audit_log already holds events; nothing copied")
+                return True
+            for table, statement in BACKFILL:
+                if _table_exists(cursor, table):
+                    cursor.execute(statement)
+                    print(f"  Copied {cursor.rowcount} row(s) of {table}")
+            connection.commit()
+            return True
+    except Exception as e:
+        connection.rollback()
+        print(f"Migration error: {e}")
+        return False
+
+
+def _create_audit_log(cursor):
+    this_month = month_start(date.today())
+    oldest = _oldest_event(cursor)
+    month = month_start(oldest) if oldest else this_month
+    partitions = []
+    while month <= month_start(this_month, 2):
+        partitions.append(partition_definition(month))
+        month = month_start(month, 1)
+
+    cursor.execute(f"""
+        CREATE TABLE audit_log (
+            id BIGINT NOT NULL AUTO_INCREMENT,
+            occurred_at DATETIME NOT NULL,
+            source VARCHAR(20) NOT NULL,
+            action VARCHAR(20) NOT NULL,
+            actor_id INT NULL,
+            actor_name VARCHAR(255) NULL,
+            subject_id VARCHAR(100) NULL,
+            subject_name VARCHAR(255) NULL,
+            field_name VARCHAR(100) NULL,
+            old_value TEXT NULL,
+            new_value TEXT NULL,
+            details TEXT NULL,
+            source_id BIGINT NULL,
+            PRIMARY KEY (id, occurred_at),
+            INDEX idx_occurred_id (occurred_at, id),
+            INDEX idx_source_occurred (source, occurred_at, id),
+            INDEX idx_subject_occurred (subject_id, occurred_at, id),
+            INDEX idx_actor_occurred (actor_id, occurred_at, id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        PARTITION BY RANGE (TO_DAYS(occurred_at)) (
+            {', '.join(partitions)},
+            PARTITION pmax VALUES LESS THAN MAXVALUE
+        )
+    """)
+    print(f"  Created audit_log with {len(partitions)} monthly partition(s)")
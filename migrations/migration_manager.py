@@ -1,11 +1,21 @@
 """
 Database Migration Manager
 Automatically runs database migrations on deployment
+
+Worker startup calls ensure_schema(): one query compares the schema fingerprint
+(migration filenames + SCHEMA_VERSION) with the one recorded in schema_state, and
+init_db()/migrations only run when it changed, under a GET_LOCK so concurrent workers
+do not race.
 """
+import hashlib
 import pymysql
 import os
 from datetime import datetime
-from app import DB_CONFIG, get_db_connection
+from app import DB_CONFIG, SCHEMA_VERSION, get_db_connection
+from audit_log import record_audit
+
+SCHEMA_LOCK_NAME = 'schema_migrations'
+SCHEMA_LOCK_TIMEOUT = 300
 
 def create_migrations_table(connection):
     """Create the migrations tracking table if it doesn't exist, and add missing columns"""
@@ -194,6 +204,13 @@ def record_migration(connection, migration_name, status='success', execution_tim
                         error_message = VALUES(error_message),
                         applied_at = CURRENT_TIMESTAMP
                 """, (migration_name, execution_time, error_message))
+            try:
+                record_audit(cursor, 'migration', 'MIGRATE', actor_name='system', subject_id=migration_name,
+                             new_value=status,
+                             details=' - '.join(part for part in (f"{execution_time} ms", error_message) if part))
+            except Exception as audit_error:
+                # audit_log only exists once migration 010 has run
+                print(f"Note: migration not added to audit_log: {audit_error}")
             connection.commit()
             return True
     except Exception as e:
@@ -222,9 +239,9 @@ def run_sql_migration(connection, migration_name, sql_statements):
         print(f"✗ Migration '{migration_name}' failed: {error_msg}")
         return False
 
-def run_python_migration(connection, migration_func):
+def run_python_migration(connection, migration_func, migration_name=None):
     """Run Python-based migration function"""
-    migration_name = migration_func.__name__
+    migration_name = migration_name or migration_func.__name__
     start_time = datetime.now()
     try:
         result = migration_func(connection)
@@ -330,7 +347,7 @@ def run_all_migrations():
                         failed_count += 1
                 elif hasattr(migration_module, 'migrate'):
                     # Python migration
-                    if run_python_migration(connection, migration_module.migrate):
+                    if run_python_migration(connection, migration_module.migrate, migration_name):
                         success_count += 1
                     else:
                         failed_count += 1
@@ -363,8 +380,107 @@ def run_all_migrations():
             except:
                 pass
 
+def schema_fingerprint(migration_files=None):
+    """Hash of SCHEMA_VERSION and the migration filenames: changes whenever there is schema work to do"""
+    if migration_files is None:
+        migration_files = load_migration_files()
+    parts = [f"schema_version={SCHEMA_VERSION}"] + [migration['file'] for migration in migration_files]
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+def get_recorded_fingerprint(connection):
+    """Fingerprint recorded by the last complete schema update (None if never recorded)"""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT fingerprint FROM schema_state WHERE id = 1")
+            result = cursor.fetchone()
+        # End the read snapshot so a later read sees another worker's update
+        connection.commit()
+        if not result:
+            return None
+        return result['fingerprint'] if isinstance(result, dict) else result[0]
+    except Exception:
+        # schema_state does not exist yet (fresh database)
+        try:
+            connection.rollback()
+        except Exception:
+            pass
+        return None
+
+def record_fingerprint(connection, fingerprint):
+    """Record the fingerprint once init_db and every migration succeeded"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_state (
+                id TINYINT PRIMARY KEY,
+                fingerprint CHAR(64) NOT NULL,
+                schema_version INT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """)
+        cursor.execute("""
+            INSERT INTO schema_state (id, fingerprint, schema_version)
+            VALUES (1, %s, %s)
+            ON DUPLICATE KEY UPDATE fingerprint = VALUES(fingerprint), schema_version = VALUES(schema_version)
+        """, (fingerprint, SCHEMA_VERSION))
+    connection.commit()
+
+def ensure_schema(init_database=None):
+    """Run init_database() and all pending migrations, but only when the schema fingerprint changed.
+    
+    The common case (nothing changed) costs one SELECT. Otherwise the first worker to get the
+    lock does the work and records the new fingerprint; workers waiting on the lock re-check
+    the fingerprint and skip. Nothing is recorded after a failure, so the next start retries.
+    """
+    fingerprint = schema_fingerprint()
+    connection = get_db_connection()
+    if not connection:
+        print("✗ Failed to connect to database")
+        return False
+    
+    try:
+        if get_recorded_fingerprint(connection) == fingerprint:
+            print(f"Schema up to date ({fingerprint[:12]}), skipping migrations")
+            return True
+        
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT GET_LOCK(%s, %s) AS acquired", (SCHEMA_LOCK_NAME, SCHEMA_LOCK_TIMEOUT))
+            result = cursor.fetchone()
+        acquired = result['acquired'] if isinstance(result, dict) else result[0]
+        if not acquired:
+            print("✗ Timed out waiting for another process to finish migrations")
+            return False
+        
+        try:
+            # Another worker may have finished the update while we waited for the lock
+            if get_recorded_fingerprint(connection) == fingerprint:
+                print(f"Schema updated by another process ({fingerprint[:12]}), skipping migrations")
+                return True
+            
+            success = True
+            if init_database:
+                print("Schema fingerprint changed, initializing database...")
+                success = bool(init_database())
+            success = run_all_migrations() and success
+            if success:
+                record_fingerprint(connection, fingerprint)
+                print(f"Schema fingerprint recorded ({fingerprint[:12]})")
+            return success
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (SCHEMA_LOCK_NAME,))
+    except Exception as e:
+        print(f"✗ Error checking schema fingerprint: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        try:
+            connection.close()
+        except:
+            pass
+
 if __name__ == '__main__':
-    # Can be run standalone
+    # Can be run standalone (always checks every migration, whatever the fingerprint)
     run_all_migrations()
 
 
@@ -18,14 +18,21 @@ print("=" * 60)
 try:
     # Import the Flask app
     print("Attempting to import app from app.py...")
+    import time
+    import_started = time.perf_counter()
     from app import app
+    import_ms = (time.perf_counter() - import_started) * 1000
+    import_budget_ms = float(os.environ.get('IMPORT_BUDGET_MS', 2000))
+    print(f"App imported in {import_ms:.0f} ms"
+          + (f" - over the {import_budget_ms:.0f} ms budget (see check_import_budget.py)" if import_ms > import_budget_ms else ""))
     
-    # Run database migrations automatically on startup
+    # Bring the schema up to date on startup (skipped unless the schema fingerprint changed)
     try:
-        print("Running database migrations...")
-        from migrations.migration_manager import run_all_migrations
-        run_all_migrations()
-        print("Migrations completed.")
+        print("Checking database schema...")
+        from app import init_db
+        from migrations.migration_manager import ensure_schema
+        ensure_schema(init_db)
+        print("Schema check completed.")
     except Exception as e:
         print(f"Warning: Error running migrations: {e}")
         import traceback
@@ -0,0 +1,219 @@
+"""
+PDF Documents
+Fee invoices and payment receipts rendered with reportlab.
+
+app.py imports this module inside the routes that produce PDFs, so reportlab is only
+loaded by the first PDF request instead of by every worker at start-up.
+
+The paragraph styles, table styles and the school logo (decoded and scaled down once)
+live in a PdfKit built once per process; document builders only assemble data rows.
+The logo is cached by file path and modification time, and invalidate_logo() drops it
+when the school profile changes.
+
+Usage:
+    pdf_bytes = fee_statement_pdf('FEE INVOICE', school_settings, student, invoice_date, fee_breakdown,
+                                  payment_details, total_fees, total_paid, balance_due, document='invoice')
+"""
+import os
+import threading
+from io import BytesIO
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+LOGO_SIZE = 1 * inch
+# Pixels per side of the cached logo: sharp at 1 inch when printed, small to embed
+LOGO_PIXELS = 300
+
+
+class PdfKit:
+    """Styles shared by every fee document, and the school logo as pre-scaled PNG bytes"""
+
+    def __init__(self):
+        styles = getSampleStyleSheet()
+        self.base = styles['Normal']
+        self.title = ParagraphStyle('DocumentTitle', parent=styles['Heading1'], fontSize=18,
+                                    textColor=colors.HexColor('#000000'), spaceAfter=0,
+                                    alignment=TA_RIGHT, fontName='Helvetica-Bold')
+        self.normal = ParagraphStyle('Normal', parent=styles['Normal'], fontSize=10,
+                                     textColor=colors.HexColor('#000000'), spaceAfter=6)
+        self.bold = ParagraphStyle('Bold', parent=self.normal, fontName='Helvetica-Bold')
+        self.total_paid = ParagraphStyle('TotalPaid', parent=self.normal, alignment=TA_RIGHT, fontSize=10)
+        self.summary = ParagraphStyle('Summary', parent=self.normal, alignment=TA_RIGHT, fontSize=10, spaceAfter=4)
+        self.footer = ParagraphStyle('Footer', parent=styles['Normal'], fontSize=8, textColor=colors.grey,
+                                     alignment=TA_CENTER)
+
+        self.header_table = TableStyle([
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('ALIGN', (2, 0), (2, 0), 'RIGHT'),
+        ])
+        self.details_table = TableStyle([
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+            ('TOPPADDING', (0, 0), (-1, -1), 6),
+        ])
+        self.fee_table = TableStyle(self._grid_commands(amount_column=2))
+        self.payment_table = TableStyle(self._grid_commands(amount_column=1))
+
+        self._logos = {}   # (path, mtime) -> PNG bytes, or None when the file cannot be read
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _grid_commands(amount_column):
+        return [
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('ALIGN', (amount_column, 0), (amount_column, -1), 'RIGHT'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+            ('TOPPADDING', (0, 0), (-1, -1), 8),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+        ]
+
+    @staticmethod
+    def _scaled_png(path):
+        from PIL import Image as PILImage   # installed with reportlab
+        with PILImage.open(path) as image:
+            image = image.convert('RGBA')
+            image.thumbnail((LOGO_PIXELS, LOGO_PIXELS))
+            buffer = BytesIO()
+            image.save(buffer, format='PNG', optimize=True)
+            return buffer.getvalue()
+
+    def logo(self, school_logo):
+        """A fresh logo flowable (flowables are not reused between documents), or a LOGO placeholder"""
+        data = None
+        if school_logo:
+            path = os.path.join(STATIC_FOLDER, school_logo)
+            try:
+                key = (path, os.path.getmtime(path))
+            except OSError:
+                key = None
+            if key:
+                with self._lock:
+                    if key not in self._logos:
+                        try:
+                            self._logos[key] = self._scaled_png(path)
+                        except Exception:
+                            self._logos[key] = None
+                    data = self._logos[key]
+        if data:
+            return Image(BytesIO(data), width=LOGO_SIZE, height=LOGO_SIZE)
+        return Paragraph("<b>LOGO</b>", self.base)
+
+    def invalidate_logo(self):
+        with self._lock:
+            self._logos.clear()
+
+
+_kit = None
+_kit_lock = threading.Lock()
+
+
+def kit():
+    """The process's PdfKit, built on first use"""
+    global _kit
+    if _kit is None:
+        with _kit_lock:
+            if _kit is None:
+                _kit = PdfKit()
+    return _kit
+
+
+def invalidate_logo():
+    """Drop the cached school logo, e.g. after the school profile changed"""
+    if _kit is not None:
+        _kit.invalidate_logo()
+
+
+def fee_statement_pdf(title, school_settings, student, document_date, fee_breakdown, payment_details,
+                      total_fees, total_paid, balance_due, document='invoice'):
+    """PDF bytes of a fee invoice or payment receipt: school header, student details, fee
+    breakdown, payments and the payment summary. document names it in the footer."""
+    pdf = kit()
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4,
+                            rightMargin=0.75*inch, leftMargin=0.75*inch,
+                            topMargin=0.75*inch, bottomMargin=0.75*inch)
+
+    elements = []
+
+    # Header: logo, contact info in the middle, document title on the right
+    contact_info = []
+    if school_settings.get('school_address'):
+        contact_info.append(school_settings['school_address'])
+    if school_settings.get('school_phone'):
+        contact_info.append(school_settings['school_phone'])
+    contact_cell = Paragraph("<br/>".join(contact_info) if contact_info else "", pdf.base)
+
+    header_table = Table([[[pdf.logo(school_settings.get('school_logo'))], contact_cell, Paragraph(title, pdf.title)]],
+                         colWidths=[2*inch, 2.5*inch, 3*inch])
+    header_table.setStyle(pdf.header_table)
+    elements.append(header_table)
+    elements.append(Spacer(1, 0.3*inch))
+
+    # Student Information
+    student_data = [
+        [Paragraph("<b>NAME:</b>", pdf.bold), Paragraph(student['full_name'], pdf.normal)],
+        [Paragraph("<b>GRADE:</b>", pdf.bold), Paragraph(student.get('current_grade', 'N/A'), pdf.normal)],
+        [Paragraph("<b>DATE:</b>", pdf.bold), Paragraph(document_date, pdf.normal)],
+    ]
+    student_table = Table(student_data, colWidths=[1.5*inch, 5.5*inch])
+    student_table.setStyle(pdf.details_table)
+    elements.append(student_table)
+    elements.append(Spacer(1, 0.3*inch))
+
+    # Fee Breakdown Table
+    fee_breakdown_data = [['Fee Breakdown', 'Description', 'Amount']]
+    for fee in fee_breakdown:
+        fee_breakdown_data.append([
+            fee['term'],
+            fee['description'],
+            f"{fee['amount']:,.2f}"
+        ])
+
+    fee_table = Table(fee_breakdown_data, colWidths=[2.5*inch, 2.5*inch, 2*inch])
+    fee_table.setStyle(pdf.fee_table)
+    elements.append(fee_table)
+    elements.append(Spacer(1, 0.3*inch))
+
+    # Payment Details Table
+    payment_details_data = [['Date', 'Amount', 'Payment Method', 'Reference No.']]
+    for payment_detail in payment_details:
+        payment_details_data.append([
+            payment_detail['date'],
+            f"{payment_detail['amount']:,.2f}",
+            payment_detail['method'],
+            payment_detail['reference']
+        ])
+
+    payment_table = Table(payment_details_data, colWidths=[1.5*inch, 1.5*inch, 2*inch, 2*inch])
+    payment_table.setStyle(pdf.payment_table)
+    elements.append(payment_table)
+    elements.append(Spacer(1, 0.2*inch))
+
+    # Total Paid (right aligned)
+    elements.append(Paragraph(f"<b>Total Paid: {total_paid:,.2f}</b>", pdf.total_paid))
+    elements.append(Spacer(1, 0.3*inch))
+
+    # Payment Summary (right aligned)
+    elements.append(Paragraph("<u><b>Payment Summary</b></u>", pdf.summary))
+    elements.append(Paragraph(f"<b>Total fees:</b> {total_fees:,.2f}", pdf.summary))
+    elements.append(Paragraph(f"<b>Total Paid:</b> {total_paid:,.2f}", pdf.summary))
+    elements.append(Spacer(1, 0.1*inch))
+    elements.append(Paragraph(f"<b>Balance Due:</b> {balance_due:,.2f}", pdf.summary))
+    elements.append(Spacer(1, 0.3*inch))
+
+    # Footer
+    elements.append(Spacer(1, 0.5*inch))
+    elements.append(Paragraph("Thank you for your payment!", pdf.footer))
+    elements.append(Paragraph(f"This is a computer-generated {document}. No signature required.", pdf.footer))
+
+    doc.build(elements)
+    return buffer.getvalue()
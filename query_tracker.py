@@ -0,0 +1,125 @@
+"""
+Query Tracker
+Per-request SQL instrumentation: every statement run through a tracked cursor is timed
+and grouped by fingerprint (the statement with its literals replaced by ?), so a request
+can report how many queries it ran, how long they took, which were slowest and which
+statement shapes repeated often enough to look like an N+1 loop.
+
+Usage:
+    stats = QueryStats()
+    with TrackingCursor(connection.cursor(), stats) as cursor:
+        cursor.execute("SELECT ...", args)
+    stats.summary()   # {'queries', 'time_ms', 'connections', 'slowest', 'repeated', 'n_plus_one'}
+"""
+import heapq
+import re
+import time
+
+
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST_RE = re.compile(r"\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """Normalized statement shape: literals and placeholders become ?, IN lists collapse to (?+)"""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _PLACEHOLDER_LIST_RE.sub('(?+)', sql)
+    sql = sql.replace('%s', '?')
+    return _WHITESPACE_RE.sub(' ', sql).strip()
+
+
+class QueryStats:
+    """Queries of one request: count, total time, the slowest statements and fingerprint counts"""
+
+    def __init__(self, keep_slowest=5):
+        self.keep_slowest = keep_slowest
+        self.count = 0
+        self.total_time = 0.0
+        self.connections = 0
+        self.fingerprints = {}   # fingerprint -> [count, total seconds]
+        self._slowest = []       # min-heap of (seconds, sequence, statement)
+
+    def record(self, sql, seconds, executions=1):
+        self.count += executions
+        self.total_time += seconds
+        shape = fingerprint(sql)
+        entry = self.fingerprints.setdefault(shape, [0, 0.0])
+        entry[0] += executions
+        entry[1] += seconds
+        item = (seconds, self.count, shape)
+        if len(self._slowest) < self.keep_slowest:
+            heapq.heappush(self._slowest, item)
+        elif seconds > self._slowest[0][0]:
+            heapq.heappushpop(self._slowest, item)
+
+    def repeated(self, minimum=2):
+        """Fingerprints run at least minimum times, most frequent first"""
+        return sorted(((shape, count, seconds) for shape, (count, seconds) in self.fingerprints.items()
+                       if count >= minimum), key=lambda item: item[1], reverse=True)
+
+    def n_plus_one(self, threshold=10):
+        """SELECT shapes repeated threshold times or more in one request: likely a query per row"""
+        return [item for item in self.repeated(threshold) if item[0].lstrip('( ').upper().startswith('SELECT')]
+
+    def summary(self, n_plus_one_threshold=10):
+        return {
+            'queries': self.count,
+            'time_ms': round(self.total_time * 1000, 1),
+            'connections': self.connections,
+            'slowest': [{'sql': shape, 'ms': round(seconds * 1000, 1)}
+                        for seconds, _, shape in sorted(self._slowest, reverse=True)],
+            'repeated': [{'sql': shape, 'count': count, 'ms': round(seconds * 1000, 1)}
+                         for shape, count, seconds in self.repeated()[:10]],
+            'n_plus_one': [{'sql': shape, 'count': count, 'ms': round(seconds * 1000, 1)}
+                           for shape, count, seconds in self.n_plus_one(n_plus_one_threshold)]
+        }
+
+
+class TrackingCursor:
+    """Cursor wrapper that times execute()/executemany() into a QueryStats"""
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._cursor.__exit__(exc_type, exc_value, traceback)
+
+    def execute(self, query, args=None):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(query, args)
+        finally:
+            self._stats.record(query, time.perf_counter() - started)
+
+    def executemany(self, query, args):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(query, args)
+        finally:
+            # pymysql folds multi-row INSERTs into one statement; other statements run once per row
+            self._stats.record(query, time.perf_counter() - started)
+
+
+def format_report(method, path, seconds, summary):
+    """Multi-line slow request report for the server log"""
+    lines = [f"Slow request {method} {path}: {seconds * 1000:.0f} ms, "
+             f"{summary['queries']} queries in {summary['time_ms']} ms, {summary['connections']} connection(s)"]
+    for query in summary['slowest']:
+        lines.append(f"  slow    {query['ms']:>8} ms  {query['sql'][:200]}")
+    for query in summary['n_plus_one']:
+        lines.append(f"  N+1     {query['count']:>5} x {query['ms']} ms  {query['sql'][:200]}")
+    return '\n'.join(lines)
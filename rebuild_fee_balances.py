@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Rebuild or reconcile the student_fee_balances summary table from student_payments
+Usage:
+    python rebuild_fee_balances.py            # rebuild every balance row
+    python rebuild_fee_balances.py --check    # report drifted rows without changing anything
+    python rebuild_fee_balances.py --fix      # rewrite only the drifted rows
+"""
+import sys
+import os
+import pymysql
+from dotenv import load_dotenv
+from fee_ledger import rebuild_fee_balances, reconcile_fee_balances
+
+load_dotenv()
+
+DB_CONFIG = {
+    'host': os.environ.get('DB_HOST', 'localhost'),
+    'user': os.environ.get('DB_USER', 'root'),
+    'password': os.environ.get('DB_PASSWORD', ''),
+    'database': os.environ.get('DB_NAME', 'modern_school'),
+    'charset': 'utf8mb4',
+    'cursorclass': pymysql.cursors.DictCursor
+}
+
+
+def main(mode):
+    connection = pymysql.connect(**DB_CONFIG)
+    try:
+        with connection.cursor() as cursor:
+            if mode == 'rebuild':
+                rows = rebuild_fee_balances(cursor)
+                connection.commit()
+                print(f"✓ Rebuilt student_fee_balances ({rows} rows)")
+                return True
+
+            drift = reconcile_fee_balances(cursor, fix=(mode == 'fix'))
+            for entry in drift:
+                print(f"  {entry['student_id']} / structure {entry['fee_structure_id']}: "
+                      f"expected {entry['expected']}, stored {entry['stored']}")
+            if mode == 'fix':
+                connection.commit()
+                print(f"✓ Fixed {len(drift)} drifted balance row(s)")
+                return True
+            if drift:
+                print(f"✗ {len(drift)} balance row(s) out of sync (run with --fix or without arguments)")
+                return False
+            print("✓ student_fee_balances is in sync with student_payments")
+            return True
+    except Exception as e:
+        connection.rollback()
+        print(f"✗ Error: {e}")
+        return False
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    mode = 'rebuild'
+    if '--check' in sys.argv[1:]:
+        mode = 'check'
+    elif '--fix' in sys.argv[1:]:
+        mode = 'fix'
+    sys.exit(0 if main(mode) else 1)